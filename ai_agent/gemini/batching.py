@@ -0,0 +1,112 @@
+"""
+Micro-batching for Gemini calls
+
+Collects individual requests for a short window (or until a size limit) and
+hands them to a batch handler as one list, so many concurrent per-item calls
+become a single model round trip. Each caller awaits only its own result.
+"""
+
+import os
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("financial-agent.ai.gemini.batching")
+
+
+class CategorizationBatchConfig:
+    """Expense categorization batching configuration"""
+
+    def __init__(self):
+        # Items per model request (1 disables batching)
+        self.max_items = int(os.environ.get("GEMINI_CATEGORIZATION_BATCH_SIZE", "20"))
+        # How long the first request of a batch waits for others to join
+        self.window_seconds = float(os.environ.get("GEMINI_CATEGORIZATION_BATCH_WINDOW_MS", "50")) / 1000
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_items > 1
+
+
+class MicroBatcher:
+    """Coalesce concurrent single-item requests into batch handler calls"""
+
+    def __init__(
+        self,
+        handler: Callable[[List[Any]], Awaitable[List[Any]]],
+        max_items: int,
+        window_seconds: float
+    ):
+        """
+        Args:
+            handler: Coroutine taking a list of items and returning one result
+                per item, in order (an Exception in the list fails that item only)
+            max_items: Flush as soon as this many items are waiting
+            window_seconds: Flush this long after the first waiting item arrived
+        """
+        self.handler = handler
+        self.max_items = max(1, max_items)
+        self.window_seconds = window_seconds
+        self._pending: List[Tuple[Any, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.stats = {"items": 0, "batches": 0, "largest_batch": 0, "failed_items": 0}
+
+    async def submit(self, item: Any) -> Any:
+        """
+        Queue an item for the next batch and wait for its result
+
+        Args:
+            item: Item to process
+
+        Returns:
+            The handler's result for this item
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((item, future))
+        self.stats["items"] += 1
+
+        if len(self._pending) >= self.max_items:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window_seconds, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch: List[Tuple[Any, asyncio.Future]]):
+        self.stats["batches"] += 1
+        self.stats["largest_batch"] = max(self.stats["largest_batch"], len(batch))
+        try:
+            results = await self.handler([item for item, _ in batch])
+            if len(results) != len(batch):
+                raise ValueError(f"Batch handler returned {len(results)} results for {len(batch)} items")
+        except Exception as e:
+            results = [e] * len(batch)
+
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                # Caller was cancelled while waiting
+                continue
+            if isinstance(result, Exception):
+                self.stats["failed_items"] += 1
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Batch counters (average batch size shows how much batching saves)"""
+        return {
+            **self.stats,
+            "pending": len(self._pending),
+            "average_batch_size": round(self.stats["items"] / self.stats["batches"], 2) if self.stats["batches"] else 0.0,
+            "max_items": self.max_items,
+            "window_ms": round(self.window_seconds * 1000, 1),
+        }
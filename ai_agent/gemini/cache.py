@@ -0,0 +1,350 @@
+"""
+Response cache for Gemini calls
+
+Content-addressed cache keyed on (model, normalized prompt): an in-process LRU
+tier in front of an optional shared Redis or MongoDB tier. Identical prompts
+(repeat categorizations of the same merchant, insight prompts for the same
+dashboard period) are answered without a model round trip, and concurrent
+identical prompts share a single in-flight call.
+"""
+
+import os
+import re
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional, Callable, Awaitable, Tuple
+
+try:
+    import redis.asyncio as redis_asyncio
+    REDIS_AVAILABLE = True
+except ImportError:
+    redis_asyncio = None
+    REDIS_AVAILABLE = False
+
+try:
+    import motor.motor_asyncio
+    MOTOR_AVAILABLE = True
+except ImportError:
+    MOTOR_AVAILABLE = False
+
+logger = logging.getLogger("financial-agent.ai.gemini.cache")
+
+# Default TTL (seconds) per call type; GEMINI_CACHE_TTL_<CALL_TYPE> overrides
+DEFAULT_TTLS = {
+    "categorization": 7 * 24 * 3600,   # Same merchant/description -> same category
+    "insights": 3600,                  # Dashboard period data changes slowly
+    "reconciliation": 300,             # Prompt embeds the pending invoices
+    "anomaly": 600,
+    "content": 3600,
+}
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+class ResponseCacheConfig:
+    """Gemini response cache configuration"""
+
+    def __init__(self):
+        self.enabled = os.environ.get("GEMINI_CACHE_ENABLED", "true").lower() == "true"
+        self.max_entries = int(os.environ.get("GEMINI_CACHE_MAX_ENTRIES", "1024"))
+        # Shared tier: "none", "redis" or "mongo"
+        self.backend = os.environ.get("GEMINI_CACHE_BACKEND", "none").lower()
+        self.redis_url = os.environ.get("GEMINI_CACHE_REDIS_URL", os.environ.get("REDIS_URL", "redis://localhost:6379/0"))
+        self.mongo_uri = os.environ.get("MONGO_URI", "mongodb://localhost:27017")
+        self.mongo_db = os.environ.get("MONGO_DB", "financial_agent")
+        self.mongo_collection = os.environ.get("GEMINI_CACHE_COLLECTION", "ai_response_cache")
+        self.key_prefix = os.environ.get("GEMINI_CACHE_PREFIX", "gemini:")
+        self.ttls = {
+            call_type: int(os.environ.get(f"GEMINI_CACHE_TTL_{call_type.upper()}", ttl))
+            for call_type, ttl in DEFAULT_TTLS.items()
+        }
+
+    def ttl_for(self, call_type: str) -> int:
+        return self.ttls.get(call_type, self.ttls["content"])
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Collapse whitespace so formatting-only differences share a cache entry"""
+    return _WHITESPACE.sub(" ", prompt).strip()
+
+
+def cache_key(model: str, prompt: str) -> str:
+    """Content address for a prompt sent to a model"""
+    digest = hashlib.sha256(f"{model}\n{normalize_prompt(prompt)}".encode("utf-8")).hexdigest()
+    return digest
+
+
+class ResponseCache:
+    """Two-tier (LRU + optional Redis/MongoDB) cache for model responses"""
+
+    def __init__(self, config: Optional[ResponseCacheConfig] = None):
+        """
+        Args:
+            config: Cache configuration (defaults to environment settings)
+        """
+        self.config = config or ResponseCacheConfig()
+        self._lru: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._redis = None
+        self._mongo = None
+        self._shared_ready = False
+        self.stats: Dict[str, Dict[str, int]] = {}
+
+    def _count(self, call_type: str, counter: str):
+        per_type = self.stats.setdefault(call_type, {
+            "hits": 0, "memory_hits": 0, "shared_hits": 0, "coalesced": 0,
+            "misses": 0, "bypassed": 0, "errors": 0
+        })
+        per_type[counter] += 1
+
+    # ========== Shared tier ==========
+
+    async def _shared(self):
+        """Lazily connect the shared tier (None when disabled or unavailable)"""
+        if self._shared_ready:
+            return self._redis or self._mongo
+        self._shared_ready = True
+        try:
+            if self.config.backend == "redis" and REDIS_AVAILABLE:
+                self._redis = redis_asyncio.from_url(self.config.redis_url, decode_responses=True)
+                return self._redis
+            if self.config.backend == "mongo" and MOTOR_AVAILABLE:
+                client = motor.motor_asyncio.AsyncIOMotorClient(self.config.mongo_uri)
+                self._mongo = client[self.config.mongo_db][self.config.mongo_collection]
+                await self._mongo.create_index("expires_at", expireAfterSeconds=0)
+                return self._mongo
+            if self.config.backend not in ("none", ""):
+                logger.warning(f"Gemini cache backend '{self.config.backend}' not available, using memory only")
+        except Exception as e:
+            logger.warning(f"Gemini shared cache unavailable, using memory only: {str(e)}")
+            self._redis = self._mongo = None
+        return None
+
+    async def _shared_get(self, key: str) -> Optional[Tuple[str, float]]:
+        shared = await self._shared()
+        if shared is None:
+            return None
+        if self._redis is not None:
+            pipe = self._redis.pipeline()
+            pipe.get(self.config.key_prefix + key)
+            pipe.ttl(self.config.key_prefix + key)
+            value, ttl = await pipe.execute()
+            return (value, float(ttl)) if value is not None and ttl and ttl > 0 else None
+        doc = await self._mongo.find_one({"_id": key})
+        if doc and doc["expires_at"] > datetime.utcnow():
+            return doc["response"], (doc["expires_at"] - datetime.utcnow()).total_seconds()
+        return None
+
+    async def _shared_set(self, key: str, value: str, ttl: int, call_type: str):
+        shared = await self._shared()
+        if shared is None:
+            return
+        if self._redis is not None:
+            await self._redis.set(self.config.key_prefix + key, value, ex=ttl)
+        else:
+            await self._mongo.update_one(
+                {"_id": key},
+                {"$set": {
+                    "response": value,
+                    "call_type": call_type,
+                    "expires_at": datetime.utcnow() + timedelta(seconds=ttl)
+                }},
+                upsert=True
+            )
+
+    # ========== Memory tier ==========
+
+    def _memory_get(self, key: str) -> Optional[str]:
+        entry = self._lru.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._lru[key]
+            return None
+        self._lru.move_to_end(key)
+        return value
+
+    def _memory_set(self, key: str, value: str, ttl: float):
+        self._lru[key] = (time.monotonic() + ttl, value)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.config.max_entries:
+            self._lru.popitem(last=False)
+
+    # ========== Public API ==========
+
+    async def get_or_generate(
+        self,
+        model: str,
+        prompt: str,
+        call_type: str,
+        generate: Callable[[], Awaitable[str]],
+        bypass: bool = False
+    ) -> str:
+        """
+        Return a cached response for the prompt or generate (and cache) one
+
+        Args:
+            model: Model name (part of the cache key)
+            prompt: Prompt text
+            call_type: Call type selecting the TTL ("categorization", "insights", ...)
+            generate: Coroutine factory calling the model on a miss
+            bypass: Skip the cache for this call (the fresh response is still stored)
+
+        Returns:
+            Model response text
+        """
+        ttl = self.config.ttl_for(call_type)
+        if not self.config.enabled or ttl <= 0:
+            return await generate()
+
+        key = cache_key(model, prompt)
+        if bypass:
+            self._count(call_type, "bypassed")
+        else:
+            value = self._memory_get(key)
+            if value is not None:
+                self._count(call_type, "hits")
+                self._count(call_type, "memory_hits")
+                return value
+
+            inflight = self._inflight.get(key)
+            if inflight is not None:
+                self._count(call_type, "hits")
+                self._count(call_type, "coalesced")
+                try:
+                    return await asyncio.shield(inflight)
+                except asyncio.CancelledError:
+                    # The generating call was cancelled, not this one: generate here instead
+                    task = asyncio.current_task()
+                    if not inflight.cancelled() or getattr(task, "cancelling", lambda: 0)():
+                        raise
+                    return await self.get_or_generate(model, prompt, call_type, generate)
+
+            try:
+                shared = await self._shared_get(key)
+            except Exception as e:
+                self._count(call_type, "errors")
+                logger.warning(f"Gemini shared cache read failed: {str(e)}")
+                shared = None
+            if shared is not None:
+                value, remaining = shared
+                self._memory_set(key, value, remaining)
+                self._count(call_type, "hits")
+                self._count(call_type, "shared_hits")
+                return value
+
+            self._count(call_type, "misses")
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await generate()
+            future.set_result(value)
+        except Exception as e:
+            future.set_exception(e)
+            # Waiters re-raise; mark the exception retrieved for the no-waiter case
+            future.exception()
+            raise
+        finally:
+            # Cancelled (or any other BaseException): never leave waiters hanging
+            if not future.done():
+                future.cancel()
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+        if value:
+            self._memory_set(key, value, ttl)
+            try:
+                await self._shared_set(key, value, ttl, call_type)
+            except Exception as e:
+                self._count(call_type, "errors")
+                logger.warning(f"Gemini shared cache write failed: {str(e)}")
+        return value
+
+    async def lookup(self, model: str, prompt: str, call_type: str) -> Optional[str]:
+        """
+        Cached response for a prompt, without generating on a miss
+
+        Used by streaming callers, which generate themselves and store() the
+        completed response.
+        """
+        if not self.config.enabled or self.config.ttl_for(call_type) <= 0:
+            return None
+        key = cache_key(model, prompt)
+        value = self._memory_get(key)
+        if value is not None:
+            self._count(call_type, "hits")
+            self._count(call_type, "memory_hits")
+            return value
+        try:
+            shared = await self._shared_get(key)
+        except Exception as e:
+            self._count(call_type, "errors")
+            logger.warning(f"Gemini shared cache read failed: {str(e)}")
+            shared = None
+        if shared is not None:
+            value, remaining = shared
+            self._memory_set(key, value, remaining)
+            self._count(call_type, "hits")
+            self._count(call_type, "shared_hits")
+            return value
+        self._count(call_type, "misses")
+        return None
+
+    async def store(self, model: str, prompt: str, call_type: str, value: str):
+        """Cache a response generated outside get_or_generate()"""
+        ttl = self.config.ttl_for(call_type)
+        if not self.config.enabled or ttl <= 0 or not value:
+            return
+        key = cache_key(model, prompt)
+        self._memory_set(key, value, ttl)
+        try:
+            await self._shared_set(key, value, ttl, call_type)
+        except Exception as e:
+            self._count(call_type, "errors")
+            logger.warning(f"Gemini shared cache write failed: {str(e)}")
+
+    async def clear(self):
+        """Drop every cached response (both tiers)"""
+        self._lru.clear()
+        shared = await self._shared()
+        if self._redis is not None:
+            keys = [key async for key in self._redis.scan_iter(match=self.config.key_prefix + "*")]
+            if keys:
+                await self._redis.delete(*keys)
+        elif shared is not None:
+            await self._mongo.delete_many({})
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Hit/miss counters per call type plus tier information"""
+        totals = {"hits": 0, "misses": 0, "bypassed": 0}
+        for per_type in self.stats.values():
+            for counter in totals:
+                totals[counter] += per_type[counter]
+        lookups = totals["hits"] + totals["misses"]
+        return {
+            "enabled": self.config.enabled,
+            "backend": self.config.backend if (self._redis or self._mongo) else "memory",
+            "memory_entries": len(self._lru),
+            "max_entries": self.config.max_entries,
+            "hit_rate": round(totals["hits"] / lookups, 4) if lookups else 0.0,
+            **totals,
+            "by_call_type": self.stats,
+            "ttls": self.config.ttls,
+        }
+
+
+_response_cache: Optional[ResponseCache] = None
+
+
+def get_response_cache() -> ResponseCache:
+    """Process-wide response cache shared by every GeminiService instance"""
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache()
+    return _response_cache
@@ -0,0 +1,400 @@
+"""
+Shared AI client layer
+
+Every Gemini call in the process (GeminiService, the Gemini OCR engine, AI
+invoice drafting, the RAG insights service, the prediction agent) goes
+through one AIClient, which applies:
+
+- a global token bucket plus optional per-feature buckets (requests/minute)
+- a bound on concurrent in-flight requests
+- jittered exponential retries for transient errors, limited by a retry budget
+- a circuit breaker that fails fast while the provider is unhealthy
+
+Callers that cannot get a slot (breaker open, queue wait too long) receive
+AIUnavailableError immediately and switch to their mock/fallback path instead
+of waiting for the provider timeout.
+"""
+
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+logger = logging.getLogger("financial-agent.ai.client")
+
+BREAKER_CLOSED = "closed"
+BREAKER_OPEN = "open"
+BREAKER_HALF_OPEN = "half_open"
+
+# Provider errors worth retrying (google.api_core exception class names)
+TRANSIENT_ERROR_NAMES = {
+    "ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "DeadlineExceeded",
+    "InternalServerError", "BadGateway", "GatewayTimeout", "Aborted",
+}
+TRANSIENT_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class AIUnavailableError(Exception):
+    """Raised when an AI call is refused without reaching the provider"""
+
+
+class CircuitOpenError(AIUnavailableError):
+    """The circuit breaker is open"""
+
+
+class AIClientOverloaded(AIUnavailableError):
+    """No request slot became available within the queue timeout"""
+
+
+class AIClientConfig:
+    """Shared AI client configuration"""
+
+    def __init__(self):
+        # Global request rate and burst across all features
+        self.rate_per_minute = float(os.environ.get("AI_CLIENT_RATE_PER_MINUTE", "60"))
+        self.burst = int(os.environ.get("AI_CLIENT_BURST", "10"))
+        self.max_in_flight = int(os.environ.get("AI_CLIENT_MAX_IN_FLIGHT", "8"))
+        # Longest a call may wait for a rate-limit token and an in-flight slot
+        self.queue_timeout = float(os.environ.get("AI_CLIENT_QUEUE_TIMEOUT", "10"))
+        self.call_timeout = float(os.environ.get("AI_CLIENT_TIMEOUT_SECONDS", "60"))
+        self.max_retries = int(os.environ.get("AI_CLIENT_MAX_RETRIES", "2"))
+        self.retry_base_seconds = float(os.environ.get("AI_CLIENT_RETRY_BASE_SECONDS", "0.5"))
+        self.retry_max_seconds = float(os.environ.get("AI_CLIENT_RETRY_MAX_SECONDS", "8"))
+        # Each request earns this fraction of a retry (bounds retries to ~20% extra load)
+        self.retry_budget_ratio = float(os.environ.get("AI_CLIENT_RETRY_BUDGET_RATIO", "0.2"))
+        self.retry_budget_reserve = float(os.environ.get("AI_CLIENT_RETRY_BUDGET_RESERVE", "10"))
+        # Consecutive transient failures that open the breaker, and how long it stays open
+        self.breaker_failures = int(os.environ.get("AI_CLIENT_BREAKER_FAILURES", "5"))
+        self.breaker_reset_seconds = float(os.environ.get("AI_CLIENT_BREAKER_RESET_SECONDS", "30"))
+
+    def feature_rate(self, feature: str) -> Optional[float]:
+        """Per-feature requests/minute from AI_CLIENT_RATE_<FEATURE> (None = global limit only)"""
+        value = os.environ.get(f"AI_CLIENT_RATE_{feature.upper()}")
+        return float(value) if value else None
+
+
+class TokenBucket:
+    """Thread-safe token bucket that hands out reservations"""
+
+    def __init__(self, rate_per_minute: float, burst: int):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait: float) -> Optional[float]:
+        """
+        Take a token, possibly ahead of time
+
+        Returns:
+            Seconds to wait before using the token, or None if that would
+            exceed max_wait (nothing is taken then)
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            wait = max(0.0, (1 - self.tokens) / self.rate) if self.rate > 0 else 0.0
+            if wait > max_wait:
+                return None
+            self.tokens -= 1
+            return wait
+
+    def refund(self):
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + 1)
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a single half-open probe"""
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = BREAKER_CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Whether a call may go to the provider now"""
+        with self._lock:
+            if self.state == BREAKER_CLOSED:
+                return True
+            if self.state == BREAKER_OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = BREAKER_HALF_OPEN
+                self._probing = False
+            if self.state == BREAKER_HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def release_probe(self):
+        """Give back a half-open probe that got no answer from the provider"""
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != BREAKER_CLOSED:
+                logger.info("AI circuit breaker closed")
+            self.state = BREAKER_CLOSED
+            self.consecutive_failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self._probing = False
+            if self.state == BREAKER_HALF_OPEN or (
+                self.state == BREAKER_CLOSED and self.consecutive_failures >= self.failure_threshold
+            ):
+                self.state = BREAKER_OPEN
+                self.opened_at = time.monotonic()
+                self.times_opened += 1
+                logger.warning(
+                    f"AI circuit breaker opened after {self.consecutive_failures} consecutive failures; "
+                    f"failing fast for {self.reset_seconds:.0f}s"
+                )
+
+    def get_metrics(self) -> Dict[str, Any]:
+        retry_in = 0.0
+        if self.state == BREAKER_OPEN:
+            retry_in = max(0.0, self.reset_seconds - (time.monotonic() - self.opened_at))
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "times_opened": self.times_opened,
+            "retry_in_seconds": round(retry_in, 1),
+        }
+
+
+def is_transient_error(error: BaseException) -> bool:
+    """Rate limits, timeouts and 5xx responses (worth retrying, count against the breaker)"""
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    if any(cls.__name__ in TRANSIENT_ERROR_NAMES for cls in type(error).__mro__):
+        return True
+    code = getattr(error, "code", None) or getattr(error, "status_code", None)
+    if isinstance(code, int) and code in TRANSIENT_STATUS_CODES:
+        return True
+    message = str(error).lower()
+    return "429" in message or "rate limit" in message or "quota" in message or "unavailable" in message
+
+
+class _FeatureStats:
+    def __init__(self):
+        self.calls = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.retries = 0
+        self.rejected_open = 0
+        self.rejected_overloaded = 0
+        self.queue_waits: Deque[float] = deque(maxlen=1000)
+
+    def as_dict(self) -> Dict[str, Any]:
+        waits = sorted(self.queue_waits)
+        def pct(p):
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))] * 1000, 1) if waits else 0.0
+        return {
+            "calls": self.calls,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "retries": self.retries,
+            "rejected_breaker_open": self.rejected_open,
+            "rejected_overloaded": self.rejected_overloaded,
+            "queue_wait_ms": {"p50": pct(0.5), "p95": pct(0.95), "max": pct(1.0)},
+        }
+
+
+class AIClient:
+    """Rate-limited, retrying, circuit-broken gateway for model calls"""
+
+    def __init__(self, config: Optional[AIClientConfig] = None):
+        """
+        Args:
+            config: Client configuration (defaults to environment settings)
+        """
+        self.config = config or AIClientConfig()
+        self.breaker = CircuitBreaker(self.config.breaker_failures, self.config.breaker_reset_seconds)
+        self._global_bucket = TokenBucket(self.config.rate_per_minute, self.config.burst)
+        self._feature_buckets: Dict[str, Optional[TokenBucket]] = {}
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._retry_tokens = self.config.retry_budget_reserve
+        self._stats: Dict[str, _FeatureStats] = {}
+
+    # ========== Admission ==========
+
+    def _feature_bucket(self, feature: str) -> Optional[TokenBucket]:
+        if feature not in self._feature_buckets:
+            rate = self.config.feature_rate(feature)
+            self._feature_buckets[feature] = TokenBucket(rate, max(1, min(self.config.burst, int(rate)))) if rate else None
+        return self._feature_buckets[feature]
+
+    def _reserve_rate(self, feature: str) -> float:
+        """Reserve feature and global tokens; returns the wait before the call may start"""
+        feature_bucket = self._feature_bucket(feature)
+        feature_wait = 0.0
+        if feature_bucket is not None:
+            feature_wait = feature_bucket.reserve(self.config.queue_timeout)
+            if feature_wait is None:
+                raise AIClientOverloaded(f"AI rate limit for '{feature}' exceeded")
+        global_wait = self._global_bucket.reserve(self.config.queue_timeout)
+        if global_wait is None:
+            if feature_bucket is not None:
+                feature_bucket.refund()
+            raise AIClientOverloaded("Global AI rate limit exceeded")
+        return max(feature_wait, global_wait)
+
+    def _try_enter(self) -> bool:
+        with self._lock:
+            if self._in_flight >= self.config.max_in_flight:
+                return False
+            self._in_flight += 1
+            return True
+
+    def _leave(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    def _admit(self, feature: str) -> _FeatureStats:
+        stats = self._stats.setdefault(feature, _FeatureStats())
+        stats.calls += 1
+        if not self.breaker.allow():
+            stats.rejected_open += 1
+            raise CircuitOpenError(f"AI provider circuit breaker is open ({feature})")
+        with self._lock:
+            self._retry_tokens = min(
+                self.config.retry_budget_reserve,
+                self._retry_tokens + self.config.retry_budget_ratio
+            )
+        return stats
+
+    def _take_retry(self) -> bool:
+        with self._lock:
+            if self._retry_tokens < 1:
+                return False
+            self._retry_tokens -= 1
+            return True
+
+    def _backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff"""
+        return random.uniform(0, min(self.config.retry_max_seconds, self.config.retry_base_seconds * (2 ** attempt)))
+
+    def _should_retry(self, error: BaseException, attempt: int, stats: _FeatureStats) -> bool:
+        transient = is_transient_error(error)
+        if transient:
+            self.breaker.record_failure()
+        else:
+            # The provider answered (e.g. invalid request): not a health problem
+            self.breaker.record_success()
+        if not transient or attempt >= self.config.max_retries or self.breaker.state == BREAKER_OPEN:
+            return False
+        if not self._take_retry():
+            logger.warning("AI retry budget exhausted; not retrying")
+            return False
+        stats.retries += 1
+        return True
+
+    def _overloaded(self, stats: _FeatureStats, feature: str, error: AIClientOverloaded):
+        stats.rejected_overloaded += 1
+        self.breaker.release_probe()
+        logger.warning(f"AI call for '{feature}' rejected: {str(error)}")
+        raise error
+
+    # ========== Calls ==========
+
+    async def _acquire(self, feature: str, stats: _FeatureStats):
+        started = time.monotonic()
+        try:
+            wait = self._reserve_rate(feature)
+        except AIClientOverloaded as e:
+            self._overloaded(stats, feature, e)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        delay = 0.005
+        while not self._try_enter():
+            if time.monotonic() - started > self.config.queue_timeout:
+                self._overloaded(stats, feature, AIClientOverloaded(f"{self.config.max_in_flight} AI calls already in flight"))
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.1)
+        stats.queue_waits.append(time.monotonic() - started)
+
+    async def call(self, feature: str, request: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run an async model request through the limiter, retries and breaker
+
+        Args:
+            feature: Calling feature ("gemini", "ocr", "invoice", "insights", ...)
+            request: Coroutine factory performing one attempt
+
+        Returns:
+            Whatever the request returns
+
+        Raises:
+            AIUnavailableError: If the breaker is open or no slot became available
+        """
+        stats = self._admit(feature)
+        attempt = 0
+        try:
+            while True:
+                await self._acquire(feature, stats)
+                try:
+                    result = await asyncio.wait_for(request(), timeout=self.config.call_timeout)
+                except Exception as e:
+                    retry = self._should_retry(e, attempt, stats)
+                    if not retry:
+                        stats.failed += 1
+                        raise
+                    logger.warning(f"AI call for '{feature}' failed (attempt {attempt + 1}), retrying: {str(e)}")
+                else:
+                    self.breaker.record_success()
+                    stats.succeeded += 1
+                    return result
+                finally:
+                    self._leave()
+                attempt += 1
+                await asyncio.sleep(self._backoff(attempt))
+                if not self.breaker.allow():
+                    stats.rejected_open += 1
+                    raise CircuitOpenError(f"AI provider circuit breaker is open ({feature})")
+        except Exception:
+            raise
+        except BaseException:
+            # Cancelled while queued, calling or backing off: a half-open probe
+            # that never got an answer must not keep the breaker shut
+            self.breaker.release_probe()
+            raise
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Breaker state, in-flight calls and per-feature queue wait/outcome counters"""
+        return {
+            "breaker": self.breaker.get_metrics(),
+            "in_flight": self._in_flight,
+            "max_in_flight": self.config.max_in_flight,
+            "rate_per_minute": self.config.rate_per_minute,
+            "retry_budget": round(self._retry_tokens, 2),
+            "features": {feature: stats.as_dict() for feature, stats in self._stats.items()},
+        }
+
+
+_ai_client: Optional[AIClient] = None
+_ai_client_lock = threading.Lock()
+
+
+def get_ai_client() -> AIClient:
+    """Process-wide AI client shared by every model caller"""
+    global _ai_client
+    if _ai_client is None:
+        with _ai_client_lock:
+            if _ai_client is None:
+                _ai_client = AIClient()
+    return _ai_client
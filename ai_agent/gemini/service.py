@@ -5,8 +5,9 @@ Provides interface to Google's Gemini AI model
 
 import os
 import json
+import asyncio
 import logging
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Callable, Awaitable, AsyncIterator
 from datetime import datetime
 
 try:
@@ -17,8 +18,44 @@ except ImportError:
     from .mock_service import MockGeminiService
     MOCK_MODE = True
 
+from .cache import get_response_cache
+from .batching import CategorizationBatchConfig, MicroBatcher
+from .client import get_ai_client, AIUnavailableError
+from .streaming import stream_generate
+
 logger = logging.getLogger("financial-agent.ai.gemini")
 
+# Transaction categories offered to the model
+EXPENSE_CATEGORIES = [
+    "Office Supplies",
+    "Utilities",
+    "Rent",
+    "Salaries",
+    "Marketing",
+    "Travel",
+    "Professional Services",
+    "Software Subscriptions",
+    "Equipment",
+    "Maintenance",
+    "Food and Entertainment",
+    "Telecommunications",
+    "Insurance",
+    "Taxes",
+    "Banking Fees",
+    "Sales Revenue",
+    "Service Revenue",
+    "Interest Income",
+    "Other Income",
+    "Uncategorized",
+]
+CATEGORIES_LIST = "\n- ".join(EXPENSE_CATEGORIES)
+
+# Transaction fields left out of categorization prompts
+CATEGORIZATION_IGNORED_FIELDS = {
+    "_id", "id", "transaction_id", "receipt_number", "reference",
+    "created_at", "updated_at", "timestamp", "transaction_date", "date"
+}
+
 class GeminiConfig:
     """Configuration for Gemini API"""
     
@@ -34,6 +71,20 @@ class GeminiService:
     
     def __init__(self):
         self.logger = logging.getLogger(__name__)
+        self.model_name = 'mock' if MOCK_MODE else 'gemini-pro'
+        self.cache = get_response_cache()
+        self.client = get_ai_client()
+        # generate_content answers from the mock service while the AI client refuses calls
+        self.fallback_to_mock = os.environ.get("GEMINI_FALLBACK_TO_MOCK", "true").lower() == "true"
+        self._fallback_service = None
+        
+        # Concurrent categorizations are sent to the model as one batched prompt
+        batch_config = CategorizationBatchConfig()
+        self.categorization_batcher = MicroBatcher(
+            self._categorize_batch,
+            batch_config.max_items,
+            batch_config.window_seconds
+        ) if batch_config.enabled else None
         
         if MOCK_MODE:
             self.logger.info("Using Mock Gemini Service for testing")
@@ -56,19 +107,20 @@ class GeminiService:
     def _initialize_model(self):
         """Initialize the Gemini model"""
         try:
-            self.model = genai.GenerativeModel('gemini-pro')
+            self.model = genai.GenerativeModel(self.model_name)
             self.logger.info("Gemini model initialized successfully")
         except Exception as e:
             self.logger.error(f"Failed to initialize Gemini model: {str(e)}")
             raise
     
-    async def reconcile_payment(self, payment_data: Dict[str, Any], invoices: List[Dict[str, Any]]) -> Dict[str, Any]:
+    async def reconcile_payment(self, payment_data: Dict[str, Any], invoices: List[Dict[str, Any]], bypass_cache: bool = False) -> Dict[str, Any]:
         """
         Reconcile a payment against a list of possible invoices
         
         Args:
             payment_data: The payment data from M-Pesa
             invoices: List of pending invoices
+            bypass_cache: Skip the response cache and call the model
             
         Returns:
             Dict with reconciliation result
@@ -78,7 +130,7 @@ class GeminiService:
             prompt = self._create_reconciliation_prompt(payment_data, invoices)
             
             # Send to Gemini
-            response = await self._generate_response(prompt)
+            response = await self._generate_response(prompt, call_type="reconciliation", bypass_cache=bypass_cache)
             
             # Parse the response into structured data
             reconciliation_result = self._parse_reconciliation_response(response)
@@ -92,12 +144,16 @@ class GeminiService:
             logger.error(f"Error in payment reconciliation: {str(e)}")
             raise
     
-    async def categorize_expense(self, transaction_data: Dict[str, Any]) -> Dict[str, Any]:
+    async def categorize_expense(self, transaction_data: Dict[str, Any], bypass_cache: bool = False) -> Dict[str, Any]:
         """
         Categorize a transaction into appropriate expense category
         
+        Concurrent calls are micro-batched into a single model request;
+        each caller still receives the result for its own transaction.
+        
         Args:
             transaction_data: The transaction data
+            bypass_cache: Skip the response cache and call the model
             
         Returns:
             Dict with categorization result
@@ -107,7 +163,15 @@ class GeminiService:
             prompt = self._create_categorization_prompt(transaction_data)
             
             # Send to Gemini
-            response = await self._generate_response(prompt)
+            generate = None
+            if self.categorization_batcher is not None:
+                generate = lambda: self.categorization_batcher.submit(transaction_data)
+            response = await self._generate_response(
+                prompt,
+                call_type="categorization",
+                bypass_cache=bypass_cache,
+                generate=generate
+            )
             
             # Parse the response into structured data
             categorization_result = self._parse_categorization_response(response)
@@ -121,13 +185,14 @@ class GeminiService:
             logger.error(f"Error in transaction categorization: {str(e)}")
             raise
     
-    async def detect_anomalies(self, transaction_data: Dict[str, Any], historical_data: List[Dict[str, Any]]) -> Dict[str, Any]:
+    async def detect_anomalies(self, transaction_data: Dict[str, Any], historical_data: List[Dict[str, Any]], bypass_cache: bool = False) -> Dict[str, Any]:
         """
         Detect anomalies in transaction data
         
         Args:
             transaction_data: The current transaction data
             historical_data: Historical transaction data for comparison
+            bypass_cache: Skip the response cache and call the model
             
         Returns:
             Dict with anomaly detection result
@@ -137,7 +202,7 @@ class GeminiService:
             prompt = self._create_anomaly_detection_prompt(transaction_data, historical_data)
             
             # Send to Gemini
-            response = await self._generate_response(prompt)
+            response = await self._generate_response(prompt, call_type="anomaly", bypass_cache=bypass_cache)
             
             # Parse the response into structured data
             anomaly_result = self._parse_anomaly_response(response)
@@ -148,12 +213,13 @@ class GeminiService:
             logger.error(f"Error in anomaly detection: {str(e)}")
             raise
     
-    async def generate_financial_insights(self, financial_data: Dict[str, Any]) -> Dict[str, Any]:
+    async def generate_financial_insights(self, financial_data: Dict[str, Any], bypass_cache: bool = False) -> Dict[str, Any]:
         """
         Generate financial insights from transaction and business data
         
         Args:
             financial_data: Financial data for analysis
+            bypass_cache: Skip the response cache and call the model
             
         Returns:
             Dict with financial insights
@@ -163,7 +229,7 @@ class GeminiService:
             prompt = self._create_insight_prompt(financial_data)
             
             # Send to Gemini
-            response = await self._generate_response(prompt)
+            response = await self._generate_response(prompt, call_type="insights", bypass_cache=bypass_cache)
             
             # Parse the response into structured data
             insights = self._parse_insights_response(response)
@@ -174,48 +240,173 @@ class GeminiService:
             logger.error(f"Error generating financial insights: {str(e)}")
             raise
     
-    async def _generate_response(self, prompt: str) -> str:
+    async def _generate_response(
+        self,
+        prompt: str,
+        call_type: str = "content",
+        bypass_cache: bool = False,
+        generate: Optional[Callable[[], Awaitable[str]]] = None
+    ) -> str:
         """
         Generate a response from Gemini API
         
+        Responses are served from the shared response cache when the same
+        prompt was answered recently; call_type selects the cache TTL.
+        
         Args:
             prompt: The prompt to send to Gemini
+            call_type: Kind of call ("reconciliation", "categorization", "anomaly", "insights", "content")
+            bypass_cache: Skip the cache lookup and call the model
+            generate: Produces the response on a cache miss (defaults to sending the prompt)
             
         Returns:
             String response from Gemini
         """
         try:
-            if MOCK_MODE:
-                # Use mock service for testing
-                return await self.mock_service.generate_content(prompt)
-            
-            response = await self.model.generate_content_async(prompt)
-            return response.text
+            return await self.cache.get_or_generate(
+                self.model_name,
+                prompt,
+                call_type,
+                generate or (lambda: self._call_model(prompt, feature=call_type)),
+                bypass=bypass_cache
+            )
             
         except Exception as e:
             logger.error(f"Error calling Gemini API: {str(e)}")
             raise
+    
+    async def _call_model(self, prompt: str, feature: str = "content") -> str:
+        """
+        Send a prompt to the model (or the mock service)
+        
+        Real model calls go through the shared AI client (rate limits,
+        retries, circuit breaker) and raise AIUnavailableError when refused.
+        """
+        if MOCK_MODE:
+            # Use mock service for testing
+            return await self.mock_service.generate_content(prompt)
+        
+        response = await self.client.call(feature, lambda: self.model.generate_content_async(prompt))
+        return response.text
 
-    async def generate_content(self, prompt: str, **kwargs) -> str:
+    async def generate_content(self, prompt: str, call_type: str = "content", bypass_cache: bool = False, **kwargs) -> str:
         """
         Generate content using Gemini AI
         
         Args:
             prompt (str): The input prompt for content generation
+            call_type (str): Kind of call, selects the response cache TTL
+            bypass_cache (bool): Skip the response cache and call the model
             **kwargs: Additional parameters for generation
             
         Returns:
             str: Generated content from Gemini
         """
-        return await self._generate_response(prompt)
+        try:
+            return await self._generate_response(prompt, call_type=call_type, bypass_cache=bypass_cache)
+        except AIUnavailableError as e:
+            if not self.fallback_to_mock:
+                raise
+            logger.warning(f"Gemini unavailable ({str(e)}), answering from mock service")
+            if self._fallback_service is None:
+                from .mock_service import MockGeminiService
+                self._fallback_service = MockGeminiService()
+            return await self._fallback_service.generate_content(prompt)
     
-    async def analyze_image(self, image_path: str, prompt: str) -> Dict[str, Any]:
+    async def stream_content(self, prompt: str, call_type: str = "content") -> AsyncIterator[str]:
+        """
+        Generate content, yielding text chunks as the model produces them
+        
+        Cached prompts are replayed in one chunk; mock mode and refused calls
+        (with GEMINI_FALLBACK_TO_MOCK) yield the mock answer in one chunk.
+        
+        Args:
+            prompt (str): The input prompt for content generation
+            call_type (str): Kind of call, selects the response cache TTL
+            
+        Yields:
+            str: Text chunks from Gemini
+        """
+        if MOCK_MODE:
+            yield await self.mock_service.generate_content(prompt)
+            return
+        
+        chunks = stream_generate(
+            self.model, prompt, call_type, self.client,
+            cache=self.cache, cache_model=self.model_name, call_type=call_type
+        )
+        started = False
+        try:
+            async for text in chunks:
+                started = True
+                yield text
+        except AIUnavailableError as e:
+            if started or not self.fallback_to_mock:
+                raise
+            logger.warning(f"Gemini unavailable ({str(e)}), answering from mock service")
+            if self._fallback_service is None:
+                from .mock_service import MockGeminiService
+                self._fallback_service = MockGeminiService()
+            yield await self._fallback_service.generate_content(prompt)
+    
+    def get_cache_metrics(self) -> Dict[str, Any]:
+        """Response cache hit/miss counters"""
+        return self.cache.get_metrics()
+    
+    def get_batching_metrics(self) -> Dict[str, Any]:
+        """Categorization micro-batching counters"""
+        if self.categorization_batcher is None:
+            return {"enabled": False}
+        return {"enabled": True, **self.categorization_batcher.get_metrics()}
+    
+    async def _categorize_batch(self, transactions: List[Dict[str, Any]]) -> List[Any]:
+        """
+        Categorize several transactions with one model request
+        
+        Items the batched response does not cover (or the whole batch, if the
+        response cannot be parsed) fall back to individual requests.
+        
+        Args:
+            transactions: Transactions collected by the batcher
+            
+        Returns:
+            One JSON response string (or Exception) per transaction, in order
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(transactions)
+        if len(transactions) > 1:
+            try:
+                response = await self._call_model(
+                    self._create_batch_categorization_prompt(transactions),
+                    feature="categorization"
+                )
+                results = self._parse_batch_categorization_response(response, len(transactions))
+            except Exception as e:
+                logger.warning(f"Batched categorization of {len(transactions)} transactions failed: {str(e)}")
+        
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing and len(transactions) > 1:
+            logger.warning(f"Falling back to individual categorization for {len(missing)} of {len(transactions)} transactions")
+        fallback = await asyncio.gather(
+            *[
+                self._call_model(self._create_categorization_prompt(transactions[i]), feature="categorization")
+                for i in missing
+            ],
+            return_exceptions=True
+        )
+        
+        responses: List[Any] = [json.dumps(result) if result is not None else None for result in results]
+        for i, response in zip(missing, fallback):
+            responses[i] = response
+        return responses
+    
+    async def analyze_image(self, image_path: str, prompt: str, image: Any = None) -> Dict[str, Any]:
         """
         Analyze an image using Gemini Vision
         
         Args:
             image_path (str): Path to the image file
             prompt (str): Text prompt for image analysis
+            image: Already loaded PIL image (skips reading image_path)
             
         Returns:
             Dict with analysis results
@@ -232,13 +423,17 @@ class GeminiService:
             # Load and prepare image
             from PIL import Image as PILImage
             
-            image = PILImage.open(image_path)
+            if image is None:
+                image = PILImage.open(image_path)
             
             # Use Gemini 2.0 Flash model for image analysis (supports multimodal)
             vision_model = genai.GenerativeModel('gemini-2.0-flash')
             
-            # Generate content with image and prompt
-            response = vision_model.generate_content([prompt, image])
+            # Generate content with image and prompt (through the shared AI client)
+            response = await self.client.call(
+                "ocr",
+                lambda: vision_model.generate_content_async([prompt, image])
+            )
             
             return {
                 "success": True,
@@ -340,7 +535,14 @@ Output JSON format only, no additional text.
     
     def _create_categorization_prompt(self, transaction_data: Dict[str, Any]) -> str:
         """Create a prompt for transaction categorization"""
-        transaction_str = json.dumps(transaction_data, indent=2)
+        # Identifiers and timestamps do not affect the category; leaving them out
+        # lets repeat transactions for the same merchant share a cached response
+        transaction_str = json.dumps(
+            {k: v for k, v in transaction_data.items() if k not in CATEGORIZATION_IGNORED_FIELDS},
+            indent=2,
+            sort_keys=True,
+            default=str
+        )
         
         prompt = f"""You are an expert financial categorization AI assistant specialized in Kenyan business transactions.
 Your task is to categorize the following transaction into the most appropriate expense or income category.
@@ -351,26 +553,7 @@ TRANSACTION DETAILS:
 ```
 
 Categorize this transaction into one of the following categories:
-- Office Supplies
-- Utilities
-- Rent
-- Salaries
-- Marketing
-- Travel
-- Professional Services
-- Software Subscriptions
-- Equipment
-- Maintenance
-- Food and Entertainment
-- Telecommunications
-- Insurance
-- Taxes
-- Banking Fees
-- Sales Revenue
-- Service Revenue
-- Interest Income
-- Other Income
-- Uncategorized
+- {CATEGORIES_LIST}
 
 Return your analysis in JSON format with these fields:
 - category: The determined category
@@ -384,6 +567,66 @@ Output JSON format only, no additional text.
         
         return prompt
 
+    def _create_batch_categorization_prompt(self, transactions: List[Dict[str, Any]]) -> str:
+        """Create a single prompt categorizing several transactions"""
+        items = [
+            {"index": i, **{k: v for k, v in transaction.items() if k not in CATEGORIZATION_IGNORED_FIELDS}}
+            for i, transaction in enumerate(transactions)
+        ]
+        transactions_str = json.dumps(items, indent=2, sort_keys=True, default=str)
+        
+        prompt = f"""You are an expert financial categorization AI assistant specialized in Kenyan business transactions.
+Your task is to categorize each of the following {len(items)} transactions into the most appropriate expense or income category.
+
+TRANSACTIONS:
+```json
+{transactions_str}
+```
+
+Categorize each transaction into one of the following categories:
+- {CATEGORIES_LIST}
+
+Return a JSON array with exactly one object per transaction, each with these fields:
+- index: The index of the transaction it describes
+- category: The determined category
+- subcategory: A more specific subcategory if applicable
+- confidence_score: A score from 0-100 indicating confidence level
+- explanation: Brief explanation for this categorization
+- action_required: Whether human review is needed (true if confidence < 70)
+
+Output the JSON array only, no additional text.
+"""
+        
+        return prompt
+    
+    def _parse_batch_categorization_response(self, response: str, count: int) -> List[Optional[Dict[str, Any]]]:
+        """
+        Split a batched categorization response back into per-transaction results
+        
+        Returns:
+            One result per transaction, None where the response has no usable entry
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * count
+        json_start = response.find("[")
+        json_end = response.rfind("]") + 1
+        if json_start < 0 or json_end <= json_start:
+            logger.warning("Could not find a JSON array in batched categorization response")
+            return results
+        
+        try:
+            items = json.loads(response[json_start:json_end])
+        except json.JSONDecodeError as e:
+            logger.warning(f"Error parsing batched categorization response: {str(e)}")
+            return results
+        
+        for item in items:
+            if not isinstance(item, dict) or not item.get("category"):
+                continue
+            index = item.pop("index", None)
+            if isinstance(index, int) and 0 <= index < count and results[index] is None:
+                results[index] = item
+        return results
+
     def _parse_categorization_response(self, response: str) -> Dict[str, Any]:
         """Parse the categorization response"""
         try:
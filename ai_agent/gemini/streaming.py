@@ -0,0 +1,129 @@
+"""
+Streaming model responses
+
+Helpers for endpoints that forward Gemini output as it is generated instead
+of waiting for the whole completion:
+
+- stream_generate() yields the text chunks of one model call. Opening the
+  stream goes through the shared AI client (rate limits, retries and the
+  circuit breaker apply until the first chunk arrives), and a completed
+  answer is stored in the response cache, so a repeat prompt is replayed
+  from the cache in a single chunk.
+- sse_stream() turns a chunk iterator into Server-Sent Events: one "token"
+  event per chunk, then a final "done" event carrying structured metadata
+  computed from the full text (or an "error" event).
+
+Event stream:
+    event: token   data: {"text": "..."}
+    event: done    data: {...metadata}
+    event: error   data: {"error": "..."}
+"""
+
+import json
+import logging
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+logger = logging.getLogger("financial-agent.ai.gemini.streaming")
+
+# Response headers for text/event-stream responses (disable proxy buffering)
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no",
+}
+
+SUGGESTION_KEYWORDS = ("suggest", "recommend", "should", "consider")
+
+
+def extract_suggestions(text: str, limit: int = 3) -> List[str]:
+    """Lines of a model answer that read as actionable suggestions"""
+    suggestions = []
+    for line in text.split("\n"):
+        if any(keyword in line.lower() for keyword in SUGGESTION_KEYWORDS):
+            suggestions.append(line.strip())
+            if len(suggestions) >= limit:
+                break
+    return suggestions
+
+
+def _chunk_text(chunk: Any) -> str:
+    try:
+        return chunk.text or ""
+    except ValueError:
+        # Chunks without text parts (e.g. a safety stop) raise on .text
+        return ""
+
+
+async def stream_generate(
+    model: Any,
+    prompt: str,
+    feature: str,
+    ai_client: Any,
+    cache: Any = None,
+    cache_model: Optional[str] = None,
+    call_type: str = "content"
+) -> AsyncIterator[str]:
+    """
+    Yield the text of one streamed model call
+
+    Args:
+        model: google.generativeai GenerativeModel
+        prompt: Prompt text
+        feature: AI client feature name (rate limits and metrics)
+        ai_client: Shared AIClient
+        cache: ResponseCache to replay from and store into (None = no caching)
+        cache_model: Model part of the cache key (defaults to the model name)
+        call_type: Cache call type selecting the TTL
+
+    Yields:
+        Text chunks as the model produces them
+    """
+    cache_model = cache_model or getattr(model, "model_name", "gemini")
+    if cache is not None:
+        cached = await cache.lookup(cache_model, prompt, call_type)
+        if cached is not None:
+            yield cached
+            return
+
+    response = await ai_client.call(feature, lambda: model.generate_content_async(prompt, stream=True))
+    parts = []
+    async for chunk in response:
+        text = _chunk_text(chunk)
+        if text:
+            parts.append(text)
+            yield text
+
+    if cache is not None and parts:
+        await cache.store(cache_model, prompt, call_type, "".join(parts))
+
+
+def sse_event(event: str, data: Any) -> str:
+    """One Server-Sent Events frame"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+async def sse_stream(
+    chunks: AsyncIterator[str],
+    finish: Callable[[str], Dict[str, Any]]
+) -> AsyncIterator[str]:
+    """
+    Frame a chunk stream as Server-Sent Events
+
+    Args:
+        chunks: Model text chunks
+        finish: Builds the final frame's metadata from the full text
+
+    Yields:
+        "token" frames, then one "done" frame (or an "error" frame)
+    """
+    parts = []
+    try:
+        async for text in chunks:
+            parts.append(text)
+            yield sse_event("token", {"text": text})
+        metadata = finish("".join(parts))
+    except Exception as e:
+        logger.error(f"Streaming response failed: {str(e)}")
+        yield sse_event("error", {"error": str(e), "partial": bool(parts)})
+        return
+    yield sse_event("done", metadata)
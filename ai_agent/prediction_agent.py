@@ -436,7 +436,7 @@ Constraints: {constraints}
             )
             
             # Get AI analysis
-            response = await self.gemini_service.generate_content(prompt)
+            response = await self.gemini_service.generate_content(prompt, call_type="prediction")
             
             # Parse and validate response
             try:
@@ -472,7 +472,7 @@ Constraints: {constraints}
                 period=period
             )
             
-            response = await self.gemini_service.generate_content(prompt)
+            response = await self.gemini_service.generate_content(prompt, call_type="prediction")
             
             try:
                 analysis_result = json.loads(response)
@@ -501,7 +501,7 @@ Constraints: {constraints}
                 context=context_str
             )
             
-            response = await self.gemini_service.generate_content(prompt)
+            response = await self.gemini_service.generate_content(prompt, call_type="prediction")
             
             try:
                 anomaly_result = json.loads(response)
@@ -532,7 +532,7 @@ Constraints: {constraints}
                 business_context=json.dumps(business_context, indent=2)
             )
             
-            response = await self.gemini_service.generate_content(prompt)
+            response = await self.gemini_service.generate_content(prompt, call_type="prediction")
             
             try:
                 alert_result = json.loads(response)
@@ -576,7 +576,7 @@ Constraints: {constraints}
                 industry_context=json.dumps(industry_context or {}, indent=2)
             )
             
-            response = await self.gemini_service.generate_content(prompt)
+            response = await self.gemini_service.generate_content(prompt, call_type="prediction")
             
             try:
                 insight_result = json.loads(response)
@@ -621,7 +621,7 @@ Constraints: {constraints}
                 constraints=json.dumps(constraints or {}, indent=2)
             )
             
-            response = await self.gemini_service.generate_content(prompt)
+            response = await self.gemini_service.generate_content(prompt, call_type="prediction")
             
             try:
                 recommendation_result = json.loads(response)
@@ -9,10 +9,11 @@
 # Imports
 # ------------------------------------------------------------------------------
 from fastapi import APIRouter, HTTPException, Depends
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from typing import Dict, Any
 import logging
 
+from ai_agent.gemini.streaming import SSE_HEADERS
 from .service import (
     get_ai_insights_service, 
     FinancialRAGService, 
@@ -44,6 +45,39 @@ def get_service() -> FinancialRAGService:
     """Dependency to get the AI insights service"""
     return get_ai_insights_service()
 
+# ------------------------------------------------------------------------------
+# Context Snapshot Maintenance
+# ------------------------------------------------------------------------------
+@router.on_event("startup")
+async def start_context_snapshots():
+    """Follow writes to the financial collections so context snapshots stay current"""
+    try:
+        get_ai_insights_service().context_snapshots.start_watching()
+    except Exception as e:
+        logger.warning(f"Context snapshot watcher not started: {str(e)}")
+
+@router.on_event("startup")
+async def start_retrieval_index():
+    """Bring the retrieval index up to date before the first questions arrive"""
+    try:
+        get_ai_insights_service().retrieval_index.sync_in_background()
+    except Exception as e:
+        logger.warning(f"Retrieval index sync not started: {str(e)}")
+
+@router.on_event("shutdown")
+async def stop_context_snapshots():
+    try:
+        await get_ai_insights_service().context_snapshots.stop_watching()
+    except Exception as e:
+        logger.warning(f"Context snapshot watcher did not stop cleanly: {str(e)}")
+
+@router.on_event("shutdown")
+async def stop_retrieval_index():
+    try:
+        await get_ai_insights_service().retrieval_index.stop()
+    except Exception as e:
+        logger.warning(f"Retrieval index sync did not stop cleanly: {str(e)}")
+
 # ------------------------------------------------------------------------------
 # API Endpoints
 # ------------------------------------------------------------------------------
@@ -77,7 +111,7 @@ async def ask_financial_question(
             )
         
         # Process the query using RAG architecture
-        response = service.ask_financial_question(request)
+        response = await service.ask_financial_question(request)
         
         logger.info("Successfully generated financial insight")
         return response
@@ -92,6 +126,33 @@ async def ask_financial_question(
             detail=f"Internal server error while processing your question: {str(e)}"
         )
 
+@router.post("/ask/stream")
+async def ask_financial_question_stream(
+    request: QueryRequest,
+    service: FinancialRAGService = Depends(get_service)
+) -> StreamingResponse:
+    """
+    Streaming variant of /ask (Server-Sent Events)
+    
+    Answer text is sent as "token" events while the model generates it, so
+    the first words arrive after the model's first-token latency instead of
+    the full completion. A final "done" event carries the full answer,
+    suggestions and data sources; failures end the stream with an "error"
+    event.
+    """
+    if not request.query or len(request.query.strip()) < 3:
+        raise HTTPException(
+            status_code=400,
+            detail="Query must be at least 3 characters long"
+        )
+    
+    logger.info(f"Received streaming financial query: {request.query[:100]}...")
+    return StreamingResponse(
+        service.stream_financial_question(request),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
+
 @router.post("/ask-advanced", response_model=AIInsightResponse)
 async def ask_advanced_financial_question(
     query: FinancialQuery,
@@ -120,7 +181,7 @@ async def ask_advanced_financial_question(
             )
         
         # Get AI insights
-        insight = service.get_financial_insight(query)
+        insight = await service.get_financial_insight(query)
         
         logger.info("Successfully generated financial insight")
         return insight
@@ -146,7 +207,7 @@ async def health_check(
     and other system health indicators.
     """
     try:
-        health_status = service.health_check()
+        health_status = await service.health_check()
         
         if health_status["status"] == "healthy":
             return JSONResponse(
@@ -19,14 +19,23 @@
 # ------------------------------------------------------------------------------
 import os
 import json
+import asyncio
 import logging
 from datetime import datetime, timedelta
-from typing import Dict, Any, List, Optional
-from pymongo import MongoClient
+from typing import Dict, Any, List, Optional, AsyncIterator
+from motor.motor_asyncio import AsyncIOMotorClient
+from bson import ObjectId
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 import google.generativeai as genai
 
+from ai_agent.gemini.client import get_ai_client
+from ai_agent.gemini.cache import get_response_cache
+from ai_agent.gemini.streaming import stream_generate, sse_stream, extract_suggestions
+from database.context_snapshots import FinancialContextSnapshots, ContextSnapshot, NO_DATA_TEXT
+from database.retrieval_index import FinancialRetrievalIndex, RetrievedRecord, render_relevant_records
+from database.rollups import DEFAULT_TENANT
+
 # Setup logging
 logger = logging.getLogger("financial-agent.ai.insights")
 
@@ -75,6 +84,42 @@ class AIInsightResponse(BaseModel):
     timestamp: str
     suggestions: Optional[List[str]] = None
 
+# Prompt for /ai/ask answers over the financial context snapshot
+INSIGHT_PROMPT_TEMPLATE = """
+You are a helpful and professional financial assistant for Small and Medium Businesses in Kenya.
+Your role is to provide accurate, actionable financial insights based ONLY on the provided context data.
+
+IMPORTANT FORMATTING INSTRUCTIONS:
+1. Use proper Markdown formatting with headers (##, ###) for sections
+2. Use numbered lists (1., 2., 3.) instead of asterisks (*) for better readability
+3. Use line breaks between sections for visual clarity
+4. Bold important terms using **text**
+5. Present data in tables when appropriate using Markdown table syntax
+6. Base your answer ONLY on the provided financial context below
+7. If the context doesn't contain enough information, clearly state this limitation
+8. Focus on actionable insights and recommendations for Kenyan SMBs
+9. Use Kenyan Shilling (KES) currency format
+10. Be professional, clear, and concise
+11. If you're uncertain about something, say so rather than guessing
+
+FINANCIAL CONTEXT:
+{context}
+
+USER QUERY:
+{query}
+
+Please provide a comprehensive answer based on the available financial data above.
+Format your response professionally with:
+- Clear section headers (##)
+- Numbered lists for requirements or steps
+- Bold text for emphasis on key points
+- Tables for data presentation where appropriate
+- Line breaks between sections
+
+Include specific numbers and insights where possible.
+If the context is insufficient, explain what additional data would be needed.
+"""
+
 # ------------------------------------------------------------------------------
 # 4. Core RAG Service Class
 # ------------------------------------------------------------------------------
@@ -85,15 +130,29 @@ class FinancialRAGService:
     This service combines:
     1. Data retrieval from MongoDB (transactions, invoices, etc.)
     2. AI generation using Google Gemini SDK
+    
+    Both steps are async (Motor and the async Gemini API), so a question in
+    flight never holds the event loop. The financial context comes from
+    precomputed per-tenant snapshots (database/context_snapshots.py) plus
+    the records a local retrieval index (database/retrieval_index.py) finds
+    relevant to the question, and answers are cached per snapshot version.
     """
     
     def __init__(self, config: AIInsightsConfig):
         self.config = config
-        self.client = MongoClient(config.mongo_uri)
+        self.client = AsyncIOMotorClient(config.mongo_uri)
         self.db = self.client[config.database_name]
         
         # Initialize Gemini model
         self.model = genai.GenerativeModel(config.gemini_model)
+        # Shared rate limits, retries and circuit breaker for Gemini calls
+        self.ai_client = get_ai_client()
+        self.response_cache = get_response_cache()
+        
+        # Summary blocks kept up to date as financial data changes
+        self.context_snapshots = FinancialContextSnapshots(self.db)
+        # Question -> relevant transactions, invoices and receipts
+        self.retrieval_index = FinancialRetrievalIndex(self.db)
         
         logger.info(f"Initialized FinancialRAGService with database: {config.database_name}")
 
@@ -101,121 +160,59 @@ class FinancialRAGService:
     # 4. Retrieval Logic (The "R" in RAG)
     # --------------------------------------------------------------------------
     
-    def retrieve_financial_context(self, query: str) -> str:
+    async def get_context_snapshot(self, tenant_id: str = DEFAULT_TENANT) -> Optional[ContextSnapshot]:
         """
-        Retrieve relevant financial data from MongoDB based on the user's query.
-        This function accesses various collections for financial data.
+        Current financial context snapshot of a tenant (None if it cannot be read)
         """
         try:
-            context_parts = []
-            
-            logger.info(f"Retrieving financial context from database: {self.config.database_name}")
-            logger.info(f"MongoDB URI: {self.config.mongo_uri[:50]}...")  # Log partial URI
-            
-            # Try to get all collection names first
-            try:
-                collections = self.db.list_collection_names()
-                logger.info(f"Available collections: {collections}")
-            except Exception as e:
-                logger.error(f"Could not list collections: {str(e)}")
-            
-            # Get transaction summary - try multiple date fields
-            logger.info("Looking for recent transactions...")
-            try:
-                # Try different date field names
-                for date_field in ["request_timestamp", "timestamp", "created_at", "date"]:
-                    recent_transactions = list(self.db.transactions.find().limit(100))
-                    if recent_transactions:
-                        logger.info(f"Found {len(recent_transactions)} transactions")
-                        break
-                else:
-                    # If no date filtering worked, just get any transactions
-                    recent_transactions = list(self.db.transactions.find().limit(100))
-                    
-            except Exception as e:
-                logger.error(f"Error finding transactions: {str(e)}")
-                recent_transactions = []
-            
-            logger.info(f"Retrieved {len(recent_transactions)} transactions")
-            logger.info(f"Retrieved {len(recent_transactions)} transactions")
-            
-            if recent_transactions:
-                total_amount = sum(t.get("amount", 0) for t in recent_transactions)
-                completed_count = len([t for t in recent_transactions if t.get("status") == "completed"])
-                context_parts.append(f"\n## Recent Transactions:")
-                context_parts.append(f"- Total transactions: {len(recent_transactions)}")
-                context_parts.append(f"- Total amount: KES {total_amount:,.2f}")
-                context_parts.append(f"- Completed transactions: {completed_count}")
-                
-                # Group by payment method/gateway
-                gateways = {}
-                for t in recent_transactions:
-                    gateway = t.get("gateway", t.get("payment_method", "Unknown"))
-                    gateways[gateway] = gateways.get(gateway, 0) + 1
-                
-                if gateways:
-                    context_parts.append(f"\n### Payment Methods:")
-                    for gateway, count in gateways.items():
-                        context_parts.append(f"- {gateway}: {count} transactions")
-            
-            # Get invoice data
-            logger.info("Looking for invoices...")
-            try:
-                recent_invoices = list(self.db.invoices.find().limit(100))
-                logger.info(f"Found {len(recent_invoices)} invoices")
-            except Exception as e:
-                logger.error(f"Error finding invoices: {str(e)}")
-                recent_invoices = []
-            
-            if recent_invoices:
-                invoice_total = sum(inv.get("total_amount", inv.get("amount", 0)) for inv in recent_invoices)
-                paid_invoices = len([inv for inv in recent_invoices if inv.get("status") == "paid"])
-                pending_invoices = len([inv for inv in recent_invoices if inv.get("status") in ["sent", "overdue", "pending"]])
-                
-                context_parts.append(f"\n## Recent Invoices:")
-                context_parts.append(f"- Total invoices: {len(recent_invoices)}")
-                context_parts.append(f"- Total invoice value: KES {invoice_total:,.2f}")
-                context_parts.append(f"- Paid invoices: {paid_invoices}")
-                context_parts.append(f"- Pending invoices: {pending_invoices}")
-            
-            # Get customer data
-            logger.info("Looking for customers...")
-            try:
-                customer_count = self.db.customers.count_documents({})
-                logger.info(f"Found {customer_count} customers")
-                if customer_count > 0:
-                    context_parts.append(f"\n## Customer Base:")
-                    context_parts.append(f"- Total customers: {customer_count}")
-            except Exception as e:
-                logger.error(f"Error finding customers: {str(e)}")
-            
-            # Get receipt/expense data
-            logger.info("Looking for receipts...")
-            try:
-                recent_receipts = list(self.db.receipts.find().limit(100))
-                logger.info(f"Found {len(recent_receipts)} receipts")
-                if recent_receipts:
-                    receipt_total = sum(r.get("amount", r.get("tax_breakdown", {}).get("total", 0)) for r in recent_receipts)
-                    context_parts.append(f"\n## Recent Receipts/Expenses:")
-                    context_parts.append(f"- Total receipts: {len(recent_receipts)}")
-                    context_parts.append(f"- Total receipt value: KES {receipt_total:,.2f}")
-            except Exception as e:
-                logger.error(f"Error finding receipts: {str(e)}")
-            
-            # Join all context parts
-            if context_parts:
-                full_context = "# FINANCIAL CONTEXT\n\n" + "\n".join(context_parts)
-                logger.info(f"Generated context with {len(context_parts)} sections")
-                return full_context
-            else:
-                logger.warning("No financial data found in database!")
-                return "No financial data available in the system."
-                
+            return await self.context_snapshots.get(tenant_id)
         except Exception as e:
             logger.error(f"Error retrieving financial context: {str(e)}", exc_info=True)
-            return f"Error retrieving financial data: {str(e)}"
+            return None
+    
+    async def retrieve_relevant_records(
+        self,
+        query: str,
+        tenant_id: str = DEFAULT_TENANT,
+        sources: Optional[List[str]] = None,
+        k: Optional[int] = None
+    ) -> List[RetrievedRecord]:
+        """
+        Records relevant to the query from the retrieval index ([] if unavailable)
+        """
+        try:
+            return await self.retrieval_index.search(query, tenant_id, k=k, sources=sources)
+        except Exception as e:
+            logger.error(f"Error searching retrieval index: {str(e)}", exc_info=True)
+            return []
+    
+    async def build_question_context(self, query: str, tenant_id: str = DEFAULT_TENANT):
+        """
+        Snapshot and relevant records for a question
+        
+        Returns:
+            (snapshot or None, records, context text)
+        """
+        snapshot, records = await asyncio.gather(
+            self.get_context_snapshot(tenant_id),
+            self.retrieve_relevant_records(query, tenant_id)
+        )
+        context = (snapshot.text if snapshot else NO_DATA_TEXT) + render_relevant_records(records)
+        return snapshot, records, context
+    
+    async def retrieve_financial_context(self, query: str, tenant_id: str = DEFAULT_TENANT) -> str:
+        """
+        Retrieve the financial context for the user's query.
+        The summary blocks are precomputed, so this is a snapshot lookup plus
+        an index search for the records the query is about.
+        """
+        snapshot, records, context = await self.build_question_context(query, tenant_id)
+        if snapshot is None:
+            return "Error retrieving financial data."
+        logger.info(f"Using financial context snapshot {snapshot.cache_tag} with {len(records)} relevant records")
+        return context
     
-    def retrieve_transaction_data(self, query: FinancialQuery) -> Dict[str, Any]:
+    async def retrieve_transaction_data(self, query: FinancialQuery) -> Dict[str, Any]:
         """
         Enhanced retrieval function for structured transaction data
         """
@@ -242,20 +239,36 @@ class FinancialRAGService:
                 elif query.transaction_type == "expense":
                     mongo_query["type"] = "debit"
             
-            # Retrieve transactions
-            transactions = list(self.db.transactions.find(mongo_query).limit(100))
-            
-            # Retrieve invoices
-            invoices = list(self.db.invoices.find(mongo_query).limit(50))
-            
-            # Calculate summary statistics
-            total_transactions = len(transactions)
-            total_amount = sum(t.get("amount", 0) for t in transactions)
+            # Records relevant to the question, then the matching documents
+            records = await self.retrieve_relevant_records(
+                query.question, sources=["transactions", "invoices"],
+                k=self.retrieval_index.config.top_k * 4
+            )
+            if records:
+                transactions, invoices = await asyncio.gather(
+                    self._find_ranked("transactions", mongo_query, records, 100),
+                    self._find_ranked("invoices", mongo_query, records, 50)
+                )
+            else:
+                # Index not built yet: fall back to an unranked sample
+                transactions, invoices = await asyncio.gather(
+                    self.db.transactions.find(mongo_query).limit(100).to_list(100),
+                    self.db.invoices.find(mongo_query).limit(50).to_list(50)
+                )
+            
+            # Calculate summary statistics over every matching transaction
+            totals = await self.db.transactions.aggregate([
+                {"$match": mongo_query},
+                {"$group": {"_id": None, "count": {"$sum": 1}, "amount": {"$sum": {"$ifNull": ["$amount", 0]}}}}
+            ]).to_list(1)
+            total_transactions = totals[0]["count"] if totals else 0
+            total_amount = totals[0]["amount"] if totals else 0
             
             # Prepare structured data for AI
             retrieved_data = {
                 "transactions": transactions,
                 "invoices": invoices,
+                "relevant_records": [record.summary for record in records],
                 "summary": {
                     "total_transactions": total_transactions,
                     "total_amount": total_amount,
@@ -265,75 +278,70 @@ class FinancialRAGService:
                 "data_sources": ["transactions", "invoices"]
             }
             
-            logger.info(f"Retrieved {total_transactions} transactions and {len(invoices)} invoices")
+            logger.info(f"Retrieved {len(transactions)} relevant transactions and {len(invoices)} invoices")
             return retrieved_data
             
         except Exception as e:
             logger.error(f"Error retrieving transaction data: {str(e)}")
             return {"error": str(e), "data_sources": []}
+    
+    async def _find_ranked(
+        self,
+        collection: str,
+        mongo_query: Dict[str, Any],
+        records: List[RetrievedRecord],
+        limit: int
+    ) -> List[Dict[str, Any]]:
+        """Documents of the retrieved records that match the filters, in rank order"""
+        ids = [record.id for record in records if record.source == collection]
+        object_ids = [ObjectId(i) if ObjectId.is_valid(i) else i for i in ids]
+        if not object_ids:
+            return []
+        documents = await self.db[collection].find(
+            {"$and": [mongo_query, {"_id": {"$in": object_ids}}]}
+        ).to_list(limit)
+        rank = {i: position for position, i in enumerate(ids)}
+        return sorted(documents, key=lambda d: rank.get(str(d["_id"]), len(rank)))[:limit]
 
     # --------------------------------------------------------------------------
     # 5. Generation Logic (The "G" in RAG)
     # --------------------------------------------------------------------------
     
-    def generate_insight(self, query: str, context: str) -> str:
+    def _build_insight_prompt(self, query: str, context: str) -> str:
+        """Format the insight prompt with the retrieved context"""
+        return INSIGHT_PROMPT_TEMPLATE.format(
+            context=context if context else NO_DATA_TEXT,
+            query=query
+        )
+    
+    async def generate_insight(self, query: str, context: str, cache_tag: Optional[str] = None) -> str:
         """
         Generate AI insights using the Gemini SDK based on retrieved context.
         This function creates a detailed prompt and uses the model to generate the final answer.
+        
+        With a cache_tag (the context snapshot version), answers are cached
+        and reused until the snapshot changes.
         """
         try:
-            # Create detailed prompt template
-            prompt_template = """
-You are a helpful and professional financial assistant for Small and Medium Businesses in Kenya.
-Your role is to provide accurate, actionable financial insights based ONLY on the provided context data.
-
-IMPORTANT FORMATTING INSTRUCTIONS:
-1. Use proper Markdown formatting with headers (##, ###) for sections
-2. Use numbered lists (1., 2., 3.) instead of asterisks (*) for better readability
-3. Use line breaks between sections for visual clarity
-4. Bold important terms using **text**
-5. Present data in tables when appropriate using Markdown table syntax
-6. Base your answer ONLY on the provided financial context below
-7. If the context doesn't contain enough information, clearly state this limitation
-8. Focus on actionable insights and recommendations for Kenyan SMBs
-9. Use Kenyan Shilling (KES) currency format
-10. Be professional, clear, and concise
-11. If you're uncertain about something, say so rather than guessing
-
-FINANCIAL CONTEXT:
-{context}
-
-USER QUERY:
-{query}
-
-Please provide a comprehensive answer based on the available financial data above.
-Format your response professionally with:
-- Clear section headers (##)
-- Numbered lists for requirements or steps
-- Bold text for emphasis on key points
-- Tables for data presentation where appropriate
-- Line breaks between sections
-
-Include specific numbers and insights where possible.
-If the context is insufficient, explain what additional data would be needed.
-"""
+            formatted_prompt = self._build_insight_prompt(query, context)
             
-            # Format the prompt with actual data
-            formatted_prompt = prompt_template.format(
-                context=context if context else "No financial data available in the system.",
-                query=query
-            )
+            async def generate() -> str:
+                response = await self.ai_client.call("insights", lambda: self.model.generate_content_async(formatted_prompt))
+                return response.text
             
-            # Generate response using Gemini
-            response = self.model.generate_content(formatted_prompt)
+            if cache_tag is None:
+                return await generate()
             
-            return response.text
+            # Generate response using Gemini (cached per snapshot version)
+            return await self.response_cache.get_or_generate(
+                f"{self.config.gemini_model}@{cache_tag}", formatted_prompt, "insights", generate
+            )
             
         except Exception as e:
             logger.error(f"Error generating insight: {str(e)}")
             return f"I apologize, but I encountered an error while analyzing your financial data: {str(e)}"
     
-    def generate_financial_insight(self, query: FinancialQuery, retrieved_data: Dict[str, Any]) -> AIInsightResponse:
+    async def generate_financial_insight(self, query: FinancialQuery, retrieved_data: Dict[str, Any]) -> AIInsightResponse:
         """
         Enhanced generation function that returns structured AI insights
         """
@@ -386,7 +394,7 @@ If the context is insufficient, explain what additional data would be needed.
             """
             
             # Generate response using Gemini
-            response = self.model.generate_content(full_prompt)
+            response = await self.ai_client.call("insights", lambda: self.model.generate_content_async(full_prompt))
             
             # Parse and structure the response
             ai_response = AIInsightResponse(
@@ -429,7 +437,7 @@ If the context is insufficient, explain what additional data would be needed.
         - Date Range: {summary.get('date_range', 'All time')}
         - Transaction Type: {summary.get('transaction_type', 'All types')}
         
-        Recent Transactions (sample):
+        Relevant Transactions (sample):
         """
         
         # Add sample transactions (first 5)
@@ -441,6 +449,10 @@ If the context is insufficient, explain what additional data would be needed.
         if len(transactions) > 5:
             formatted += f"\n... and {len(transactions) - 5} more transactions"
         
+        relevant = data.get("relevant_records", [])
+        if relevant:
+            formatted += "\n\nRecords Relevant to the Question:\n" + "\n".join(f"- {r}" for r in relevant[:10])
+        
         return formatted
     
     def _extract_suggestions(self, ai_response: str) -> List[str]:
@@ -448,30 +460,25 @@ If the context is insufficient, explain what additional data would be needed.
         Extract actionable suggestions from AI response
         """
         # Simple extraction - in production, could use more sophisticated NLP
-        suggestions = []
-        lines = ai_response.split('\n')
-        
-        for line in lines:
-            if any(keyword in line.lower() for keyword in ['suggest', 'recommend', 'should', 'consider']):
-                suggestions.append(line.strip())
-        
-        return suggestions[:3]  # Return top 3 suggestions
+        return extract_suggestions(ai_response, limit=3)  # Return top 3 suggestions
 
     # --------------------------------------------------------------------------
     # 6. Main Service Methods - Tying It All Together
     # --------------------------------------------------------------------------
     
-    def ask_financial_question(self, request: QueryRequest) -> QueryResponse:
+    async def ask_financial_question(self, request: QueryRequest) -> QueryResponse:
         """
         Main endpoint function that ties retrieval and generation together.
         This implements the complete RAG pipeline for the /ai/ask endpoint.
         """
         try:
             # Step 1: Retrieve financial context (RAG - Retrieval)
-            context = self.retrieve_financial_context(request.query)
+            snapshot, records, context = await self.build_question_context(request.query)
             
             # Step 2: Generate AI insights (RAG - Generation)
-            answer = self.generate_insight(request.query, context)
+            answer = await self.generate_insight(
+                request.query, context, cache_tag=snapshot.cache_tag if snapshot else None
+            )
             
             # Step 3: Create and return response
             response = QueryResponse(answer=answer)
@@ -486,35 +493,70 @@ If the context is insufficient, explain what additional data would be needed.
                 answer=f"I apologize, but I encountered an error while processing your question: {str(e)}"
             )
     
-    def get_financial_insight(self, query: FinancialQuery) -> AIInsightResponse:
+    async def stream_financial_question(self, request: QueryRequest) -> AsyncIterator[str]:
+        """
+        Streaming variant of ask_financial_question (Server-Sent Events)
+        
+        Answer text is forwarded as the model produces it; the final "done"
+        event carries the suggestions, data sources and snapshot version.
+        """
+        snapshot, records, context = await self.build_question_context(request.query)
+        prompt = self._build_insight_prompt(request.query, context)
+        
+        chunks = stream_generate(
+            self.model, prompt, "insights", self.ai_client,
+            cache=self.response_cache if snapshot else None,
+            cache_model=f"{self.config.gemini_model}@{snapshot.cache_tag}" if snapshot else None,
+            call_type="insights"
+        )
+        
+        def finish(answer: str) -> Dict[str, Any]:
+            logger.info(f"Successfully streamed answer for query: {request.query[:50]}...")
+            return {
+                "answer": answer,
+                "suggestions": self._extract_suggestions(answer),
+                "data_sources": list(snapshot.blocks) if snapshot else [],
+                "relevant_records": [{"source": r.source, "id": r.id, "score": r.score} for r in records],
+                "context_version": snapshot.cache_tag if snapshot else None,
+                "timestamp": datetime.now().isoformat()
+            }
+        
+        async for frame in sse_stream(chunks, finish):
+            yield frame
+    
+    async def get_financial_insight(self, query: FinancialQuery) -> AIInsightResponse:
         """
         Enhanced method that returns structured insights with additional metadata
         """
         logger.info(f"Processing financial query: {query.question}")
         
         # Step 1: Retrieve relevant data (RAG - Retrieval)
-        retrieved_data = self.retrieve_transaction_data(query)
+        retrieved_data = await self.retrieve_transaction_data(query)
         
         # Step 2: Generate AI insights (RAG - Generation)
-        insight = self.generate_financial_insight(query, retrieved_data)
+        insight = await self.generate_financial_insight(query, retrieved_data)
         
         return insight
     
-    def health_check(self) -> Dict[str, Any]:
+    async def health_check(self) -> Dict[str, Any]:
         """
         Check the health of the AI insights service
         """
         try:
             # Check database connection
-            db_status = self.client.admin.command('ping')
+            db_status = await self.client.admin.command('ping')
             
             # Check Gemini API (simple test)
-            test_response = self.model.generate_content("Hello, are you working?")
+            test_response = await self.ai_client.call(
+                "insights",
+                lambda: self.model.generate_content_async("Hello, are you working?")
+            )
             
             return {
                 "status": "healthy",
                 "database": "connected",
                 "gemini_api": "connected",
+                "ai_circuit_breaker": self.ai_client.breaker.state,
                 "timestamp": datetime.now().isoformat()
             }
         except Exception as e:
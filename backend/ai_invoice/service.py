@@ -4,8 +4,11 @@ Generates invoice drafts using Gemini AI based on customer context and natural l
 """
 
 import os
+import time
+import asyncio
 import logging
-from typing import Dict, Any, List, Optional
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime, timedelta
 import json
 
@@ -19,8 +22,95 @@ except ImportError:
 from motor.motor_asyncio import AsyncIOMotorClient
 from bson import ObjectId
 
+from database.mongodb import normalize_invoice_issue_date
+from ai_agent.gemini.client import get_ai_client, AIUnavailableError
+
 logger = logging.getLogger(__name__)
 
+# Invoices of a customer the pattern analysis looks at (most recent first)
+PATTERN_WINDOW = int(os.getenv("AI_INVOICE_PATTERN_WINDOW", "50"))
+# Safety net for invoice edits that leave no trace in the recent-invoice stamp
+PATTERN_CACHE_TTL = float(os.getenv("AI_INVOICE_PATTERN_CACHE_TTL", "3600"))
+PATTERN_CACHE_SIZE = int(os.getenv("AI_INVOICE_PATTERN_CACHE_SIZE", "1000"))
+
+EMPTY_PATTERNS = {
+    "average_invoice_amount": 0,
+    "common_items": [],
+    "typical_amounts": {},
+    "typical_quantity": 1,
+    "invoice_frequency": "monthly",
+    "last_invoice_amount": 0,
+}
+
+
+class CustomerPatternCache:
+    """
+    Per-customer invoice pattern analysis, reused until the customer's invoices change
+    
+    Entries are keyed by a stamp of the customer's recent invoices (ids and
+    update times, plus the invoice count), which every context lookup reads
+    anyway: a new or edited invoice changes the stamp, so the next draft
+    re-analyzes without any invalidation hook.
+    """
+    
+    def __init__(self, ttl_seconds: float = PATTERN_CACHE_TTL, max_customers: int = PATTERN_CACHE_SIZE):
+        self.ttl_seconds = ttl_seconds
+        self.max_customers = max_customers
+        # customer_id -> (stamp, monotonic time stored, patterns)
+        self._entries: "OrderedDict[str, Tuple[Tuple, float, Dict[str, Any]]]" = OrderedDict()
+    
+    def get(self, customer_id: str, stamp: Tuple) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(customer_id)
+        if entry and entry[0] == stamp and time.monotonic() - entry[1] < self.ttl_seconds:
+            self._entries.move_to_end(customer_id)
+            return entry[2]
+        return None
+    
+    def put(self, customer_id: str, stamp: Tuple, patterns: Dict[str, Any]) -> None:
+        self._entries[customer_id] = (stamp, time.monotonic(), patterns)
+        self._entries.move_to_end(customer_id)
+        while len(self._entries) > self.max_customers:
+            self._entries.popitem(last=False)
+    
+    def invalidate(self, customer_id: Optional[str] = None) -> None:
+        if customer_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(customer_id, None)
+
+
+# Shared across requests (the service itself is created per request)
+_pattern_cache = CustomerPatternCache()
+
+
+def get_pattern_cache() -> CustomerPatternCache:
+    """Process-wide customer pattern cache"""
+    return _pattern_cache
+
+
+def _invoice_stamp(customer: Dict[str, Any], invoices: List[Dict[str, Any]]) -> Tuple:
+    """Changes whenever an invoice of the customer is added or updated"""
+    return (customer.get("total_invoices", 0),) + tuple(
+        (str(inv.get("_id")), str(inv.get("updated_at", ""))) for inv in invoices
+    )
+
+
+def _invoice_frequency(dates: List[datetime]) -> str:
+    """Label for the average gap between invoice dates"""
+    dates = sorted(d for d in dates if isinstance(d, datetime))
+    if len(dates) < 2:
+        return "monthly"
+    average_gap = (dates[-1] - dates[0]).days / (len(dates) - 1)
+    if average_gap <= 10:
+        return "weekly"
+    if average_gap <= 20:
+        return "biweekly"
+    if average_gap <= 45:
+        return "monthly"
+    if average_gap <= 100:
+        return "quarterly"
+    return "occasional"
+
 
 class AIInvoiceService:
     """Service for generating invoices using Gemini AI"""
@@ -29,6 +119,8 @@ class AIInvoiceService:
         self.db = db
         self.logger = logger
         self.model = None
+        self.ai_client = get_ai_client()
+        self.pattern_cache = get_pattern_cache()
         
         if GEMINI_AVAILABLE:
             self._initialize_gemini()
@@ -51,26 +143,24 @@ class AIInvoiceService:
     async def get_customer_context(self, customer_id: str) -> Dict[str, Any]:
         """
         Gather customer context for AI invoice generation
-        Includes customer details, recent invoices, payment history, and patterns
+        Includes customer details, recent invoices, and patterns
+        
+        The customer and recent invoices are fetched concurrently; patterns
+        come from the per-customer cache unless the invoices changed.
         """
         try:
-            # Get customer details
-            customer = await self.db.customers.find_one({"customer_id": customer_id})
+            # Get customer details and recent invoices (last 10)
+            customer, recent_invoices = await asyncio.gather(
+                self.db.customers.find_one({"customer_id": customer_id}),
+                self.db.invoices.find(
+                    {"customer_id": customer_id}
+                ).sort("issue_date", -1).limit(10).to_list(10)
+            )
             if not customer:
                 raise ValueError(f"Customer {customer_id} not found")
             
-            # Get recent invoices (last 10)
-            recent_invoices = await self.db.invoices.find(
-                {"customer_id": customer_id}
-            ).sort("issue_date", -1).limit(10).to_list(10)
-            
-            # Get payment history (last 10)
-            recent_payments = await self.db.receipts.find(
-                {"customer_name": customer["name"]}
-            ).sort("transaction_date", -1).limit(10).to_list(10)
-            
             # Calculate patterns
-            patterns = await self._analyze_patterns(customer_id, recent_invoices)
+            patterns = await self._analyze_patterns(customer_id, recent_invoices, customer)
             
             context = {
                 "customer": {
@@ -108,44 +198,68 @@ class AIInvoiceService:
             self.logger.error(f"Error gathering customer context: {str(e)}")
             raise
     
-    async def _analyze_patterns(self, customer_id: str, invoices: List[Dict]) -> Dict[str, Any]:
-        """Analyze customer invoice patterns"""
-        if not invoices:
-            return {
-                "average_invoice_amount": 0,
-                "common_items": [],
-                "typical_quantity": 1,
-                "invoice_frequency": "monthly",
-            }
+    async def _analyze_patterns(
+        self,
+        customer_id: str,
+        invoices: List[Dict],
+        customer: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """
+        Analyze customer invoice patterns (cached per customer)
         
-        # Calculate average amount
-        amounts = [inv.get("amount", 0) for inv in invoices]
-        avg_amount = sum(amounts) / len(amounts) if amounts else 0
+        Args:
+            customer_id: Customer ID
+            invoices: The customer's most recent invoices, newest first
+            customer: Customer document (its invoice count is part of the cache stamp)
+        """
+        if not invoices:
+            return dict(EMPTY_PATTERNS)
         
-        # Extract common items
-        all_items = []
-        for inv in invoices:
-            items = inv.get("items", [])
-            if isinstance(items, list):
-                for item in items:
-                    if isinstance(item, dict):
-                        all_items.append(item.get("description", ""))
+        stamp = _invoice_stamp(customer or {}, invoices)
+        patterns = self.pattern_cache.get(customer_id, stamp)
+        if patterns is None:
+            patterns = await self._aggregate_patterns(customer_id)
+            self.pattern_cache.put(customer_id, stamp, patterns)
         
-        # Count item frequency
-        item_counts = {}
-        for item in all_items:
-            if item:
-                item_counts[item] = item_counts.get(item, 0) + 1
+        return {**patterns, "last_invoice_amount": invoices[0].get("amount", 0)}
+    
+    async def _aggregate_patterns(self, customer_id: str) -> Dict[str, Any]:
+        """Common items with typical prices and quantities, amounts and frequency, in one aggregation"""
+        rows = await self.db.invoices.aggregate([
+            {"$match": {"customer_id": customer_id}},
+            {"$sort": {"issue_date": -1}},
+            {"$limit": PATTERN_WINDOW},
+            {"$facet": {
+                "invoices": [{"$project": {"_id": 0, "amount": 1, "issue_date_ts": 1}}],
+                "items": [
+                    {"$unwind": "$items"},
+                    {"$match": {"items.description": {"$nin": [None, ""]}}},
+                    {"$group": {
+                        "_id": "$items.description",
+                        "count": {"$sum": 1},
+                        "unit_price": {"$avg": "$items.unit_price"},
+                        "quantity": {"$avg": "$items.quantity"}
+                    }},
+                    {"$sort": {"count": -1, "_id": 1}},
+                    {"$limit": 5}
+                ]
+            }}
+        ]).to_list(1)
+        row = rows[0] if rows else {}
+        invoices = row.get("invoices", [])
+        items = row.get("items", [])
         
-        # Get top 5 most common items
-        common_items = sorted(item_counts.items(), key=lambda x: x[1], reverse=True)[:5]
+        amounts = [inv.get("amount") or 0 for inv in invoices]
+        quantities = sorted(item["quantity"] for item in items if item.get("quantity"))
         
         return {
-            "average_invoice_amount": round(avg_amount, 2),
-            "common_items": [item[0] for item in common_items],
-            "typical_quantity": 1,
-            "invoice_frequency": "monthly",
-            "last_invoice_amount": amounts[0] if amounts else 0,
+            "average_invoice_amount": round(sum(amounts) / len(amounts), 2) if amounts else 0,
+            "common_items": [item["_id"] for item in items],
+            "typical_amounts": {
+                item["_id"]: round(item["unit_price"], 2) for item in items if item.get("unit_price") is not None
+            },
+            "typical_quantity": round(quantities[len(quantities) // 2], 2) if quantities else 1,
+            "invoice_frequency": _invoice_frequency([inv.get("issue_date_ts") for inv in invoices]),
         }
     
     async def generate_invoice_draft(
@@ -175,8 +289,12 @@ class AIInvoiceService:
             # Build prompt
             prompt = self._build_invoice_prompt(context, user_input, options)
             
-            # Generate invoice using Gemini
-            response = await self._call_gemini(prompt)
+            # Generate invoice using Gemini (mock draft while the AI client refuses calls)
+            try:
+                response = await self._call_gemini(prompt)
+            except AIUnavailableError as e:
+                self.logger.warning(f"Gemini unavailable, generating mock invoice draft: {str(e)}")
+                return await self._generate_mock_invoice(customer_id, user_input, options)
             
             # Parse response
             invoice_draft = self._parse_invoice_response(response, context, options)
@@ -200,6 +318,12 @@ class AIInvoiceService:
         patterns = context["patterns"]
         preferences = context["preferences"]
         
+        typical_amounts = patterns.get("typical_amounts", {})
+        common_items = ', '.join(
+            f"{item} (~KES {typical_amounts[item]:,.2f})" if item in typical_amounts else item
+            for item in patterns['common_items'][:3]
+        ) or 'None'
+        
         prompt = f"""You are an expert invoice generator. Generate a professional invoice based on the following context and user request.
 
 CUSTOMER CONTEXT:
@@ -213,7 +337,9 @@ CUSTOMER CONTEXT:
 HISTORICAL PATTERNS:
 - Average Invoice Amount: KES {patterns['average_invoice_amount']:,.2f}
 - Last Invoice Amount: KES {patterns['last_invoice_amount']:,.2f}
-- Common Items: {', '.join(patterns['common_items'][:3]) if patterns['common_items'] else 'None'}
+- Common Items: {common_items}
+- Typical Quantity: {patterns.get('typical_quantity', 1)}
+- Invoice Frequency: {patterns.get('invoice_frequency', 'monthly')}
 
 USER REQUEST:
 {user_input}
@@ -249,14 +375,16 @@ Generate the invoice now. Return ONLY valid JSON, no markdown or explanations.""
         return prompt
     
     async def _call_gemini(self, prompt: str) -> str:
-        """Call Gemini AI with the prompt"""
+        """Call Gemini AI (async API) with the prompt through the shared AI client"""
+        generation_config = genai.types.GenerationConfig(
+            temperature=0.2,
+            max_output_tokens=2048,
+        )
+        
         try:
-            response = self.model.generate_content(
-                prompt,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=0.2,
-                    max_output_tokens=2048,
-                )
+            response = await self.ai_client.call(
+                "invoice",
+                lambda: self.model.generate_content_async(prompt, generation_config=generation_config)
             )
             return response.text
         except Exception as e:
@@ -463,9 +591,13 @@ Generate the invoice now. Return ONLY valid JSON, no markdown or explanations.""
                 "created_at": datetime.now(),
                 "updated_at": datetime.now(),
             }
+            invoice["issue_date_ts"] = normalize_invoice_issue_date(invoice)
+            invoice["reconciliation_keys"] = await self.db.build_invoice_match_keys(invoice)
             
             # Insert invoice
             await self.db.invoices.insert_one(invoice)
+            await self.db.on_financial_write("invoices", invoice)
+            self.pattern_cache.invalidate(draft["customer_id"])
             
             # Update customer totals
             await self._update_customer_totals(draft["customer_id"])
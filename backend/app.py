@@ -351,6 +351,20 @@ async def env_info():
             "gemini_model": os.environ.get("GEMINI_MODEL", "gemini-1.5-pro")
         }
 
+# AI client metrics: rate-limit queue waits, circuit breaker state and response cache
+@app.get("/api/ai/metrics", tags=["system"])
+async def ai_metrics():
+    try:
+        from ai_agent.gemini.client import get_ai_client
+        from ai_agent.gemini.cache import get_response_cache
+    except ImportError as e:
+        raise HTTPException(status_code=503, detail=f"AI client not available: {e}")
+    return {
+        "client": get_ai_client().get_metrics(),
+        "response_cache": get_response_cache().get_metrics(),
+        "timestamp": datetime.now().isoformat()
+    }
+
 # Note: OCR router now provides expense summary at /api/receipts/analytics/summary
 # The temporary endpoint has been removed as OCR router integration is complete
 
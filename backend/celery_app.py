@@ -25,13 +25,16 @@ celery_app.conf.update(
     task_track_started=True,
     task_time_limit=300,  # 5 minutes max per task
     worker_prefetch_multiplier=1,
-    worker_max_tasks_per_child=50,
+    # OCR models are recycled by the engine pool (OCR_ENGINE_MAX_USES), so worker
+    # processes can live longer without reloading them
+    worker_max_tasks_per_child=int(os.getenv("CELERY_MAX_TASKS_PER_CHILD", "500")),
 )
 
 # Task routing
 celery_app.conf.task_routes = {
     'backend.ocr.tasks.process_receipt_task': {'queue': 'ocr_processing'},
     'backend.ocr.tasks.batch_process_receipts': {'queue': 'batch_processing'},
+    'backend.ocr.tasks.aggregate_batch_results': {'queue': 'batch_processing'},
 }
 
 if __name__ == "__main__":
@@ -0,0 +1,401 @@
+"""
+Financial context snapshots for AI prompts
+
+Keeps a `context_snapshots` collection with one document per tenant holding
+the summary blocks (transactions, invoices, customers, receipts) that the AI
+insights service puts in front of every question, already rendered as prompt
+text. Questions read the snapshot (an in-process copy, re-read by _id at most
+every few seconds) instead of loading and summing source documents per
+request.
+
+Snapshots are kept current the same way as the financial rollups: writes that
+refresh rollups also mark the written source stale for its tenant, and stale
+blocks are re-aggregated after a short debounce so a burst of writes costs one
+refresh. Where MongoDB runs as a replica set, a change stream on the source
+collections catches writes that bypass the Database helpers; otherwise a
+snapshot older than CONTEXT_SNAPSHOT_MAX_AGE is refreshed in the background
+when read.
+
+Every content change increments the snapshot's version. Callers caching AI
+answers key them on the version (ContextSnapshot.cache_tag), so an answer is
+never served for data that has since changed.
+"""
+import os
+import time
+import asyncio
+import hashlib
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Iterable, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError, DuplicateKeyError
+
+from .rollups import DEFAULT_TENANT, INVOICE_AMOUNT
+
+logger = logging.getLogger("financial-agent.database.context_snapshots")
+
+SNAPSHOTS_COLLECTION = "context_snapshots"
+SNAPSHOT_SOURCES = ("transactions", "invoices", "customers", "receipts")
+
+NO_DATA_TEXT = "No financial data available in the system."
+
+# Compare-and-set attempts per refresh before deferring to the competing writers
+REFRESH_ATTEMPTS = 5
+
+RECEIPT_VALUE = {"$ifNull": ["$amount", {"$ifNull": ["$tax_breakdown.total", 0]}]}
+
+
+class ContextSnapshotConfig:
+    """Context snapshot configuration"""
+
+    def __init__(self):
+        # Seconds to wait after a write before refreshing, so bursts coalesce
+        self.refresh_delay = float(os.environ.get("CONTEXT_SNAPSHOT_REFRESH_DELAY", "2"))
+        # Seconds a process serves its in-memory copy before re-reading the snapshot
+        self.cache_seconds = float(os.environ.get("CONTEXT_SNAPSHOT_CACHE_SECONDS", "5"))
+        # Snapshots older than this are refreshed in the background when read
+        self.max_age = float(os.environ.get("CONTEXT_SNAPSHOT_MAX_AGE", "900"))
+        # Watch the source collections with a change stream (replica sets only)
+        self.watch = os.environ.get("CONTEXT_SNAPSHOT_WATCH", "true").lower() == "true"
+
+
+@dataclass
+class ContextSnapshot:
+    """Rendered financial context of one tenant"""
+    tenant_id: str
+    version: int
+    text: str
+    blocks: Dict[str, Any] = field(default_factory=dict)
+    updated_at: Optional[datetime] = None
+
+    @property
+    def cache_tag(self) -> str:
+        """Identifies this snapshot version in AI response cache keys"""
+        return f"{self.tenant_id}:v{self.version}"
+
+    @classmethod
+    def from_document(cls, document: Dict[str, Any]) -> "ContextSnapshot":
+        return cls(
+            tenant_id=document["tenant_id"],
+            version=document.get("version", 0),
+            text=document.get("text") or NO_DATA_TEXT,
+            blocks=document.get("blocks", {}),
+            updated_at=document.get("updated_at")
+        )
+
+
+def tenant_match(tenant_id: str) -> Dict[str, Any]:
+    """Source documents of a tenant (untenanted documents belong to the default tenant)"""
+    if tenant_id == DEFAULT_TENANT:
+        return {"tenant_id": {"$in": [DEFAULT_TENANT, None]}}
+    return {"tenant_id": tenant_id}
+
+
+def _block_hash(block: Dict[str, Any]) -> str:
+    return hashlib.sha1(repr(sorted(block.items())).encode("utf-8")).hexdigest()
+
+
+def render_context(blocks: Dict[str, Any]) -> str:
+    """Prompt text for a tenant's summary blocks"""
+    context_parts = []
+
+    transactions = blocks.get("transactions") or {}
+    if transactions.get("count"):
+        context_parts.append(f"\n## Transactions:")
+        context_parts.append(f"- Total transactions: {transactions['count']}")
+        context_parts.append(f"- Total amount: KES {transactions['amount']:,.2f}")
+        context_parts.append(f"- Completed transactions: {transactions['completed']}")
+        if transactions.get("gateways"):
+            context_parts.append(f"\n### Payment Methods:")
+            for gateway, count in transactions["gateways"]:
+                context_parts.append(f"- {gateway}: {count} transactions")
+
+    invoices = blocks.get("invoices") or {}
+    if invoices.get("count"):
+        context_parts.append(f"\n## Invoices:")
+        context_parts.append(f"- Total invoices: {invoices['count']}")
+        context_parts.append(f"- Total invoice value: KES {invoices['amount']:,.2f}")
+        context_parts.append(f"- Paid invoices: {invoices['paid']}")
+        context_parts.append(f"- Pending invoices: {invoices['pending']}")
+
+    customers = blocks.get("customers") or {}
+    if customers.get("count"):
+        context_parts.append(f"\n## Customer Base:")
+        context_parts.append(f"- Total customers: {customers['count']}")
+
+    receipts = blocks.get("receipts") or {}
+    if receipts.get("count"):
+        context_parts.append(f"\n## Receipts/Expenses:")
+        context_parts.append(f"- Total receipts: {receipts['count']}")
+        context_parts.append(f"- Total receipt value: KES {receipts['amount']:,.2f}")
+
+    if not context_parts:
+        return NO_DATA_TEXT
+    return "# FINANCIAL CONTEXT\n\n" + "\n".join(context_parts)
+
+
+class FinancialContextSnapshots:
+    """Maintains and serves the context_snapshots collection"""
+
+    def __init__(self, db, config: Optional[ContextSnapshotConfig] = None):
+        """
+        Args:
+            db: Motor database handle
+            config: Snapshot configuration (defaults to environment settings)
+        """
+        self.db = db
+        self.collection = db[SNAPSHOTS_COLLECTION]
+        self.config = config or ContextSnapshotConfig()
+        # tenant -> (monotonic time read, snapshot)
+        self._memory: Dict[str, Tuple[float, ContextSnapshot]] = {}
+        self._stale: Dict[str, set] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        self._watch_task: Optional[asyncio.Task] = None
+
+    # ========== BLOCKS ==========
+
+    async def _aggregate_one(self, collection: str, pipeline: List[Dict[str, Any]]) -> Dict[str, Any]:
+        rows = await self.db[collection].aggregate(pipeline).to_list(1)
+        return rows[0] if rows else {}
+
+    async def _transactions_block(self, tenant_id: str) -> Dict[str, Any]:
+        row = await self._aggregate_one("transactions", [
+            {"$match": tenant_match(tenant_id)},
+            {"$facet": {
+                "totals": [{"$group": {
+                    "_id": None,
+                    "count": {"$sum": 1},
+                    "amount": {"$sum": {"$ifNull": ["$amount", 0]}},
+                    "completed": {"$sum": {"$cond": [{"$eq": ["$status", "completed"]}, 1, 0]}}
+                }}],
+                "gateways": [
+                    {"$group": {
+                        "_id": {"$ifNull": ["$gateway", {"$ifNull": ["$payment_method", "Unknown"]}]},
+                        "count": {"$sum": 1}
+                    }},
+                    {"$sort": {"count": -1, "_id": 1}},
+                    {"$limit": 10}
+                ]
+            }}
+        ])
+        totals = (row.get("totals") or [{}])[0]
+        return {
+            "count": totals.get("count", 0),
+            "amount": round(totals.get("amount") or 0.0, 2),
+            "completed": totals.get("completed", 0),
+            "gateways": [[str(g["_id"]), g["count"]] for g in row.get("gateways", [])]
+        }
+
+    async def _invoices_block(self, tenant_id: str) -> Dict[str, Any]:
+        row = await self._aggregate_one("invoices", [
+            {"$match": tenant_match(tenant_id)},
+            {"$group": {
+                "_id": None,
+                "count": {"$sum": 1},
+                "amount": {"$sum": INVOICE_AMOUNT},
+                "paid": {"$sum": {"$cond": [{"$eq": ["$status", "paid"]}, 1, 0]}},
+                "pending": {"$sum": {"$cond": [{"$in": ["$status", ["sent", "overdue", "pending"]]}, 1, 0]}}
+            }}
+        ])
+        return {
+            "count": row.get("count", 0),
+            "amount": round(row.get("amount") or 0.0, 2),
+            "paid": row.get("paid", 0),
+            "pending": row.get("pending", 0)
+        }
+
+    async def _customers_block(self, tenant_id: str) -> Dict[str, Any]:
+        return {"count": await self.db.customers.count_documents(tenant_match(tenant_id))}
+
+    async def _receipts_block(self, tenant_id: str) -> Dict[str, Any]:
+        row = await self._aggregate_one("receipts", [
+            {"$match": tenant_match(tenant_id)},
+            {"$group": {"_id": None, "count": {"$sum": 1}, "amount": {"$sum": RECEIPT_VALUE}}}
+        ])
+        return {"count": row.get("count", 0), "amount": round(row.get("amount") or 0.0, 2)}
+
+    async def _build_block(self, source: str, tenant_id: str) -> Dict[str, Any]:
+        builders = {
+            "transactions": self._transactions_block,
+            "invoices": self._invoices_block,
+            "customers": self._customers_block,
+            "receipts": self._receipts_block,
+        }
+        return await builders[source](tenant_id)
+
+    # ========== MAINTENANCE ==========
+
+    async def refresh(self, tenant_id: str = DEFAULT_TENANT, sources: Iterable[str] = SNAPSHOT_SOURCES) -> ContextSnapshot:
+        """
+        Re-aggregate the given blocks of a tenant's snapshot
+
+        The version is incremented only when a block's content changed.
+        Refreshes may run concurrently (the Database helpers and the AI
+        service each keep an instance), so the write is a compare-and-set on
+        the version, and a block is only replaced by one aggregated later
+        than the stored block (built_at).
+
+        Args:
+            tenant_id: Tenant to refresh
+            sources: Source collections whose blocks to rebuild
+
+        Returns:
+            The current snapshot
+        """
+        sources = [s for s in SNAPSHOT_SOURCES if s in set(sources)]
+        started = datetime.now()
+        built = dict(zip(sources, await asyncio.gather(*(self._build_block(source, tenant_id) for source in sources))))
+
+        for _ in range(REFRESH_ATTEMPTS):
+            current = await self.collection.find_one({"_id": tenant_id}) or {}
+            blocks = dict(current.get("blocks", {}))
+            hashes = current.get("hashes", {})
+            built_at = current.get("built_at", {})
+            updates = {}
+            for source, block in built.items():
+                stored_at = built_at.get(source)
+                if isinstance(stored_at, datetime) and stored_at >= started:
+                    continue  # A later refresh already stored newer data
+                digest = _block_hash(block)
+                if hashes.get(source) != digest:
+                    blocks[source] = block
+                    updates[f"blocks.{source}"] = block
+                    updates[f"hashes.{source}"] = digest
+                    updates[f"built_at.{source}"] = started
+
+            now = datetime.now()
+            if not updates and current:
+                document = await self.collection.find_one_and_update(
+                    {"_id": tenant_id},
+                    {"$set": {"updated_at": now}},
+                    return_document=ReturnDocument.AFTER
+                )
+                break
+
+            try:
+                document = await self.collection.find_one_and_update(
+                    {"_id": tenant_id, "version": current.get("version", {"$exists": False})},
+                    {
+                        "$set": {
+                            **updates,
+                            "tenant_id": tenant_id,
+                            "text": render_context(blocks),
+                            "updated_at": now
+                        },
+                        "$inc": {"version": 1}
+                    },
+                    upsert=not current,
+                    return_document=ReturnDocument.AFTER
+                )
+            except DuplicateKeyError:
+                document = None  # Created concurrently
+            if document is not None:
+                logger.info(f"Context snapshot for {tenant_id} now at version {document['version']} ({', '.join(sources)})")
+                break
+        else:
+            # Lost every race: the competing refreshes stored current data
+            document = await self.collection.find_one({"_id": tenant_id})
+
+        snapshot = ContextSnapshot.from_document(document)
+        self._memory[tenant_id] = (time.monotonic(), snapshot)
+        return snapshot
+
+    def mark_stale(self, source: str, *documents: Optional[Dict[str, Any]]) -> None:
+        """
+        Schedule a debounced refresh of the blocks fed by a written source
+
+        Args:
+            source: Source collection that was written
+            documents: Written documents (their tenant_id selects the snapshot)
+        """
+        if source not in SNAPSHOT_SOURCES:
+            return
+        tenants = {(d.get("tenant_id") or DEFAULT_TENANT) for d in documents if d} or {DEFAULT_TENANT}
+        for tenant_id in tenants:
+            self._stale.setdefault(tenant_id, set()).add(source)
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = loop.create_task(self._flush())
+
+    async def _flush(self) -> None:
+        # Writes marked while a refresh is awaited are picked up by the next pass
+        while self._stale:
+            await asyncio.sleep(self.config.refresh_delay)
+            stale, self._stale = self._stale, {}
+            for tenant_id, sources in stale.items():
+                try:
+                    await self.refresh(tenant_id, sources)
+                except Exception as e:
+                    logger.warning(f"Failed to refresh context snapshot for {tenant_id}: {str(e)}")
+
+    def _refresh_in_background(self, tenant_id: str) -> None:
+        task = self._refreshing.get(tenant_id)
+        if task is None or task.done():
+            self._refreshing[tenant_id] = asyncio.get_running_loop().create_task(self._refresh_quietly(tenant_id))
+
+    async def _refresh_quietly(self, tenant_id: str) -> None:
+        try:
+            await self.refresh(tenant_id)
+        except Exception as e:
+            logger.warning(f"Failed to refresh context snapshot for {tenant_id}: {str(e)}")
+
+    # ========== CHANGE STREAM ==========
+
+    def start_watching(self) -> None:
+        """Follow writes to the source collections (no-op when disabled)"""
+        if self.config.watch and (self._watch_task is None or self._watch_task.done()):
+            self._watch_task = asyncio.get_running_loop().create_task(self._watch())
+
+    async def stop_watching(self) -> None:
+        for task in [self._watch_task, self._flush_task, *self._refreshing.values()]:
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._watch_task = self._flush_task = None
+        self._refreshing.clear()
+
+    async def _watch(self) -> None:
+        pipeline = [{"$match": {"ns.coll": {"$in": list(SNAPSHOT_SOURCES)}}}]
+        try:
+            async with self.db.watch(pipeline, full_document="updateLookup") as stream:
+                async for change in stream:
+                    self.mark_stale(change["ns"]["coll"], change.get("fullDocument"))
+        except asyncio.CancelledError:
+            raise
+        except PyMongoError as e:
+            # Standalone servers have no change streams; reads fall back to max-age refreshes
+            logger.info(f"Context snapshot change stream unavailable, using max-age refresh: {str(e)}")
+
+    # ========== QUERIES ==========
+
+    async def get(self, tenant_id: str = DEFAULT_TENANT) -> ContextSnapshot:
+        """
+        Current snapshot of a tenant, built on first use
+
+        Returns:
+            The snapshot (possibly up to cache_seconds behind the stored one)
+        """
+        cached = self._memory.get(tenant_id)
+        if cached and time.monotonic() - cached[0] < self.config.cache_seconds:
+            return cached[1]
+
+        document = await self.collection.find_one({"_id": tenant_id}, {"hashes": 0, "built_at": 0})
+        if document is None:
+            return await self.refresh(tenant_id)
+
+        snapshot = ContextSnapshot.from_document(document)
+        self._memory[tenant_id] = (time.monotonic(), snapshot)
+        updated_at = snapshot.updated_at
+        if updated_at is None or (datetime.now() - updated_at).total_seconds() > self.config.max_age:
+            self._refresh_in_background(tenant_id)
+        return snapshot
@@ -0,0 +1,132 @@
+"""
+Normalized reconciliation match keys for invoices
+
+Invoices carry a `reconciliation_keys` sub-document (normalized phone number,
+amount band and invoice-number tokens) so payment reconciliation can shortlist
+candidate invoices through indexes instead of scanning every pending invoice.
+"""
+from typing import Dict, Any, List, Optional
+import math
+import re
+
+# Width of one amount band: adjacent bands cover the +/-5% tolerance used when
+# scoring payments against invoices
+AMOUNT_BAND_RATIO = 1.05
+
+_NON_DIGITS = re.compile(r"\D+")
+_TOKEN_SPLIT = re.compile(r"[^0-9a-z]+")
+_YEAR = re.compile(r"^(19|20)\d{2}$")
+
+
+def normalize_phone(phone: Any) -> Optional[str]:
+    """
+    Normalize a Kenyan phone number to 2547XXXXXXXX / 2541XXXXXXXX form
+
+    Args:
+        phone: Raw phone number (e.g. "+254 712 345 678", "0712345678")
+
+    Returns:
+        Normalized digits, or None if the number is empty
+    """
+    if not phone:
+        return None
+    digits = _NON_DIGITS.sub("", str(phone))
+    if digits.startswith("0") and len(digits) == 10:
+        digits = "254" + digits[1:]
+    elif len(digits) == 9 and digits[0] in "71":
+        digits = "254" + digits
+    return digits or None
+
+
+def amount_band(amount: Any) -> Optional[int]:
+    """
+    Logarithmic amount band; amounts within 5% fall in the same or adjacent band
+
+    Args:
+        amount: Invoice or payment amount
+
+    Returns:
+        Band number, or None for non-positive/invalid amounts
+    """
+    try:
+        value = float(amount)
+    except (TypeError, ValueError):
+        return None
+    if value <= 0:
+        return None
+    return int(math.floor(math.log(value) / math.log(AMOUNT_BAND_RATIO)))
+
+
+def reference_tokens(reference: Any) -> List[str]:
+    """
+    Tokens used to match a payment reference against an invoice number
+
+    The compact form ("INV-2025-0042" -> "inv20250042") plus each
+    alphanumeric token of 4+ characters that contains a digit, excluding
+    bare years which would match a whole year's invoices.
+
+    Args:
+        reference: Invoice number or payment reference
+
+    Returns:
+        Sorted list of unique tokens
+    """
+    if not reference:
+        return []
+    text = str(reference).lower()
+    tokens = set()
+    compact = _TOKEN_SPLIT.sub("", text)
+    if compact:
+        tokens.add(compact)
+    for token in _TOKEN_SPLIT.split(text):
+        if len(token) >= 4 and any(ch.isdigit() for ch in token) and not _YEAR.match(token):
+            tokens.add(token)
+    return sorted(tokens)
+
+
+def invoice_amount(invoice: Dict[str, Any]) -> float:
+    """Invoice total across the legacy (total/amount) and normalized (total_amount) schemas"""
+    for field in ("total", "total_amount", "amount"):
+        value = invoice.get(field)
+        if value:
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                continue
+    return 0.0
+
+
+def invoice_phone(invoice: Dict[str, Any], customer: Optional[Dict[str, Any]] = None) -> Optional[str]:
+    """Normalized customer phone for an invoice, from embedded fields or a customer document"""
+    embedded = invoice.get("customer") if isinstance(invoice.get("customer"), dict) else {}
+    candidates = [
+        embedded.get("phone_number"),
+        embedded.get("phone"),
+        invoice.get("customer_phone"),
+        invoice.get("phone_number"),
+    ]
+    if customer:
+        candidates += [customer.get("phone"), customer.get("phone_number")]
+    for phone in candidates:
+        normalized = normalize_phone(phone)
+        if normalized:
+            return normalized
+    return None
+
+
+def build_invoice_match_keys(invoice: Dict[str, Any], customer: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Build the reconciliation_keys sub-document for an invoice
+
+    Args:
+        invoice: Invoice document
+        customer: Optional customer document (normalized schema keeps the phone there)
+
+    Returns:
+        {"phone": str|None, "amount_band": int|None, "ref_tokens": [str]}
+    """
+    return {
+        "phone": invoice_phone(invoice, customer),
+        "amount_band": amount_band(invoice_amount(invoice)),
+        "ref_tokens": reference_tokens(invoice.get("invoice_number") or invoice.get("invoice_id")),
+    }
@@ -3,15 +3,57 @@ MongoDB database connection and operations
 """
 import os
 import motor.motor_asyncio
-from pymongo import ReturnDocument
+from pymongo import ReturnDocument, InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 from typing import Dict, Any, List, Optional, Union
 import logging
 from datetime import datetime
 import json
 import uuid
 
+from dateutil import parser as date_parser
+
+from .rollups import FinancialRollups
+from .context_snapshots import FinancialContextSnapshots
+from .retrieval_index import FinancialRetrievalIndex
+from .match_keys import build_invoice_match_keys
+
 logger = logging.getLogger("financial-agent.database")
 
+# Invoice date fields in priority order. Older records store `issue_date` as a
+# string, generated data uses `date_issued`; `created_at` is the last resort.
+INVOICE_DATE_FIELDS = ("issue_date", "date_issued", "date", "created_at")
+
+# Fields feeding an invoice's reconciliation_keys (phone, amount band, number tokens)
+INVOICE_MATCH_FIELDS = (
+    "total", "total_amount", "amount", "invoice_number", "invoice_id",
+    "customer", "customer_id", "customer_phone", "phone_number"
+)
+
+
+def normalize_invoice_issue_date(invoice: Dict[str, Any]) -> Optional[datetime]:
+    """
+    Resolve an invoice's issue date to a real datetime
+    
+    Args:
+        invoice: Invoice document (or partial document)
+        
+    Returns:
+        Issue date as datetime, or None if no parseable date is present
+    """
+    for field in INVOICE_DATE_FIELDS:
+        value = invoice.get(field)
+        if not value:
+            continue
+        if isinstance(value, datetime):
+            return value
+        try:
+            return date_parser.parse(str(value))
+        except (ValueError, OverflowError):
+            logger.debug(f"Unparseable invoice {field}: {value!r}")
+    return None
+
+
 class DatabaseConfig:
     """MongoDB configuration"""
     
@@ -62,6 +104,18 @@ class Database:
         self.scheduled_reports = self.db[self.config.scheduled_reports_collection]
         self.report_templates = self.db[self.config.report_templates_collection]
         
+        # Unique gateway reference index on transactions (created on first use)
+        self._transaction_indexes_ready = False
+        
+        # Materialized monthly rollups for trend/comparison reports
+        self.rollups = FinancialRollups(self.db)
+        
+        # Per-tenant financial context served to AI prompts
+        self.context_snapshots = FinancialContextSnapshots(self.db)
+        
+        # Records AI prompts retrieve; written documents are re-indexed
+        self.retrieval_index = FinancialRetrievalIndex(self.db)
+        
         logger.info(f"Connected to MongoDB: {self.config.mongo_uri}")
     
     async def store_transaction(self, transaction_data: Dict[str, Any]) -> str:
@@ -89,8 +143,55 @@ class Database:
         result = await self.transactions.insert_one(transaction_data)
         logger.info(f"Stored transaction: {result.inserted_id}")
         
+        await self.on_financial_write(self.config.transactions_collection, transaction_data)
+        
         return str(result.inserted_id)
     
+    async def store_transaction_once(self, transaction_data: Dict[str, Any]) -> str:
+        """
+        Store a gateway transaction unless one with the same gateway reference exists
+        
+        A unique index on (gateway, gateway_reference) makes concurrent
+        deliveries of the same payment store a single transaction.
+        
+        Args:
+            transaction_data: Transaction data
+            
+        Returns:
+            ID of the new or the existing transaction
+        """
+        reference = transaction_data.get("gateway_reference")
+        if not reference:
+            return await self.store_transaction(transaction_data)
+        
+        await self.ensure_transaction_indexes()
+        key = {"gateway": transaction_data.get("gateway"), "gateway_reference": reference}
+        existing = await self.transactions.find_one(key, {"_id": 1})
+        if existing:
+            logger.info(f"Transaction with gateway reference {reference} already stored: {existing['_id']}")
+            return str(existing["_id"])
+        try:
+            return await self.store_transaction(transaction_data)
+        except DuplicateKeyError:
+            existing = await self.transactions.find_one(key, {"_id": 1})
+            return str(existing["_id"])
+    
+    async def ensure_transaction_indexes(self):
+        """Create the unique gateway reference index used by store_transaction_once"""
+        if self._transaction_indexes_ready:
+            return
+        try:
+            await self.transactions.create_index(
+                [("gateway", 1), ("gateway_reference", 1)],
+                unique=True,
+                partialFilterExpression={"gateway_reference": {"$type": "string", "$gt": ""}},
+                name="gateway_reference_unique"
+            )
+        except Exception as e:
+            # Existing duplicates: store_transaction_once still checks before inserting
+            logger.warning(f"Unique gateway reference index not created: {e}")
+        self._transaction_indexes_ready = True
+    
     async def update_transaction(self, transaction_id: str, update_data: Dict[str, Any]) -> Dict[str, Any]:
         """
         Update a transaction in the database
@@ -102,6 +203,11 @@ class Database:
         Returns:
             Updated transaction
         """
+        # A moved transaction date also invalidates the old month's rollups
+        before = None
+        if "transaction_date" in update_data:
+            before = await self.transactions.find_one({"_id": transaction_id}, {"transaction_date": 1})
+        
         # Update the transaction
         result = await self.transactions.find_one_and_update(
             {"_id": transaction_id},
@@ -110,6 +216,8 @@ class Database:
         )
         
         if result:
+            await self.on_financial_write(self.config.transactions_collection, before, result)
+            
             # Convert ObjectId to string for id field
             if "_id" in result:
                 result["id"] = str(result.pop("_id"))
@@ -208,10 +316,18 @@ class Database:
             if timestamp_field in invoice_data and isinstance(invoice_data[timestamp_field], str):
                 invoice_data[timestamp_field] = datetime.fromisoformat(invoice_data[timestamp_field])
         
+        # Normalized BSON date used by period-filtered reports
+        invoice_data["issue_date_ts"] = normalize_invoice_issue_date(invoice_data)
+        
+        # Indexed keys for reconciliation candidate retrieval
+        invoice_data["reconciliation_keys"] = await self.build_invoice_match_keys(invoice_data)
+        
         # Store the invoice
         result = await self.invoices.insert_one(invoice_data)
         logger.info(f"Stored invoice: {result.inserted_id}")
         
+        await self.on_financial_write(self.config.invoices_collection, invoice_data)
+        
         return str(result.inserted_id)
     
     async def update_invoice(self, invoice_id: str, update_data: Dict[str, Any]) -> Dict[str, Any]:
@@ -228,6 +344,11 @@ class Database:
         # Always update the updated_at timestamp
         update_data["updated_at"] = datetime.now()
         
+        # A moved issue date also invalidates the old month's rollups
+        before = None
+        if any(field in update_data for field in INVOICE_DATE_FIELDS):
+            before = await self.invoices.find_one({"_id": invoice_id}, {"issue_date_ts": 1})
+        
         # Update the invoice
         result = await self.invoices.find_one_and_update(
             {"_id": invoice_id},
@@ -235,7 +356,24 @@ class Database:
             return_document=ReturnDocument.AFTER
         )
         
+        # Keep derived fields in sync when any of their source fields change
+        derived = {}
+        if result and any(field in update_data for field in INVOICE_DATE_FIELDS):
+            derived["issue_date_ts"] = normalize_invoice_issue_date(result)
+        if result and any(field in update_data for field in INVOICE_MATCH_FIELDS):
+            derived["reconciliation_keys"] = await self.build_invoice_match_keys(result)
+        
+        changed = {k: v for k, v in derived.items() if result.get(k) != v}
+        if changed:
+            await self.invoices.update_one(
+                {"_id": invoice_id},
+                {"$set": changed}
+            )
+            result.update(changed)
+        
         if result:
+            await self.on_financial_write(self.config.invoices_collection, before, result)
+            
             # Convert ObjectId to string for id field
             if "_id" in result:
                 result["id"] = str(result.pop("_id"))
@@ -246,6 +384,27 @@ class Database:
             logger.error(f"Invoice not found: {invoice_id}")
             return None
     
+    async def build_invoice_match_keys(self, invoice: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Build an invoice's reconciliation_keys, looking up the customer's
+        phone when the invoice itself does not carry one
+        
+        Args:
+            invoice: Invoice data
+            
+        Returns:
+            Reconciliation keys sub-document
+        """
+        keys = build_invoice_match_keys(invoice)
+        if keys["phone"] is None and invoice.get("customer_id"):
+            customer = await self.customers.find_one(
+                {"customer_id": invoice["customer_id"]},
+                {"phone": 1, "phone_number": 1}
+            )
+            if customer:
+                keys = build_invoice_match_keys(invoice, customer)
+        return keys
+    
     async def get_invoice(self, invoice_id: str) -> Dict[str, Any]:
         """
         Get an invoice by ID
@@ -316,6 +475,55 @@ class Database:
         
         return str(result.inserted_id)
     
+    async def apply_reconciliation_batch(
+        self,
+        logs: List[Dict[str, Any]],
+        invoice_updates: List[tuple],
+        transaction_updates: List[tuple],
+        batch_size: int = 1000
+    ) -> Dict[str, int]:
+        """
+        Write a reconciliation batch's logs and status updates with bulk writes
+        
+        Args:
+            logs: Reconciliation log documents
+            invoice_updates: (invoice_id, update_data) pairs
+            transaction_updates: (transaction_id, update_data) pairs
+            batch_size: Operations per bulk_write call
+            
+        Returns:
+            Dict with written counts per collection and the number of failed operations
+        """
+        now = datetime.now()
+        operations = {
+            "logs": (self.reconciliation, [
+                InsertOne({"_id": str(uuid.uuid4()), "timestamp": now, **log}) for log in logs
+            ]),
+            "invoices": (self.invoices, [
+                UpdateOne({"_id": invoice_id}, {"$set": {**update, "updated_at": now}})
+                for invoice_id, update in invoice_updates
+            ]),
+            "transactions": (self.transactions, [
+                UpdateOne({"_id": transaction_id}, {"$set": update})
+                for transaction_id, update in transaction_updates
+            ]),
+        }
+        
+        stats = {"logs": 0, "invoices": 0, "transactions": 0, "errors": 0}
+        for key, (collection, ops) in operations.items():
+            for start in range(0, len(ops), batch_size):
+                try:
+                    result = await collection.bulk_write(ops[start:start + batch_size], ordered=False)
+                    stats[key] += result.inserted_count + result.matched_count
+                except BulkWriteError as e:
+                    details = e.details or {}
+                    stats[key] += details.get("nInserted", 0) + details.get("nMatched", 0)
+                    stats["errors"] += len(details.get("writeErrors", []))
+                    logger.error(f"Bulk reconciliation write to {collection.name} partially failed: {details.get('writeErrors', [])[:3]}")
+        
+        logger.info(f"Applied reconciliation batch: {stats}")
+        return stats
+    
     async def create_document(self, collection_name: str, document: Dict[str, Any]) -> str:
         """
         Generic method to create a document in any collection
@@ -340,6 +548,8 @@ class Database:
         result = await collection.insert_one(document)
         logger.info(f"Created document in {collection_name}: {result.inserted_id}")
         
+        await self.on_financial_write(collection_name, document)
+        
         return str(result.inserted_id)
     
     async def find_one(self, collection_name: str, query: Dict[str, Any]) -> Optional[Dict[str, Any]]:
@@ -400,6 +610,8 @@ class Database:
         )
         
         if result:
+            await self.on_financial_write(collection_name, result)
+            
             # Convert ObjectId to string for id field
             if "_id" in result:
                 result["id"] = str(result.pop("_id"))
@@ -410,6 +622,35 @@ class Database:
             logger.error(f"Document not found in {collection_name}: {document_id}")
             return None
     
+    async def on_financial_write(self, collection_name: str, *documents: Optional[Dict[str, Any]]) -> None:
+        """
+        Update the data derived from a write to a financial collection
+        
+        Refreshes financial rollups for the months the write touched, marks
+        the tenant's AI context snapshot stale for the source and queues the
+        written documents for the retrieval index. Code writing to these
+        collections without the methods above must call it too. Rollups,
+        snapshots and the index are derived data, so failures are logged and
+        never fail the write.
+        
+        Args:
+            collection_name: Source collection that was written
+            documents: Affected documents (before and/or after the write)
+        """
+        documents = [d for d in documents if d]
+        try:
+            self.context_snapshots.mark_stale(collection_name, *documents)
+        except Exception as e:
+            logger.warning(f"Failed to mark context snapshot stale for {collection_name}: {e}")
+        try:
+            self.retrieval_index.mark_stale(collection_name, *documents)
+        except Exception as e:
+            logger.warning(f"Failed to queue retrieval index update for {collection_name}: {e}")
+        try:
+            await self.rollups.refresh_documents(collection_name, *documents)
+        except Exception as e:
+            logger.warning(f"Failed to refresh financial rollups for {collection_name}: {e}")
+    
     async def close(self):
         """Close the database connection"""
         if self.client:
@@ -0,0 +1,743 @@
+"""
+Retrieval index for AI prompts
+
+Keeps a local vector index of the records a financial question can be about:
+transaction descriptions, invoice line items and customers, receipt merchants
+and OCR text. The AI insights service asks it for the top-k records relevant
+to a question and puts only those in the prompt, instead of a fixed sample of
+the most recent documents.
+
+Each tenant has a directory holding
+- vectors.f32:   one float32 row per record, memory-mapped for search
+- records.jsonl: the record behind each row (source, id, summary line)
+- meta.json:     row count, embedder, and the sync watermarks per source
+
+Files are append-only: a changed document gets a new row and its old row is
+masked out, and the files are compacted once enough rows are dead. Writers
+hold an exclusive file lock, so several workers can share one directory; each
+reader re-maps the files when meta.json changes.
+
+The index is built and kept current incrementally. Writes made through
+Database re-index the written documents shortly afterwards (mark_stale, the
+same hook that refreshes rollups and context snapshots). For writes made
+elsewhere, a sync reads the documents whose updated_at or created_at is at or
+after the previous sync, and searches start a background sync once the index
+is older than RETRIEVAL_INDEX_SYNC_SECONDS. Neither depends on the type of
+_id (ObjectId or uuid string). Documents written outside Database without
+either timestamp, and deleted documents, are only picked up by rebuild().
+
+Everything runs offline. The default embedder hashes words and character
+trigrams into a fixed-size vector (no model download, tolerant of OCR
+misspellings); RETRIEVAL_INDEX_EMBEDDER="module:factory" plugs in any local
+embedding function instead.
+"""
+import os
+import re
+import json
+import math
+import time
+import zlib
+import asyncio
+import hashlib
+import logging
+import importlib
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Iterable, Sequence, Tuple
+
+import numpy as np
+from pymongo.errors import PyMongoError
+
+from .rollups import DEFAULT_TENANT
+from .context_snapshots import tenant_match
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process use only
+    fcntl = None
+
+logger = logging.getLogger("financial-agent.database.retrieval_index")
+
+INDEX_SOURCES = ("transactions", "invoices", "receipts")
+
+# Characters of receipt OCR text that are embedded (the summary line is always kept)
+OCR_TEXT_LIMIT = 2000
+SUMMARY_LIMIT = 240
+
+VECTORS_FILE = "vectors.f32"
+RECORDS_FILE = "records.jsonl"
+META_FILE = "meta.json"
+LOCK_FILE = ".lock"
+
+# A sync re-reads documents stamped this long before the previous sync started,
+# covering writes in flight at the time and clock skew between workers
+WATERMARK_OVERLAP = timedelta(minutes=1)
+
+
+class RetrievalIndexConfig:
+    """Retrieval index configuration"""
+
+    def __init__(self):
+        # Directory holding one sub-directory per tenant
+        self.directory = os.environ.get("RETRIEVAL_INDEX_DIR", "data/retrieval_index")
+        # Records put in a prompt, and the similarity a record needs to qualify
+        self.top_k = int(os.environ.get("RETRIEVAL_INDEX_TOP_K", "8"))
+        self.min_score = float(os.environ.get("RETRIEVAL_INDEX_MIN_SCORE", "0.15"))
+        # Searches start a background sync when the last one is older than this
+        self.sync_seconds = float(os.environ.get("RETRIEVAL_INDEX_SYNC_SECONDS", "30"))
+        self.batch_size = int(os.environ.get("RETRIEVAL_INDEX_BATCH_SIZE", "500"))
+        # Seconds between a write through Database and re-indexing the written documents
+        self.refresh_delay = float(os.environ.get("RETRIEVAL_INDEX_REFRESH_DELAY", "2"))
+        # "module:factory" returning a local embedding function; empty = built-in hashing
+        self.embedder = os.environ.get("RETRIEVAL_INDEX_EMBEDDER", "")
+        self.dimensions = int(os.environ.get("RETRIEVAL_INDEX_DIMENSIONS", "512"))
+
+
+# ========== EMBEDDING ==========
+
+TOKEN = re.compile(r"[a-z0-9]+")
+STOP_WORDS = frozenset(
+    "a an and are as at be by did do does for from had has have how i in is it me much "
+    "my of on or our show tell than that the their this to was we were what when where "
+    "which who why with you your".split()
+)
+
+
+class HashingEmbedder:
+    """
+    Local default embedding: signed feature hashing of words and character
+    trigrams (the index L2-normalises vectors, so similarity is a dot product)
+
+    Trigrams keep OCR misspellings ("NA1VAS SUPERMARKT") close to the clean
+    name. Deterministic and dependency-free, so the index can be rebuilt
+    anywhere with identical vectors.
+    """
+
+    def __init__(self, dimensions: int = 512):
+        self.dimensions = dimensions
+        self.name = f"hashing-v1-{dimensions}"
+        # token -> (columns, signed weights); vocabularies are small
+        self._features: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+    def _token_features(self, token: str) -> Tuple[np.ndarray, np.ndarray]:
+        cached = self._features.get(token)
+        if cached is not None:
+            return cached
+        features = [(token, 1.0)]
+        if len(token) > 3 and not token.isdigit():
+            padded = f"#{token}#"
+            features += [(padded[i:i + 3], 0.4) for i in range(len(padded) - 2)]
+        columns, weights = [], []
+        for feature, weight in features:
+            digest = zlib.crc32(feature.encode("utf-8"))
+            columns.append(digest % self.dimensions)
+            weights.append(weight if digest & 0x80000000 else -weight)
+        cached = (np.array(columns, dtype=np.int64), np.array(weights, dtype=np.float32))
+        if len(self._features) < 200_000:
+            self._features[token] = cached
+        return cached
+
+    def __call__(self, texts: Sequence[str]) -> np.ndarray:
+        cells, values = [], []
+        for row, text in enumerate(texts):
+            counts: Dict[str, int] = {}
+            for token in TOKEN.findall(text.lower()):
+                if token not in STOP_WORDS:
+                    counts[token] = counts.get(token, 0) + 1
+            offset = row * self.dimensions
+            for token, count in counts.items():
+                columns, weights = self._token_features(token)
+                cells.append(columns + offset)
+                # Sublinear term frequency: repeated OCR lines do not dominate
+                values.append(weights * (1.0 + math.log(count)) if count > 1 else weights)
+        size = len(texts) * self.dimensions
+        if not cells:
+            return np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        # One scatter-add for the whole batch
+        flat = np.bincount(np.concatenate(cells), weights=np.concatenate(values), minlength=size)
+        return flat.astype(np.float32).reshape(len(texts), self.dimensions)
+
+
+def load_embedder(spec: str, dimensions: int):
+    """
+    Embedding function for the index
+
+    Args:
+        spec: "module:attribute" naming a factory (called with no arguments)
+              or an embedding callable; empty for the built-in HashingEmbedder
+        dimensions: Vector size of the built-in embedder
+
+    The callable maps a list of texts to an (n, d) array and should expose
+    `dimensions` and `name` (the index is rebuilt when either changes).
+    """
+    if not spec:
+        return HashingEmbedder(dimensions)
+    module_name, _, attribute = spec.partition(":")
+    target = getattr(importlib.import_module(module_name), attribute or "embedder")
+    embedder = target() if isinstance(target, type) or not hasattr(target, "dimensions") else target
+    if not hasattr(embedder, "dimensions"):
+        raise ValueError(f"Embedder {spec} does not declare its dimensions")
+    return embedder
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+# ========== RECORDS ==========
+
+@dataclass
+class IndexRecord:
+    """One document as the index sees it"""
+    source: str
+    id: str
+    summary: str
+    text: str
+
+    @property
+    def key(self) -> str:
+        return f"{self.source}:{self.id}"
+
+    @property
+    def digest(self) -> str:
+        return hashlib.sha1(self.text.encode("utf-8")).hexdigest()[:16]
+
+
+@dataclass
+class RetrievedRecord:
+    """A search hit"""
+    source: str
+    id: str
+    summary: str
+    score: float
+
+
+def _date(value: Any) -> str:
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d")
+    return str(value)[:10] if value else ""
+
+
+def _money(value: Any) -> str:
+    try:
+        return f"KES {float(value):,.2f}"
+    except (TypeError, ValueError):
+        return ""
+
+
+def _first(document: Dict[str, Any], *paths: str) -> Any:
+    """First non-empty value among dotted paths"""
+    for path in paths:
+        value: Any = document
+        for part in path.split("."):
+            value = value.get(part) if isinstance(value, dict) else None
+        if value not in (None, "", {}, []):
+            return value
+    return None
+
+
+def _join(*parts: Any) -> str:
+    return " | ".join(str(p) for p in parts if p not in (None, ""))
+
+
+def _item_lines(items: Any) -> List[str]:
+    lines = []
+    for item in items or []:
+        if not isinstance(item, dict):
+            continue
+        description = item.get("description") or item.get("name") or item.get("item")
+        if not description:
+            continue
+        quantity = item.get("quantity")
+        price = item.get("unit_price") or item.get("price")
+        line = str(description)
+        if quantity not in (None, "", 1, 1.0):
+            line += f" x{quantity:g}" if isinstance(quantity, (int, float)) else f" x{quantity}"
+        if isinstance(price, (int, float)):
+            line += f" @ {price:,.2f}"
+        lines.append(line)
+    return lines
+
+
+def _customer_name(document: Dict[str, Any]) -> Any:
+    customer = document.get("customer")
+    if isinstance(customer, dict):
+        return customer.get("name")
+    return document.get("customer_name") or (customer if isinstance(customer, str) else None)
+
+
+def render_record(source: str, document: Dict[str, Any]) -> IndexRecord:
+    """Summary line (what prompts show) and searchable text of a source document"""
+    if source == "transactions":
+        summary = _join(
+            "Transaction",
+            _date(_first(document, "timestamp", "request_timestamp", "transaction_date", "created_at")),
+            _money(document.get("amount")),
+            _first(document, "gateway", "payment_method"),
+            document.get("type"),
+            document.get("status"),
+            document.get("description"),
+            _first(document, "merchant_name", "merchant", "customer_name"),
+            _first(document, "gateway_reference", "reference"),
+        )
+        text = summary
+    elif source == "invoices":
+        items = _item_lines(document.get("items"))
+        summary = _join(
+            "Invoice",
+            document.get("invoice_number"),
+            _date(_first(document, "date_issued", "issue_date", "created_at")),
+            _customer_name(document),
+            _money(_first(document, "total", "total_amount", "amount")),
+            document.get("status"),
+            "items: " + "; ".join(items) if items else None,
+        )
+        text = _join(summary, document.get("notes"), document.get("description"))
+    elif source == "receipts":
+        extracted = _first(document, "ocr_data.extracted_data") or {}
+        items = _item_lines(document.get("items") or extracted.get("items"))
+        summary = _join(
+            "Receipt",
+            _date(_first(document, "transaction_date", "issued_date", "created_at")),
+            _first(document, "vendor.name", "merchant_name", "vendor_name") or extracted.get("merchant_name"),
+            _money(_first(document, "total_amount", "amount", "tax_breakdown.total") or extracted.get("total_amount")),
+            document.get("category") or extracted.get("category"),
+            "items: " + "; ".join(items) if items else None,
+        )
+        ocr_text = _first(document, "ocr_result.text", "raw_text", "ocr_text") or ""
+        text = _join(summary, str(ocr_text)[:OCR_TEXT_LIMIT])
+    else:
+        raise ValueError(f"Unknown index source: {source}")
+
+    if len(summary) > SUMMARY_LIMIT:
+        summary = summary[:SUMMARY_LIMIT - 3] + "..."
+    return IndexRecord(source=source, id=str(document.get("_id")), summary=summary, text=text)
+
+
+def render_relevant_records(records: Iterable[RetrievedRecord]) -> str:
+    """Prompt section listing retrieved records (empty when there are none)"""
+    lines = [f"- {record.summary}" for record in records]
+    if not lines:
+        return ""
+    return "\n\n## Records Relevant to the Question:\n" + "\n".join(lines)
+
+
+# ========== ON-DISK INDEX ==========
+
+class RetrievalIndex:
+    """Append-only vector index of one tenant, memory-mapped from disk"""
+
+    def __init__(self, directory: str, embedder):
+        """
+        Args:
+            directory: Directory holding this index's files
+            embedder: Embedding function (see load_embedder)
+        """
+        self.directory = directory
+        self.embedder = embedder
+        self.embedder_name = getattr(embedder, "name", type(embedder).__name__)
+        self.dimensions = int(embedder.dimensions)
+        self.meta: Dict[str, Any] = {}
+        self._vectors: Optional[np.ndarray] = None
+        self._records: List[Dict[str, Any]] = []
+        self._records_offset = 0
+        self._latest: Dict[str, int] = {}
+        self._live = np.zeros(0, dtype=bool)
+        self._sources = np.zeros(0, dtype=np.int8)
+        self._stamp: Optional[Tuple[int, int]] = None
+        # Threads of this process (searches, syncs) load and rebind the state above
+        self._mutex = threading.Lock()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    @contextmanager
+    def _lock(self, exclusive: bool):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path(LOCK_FILE), "a") as handle:
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(handle, fcntl.LOCK_UN)
+
+    # ========== READING ==========
+
+    def _meta_stamp(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self._path(META_FILE))
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _compatible(self, meta: Dict[str, Any]) -> bool:
+        return meta.get("embedder") == self.embedder_name and meta.get("dimensions") == self.dimensions
+
+    def refresh(self) -> None:
+        """Re-map the files if another writer (or process) changed them"""
+        with self._mutex:
+            if self._meta_stamp() != self._stamp:
+                with self._lock(exclusive=False):
+                    self._load()
+
+    def _load(self) -> None:
+        stamp = self._meta_stamp()
+        try:
+            with open(self._path(META_FILE)) as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            meta = {}
+        if not self._compatible(meta):
+            # Built by another embedder: empty until the next write rebuilds it
+            meta = {}
+
+        rows = meta.get("rows", 0)
+        if meta.get("generation") != self.meta.get("generation") or rows < len(self._records):
+            self._records, self._records_offset, self._latest = [], 0, {}
+
+        if rows > len(self._records):
+            with open(self._path(RECORDS_FILE), "rb") as f:
+                f.seek(self._records_offset)
+                while len(self._records) < rows:
+                    line = f.readline()
+                    if not line.endswith(b"\n"):
+                        break
+                    self._records_offset += len(line)
+                    record = json.loads(line)
+                    self._latest[record["key"]] = len(self._records)
+                    self._records.append(record)
+            rows = len(self._records)
+
+        if rows:
+            self._vectors = np.memmap(self._path(VECTORS_FILE), dtype=np.float32, mode="r",
+                                      shape=(rows, self.dimensions))
+        else:
+            self._vectors = None
+        self._live = np.zeros(rows, dtype=bool)
+        self._live[list(self._latest.values())] = True
+        self._sources = np.array(
+            [INDEX_SOURCES.index(r["source"]) if r["source"] in INDEX_SOURCES else -1 for r in self._records],
+            dtype=np.int8
+        )
+        self.meta = meta
+        self._stamp = stamp
+
+    @property
+    def size(self) -> int:
+        """Live records"""
+        return len(self._latest)
+
+    def search(
+        self,
+        query: str,
+        k: int = 8,
+        sources: Optional[Iterable[str]] = None,
+        min_score: float = 0.0
+    ) -> List[RetrievedRecord]:
+        """
+        Records most similar to a query
+
+        Args:
+            query: Question text
+            k: Maximum records returned
+            sources: Restrict to these source collections
+            min_score: Minimum cosine similarity
+
+        Returns:
+            Hits, best first
+        """
+        self.refresh()
+        # One consistent view: a sync in another thread may rebind these meanwhile
+        with self._mutex:
+            vectors, live, row_sources, records = self._vectors, self._live, self._sources, self._records
+        if vectors is None or k <= 0:
+            return []
+        query_vector = _normalize(self.embedder([query]))[0]
+        scores = np.asarray(vectors @ query_vector)
+        mask = live
+        if sources is not None:
+            mask = mask & np.isin(row_sources, [INDEX_SOURCES.index(s) for s in sources if s in INDEX_SOURCES])
+        scores = np.where(mask, scores, -np.inf)
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        hits = []
+        for row in top:
+            score = float(scores[row])
+            if score < min_score or not np.isfinite(score):
+                break
+            record = records[row]
+            hits.append(RetrievedRecord(source=record["source"], id=record["id"],
+                                        summary=record["summary"], score=round(score, 4)))
+        return hits
+
+    # ========== WRITING ==========
+
+    def _write_meta(self, meta: Dict[str, Any]) -> None:
+        temp = self._path(META_FILE + ".tmp")
+        with open(temp, "w") as f:
+            json.dump(meta, f)
+        os.replace(temp, self._path(META_FILE))
+
+    def upsert(self, records: Sequence[IndexRecord], watermarks: Optional[Dict[str, Any]] = None) -> int:
+        """
+        Add or replace records (unchanged records are skipped)
+
+        Args:
+            records: Records to index
+            watermarks: Sync watermarks to store with the write
+
+        Returns:
+            Rows written
+        """
+        with self._mutex, self._lock(exclusive=True):
+            self._load()
+            meta = dict(self.meta)
+            if not meta:
+                meta = {"embedder": self.embedder_name, "dimensions": self.dimensions, "rows": 0,
+                        "generation": time.time_ns(), "watermarks": {}}
+                for name in (VECTORS_FILE, RECORDS_FILE):
+                    open(self._path(name), "wb").close()
+                self._records, self._records_offset, self._latest = [], 0, {}
+
+            changed = {}
+            for record in records:
+                digest = record.digest
+                row = self._latest.get(record.key)
+                if row is None or self._records[row].get("digest") != digest:
+                    changed[record.key] = (record, digest)
+
+            if changed:
+                new = list(changed.values())
+                vectors = _normalize(self.embedder([record.text for record, _ in new]))
+                with open(self._path(VECTORS_FILE), "ab") as f:
+                    f.write(vectors.astype(np.float32).tobytes())
+                with open(self._path(RECORDS_FILE), "ab") as f:
+                    for record, digest in new:
+                        f.write((json.dumps({
+                            "key": record.key, "source": record.source, "id": record.id,
+                            "summary": record.summary, "digest": digest
+                        }) + "\n").encode("utf-8"))
+                meta["rows"] = meta["rows"] + len(new)
+
+            if watermarks:
+                meta["watermarks"] = {**meta.get("watermarks", {}), **watermarks}
+            meta["synced_at"] = datetime.now().isoformat()
+            self._write_meta(meta)
+            self._load()
+
+            dead = len(self._records) - len(self._latest)
+            if dead > max(1000, len(self._records) // 4):
+                self._compact()
+            return len(changed)
+
+    def _compact(self) -> None:
+        """Rewrite the files without dead rows (caller holds the write lock)"""
+        rows = sorted(self._latest.values())
+        vectors = np.asarray(self._vectors[rows]) if rows else np.zeros((0, self.dimensions), np.float32)
+        meta = {**self.meta, "rows": len(rows), "generation": time.time_ns()}
+
+        with open(self._path(VECTORS_FILE + ".tmp"), "wb") as f:
+            f.write(vectors.astype(np.float32).tobytes())
+        with open(self._path(RECORDS_FILE + ".tmp"), "wb") as f:
+            for row in rows:
+                f.write((json.dumps(self._records[row]) + "\n").encode("utf-8"))
+        os.replace(self._path(VECTORS_FILE + ".tmp"), self._path(VECTORS_FILE))
+        os.replace(self._path(RECORDS_FILE + ".tmp"), self._path(RECORDS_FILE))
+        self._write_meta(meta)
+        logger.info(f"Compacted retrieval index {self.directory}: {len(rows)} rows")
+        self._load()
+
+    def clear(self) -> None:
+        """Drop every record and watermark"""
+        with self._mutex, self._lock(exclusive=True):
+            for name in (META_FILE, VECTORS_FILE, RECORDS_FILE):
+                try:
+                    os.remove(self._path(name))
+                except FileNotFoundError:
+                    pass
+            self.meta = {}
+            self._load()
+
+
+# ========== MONGODB SYNC ==========
+
+def _watermark_query(watermark: Dict[str, Any]) -> Dict[str, Any]:
+    """Documents written since a watermark ({} = everything)"""
+    if not watermark.get("since"):
+        return {}
+    # Re-reading unchanged documents is harmless (unchanged records are skipped)
+    since = datetime.fromisoformat(watermark["since"]) - WATERMARK_OVERLAP
+    return {"$or": [{"updated_at": {"$gte": since}}, {"created_at": {"$gte": since}}]}
+
+
+class FinancialRetrievalIndex:
+    """Per-tenant retrieval indexes kept in step with the financial collections"""
+
+    def __init__(self, db, config: Optional[RetrievalIndexConfig] = None, embedder=None):
+        """
+        Args:
+            db: Motor database handle
+            config: Index configuration (defaults to environment settings)
+            embedder: Embedding function (defaults to config.embedder)
+        """
+        self.db = db
+        self.config = config or RetrievalIndexConfig()
+        self.embedder = embedder or load_embedder(self.config.embedder, self.config.dimensions)
+        self._indexes: Dict[str, RetrievalIndex] = {}
+        self._synced: Dict[str, float] = {}
+        self._syncing: Dict[str, asyncio.Task] = {}
+        # source -> _ids written since the last flush
+        self._stale: Dict[str, set] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._indexes_ready = False
+
+    def index(self, tenant_id: str = DEFAULT_TENANT) -> RetrievalIndex:
+        index = self._indexes.get(tenant_id)
+        if index is None:
+            directory = os.path.join(self.config.directory, re.sub(r"[^A-Za-z0-9_.-]", "_", tenant_id))
+            index = self._indexes[tenant_id] = RetrievalIndex(directory, self.embedder)
+        return index
+
+    async def ensure_indexes(self):
+        """Index the timestamps a sync selects changed documents by"""
+        if self._indexes_ready:
+            return
+        for source in INDEX_SOURCES:
+            await self.db[source].create_index([("updated_at", 1)])
+            await self.db[source].create_index([("created_at", 1)])
+        self._indexes_ready = True
+
+    async def sync(self, tenant_id: str = DEFAULT_TENANT) -> int:
+        """
+        Index documents inserted or updated since the last sync
+
+        Returns:
+            Rows written
+        """
+        await self.ensure_indexes()
+        index = self.index(tenant_id)
+        await asyncio.to_thread(index.refresh)
+        written = 0
+        for source in INDEX_SOURCES:
+            started = datetime.now()
+            since = _watermark_query(index.meta.get("watermarks", {}).get(source, {}))
+            query = {"$and": [tenant_match(tenant_id), since]} if since else tenant_match(tenant_id)
+            records = []
+            async for document in self.db[source].find(query).batch_size(self.config.batch_size):
+                records.append(render_record(source, document))
+                if len(records) >= self.config.batch_size:
+                    written += await asyncio.to_thread(index.upsert, records)
+                    records = []
+            # The watermark moves only once the whole source has been read
+            written += await asyncio.to_thread(index.upsert, records, {source: {"since": started.isoformat()}})
+        self._synced[tenant_id] = time.monotonic()
+        if written:
+            logger.info(f"Retrieval index for {tenant_id}: {written} records indexed, {index.size} live")
+        return written
+
+    async def rebuild(self, tenant_id: str = DEFAULT_TENANT) -> int:
+        """Re-index a tenant from scratch (drops deleted documents)"""
+        await asyncio.to_thread(self.index(tenant_id).clear)
+        return await self.sync(tenant_id)
+
+    def mark_stale(self, source: str, *documents: Optional[Dict[str, Any]]) -> None:
+        """
+        Schedule a debounced re-index of written documents
+
+        Args:
+            source: Source collection that was written
+            documents: Written documents (re-read by _id, so partial documents are fine)
+        """
+        if source not in INDEX_SOURCES:
+            return
+        ids = {d["_id"] for d in documents if d and d.get("_id") is not None}
+        if not ids:
+            return
+        self._stale.setdefault(source, set()).update(ids)
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = loop.create_task(self._flush())
+
+    async def _flush(self) -> None:
+        # Writes marked while documents are re-indexed are picked up by the next pass
+        while self._stale:
+            await asyncio.sleep(self.config.refresh_delay)
+            stale, self._stale = self._stale, {}
+            for source, ids in stale.items():
+                try:
+                    await self.index_documents(source, list(ids))
+                except (PyMongoError, OSError, ValueError) as e:
+                    logger.warning(f"Failed to re-index written {source}: {str(e)}")
+
+    async def index_documents(self, source: str, ids: Sequence[Any]) -> int:
+        """
+        Re-index documents of a source by _id, whichever tenant they belong to
+
+        Returns:
+            Rows written
+        """
+        records: Dict[str, List[IndexRecord]] = {}
+        for start in range(0, len(ids), self.config.batch_size):
+            batch = list(ids[start:start + self.config.batch_size])
+            async for document in self.db[source].find({"_id": {"$in": batch}}):
+                tenant_id = document.get("tenant_id") or DEFAULT_TENANT
+                records.setdefault(tenant_id, []).append(render_record(source, document))
+        written = 0
+        for tenant_id, tenant_records in records.items():
+            written += await asyncio.to_thread(self.index(tenant_id).upsert, tenant_records)
+        return written
+
+    def sync_in_background(self, tenant_id: str = DEFAULT_TENANT) -> None:
+        task = self._syncing.get(tenant_id)
+        if task is None or task.done():
+            self._syncing[tenant_id] = asyncio.get_running_loop().create_task(self._sync_quietly(tenant_id))
+
+    async def _sync_quietly(self, tenant_id: str) -> None:
+        try:
+            await self.sync(tenant_id)
+        except (PyMongoError, OSError, ValueError) as e:
+            logger.warning(f"Failed to sync retrieval index for {tenant_id}: {str(e)}")
+
+    async def stop(self) -> None:
+        for task in [self._flush_task, *self._syncing.values()]:
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._syncing.clear()
+
+    async def search(
+        self,
+        query: str,
+        tenant_id: str = DEFAULT_TENANT,
+        k: Optional[int] = None,
+        sources: Optional[Iterable[str]] = None
+    ) -> List[RetrievedRecord]:
+        """
+        Records of a tenant relevant to a query
+
+        Searches what is indexed now; an index older than sync_seconds is
+        brought up to date in the background for later questions. The search
+        itself (file lock, re-map, embedding) runs in a worker thread.
+        """
+        synced = self._synced.get(tenant_id)
+        if synced is None or time.monotonic() - synced > self.config.sync_seconds:
+            self.sync_in_background(tenant_id)
+        return await asyncio.to_thread(
+            self.index(tenant_id).search,
+            query, k=k or self.config.top_k, sources=sources, min_score=self.config.min_score
+        )
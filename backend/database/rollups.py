@@ -0,0 +1,418 @@
+"""
+Materialized monthly financial rollups
+
+Keeps a `financial_rollups` collection with one document per
+(tenant, month, metric, category) so trend and comparison reports read a few
+dozen pre-aggregated documents instead of scanning invoices, payments,
+receipts and transactions on every request.
+
+Rollups are maintained incrementally: when a source document is written the
+affected month is re-aggregated for that source (an indexed, single-month
+query) and the rollup documents for that month are replaced. A full rebuild
+is available for backfills (see scripts/rebuild_financial_rollups.py).
+"""
+from typing import Dict, Any, List, Optional, Iterable, Tuple
+from datetime import datetime, timedelta
+from dataclasses import dataclass, field
+import logging
+
+from dateutil import parser as date_parser
+from pymongo import UpdateOne
+
+logger = logging.getLogger("financial-agent.database.rollups")
+
+ROLLUPS_COLLECTION = "financial_rollups"
+DEFAULT_TENANT = "default"
+
+EXPENSE_RECEIPT_MATCH = {
+    "$or": [
+        {"receipt_type": "expense"},
+        {"receipt_type": "refund"},
+        {"ocr_data.extracted_data.total_amount": {"$exists": True}}
+    ]
+}
+
+# Receipt amount with the same priority as the expenses API and cash flow:
+# OCR data > tax breakdown > line items
+RECEIPT_AMOUNT = {
+    "$max": [
+        {
+            "$cond": [
+                {"$ifNull": ["$ocr_data", False]},
+                {"$ifNull": ["$ocr_data.extracted_data.total_amount", 0]},
+                {
+                    "$cond": [
+                        {"$ifNull": ["$tax_breakdown", False]},
+                        {"$add": [
+                            {"$ifNull": ["$tax_breakdown.subtotal", 0]},
+                            {"$ifNull": ["$tax_breakdown.vat_amount", 0]}
+                        ]},
+                        {"$sum": {"$ifNull": ["$line_items.total", []]}}
+                    ]
+                }
+            ]
+        },
+        0
+    ]
+}
+
+RECEIPT_CATEGORY = {
+    "$cond": [
+        {"$ifNull": ["$ocr_data", False]},
+        {"$ifNull": ["$ocr_data.extracted_data.merchant_name", "Other Expenses"]},
+        {"$ifNull": ["$category", "Other Expenses"]}
+    ]
+}
+
+INVOICE_AMOUNT = {"$ifNull": ["$total_amount", {"$ifNull": ["$amount", 0]}]}
+
+
+@dataclass(frozen=True)
+class RollupMetric:
+    """Definition of one rolled-up metric over a source collection"""
+    name: str
+    collection: str
+    date_field: str
+    amount: Any
+    match: Dict[str, Any] = field(default_factory=dict)
+    category: Any = "all"
+    # "datetime" for BSON dates, "string" for YYYY-MM-DD strings
+    date_type: str = "datetime"
+
+
+ROLLUP_METRICS: Tuple[RollupMetric, ...] = (
+    RollupMetric(
+        name="revenue",
+        collection="invoices",
+        date_field="issue_date_ts",
+        amount=INVOICE_AMOUNT,
+        match={"status": "paid"},
+    ),
+    RollupMetric(
+        name="invoiced",
+        collection="invoices",
+        date_field="issue_date_ts",
+        amount=INVOICE_AMOUNT,
+        category={"$ifNull": ["$status", "unknown"]},
+    ),
+    RollupMetric(
+        name="expenses",
+        collection="transactions",
+        date_field="transaction_date",
+        date_type="string",
+        amount={"$ifNull": ["$amount", 0]},
+        match={"type": "expense"},
+    ),
+    RollupMetric(
+        name="payments_received",
+        collection="payments",
+        date_field="payment_date",
+        amount={"$ifNull": ["$amount", 0]},
+        match={"status": {"$in": ["completed", "successful", "paid"]}},
+    ),
+    RollupMetric(
+        name="payments_refunded",
+        collection="payments",
+        date_field="payment_date",
+        amount={"$ifNull": ["$amount", 0]},
+        match={"status": {"$in": ["refunded", "Refunded", "failed", "Failed", "returned", "Returned"]}},
+    ),
+    RollupMetric(
+        name="receipt_expenses",
+        collection="receipts",
+        date_field="created_at",
+        amount=RECEIPT_AMOUNT,
+        match=EXPENSE_RECEIPT_MATCH,
+        category=RECEIPT_CATEGORY,
+    ),
+)
+
+ROLLUP_SOURCES = frozenset(metric.collection for metric in ROLLUP_METRICS)
+
+
+def month_key(value: datetime) -> str:
+    """Format a datetime as a rollup month key (YYYY-MM)"""
+    return value.strftime("%Y-%m")
+
+
+def month_start(month: str) -> datetime:
+    """First instant of a YYYY-MM month"""
+    return datetime.strptime(month, "%Y-%m")
+
+
+def next_month_start(month: str) -> datetime:
+    """First instant of the month after a YYYY-MM month"""
+    start = month_start(month)
+    return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def iter_months(start: datetime, end: datetime) -> List[str]:
+    """All month keys from start to end (inclusive)"""
+    months = []
+    current = datetime(start.year, start.month, 1)
+    while current <= end:
+        months.append(month_key(current))
+        current = next_month_start(month_key(current))
+    return months
+
+
+def _document_month(document: Dict[str, Any], date_field: str) -> Optional[str]:
+    """Month key of a source document's date field, if present"""
+    value = document.get(date_field)
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return month_key(value)
+    try:
+        return month_key(date_parser.parse(str(value)))
+    except (ValueError, OverflowError):
+        return None
+
+
+class FinancialRollups:
+    """Maintains and queries the financial_rollups collection"""
+
+    def __init__(self, db):
+        """
+        Args:
+            db: Motor database handle
+        """
+        self.db = db
+        self.collection = db[ROLLUPS_COLLECTION]
+
+    async def ensure_indexes(self):
+        """Create the lookup index for period queries"""
+        await self.collection.create_index(
+            [("tenant_id", 1), ("metric", 1), ("month", 1), ("category", 1)],
+            unique=True
+        )
+
+    # ========== MAINTENANCE ==========
+
+    def _month_range(self, metric: RollupMetric, months: Iterable[str]) -> Dict[str, Any]:
+        """Match clause selecting source documents in any of the given months"""
+        clauses = []
+        for month in sorted(set(months)):
+            if metric.date_type == "string":
+                upper = month_key(next_month_start(month))
+                clauses.append({metric.date_field: {"$gte": month, "$lt": upper}})
+            else:
+                clauses.append({metric.date_field: {"$gte": month_start(month), "$lt": next_month_start(month)}})
+        if len(clauses) == 1:
+            return clauses[0]
+        return {"$or": clauses}
+
+    def _pipeline(
+        self,
+        metric: RollupMetric,
+        date_match: Dict[str, Any],
+        tenant_id: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Aggregation grouping a metric's source documents by tenant/month/category"""
+        if metric.date_type == "string":
+            month_expr = {"$substr": [f"${metric.date_field}", 0, 7]}
+        else:
+            month_expr = {"$dateToString": {"format": "%Y-%m", "date": f"${metric.date_field}"}}
+
+        clauses = [metric.match, date_match] if metric.match else [date_match]
+        if tenant_id == DEFAULT_TENANT:
+            # Documents written before tenants existed belong to the default tenant
+            clauses.append({"tenant_id": {"$in": [DEFAULT_TENANT, None]}})
+        elif tenant_id:
+            clauses.append({"tenant_id": tenant_id})
+        match = {"$and": clauses} if len(clauses) > 1 else date_match
+        return [
+            {"$match": match},
+            {"$group": {
+                "_id": {
+                    "tenant_id": {"$ifNull": ["$tenant_id", DEFAULT_TENANT]},
+                    "month": month_expr,
+                    "category": metric.category
+                },
+                "amount": {"$sum": metric.amount},
+                "count": {"$sum": 1}
+            }}
+        ]
+
+    async def _write_rows(self, metric: RollupMetric, rows: List[Dict[str, Any]], scope: Dict[str, Any]) -> int:
+        """Upsert aggregated rows and drop stale rollups for the same scope"""
+        now = datetime.now()
+        operations = []
+        ids = []
+        for row in rows:
+            key = row["_id"]
+            category = str(key.get("category") or "Other")
+            rollup_id = f"{key['tenant_id']}|{key['month']}|{metric.name}|{category}"
+            ids.append(rollup_id)
+            operations.append(UpdateOne(
+                {"_id": rollup_id},
+                {"$set": {
+                    "tenant_id": key["tenant_id"],
+                    "month": key["month"],
+                    "metric": metric.name,
+                    "category": category,
+                    "amount": round(row.get("amount") or 0.0, 2),
+                    "count": row.get("count", 0),
+                    "updated_at": now
+                }},
+                upsert=True
+            ))
+
+        if operations:
+            await self.collection.bulk_write(operations, ordered=False)
+        await self.collection.delete_many({**scope, "metric": metric.name, "_id": {"$nin": ids}})
+        return len(operations)
+
+    async def refresh_months(self, source: str, months: Iterable[str]) -> int:
+        """
+        Re-aggregate the given months for every metric fed by a source collection
+
+        Args:
+            source: Source collection name (invoices, payments, receipts, transactions)
+            months: Month keys (YYYY-MM) to refresh
+
+        Returns:
+            Number of rollup documents written
+        """
+        months = sorted({m for m in months if m})
+        if not months:
+            return 0
+
+        written = 0
+        for metric in ROLLUP_METRICS:
+            if metric.collection != source:
+                continue
+            pipeline = self._pipeline(metric, self._month_range(metric, months))
+            rows = await self.db[metric.collection].aggregate(pipeline).to_list(None)
+            written += await self._write_rows(metric, rows, {"month": {"$in": months}})
+        return written
+
+    async def refresh_documents(self, source: str, *documents: Dict[str, Any]) -> int:
+        """
+        Refresh the months touched by the given source documents
+
+        Args:
+            source: Source collection name
+            documents: Source documents (before and/or after a write)
+
+        Returns:
+            Number of rollup documents written
+        """
+        if source not in ROLLUP_SOURCES:
+            return 0
+
+        months = set()
+        for metric in ROLLUP_METRICS:
+            if metric.collection != source:
+                continue
+            for document in documents:
+                if document:
+                    months.add(_document_month(document, metric.date_field))
+        months.discard(None)
+        return await self.refresh_months(source, months)
+
+    async def rebuild(self) -> Dict[str, int]:
+        """
+        Rebuild every rollup from the source collections (backfill)
+
+        Returns:
+            Rollup document count per metric
+        """
+        stats = {}
+        for metric in ROLLUP_METRICS:
+            date_match = {metric.date_field: {"$nin": [None, ""]}}
+            rows = await self.db[metric.collection].aggregate(self._pipeline(metric, date_match)).to_list(None)
+            stats[metric.name] = await self._write_rows(metric, rows, {})
+            logger.info(f"Rebuilt {stats[metric.name]} rollups for {metric.name}")
+        return stats
+
+    # ========== QUERIES ==========
+
+    async def get_monthly(
+        self,
+        metric: str,
+        start_month: str,
+        end_month: str,
+        tenant_id: str = DEFAULT_TENANT
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Monthly totals for a metric, summed over categories
+
+        Returns:
+            {month: {"amount": float, "count": int, "by_category": {category: amount}}}
+        """
+        cursor = self.collection.find({
+            "tenant_id": tenant_id,
+            "metric": metric,
+            "month": {"$gte": start_month, "$lte": end_month}
+        })
+
+        months: Dict[str, Dict[str, Any]] = {}
+        async for doc in cursor:
+            entry = months.setdefault(doc["month"], {"amount": 0.0, "count": 0, "by_category": {}})
+            entry["amount"] += doc.get("amount", 0.0)
+            entry["count"] += doc.get("count", 0)
+            entry["by_category"][doc["category"]] = entry["by_category"].get(doc["category"], 0.0) + doc.get("amount", 0.0)
+        return months
+
+    async def period_totals(
+        self,
+        metric_name: str,
+        start: datetime,
+        end: datetime,
+        tenant_id: str = DEFAULT_TENANT
+    ) -> Dict[str, Any]:
+        """
+        Totals for a metric over the days start..end (inclusive)
+
+        Whole months inside the period are read from the rollups; partial months
+        at either edge are aggregated from the source collection (one indexed,
+        single-month query each).
+
+        Returns:
+            {"amount": float, "count": int, "by_category": {category: amount}}
+        """
+        metric = next(m for m in ROLLUP_METRICS if m.name == metric_name)
+        start_day = datetime(start.year, start.month, start.day)
+        end_day = datetime(end.year, end.month, end.day)
+
+        totals = {"amount": 0.0, "count": 0, "by_category": {}}
+
+        def add(amount, count, category):
+            totals["amount"] += amount
+            totals["count"] += count
+            totals["by_category"][category] = totals["by_category"].get(category, 0.0) + amount
+
+        whole_months = []
+        partial_ranges = []
+        for month in iter_months(start_day, end_day):
+            first_day = month_start(month)
+            last_day = next_month_start(month) - timedelta(days=1)
+            if start_day <= first_day and end_day >= last_day:
+                whole_months.append(month)
+            else:
+                partial_ranges.append((max(first_day, start_day), min(last_day, end_day)))
+
+        if whole_months:
+            cursor = self.collection.find({
+                "tenant_id": tenant_id,
+                "metric": metric.name,
+                "month": {"$in": whole_months}
+            })
+            async for doc in cursor:
+                add(doc.get("amount", 0.0), doc.get("count", 0), doc["category"])
+
+        for range_start, range_end in partial_ranges:
+            if metric.date_type == "string":
+                date_match = {metric.date_field: {
+                    "$gte": range_start.strftime("%Y-%m-%d"),
+                    "$lte": range_end.strftime("%Y-%m-%d")
+                }}
+            else:
+                date_match = {metric.date_field: {"$gte": range_start, "$lt": range_end + timedelta(days=1)}}
+            pipeline = self._pipeline(metric, date_match, tenant_id)
+            rows = await self.db[metric.collection].aggregate(pipeline).to_list(None)
+            for row in rows:
+                add(row.get("amount") or 0.0, row.get("count", 0), str(row["_id"].get("category") or "Other"))
+
+        return totals
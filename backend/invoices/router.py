@@ -496,6 +496,7 @@ async def mark_invoice_paid(
             {"_id": ObjectId(invoice_id)},
             {"$set": update_data}
         )
+        await db_instance.on_financial_write("invoices", {**invoice, **update_data})
         
         # Initialize receipt integration if not already done
         if invoice_receipt_integration is None:
@@ -546,6 +546,9 @@ async def create_invoice_with_items(db, invoice_data: dict, items_data: list):
     """
     Create invoice and items atomically using transactions
     
+    `db` is the Database instance; rollups, context snapshots and the
+    retrieval index are updated once the transaction has committed.
+    
     Example usage:
         invoice_data = {
             "invoice_number": "INV-001",
@@ -577,8 +580,9 @@ async def create_invoice_with_items(db, invoice_data: dict, items_data: list):
                 items_data,
                 session=session
             )
-            
-            return invoice_id
+    
+    await db.on_financial_write("invoices", invoice_data)
+    return invoice_id
 
 
 # ============================================================================
@@ -0,0 +1,276 @@
+"""
+OCR result deduplication
+
+Users often upload the same receipt photo twice. Every saved OCR result
+carries a content hash (sha256 of the file) and a perceptual hash (64-bit
+dHash, robust to re-compression and resizing) of the uploaded image, plus the
+OCR engine version that produced it. A new upload whose hash matches an
+earlier result from the current engines is flagged as a possible duplicate
+expense. Only an exact content hash match reuses the earlier result instead of
+running the multi-engine pipeline: receipts from the same shop share a layout,
+so a perceptual match may well be a different purchase and is OCR'd anyway.
+
+Perceptual lookups use 8 one-byte bands of the hash: two hashes within 7 bits
+of each other share at least one band exactly, so an indexed $in query finds
+every candidate and the exact Hamming distance is checked in Python.
+"""
+import os
+import hashlib
+import logging
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+import cv2
+import numpy as np
+
+from .engine_pool import get_engine_pool, easyocr
+
+logger = logging.getLogger("financial-agent.ocr.dedup")
+
+# Bump when preprocessing or engine selection changes in a way that changes results
+OCR_PIPELINE_VERSION = "phase2.5"
+
+PHASH_BANDS = 8
+
+
+class OCRDedupConfig:
+    """OCR result deduplication configuration"""
+
+    def __init__(self):
+        self.enabled = os.environ.get("OCR_DEDUP_ENABLED", "true").lower() == "true"
+        # Largest perceptual hash distance (bits of 64) flagged as a possible duplicate
+        self.max_distance = min(PHASH_BANDS - 1, int(os.environ.get("OCR_DEDUP_MAX_DISTANCE", "6")))
+        # "user": only match a user's own uploads; "global": any upload
+        self.scope = os.environ.get("OCR_DEDUP_SCOPE", "user").lower()
+        self.max_candidates = int(os.environ.get("OCR_DEDUP_MAX_CANDIDATES", "50"))
+
+
+@dataclass
+class ImageFingerprint:
+    """Hashes identifying an uploaded receipt image"""
+    content_hash: str
+    perceptual_hash: Optional[str] = None
+
+    @property
+    def phash_bands(self) -> List[str]:
+        if not self.perceptual_hash:
+            return []
+        step = len(self.perceptual_hash) // PHASH_BANDS
+        return [f"{i}:{self.perceptual_hash[i * step:(i + 1) * step]}" for i in range(PHASH_BANDS)]
+
+
+def perceptual_hash(image: np.ndarray) -> str:
+    """64-bit difference hash (hex) of a grayscale image"""
+    # Normalise size and smooth first so re-encoding noise and flat paper
+    # areas do not flip neighbouring comparisons
+    normalised = cv2.GaussianBlur(cv2.resize(image, (64, 64), interpolation=cv2.INTER_AREA), (5, 5), 0)
+    small = cv2.resize(normalised, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return f"{int(''.join('1' if b else '0' for b in bits), 2):016x}"
+
+
+def hamming_distance(a: str, b: str) -> int:
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+
+def fingerprint_image(image_path: str) -> ImageFingerprint:
+    """
+    Hash an uploaded file (blocking; run off the event loop)
+
+    Args:
+        image_path: Path to the uploaded receipt
+
+    Returns:
+        Content hash, plus a perceptual hash when the file is an image
+    """
+    with open(image_path, "rb") as f:
+        data = f.read()
+
+    phash = None
+    # A half-scale grayscale decode is plenty for a 9x8 hash
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_2)
+    if image is not None and image.size:
+        phash = perceptual_hash(image)
+
+    return ImageFingerprint(content_hash=hashlib.sha256(data).hexdigest(), perceptual_hash=phash)
+
+
+def current_engine_version() -> str:
+    """Version string of the OCR pipeline and engines that produce new results"""
+    pool = get_engine_pool()
+    return ";".join([
+        f"pipeline={OCR_PIPELINE_VERSION}",
+        f"tesseract={pool.tesseract_version or 'none'}",
+        f"easyocr={getattr(easyocr, '__version__', 'none') if easyocr else 'none'}",
+    ])
+
+
+class OCRDedupCache:
+    """Looks up reusable OCR results in the ocr_results collection"""
+
+    def __init__(self, db, collection: str = "ocr_results", config: Optional[OCRDedupConfig] = None):
+        """
+        Args:
+            db: Database instance
+            collection: Collection that save_ocr_result writes to
+            config: Dedup configuration (defaults to environment settings)
+        """
+        self.db = db
+        self.collection_name = collection
+        self.config = config or OCRDedupConfig()
+        self._indexes_ready = False
+        self.stats = {"lookups": 0, "exact_hits": 0, "perceptual_hits": 0, "misses": 0, "errors": 0}
+
+    @property
+    def collection(self):
+        return self.db.db[self.collection_name]
+
+    async def ensure_indexes(self):
+        if self._indexes_ready:
+            return
+        await self.collection.create_index([("content_hash", 1), ("engine_version", 1)])
+        await self.collection.create_index([("phash_bands", 1), ("engine_version", 1)])
+        self._indexes_ready = True
+
+    def index_fields(self, fingerprint: Optional[ImageFingerprint], user_id: Optional[str], receipt_id: Optional[str]) -> Dict[str, Any]:
+        """Fields save_ocr_result stores so the result can be found again"""
+        if fingerprint is None:
+            return {}
+        return {
+            "content_hash": fingerprint.content_hash,
+            "perceptual_hash": fingerprint.perceptual_hash,
+            "phash_bands": fingerprint.phash_bands,
+            "engine_version": current_engine_version(),
+            "user_id": user_id,
+            "receipt_id": receipt_id,
+            "dedup_hits": 0,
+        }
+
+    async def lookup(self, fingerprint: ImageFingerprint, user_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Find a reusable OCR result for an image
+
+        Args:
+            fingerprint: Hashes of the new upload
+            user_id: Uploading user (limits matches when scope is "user")
+
+        Returns:
+            The cached ocr_results document with "match" ("exact" or
+            "perceptual") and "distance" added, or None
+        """
+        if not self.config.enabled:
+            return None
+        self.stats["lookups"] += 1
+
+        base_query = {
+            "engine_version": current_engine_version(),
+            "status": "completed",
+            "text": {"$nin": ["", None]},
+        }
+        if self.config.scope == "user":
+            base_query["user_id"] = user_id
+
+        try:
+            await self.ensure_indexes()
+
+            doc = await self.collection.find_one(
+                {**base_query, "content_hash": fingerprint.content_hash},
+                sort=[("created_at", 1)]
+            )
+            if doc:
+                self.stats["exact_hits"] += 1
+                return await self._hit(doc, "exact", 0)
+
+            if fingerprint.perceptual_hash:
+                cursor = self.collection.find(
+                    {**base_query, "phash_bands": {"$in": fingerprint.phash_bands}}
+                ).sort("created_at", 1).limit(self.config.max_candidates)
+                best, best_distance = None, None
+                async for candidate in cursor:
+                    if not candidate.get("perceptual_hash"):
+                        continue
+                    distance = hamming_distance(fingerprint.perceptual_hash, candidate["perceptual_hash"])
+                    if distance <= self.config.max_distance and (best is None or distance < best_distance):
+                        best, best_distance = candidate, distance
+                if best is not None:
+                    self.stats["perceptual_hits"] += 1
+                    return await self._hit(best, "perceptual", best_distance)
+
+        except Exception as e:
+            # The cache is an optimisation; fall through to full OCR
+            self.stats["errors"] += 1
+            logger.warning(f"OCR dedup lookup failed: {str(e)}")
+            return None
+
+        self.stats["misses"] += 1
+        return None
+
+    async def _hit(self, doc: Dict[str, Any], match: str, distance: int) -> Dict[str, Any]:
+        await self.collection.update_one(
+            {"_id": doc["_id"]},
+            {"$inc": {"dedup_hits": 1}, "$set": {"last_hit_at": datetime.utcnow()}}
+        )
+        doc["id"] = str(doc.pop("_id"))
+        doc["match"] = match
+        doc["distance"] = distance
+        logger.info(f"OCR dedup {match} hit: reusing result {doc['id']} of receipt {doc.get('receipt_id')}")
+        return doc
+
+    async def invalidate(self, stale_only: bool = True) -> int:
+        """
+        Stop OCR results from being reused
+
+        Args:
+            stale_only: Only results from other engine versions (True) or all (False)
+
+        Returns:
+            Number of results removed from the cache (the results themselves are kept)
+        """
+        query: Dict[str, Any] = {"content_hash": {"$exists": True}}
+        if stale_only:
+            query["engine_version"] = {"$ne": current_engine_version()}
+        result = await self.collection.update_many(
+            query,
+            {"$unset": {"content_hash": "", "perceptual_hash": "", "phash_bands": ""}}
+        )
+        logger.info(f"Invalidated {result.modified_count} cached OCR results (stale_only={stale_only})")
+        return result.modified_count
+
+    async def get_stats(self) -> Dict[str, Any]:
+        """Hit rate in this process plus cache contents by engine version"""
+        hits = self.stats["exact_hits"] + self.stats["perceptual_hits"]
+        by_version = await self.collection.aggregate([
+            {"$match": {"content_hash": {"$exists": True}}},
+            {"$group": {"_id": "$engine_version", "entries": {"$sum": 1}, "hits": {"$sum": "$dedup_hits"}}},
+        ]).to_list(length=None)
+        current = current_engine_version()
+        return {
+            "enabled": self.config.enabled,
+            "scope": self.config.scope,
+            "max_distance": self.config.max_distance,
+            "engine_version": current,
+            "process": {
+                **self.stats,
+                "hit_rate": round(hits / self.stats["lookups"], 4) if self.stats["lookups"] else 0.0,
+            },
+            "entries": {
+                (row["_id"] or "unknown"): {"entries": row["entries"], "hits": row["hits"], "current": row["_id"] == current}
+                for row in by_version
+            },
+        }
+
+
+_cache: Optional[OCRDedupCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_ocr_dedup_cache(db) -> OCRDedupCache:
+    """Process-wide OCR dedup cache (OCRService is created per request)"""
+    global _cache
+    if _cache is None or _cache.db is not db:
+        with _cache_lock:
+            if _cache is None or _cache.db is not db:
+                _cache = OCRDedupCache(db)
+    return _cache
@@ -0,0 +1,283 @@
+"""
+Process-wide OCR engine pool
+
+Loading an EasyOCR model takes seconds and hundreds of MB, so readers are
+loaded once per process and leased to receipts instead of being rebuilt per
+EnhancedReceiptProcessor. Engines are retired after a configurable number of
+uses (or repeated failures) and replaced in the background, which bounds
+memory growth in long-lived workers. Tesseract runs as a subprocess and needs
+no model; the pool only probes that the binary is available.
+"""
+import os
+import time
+import queue
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager, asynccontextmanager
+from typing import Dict, Any, Optional
+
+try:
+    import easyocr
+    EASYOCR_AVAILABLE = True
+except ImportError:
+    easyocr = None
+    EASYOCR_AVAILABLE = False
+
+try:
+    import pytesseract
+except ImportError:
+    pytesseract = None
+
+logger = logging.getLogger("financial-agent.ocr.engine_pool")
+
+
+class OCREnginePoolExhausted(Exception):
+    """Raised when no OCR engine became free within the acquire timeout"""
+
+
+class OCREnginePoolConfig:
+    """OCR engine pool configuration"""
+
+    def __init__(self):
+        # Warm engines per process (each holds its own EasyOCR model in memory)
+        self.size = max(1, int(os.environ.get("OCR_ENGINE_POOL_SIZE", "1")))
+        # Retire an engine after this many receipts (0 = never)
+        self.max_uses = int(os.environ.get("OCR_ENGINE_MAX_USES", "500"))
+        # Retire an engine after this many consecutive failures
+        self.max_failures = int(os.environ.get("OCR_ENGINE_MAX_FAILURES", "3"))
+        self.acquire_timeout = float(os.environ.get("OCR_ENGINE_ACQUIRE_TIMEOUT", "60"))
+        # Load models at worker/API start instead of on the first receipt
+        self.warmup = os.environ.get("OCR_ENGINE_WARMUP", "true").lower() == "true"
+        self.languages = [lang.strip() for lang in os.environ.get("OCR_EASYOCR_LANGUAGES", "en").split(",") if lang.strip()]
+        self.gpu = os.environ.get("OCR_EASYOCR_GPU", "false").lower() == "true"
+
+
+class OCREngine:
+    """One warm set of OCR models leased to a single receipt at a time"""
+
+    def __init__(self, engine_id: int, config: OCREnginePoolConfig):
+        self.id = engine_id
+        self.uses = 0
+        self.consecutive_failures = 0
+        self.created_at = time.time()
+
+        start = time.time()
+        self.easyocr_reader = None
+        if EASYOCR_AVAILABLE:
+            try:
+                self.easyocr_reader = easyocr.Reader(config.languages, gpu=config.gpu)
+            except Exception as e:
+                logger.error(f"Failed to initialize EasyOCR for engine {engine_id}: {str(e)}")
+        self.load_seconds = time.time() - start
+
+    def record(self, failed: bool):
+        self.uses += 1
+        self.consecutive_failures = self.consecutive_failures + 1 if failed else 0
+
+
+class OCREnginePool:
+    """Bounded pool of warm OCR engines shared by every processor in the process"""
+
+    def __init__(self, config: Optional[OCREnginePoolConfig] = None):
+        """
+        Args:
+            config: Pool configuration (defaults to environment settings)
+        """
+        self.config = config or OCREnginePoolConfig()
+        # LIFO keeps recently used (cache-warm) engines busy and lets idle ones age out
+        self._idle: "queue.LifoQueue[OCREngine]" = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._next_id = 0
+        self._tesseract_version: Optional[str] = None
+        self.stats = {
+            "leases": 0, "waits": 0, "wait_seconds": 0.0, "built": 0,
+            "build_seconds": 0.0, "recycled": 0, "failed_leases": 0, "exhausted": 0
+        }
+
+    @property
+    def easyocr_available(self) -> bool:
+        return EASYOCR_AVAILABLE
+
+    @property
+    def tesseract_version(self) -> Optional[str]:
+        """Tesseract version, probed once per process (None if unavailable)"""
+        if self._tesseract_version is None and pytesseract is not None:
+            try:
+                self._tesseract_version = str(pytesseract.get_tesseract_version())
+            except Exception:
+                self._tesseract_version = ""
+        return self._tesseract_version or None
+
+    def _build(self) -> OCREngine:
+        with self._lock:
+            self._next_id += 1
+            engine_id = self._next_id
+        engine = OCREngine(engine_id, self.config)
+        self.stats["built"] += 1
+        self.stats["build_seconds"] += engine.load_seconds
+        logger.info(f"OCR engine {engine_id} loaded in {engine.load_seconds:.2f}s")
+        return engine
+
+    def _reserve_slot(self) -> bool:
+        with self._lock:
+            if self._created >= self.config.size:
+                return False
+            self._created += 1
+            return True
+
+    def _release_slot(self):
+        with self._lock:
+            self._created -= 1
+
+    def warm(self):
+        """Load engines up to the pool size (call at worker/API start)"""
+        self.tesseract_version
+        while self._reserve_slot():
+            try:
+                self._idle.put(self._build())
+            except Exception:
+                self._release_slot()
+                raise
+        logger.info(f"OCR engine pool warm: {self._created} engine(s)")
+
+    def _checkout(self, timeout: Optional[float] = None) -> OCREngine:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        if self._reserve_slot():
+            try:
+                return self._build()
+            except Exception:
+                self._release_slot()
+                raise
+
+        timeout = timeout if timeout is not None else self.config.acquire_timeout
+        started = time.time()
+        self.stats["waits"] += 1
+        try:
+            while True:
+                remaining = timeout - (time.time() - started)
+                if remaining <= 0:
+                    self.stats["exhausted"] += 1
+                    raise OCREnginePoolExhausted(f"No OCR engine free after {timeout:.0f}s")
+                try:
+                    return self._idle.get(timeout=min(1.0, remaining))
+                except queue.Empty:
+                    pass
+                # A recycled engine frees its slot; load a replacement ourselves
+                if self._reserve_slot():
+                    try:
+                        return self._build()
+                    except Exception:
+                        self._release_slot()
+                        raise
+        finally:
+            self.stats["wait_seconds"] += time.time() - started
+
+    def _checkin(self, engine: OCREngine, failed: bool):
+        engine.record(failed)
+        if failed:
+            self.stats["failed_leases"] += 1
+
+        worn_out = self.config.max_uses and engine.uses >= self.config.max_uses
+        unhealthy = engine.consecutive_failures >= self.config.max_failures
+        if not (worn_out or unhealthy):
+            self._idle.put(engine)
+            return
+
+        logger.info(
+            f"Recycling OCR engine {engine.id} after {engine.uses} uses"
+            + (f" ({engine.consecutive_failures} consecutive failures)" if unhealthy else "")
+        )
+        self.stats["recycled"] += 1
+        self._release_slot()
+        if self.config.warmup:
+            # Replace it off the request path so the next receipt finds a warm engine
+            threading.Thread(target=self._replace, name="ocr-engine-replace", daemon=True).start()
+
+    def _replace(self):
+        if not self._reserve_slot():
+            return
+        try:
+            self._idle.put(self._build())
+        except Exception as e:
+            self._release_slot()
+            logger.error(f"Failed to replace recycled OCR engine: {str(e)}")
+
+    @contextmanager
+    def lease(self, timeout: Optional[float] = None):
+        """
+        Borrow an engine for the duration of a with-block
+
+        An exception escaping the block counts as a failure of the engine.
+        """
+        engine = self._checkout(timeout)
+        self.stats["leases"] += 1
+        failed = False
+        try:
+            yield engine
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self._checkin(engine, failed)
+
+    @asynccontextmanager
+    async def lease_async(self, timeout: Optional[float] = None):
+        """Async variant of lease(); loading or waiting happens off the event loop"""
+        try:
+            engine = self._idle.get_nowait()
+        except queue.Empty:
+            checkout = asyncio.get_running_loop().run_in_executor(None, self._checkout, timeout)
+            try:
+                engine = await asyncio.shield(checkout)
+            except asyncio.CancelledError:
+                # The thread may still check an engine out; put it back unused
+                checkout.add_done_callback(
+                    lambda f: self._idle.put(f.result()) if not f.cancelled() and f.exception() is None else None
+                )
+                raise
+        self.stats["leases"] += 1
+        failed = False
+        try:
+            yield engine
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self._checkin(engine, failed)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Pool size, usage and recycling counters"""
+        idle = self._idle.qsize()
+        return {
+            "size": self.config.size,
+            "loaded": self._created,
+            "idle": idle,
+            "in_use": max(0, self._created - idle),
+            "max_uses": self.config.max_uses,
+            "easyocr_available": self.easyocr_available,
+            "tesseract_version": self._tesseract_version or None,
+            **self.stats,
+            "average_build_seconds": round(self.stats["build_seconds"] / self.stats["built"], 3) if self.stats["built"] else 0.0,
+        }
+
+
+_pool: Optional[OCREnginePool] = None
+_pool_pid: Optional[int] = None
+_pool_lock = threading.Lock()
+
+
+def get_engine_pool() -> OCREnginePool:
+    """The OCR engine pool of the current process (recreated after a fork)"""
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = OCREnginePool()
+                _pool_pid = os.getpid()
+    return _pool
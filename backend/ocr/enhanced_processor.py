@@ -3,7 +3,6 @@ Enhanced OCR Processor with Multiple Engines
 """
 import cv2
 import numpy as np
-import easyocr
 import pytesseract
 from PIL import Image
 import logging
@@ -20,6 +19,10 @@ load_dotenv()
 
 from .models import OCRResult, ProcessingStatus
 from .gemini_ocr_engine import create_gemini_ocr_engine
+from .engine_pool import get_engine_pool
+from .executor import OCRExecutor, get_ocr_executor
+from .quality import PreprocessingConfig, assess_image_quality, plan_preprocessing
+from .field_extractor import ReceiptFieldExtractor
 from dataclasses import dataclass
 
 logger = logging.getLogger("financial-agent.ocr.enhanced_processor")
@@ -34,23 +37,29 @@ class Phase2OCRResult:
     engine: str = "phase2_enhanced"
     error: Optional[str] = None
     structured_data: Optional[Dict[str, any]] = None
+    early_exit: bool = False
+    engine_runs: Optional[Dict[str, Dict[str, Any]]] = None
+    preprocessing: Optional[Dict[str, Any]] = None
 
 class EnhancedReceiptProcessor:
     """
     Advanced receipt processor with multiple OCR engines
     """
     
-    def __init__(self):
-        # Initialize OCR engines
-        try:
-            self.easyocr_reader = easyocr.Reader(['en'])
-            logger.info("EasyOCR initialized successfully")
-        except Exception as e:
-            logger.error(f"Failed to initialize EasyOCR: {str(e)}")
-            self.easyocr_reader = None
+    def __init__(self, enable_gemini: bool = True, executor: Optional[OCRExecutor] = None):
+        """
+        Args:
+            enable_gemini: Create the Gemini Vision engine (OCR worker processes skip it)
+            executor: Backend running the CPU-bound stages (defaults to the process-wide one)
+        """
+        # OCR models (EasyOCR readers) are loaded once per process and leased per receipt
+        self.engine_pool = get_engine_pool()
+        
+        # Preprocessing, Tesseract and EasyOCR run off the event loop
+        self.executor = executor or get_ocr_executor()
         
         # Initialize Gemini OCR Engine
-        self.gemini_ocr = create_gemini_ocr_engine()
+        self.gemini_ocr = create_gemini_ocr_engine() if enable_gemini else None
         if self.gemini_ocr:
             logger.info("Gemini OCR Engine initialized successfully")
         else:
@@ -62,70 +71,62 @@ class EnhancedReceiptProcessor:
             '-c tessedit_char_whitelist=0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz.,-/:$ '
         )
         
+        # Tesseract page segmentation variants tried for each receipt
+        self.tesseract_psm_configs = {
+            'tesseract_psm6': '--oem 3 --psm 6',  # Default for receipts
+            'tesseract_psm4': '--oem 3 --psm 4',  # Single text column
+            'tesseract_psm8': '--oem 3 --psm 8',  # Single word
+            'tesseract_psm7': '--oem 3 --psm 7',  # Single text line
+        }
+        
         # Phase 2: Advanced preprocessing settings
         self.preprocessing_enabled = True
+        # Stages are picked per image from a quick quality check (see quality.py)
+        self.preprocessing_config = PreprocessingConfig()
         self.multi_engine_enabled = True
         self.confidence_threshold = 0.7
+        # Pattern score a result needs to end the engine race early (0.4 = amount and date found)
+        self.min_pattern_score = 0.4
         self.use_gemini_ocr = True  # Enable Gemini OCR by default
         
-        # Kenyan business patterns
-        self.patterns = {
-            'currency': [
-                r'ksh[:\s]*(\d+[\.,]\d{2})',
-                r'kes[:\s]*(\d+[\.,]\d{2})',
-                r'(\d+[\.,]\d{2})\s*kes',
-                r'total[:\s]*(\d+[\.,]\d{2})'
-            ],
-            'date': [
-                r'\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4}',
-                r'\d{1,2}\s+(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)\s+\d{2,4}',
-                r'\d{4}[\/\-\.]\d{1,2}[\/\-\.]\d{1,2}'
-            ],
-            'phone': [
-                r'(?:\+254|0)[7]\d{8}',
-                r'\d{4}\s*\d{3}\s*\d{3}',
-                r'\d{10}'
-            ],
-            'mpesa_reference': [
-                r'[A-Z]{2}\d{8}[A-Z]{2}',
-                r'mpesa[:\s]*([A-Z0-9]{10})',
-                r'ref[:\s]*([A-Z0-9]+)'
-            ]
-        }
+        # Kenyan receipt patterns, compiled once into a single-pass scanner
+        self.field_extractor = ReceiptFieldExtractor()
     
     async def process_receipt(self, image_path: str) -> OCRResult:
         """
         Process receipt with multiple OCR engines
+        
+        Engines run concurrently; the first sufficient result wins (see run_ocr_engines).
         """
         try:
-            # Phase 2: Advanced preprocessing pipeline
-            processed_image_path = await self.preprocess_image(image_path)
+            start_time = time.time()
             
             # Phase 2: Intelligent multi-engine processing with Gemini
-            ocr_results = []
-            
-            # 1. Gemini Vision OCR (if available and enabled) - Most advanced
-            gemini_result = None
-            if self.use_gemini_ocr and self.gemini_ocr:
-                try:
-                    gemini_result = await self.gemini_ocr_advanced(image_path)  # Use original image for Gemini
-                    ocr_results.append(gemini_result)
-                    logger.info(f"Gemini OCR confidence: {gemini_result.confidence_score:.2%}")
-                except Exception as e:
-                    logger.warning(f"Gemini OCR failed, falling back to traditional OCR: {e}")
-            
-            # 2. Primary: Tesseract OCR with receipt-optimized config
-            tesseract_result = await self.tesseract_ocr_advanced(processed_image_path)
-            ocr_results.append(tesseract_result)
-            
-            # 3. Secondary: EasyOCR (if confidence is still low)
-            best_confidence = max(r.confidence_score for r in ocr_results) if ocr_results else 0
-            if self.multi_engine_enabled and self.easyocr_reader and best_confidence < self.confidence_threshold:
-                easyocr_result = await self.easyocr_ocr_advanced(processed_image_path)
-                ocr_results.append(easyocr_result)
+            ocr_results, winner, engine_runs, preprocessing = await self.run_ocr_engines(image_path)
+            
+            if winner:
+                # Early exit: the fastest sufficient engine decides
+                result = ocr_results[winner]
+                final_result = Phase2OCRResult(
+                    text=result.raw_text,
+                    confidence=result.confidence_score,
+                    processing_time=time.time() - start_time,
+                    status=ProcessingStatus.COMPLETED,
+                    engine=winner,
+                    early_exit=True
+                )
+                logger.info(f"OCR early exit: {winner} ({result.confidence_score:.2%}) after {final_result.processing_time:.2f}s")
+            else:
+                # Phase 2: Intelligent result combination (best Tesseract variant only)
+                tesseract_results = [r for name, r in ocr_results.items() if name in self.tesseract_psm_configs]
+                combined = [r for name, r in ocr_results.items() if name not in self.tesseract_psm_configs]
+                if tesseract_results:
+                    combined.append(max(tesseract_results, key=lambda r: r.confidence_score))
+                final_result = self.combine_ocr_results_advanced(combined)
+                final_result.processing_time = time.time() - start_time
             
-            # Phase 2: Intelligent result combination
-            final_result = self.combine_ocr_results_advanced(ocr_results)
+            final_result.engine_runs = engine_runs
+            final_result.preprocessing = preprocessing
             
             # Phase 2: Enhanced structured data extraction with Kenyan patterns
             structured_data = self.extract_structured_data_phase2(final_result.text)
@@ -146,51 +147,183 @@ class EnhancedReceiptProcessor:
                 error=str(e)
             )
     
-    async def preprocess_image(self, image_path: str) -> str:
+    def is_sufficient_result(self, result: OCRResult) -> bool:
+        """Whether a single engine's result is good enough to stop the others"""
+        return (
+            bool(result.raw_text.strip())
+            and result.confidence_score >= self.confidence_threshold
+            and self.calculate_receipt_pattern_score(result.raw_text) >= self.min_pattern_score
+        )
+    
+    async def run_ocr_engines(self, image_path: str) -> Tuple[Dict[str, OCRResult], Optional[str], Dict[str, Dict[str, Any]], Optional[Dict[str, Any]]]:
         """
-        Phase 2: Advanced image preprocessing pipeline
+        Race the OCR engines and Tesseract PSM variants
+        
+        The image is decoded once and shared by every stage (shared memory in
+        process mode), without temp files. Gemini starts on the decoded image
+        right away; Tesseract variants and EasyOCR start as soon as
+        preprocessing finishes. The first result that
+        passes is_sufficient_result wins and the remaining engines are cancelled.
+        
+        Args:
+            image_path: Path to the receipt image
+            
+        Returns:
+            (results by engine name, winning engine or None, per-engine run info,
+            preprocessing report or None if Gemini won before it finished)
         """
+        started = time.time()
+        image = await asyncio.to_thread(self.load_image, image_path)
+        frame = self.executor.share(image)
+        preprocess = asyncio.ensure_future(self.preprocess_image(frame))
+        
+        async def on_preprocessed(run, *args):
+            # Shielded: cancelling one engine must not cancel the shared preprocessing
+            processed, _ = await asyncio.shield(preprocess)
+            return await run(processed, *args)
+        
+        tasks = {}
+        
+        # 1. Gemini Vision OCR (if available and enabled) - uses the original image
+        if self.use_gemini_ocr and self.gemini_ocr:
+            tasks[asyncio.ensure_future(self.gemini_ocr_advanced(image_path, image))] = 'gemini'
+        
+        # 2. Tesseract OCR, one task per receipt-optimized config
+        for name, config in self.tesseract_psm_configs.items():
+            tasks[asyncio.ensure_future(on_preprocessed(self.tesseract_ocr_psm, config))] = name
+        
+        # 3. EasyOCR
+        if self.multi_engine_enabled and self.engine_pool.easyocr_available:
+            tasks[asyncio.ensure_future(on_preprocessed(self.easyocr_ocr_advanced))] = 'easyocr'
+        
+        results: Dict[str, OCRResult] = {}
+        engine_runs: Dict[str, Dict[str, Any]] = {}
+        winner = None
+        pending = set(tasks)
         try:
-            # Load image
-            image = cv2.imread(image_path)
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    name = tasks[task]
+                    elapsed = round(time.time() - started, 3)
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        logger.warning(f"OCR engine {name} failed: {e}")
+                        engine_runs[name] = {"status": "failed", "seconds": elapsed, "error": str(e)}
+                        continue
+                    
+                    results[name] = result
+                    engine_runs[name] = {"status": "completed", "seconds": elapsed, "confidence": result.confidence_score}
+                    if self.is_sufficient_result(result) and (
+                        winner is None or result.confidence_score > results[winner].confidence_score
+                    ):
+                        winner = name
+        finally:
+            for task in pending:
+                task.cancel()
+                engine_runs[tasks[task]] = {"status": "cancelled", "seconds": round(time.time() - started, 3)}
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+            if not preprocess.done():
+                preprocess.cancel()
+                await asyncio.gather(preprocess, return_exceptions=True)
+            
+            self.executor.release(frame)
+            preprocessing = None
+            if not preprocess.cancelled() and preprocess.exception() is None:
+                processed, preprocessing = preprocess.result()
+                if processed is not frame:
+                    self.executor.release(processed)
+        
+        return results, winner, engine_runs, preprocessing
+    
+    def load_image(self, image_path: str) -> np.ndarray:
+        """
+        Decode a receipt image once (BGR); every engine works from this buffer
+        """
+        image = cv2.imdecode(np.fromfile(image_path, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError(f"Could not load image: {image_path}")
+        return image
+    
+    async def preprocess_image(self, image):
+        """
+        Phase 2: Advanced image preprocessing pipeline
+        
+        Only the stages the image needs run: a quality check on a downsampled
+        copy picks the plan (see quality.plan_preprocessing).
+        
+        Args:
+            image: Decoded image, or a handle from self.executor.share()
             
-            if image is None:
-                raise ValueError(f"Could not load image: {image_path}")
+        Returns:
+            (preprocessed image, same kind of handle as the input;
+            report with the quality estimates, plan and per-stage timings in ms)
+        """
+        return await self.executor.run("preprocess", self, image)
+    
+    def preprocess_image_sync(self, image: np.ndarray) -> Tuple[np.ndarray, Dict[str, Any]]:
+        """Blocking body of preprocess_image (runs in an OCR worker)"""
+        original = image
+        timings: Dict[str, float] = {}
+        report: Dict[str, Any] = {"quality": None, "plan": None, "timings_ms": timings}
+        
+        def timed(stage, func, *args):
+            started = time.perf_counter()
+            result = func(*args)
+            timings[stage] = round((time.perf_counter() - started) * 1000, 2)
+            return result
+        
+        try:
+            quality = None
+            if self.preprocessing_config.adaptive:
+                quality = timed("assess", assess_image_quality, image)
+                report["quality"] = quality.to_dict()
+            plan = plan_preprocessing(quality, self.preprocessing_config)
+            report["plan"] = plan.to_dict()
+            stages = set(plan.stages)
             
             # Phase 2.1: Perspective correction
-            image = self.correct_perspective(image)
+            if "perspective" in stages:
+                image = timed("perspective", self.correct_perspective, image)
             
             # Phase 2.2: Shadow removal
-            image = self.remove_shadows(image)
+            if "shadows" in stages:
+                image = timed("shadows", self.remove_shadows, image)
             
             # Convert to grayscale
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
             
             # Phase 2.3: Auto-rotate with improved detection
-            gray = self.auto_rotate_image_advanced(gray)
+            if "rotate" in stages:
+                gray = timed("rotate", self.auto_rotate_image_advanced, gray)
             
             # Phase 2.4: Advanced denoising
-            denoised = self.advanced_denoise(gray)
+            if "denoise" in stages:
+                gray = timed("denoise", self.advanced_denoise, gray, not plan.light_denoise)
             
             # Phase 2.5: Multi-stage contrast enhancement
-            enhanced = self.multi_stage_enhance_contrast(denoised)
+            if "contrast" in stages:
+                gray = timed("contrast", self.multi_stage_enhance_contrast, gray)
             
             # Phase 2.6: Adaptive thresholding
-            thresh = self.adaptive_threshold(enhanced)
+            thresh = timed("threshold", self.adaptive_threshold, gray)
             
             # Phase 2.7: Morphological operations for text cleanup
-            cleaned = self.morphological_cleanup(thresh)
-            
-            # Save processed image
-            processed_path = str(Path(image_path).parent / f"processed_phase2_{Path(image_path).name}")
-            cv2.imwrite(processed_path, cleaned)
+            cleaned = timed("morphology", self.morphological_cleanup, thresh)
             
-            logger.info(f"Phase 2 preprocessing completed: {processed_path}")
-            return processed_path
+            report["total_ms"] = round(sum(timings.values()), 2)
+            logger.info(
+                f"Phase 2 preprocessing completed: {cleaned.shape[1]}x{cleaned.shape[0]}, "
+                f"stages={plan.stages} in {report['total_ms']:.0f}ms"
+            )
+            return cleaned, report
             
         except Exception as e:
             logger.warning(f"Image preprocessing failed, using original: {str(e)}")
-            return image_path
+            report["error"] = str(e)
+            return original, report
     
     async def tesseract_ocr(self, image_path: str) -> OCRResult:
         """
@@ -199,22 +332,8 @@ class EnhancedReceiptProcessor:
         try:
             start_time = time.time()
             
-            # Extract text
-            text = pytesseract.image_to_string(
-                Image.open(image_path),
-                config=self.tesseract_config
-            )
-            
-            # Get confidence
-            data = pytesseract.image_to_data(
-                Image.open(image_path),
-                config=self.tesseract_config,
-                output_type=pytesseract.Output.DICT
-            )
-            
-            # Calculate average confidence
-            confidences = [int(conf) for conf in data['conf'] if int(conf) > 0]
-            avg_confidence = sum(confidences) / len(confidences) if confidences else 0
+            # Text and confidence from one Tesseract pass
+            text, avg_confidence = self.read_tesseract(image_path, self.tesseract_config)
             
             processing_time = time.time() - start_time
             
@@ -242,13 +361,14 @@ class EnhancedReceiptProcessor:
         Extract text using EasyOCR
         """
         try:
-            if not self.easyocr_reader:
-                raise Exception("EasyOCR reader not initialized")
-                
             start_time = time.time()
             
-            # Extract text
-            results = self.easyocr_reader.readtext(image_path)
+            async with self.engine_pool.lease_async() as engine:
+                if not engine.easyocr_reader:
+                    raise Exception("EasyOCR reader not initialized")
+                
+                # Extract text
+                results = engine.easyocr_reader.readtext(image_path)
             
             # Combine text and calculate confidence
             text_parts = []
@@ -285,118 +405,129 @@ class EnhancedReceiptProcessor:
     
     # ==================== PHASE 2: ENHANCED OCR METHODS ====================
     
-    async def tesseract_ocr_advanced(self, image_path: str) -> OCRResult:
+    async def tesseract_ocr_advanced(self, image) -> OCRResult:
         """
         Phase 2: Advanced Tesseract OCR with receipt-specific optimizations
         """
         start_time = time.time()
         
-        try:
-            # Phase 2.1: Multiple configuration attempts for receipts
-            configs = [
-                '--oem 3 --psm 6',  # Default for receipts
-                '--oem 3 --psm 4',  # Single text column
-                '--oem 3 --psm 8',  # Single word
-                '--oem 3 --psm 7',  # Single text line
-            ]
-            
-            best_result = None
-            best_confidence = 0
-            
-            for config in configs:
-                try:
-                    # Extract text with current config
-                    text = pytesseract.image_to_string(
-                        Image.open(image_path),
-                        config=config
-                    )
-                    
-                    # Get confidence data
-                    data = pytesseract.image_to_data(
-                        Image.open(image_path),
-                        config=config,
-                        output_type=pytesseract.Output.DICT
-                    )
-                    
-                    # Calculate confidence
-                    confidences = [int(conf) for conf in data['conf'] if int(conf) > 0]
-                    avg_confidence = sum(confidences) / len(confidences) if confidences else 0
-                    
-                    # Keep best result
-                    if avg_confidence > best_confidence:
-                        best_confidence = avg_confidence
-                        best_result = text
-                        
-                except Exception as e:
-                    logger.warning(f"Tesseract config {config} failed: {e}")
-                    continue
-            
-            if best_result is None:
-                raise Exception("All Tesseract configurations failed")
-            
-            processing_time = time.time() - start_time
-            
-            return OCRResult(
-                raw_text=best_result.strip(),
-                confidence_score=best_confidence / 100.0,
-                processing_time=processing_time,
-                preprocessed=True
-            )
-            
-        except Exception as e:
-            logger.error(f"Advanced Tesseract OCR failed: {str(e)}")
+        # Phase 2.1: Multiple configuration attempts for receipts, run concurrently
+        results = await asyncio.gather(
+            *(self.tesseract_ocr_psm(image, config) for config in self.tesseract_psm_configs.values()),
+            return_exceptions=True
+        )
+        
+        # Keep best result
+        scored = [r for r in results if isinstance(r, OCRResult) and r.confidence_score > 0]
+        if not scored:
+            logger.error("Advanced Tesseract OCR failed: All Tesseract configurations failed")
             return OCRResult(
                 raw_text="",
                 confidence_score=0.0,
                 processing_time=time.time() - start_time,
                 preprocessed=True
             )
+        
+        best_result = max(scored, key=lambda r: r.confidence_score)
+        best_result.processing_time = time.time() - start_time
+        return best_result
     
-    async def easyocr_ocr_advanced(self, image_path: str) -> OCRResult:
+    async def tesseract_ocr_psm(self, image, config: str) -> OCRResult:
+        """
+        Tesseract OCR with a single configuration (one page segmentation mode)
+        """
+        return await self.executor.run("tesseract_psm", self, image, config)
+    
+    def tesseract_ocr_psm_sync(self, image: np.ndarray, config: str) -> OCRResult:
+        """Blocking body of tesseract_ocr_psm (runs in an OCR worker)"""
+        start_time = time.time()
+        
+        text, avg_confidence = self.read_tesseract(image, config)
+        
+        return OCRResult(
+            raw_text=text.strip(),
+            confidence_score=avg_confidence / 100.0,
+            processing_time=time.time() - start_time,
+            preprocessed=True
+        )
+    
+    def read_tesseract(self, image, config: str) -> Tuple[str, float]:
+        """
+        Text and average word confidence (0-100) from a single image_to_data call
+        
+        Args:
+            image: Decoded image array (or a file path)
+            config: Tesseract command-line configuration
+        """
+        data = pytesseract.image_to_data(image, config=config, output_type=pytesseract.Output.DICT)
+        
+        # Rebuild the text line by line, in Tesseract's reading order
+        lines: Dict[Tuple[int, int, int], List[str]] = {}
+        confidences = []
+        for i, word in enumerate(data['text']):
+            conf = int(float(data['conf'][i]))
+            if conf > 0:
+                confidences.append(conf)
+            if word.strip():
+                key = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+                lines.setdefault(key, []).append(word)
+        
+        text = '\n'.join(' '.join(words) for words in lines.values())
+        avg_confidence = sum(confidences) / len(confidences) if confidences else 0
+        return text, avg_confidence
+    
+    async def easyocr_ocr_advanced(self, image) -> OCRResult:
         """
         Phase 2: Advanced EasyOCR with receipt optimization
         """
+        return await self.executor.run("easyocr", self, image)
+    
+    def easyocr_ocr_advanced_sync(self, image: np.ndarray) -> OCRResult:
+        """Blocking body of easyocr_ocr_advanced (runs in an OCR worker)"""
         start_time = time.time()
         
         try:
-            if not self.easyocr_reader:
-                raise Exception("EasyOCR not initialized")
-            
             # Phase 2.1: Multi-parameter EasyOCR
             results = []
             
-            # Configuration 1: Standard
-            try:
-                result1 = self.easyocr_reader.readtext(
-                    image_path,
-                    detail=1,
-                    paragraph=False,
-                    width_ths=0.7,
-                    height_ths=0.7
-                )
-                results.append(("standard", result1))
+            with self.engine_pool.lease() as engine:
+                reader = engine.easyocr_reader
+                if not reader:
+                    raise Exception("EasyOCR not initialized")
                 
-            except Exception as e:
-                logger.warning(f"EasyOCR standard config failed: {e}")
-            
-            # Configuration 2: Receipt optimized
-            try:
-                result2 = self.easyocr_reader.readtext(
-                    image_path,
-                    detail=1,
-                    paragraph=True,
-                    width_ths=0.5,
-                    height_ths=0.5,
-                    x_ths=0.1,
-                    y_ths=0.1
-                )
-                results.append(("receipt_optimized", result2))
+                # Configuration 1: Standard
+                try:
+                    result1 = reader.readtext(
+                        image,
+                        detail=1,
+                        paragraph=False,
+                        width_ths=0.7,
+                        height_ths=0.7
+                    )
+                    results.append(("standard", result1))
                 
-            except Exception as e:
-                logger.warning(f"EasyOCR receipt config failed: {e}")
-            
-            if not results:
-                raise Exception("All EasyOCR configurations failed")
+                except Exception as e:
+                    logger.warning(f"EasyOCR standard config failed: {e}")
+                
+                # Configuration 2: Receipt optimized
+                try:
+                    result2 = reader.readtext(
+                        image,
+                        detail=1,
+                        paragraph=True,
+                        width_ths=0.5,
+                        height_ths=0.5,
+                        x_ths=0.1,
+                        y_ths=0.1
+                    )
+                    results.append(("receipt_optimized", result2))
+                
+                except Exception as e:
+                    logger.warning(f"EasyOCR receipt config failed: {e}")
+                
+                if not results:
+                    # Counts against the engine, so a broken reader gets recycled
+                    raise Exception("All EasyOCR configurations failed")
             
             # Phase 2.2: Choose best result based on confidence and text length
             best_config = None
@@ -442,9 +573,13 @@ class EnhancedReceiptProcessor:
                 preprocessed=True
             )
     
-    async def gemini_ocr_advanced(self, image_path: str) -> OCRResult:
+    async def gemini_ocr_advanced(self, image_path: str, image: Optional[np.ndarray] = None) -> OCRResult:
         """
         Phase 2: Advanced Gemini Vision OCR with structured data extraction
+        
+        Args:
+            image_path: Path to the receipt image
+            image: Already decoded image (BGR); avoids reading the file again
         """
         start_time = time.time()
         
@@ -452,8 +587,14 @@ class EnhancedReceiptProcessor:
             if not self.gemini_ocr:
                 raise Exception("Gemini OCR not available")
             
+            pil_image = None
+            if image is not None:
+                pil_image = await asyncio.to_thread(
+                    lambda: Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+                )
+            
             # Use Gemini's comprehensive analysis (text + structured data)
-            result = await self.gemini_ocr.comprehensive_analysis(image_path)
+            result = await self.gemini_ocr.comprehensive_analysis(image_path, image=pil_image)
             
             processing_time = time.time() - start_time
             
@@ -607,40 +748,7 @@ class EnhancedReceiptProcessor:
     
     def calculate_receipt_pattern_score(self, text: str) -> float:
         """Calculate how well text matches receipt patterns"""
-        score = 0.0
-        text_lower = text.lower()
-        
-        # Check for currency patterns
-        for pattern in self.patterns['currency']:
-            if re.search(pattern, text_lower):
-                score += 0.2
-                break
-        
-        # Check for date patterns
-        for pattern in self.patterns['date']:
-            if re.search(pattern, text_lower):
-                score += 0.2
-                break
-        
-        # Check for common Kenyan vendors
-        for vendor in self.patterns.get('common_vendors', []):
-            if vendor in text_lower:
-                score += 0.3
-                break
-        
-        # Check for business registration patterns
-        for pattern in self.patterns.get('tax_numbers', []):
-            if re.search(pattern, text_lower):
-                score += 0.15
-                break
-        
-        # Check for transaction references
-        for pattern in self.patterns.get('mpesa', []):
-            if re.search(pattern, text_lower):
-                score += 0.15
-                break
-        
-        return min(score, 1.0)  # Cap at 1.0
+        return min(self.field_extractor.extract(text).pattern_score, 1.0)  # Cap at 1.0
     
     def merge_complementary_text(self, results: List[OCRResult], primary_result: OCRResult) -> str:
         """Merge unique information from multiple OCR results"""
@@ -693,88 +801,11 @@ class EnhancedReceiptProcessor:
     def extract_structured_data_phase2(self, text: str) -> Dict[str, any]:
         """
         Phase 2: Enhanced structured data extraction with Kenyan patterns
-        """
-        structured_data = self.extract_structured_data(text)  # Start with basic extraction
-        
-        # Phase 2.1: Enhanced Kenyan business patterns
-        enhanced_patterns = {
-            'vendor_name': [
-                r'(?:^|\n)([A-Z][A-Z\s&.,-]{2,30}?)(?:\n|$)',  # Capitalized business names
-                r'(?:business|company|ltd|limited|shop)[:\s]*([^\n\r]+)',
-            ],
-            'kra_pin': [
-                r'pin[:\s]*([a-z]\d{9}[a-z])',
-                r'kra[:\s]*pin[:\s]*([a-z]\d{9}[a-z])',
-                r'tax[:\s]*pin[:\s]*([a-z]\d{9}[a-z])',
-            ],
-            'vat_number': [
-                r'vat[:\s]*no[:\s]*(\d{10})',
-                r'vat[:\s]*(\d{10})',
-            ],
-            'mpesa_reference': [
-                r'mpesa[:\s]*(?:ref|reference|code)[:\s]*([a-z0-9]{8,12})',
-                r'transaction[:\s]*(?:ref|reference|id)[:\s]*([a-z0-9]{8,12})',
-                r'ref[:\s]*no[:\s]*([a-z0-9]{8,12})',
-            ],
-            'phone_mpesa': [
-                r'(?:from|to)[:\s]*(\d{10})',
-                r'(?:07\d{8}|01\d{8}|\+254\d{9})',
-            ],
-            'till_number': [
-                r'till[:\s]*(?:no|number)[:\s]*(\d{5,7})',
-                r'paybill[:\s]*(\d{5,7})',
-            ]
-        }
-        
-        # Extract enhanced patterns
-        for key, patterns in enhanced_patterns.items():
-            if key not in structured_data or not structured_data[key]:
-                for pattern in patterns:
-                    matches = re.findall(pattern, text, re.IGNORECASE | re.MULTILINE)
-                    if matches:
-                        structured_data[key] = matches[0] if isinstance(matches[0], str) else matches[0][0]
-                        break
-        
-        # Phase 2.2: Enhanced amount extraction with Kenyan currency
-        amount_patterns = [
-            r'total[:\s]*(?:ksh|kes)[:\s]*(\d+[\.,]\d{2})',
-            r'total[:\s]*(\d+[\.,]\d{2})',
-            r'amount[:\s]*(?:ksh|kes)[:\s]*(\d+[\.,]\d{2})', 
-            r'(?:ksh|kes)[:\s]*(\d+[\.,]\d{2})',
-            r'(\d+[\.,]\d{2})[:\s]*(?:ksh|kes)',
-        ]
-        
-        for pattern in amount_patterns:
-            matches = re.findall(pattern, text.lower())
-            if matches:
-                # Convert to float and find the largest amount (likely total)
-                amounts = []
-                for match in matches:
-                    try:
-                        amount = float(match.replace(',', ''))
-                        amounts.append(amount)
-                    except ValueError:
-                        continue
-                
-                if amounts:
-                    structured_data['total_amount'] = max(amounts)
-                    structured_data['currency'] = 'KES'
-                    break
         
-        # Phase 2.3: Date extraction with Kenyan formats
-        date_patterns = [
-            r'(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})',
-            r'(\d{1,2}\s+(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)\s+\d{2,4})',
-            r'date[:\s]*(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})',
-        ]
-        
-        for pattern in date_patterns:
-            matches = re.findall(pattern, text.lower())
-            if matches:
-                structured_data['transaction_date'] = matches[0]
-                break
-        
-        return structured_data
+        Amounts, total (with VAT and subtotal), dates, phones, M-Pesa references,
+        KRA PIN, VAT and till numbers and the vendor name, from one pass over the text.
+        """
+        return self.field_extractor.extract(text).to_dict()
     
     def validate_and_score_result(self, result: OCRResult) -> OCRResult:
         """
@@ -836,69 +867,23 @@ class EnhancedReceiptProcessor:
         """
         Extract structured data from OCR text
         """
-        data = {}
-        
-        # Extract amounts
-        amounts = self.extract_amounts(text)
-        if amounts:
-            data['amounts'] = amounts
-            data['total_amount'] = max(amounts)  # Assume highest is total
-        
-        # Extract dates
-        dates = self.extract_dates(text)
-        if dates:
-            data['dates'] = dates
-        
-        # Extract phone numbers
-        phones = self.extract_phones(text)
-        if phones:
-            data['phone_numbers'] = phones
-        
-        # Extract M-Pesa references
-        mpesa_refs = self.extract_mpesa_references(text)
-        if mpesa_refs:
-            data['mpesa_references'] = mpesa_refs
-        
-        return data
+        return self.field_extractor.extract(text).basic_data()
     
     def extract_amounts(self, text: str) -> List[float]:
         """Extract monetary amounts from text"""
-        amounts = []
-        for pattern in self.patterns['currency']:
-            matches = re.findall(pattern, text.lower())
-            for match in matches:
-                try:
-                    # Clean and convert amount
-                    amount_str = match.replace(',', '.')
-                    amount = float(amount_str)
-                    amounts.append(amount)
-                except ValueError:
-                    continue
-        return list(set(amounts))  # Remove duplicates
+        return self.field_extractor.extract(text).amounts
     
     def extract_dates(self, text: str) -> List[str]:
         """Extract dates from text"""
-        dates = []
-        for pattern in self.patterns['date']:
-            matches = re.findall(pattern, text)
-            dates.extend(matches)
-        return list(set(dates))
+        return self.field_extractor.extract(text).dates
     
     def extract_phones(self, text: str) -> List[str]:
         """Extract phone numbers from text"""
-        phones = []
-        for pattern in self.patterns['phone']:
-            matches = re.findall(pattern, text)
-            phones.extend(matches)
-        return list(set(phones))
+        return self.field_extractor.extract(text).phone_numbers
     
     def extract_mpesa_references(self, text: str) -> List[str]:
         """Extract M-Pesa reference numbers"""
-        refs = []
-        for pattern in self.patterns['mpesa_reference']:
-            matches = re.findall(pattern, text.upper())
-            refs.extend(matches)
-        return list(set(refs))
+        return self.field_extractor.extract(text).mpesa_references
     
     def auto_rotate_image(self, image: np.ndarray) -> np.ndarray:
         """
@@ -939,7 +924,12 @@ class EnhancedReceiptProcessor:
             contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
             
             # Find the largest rectangular contour
+            min_area = 0.25 * gray.shape[0] * gray.shape[1]
             for contour in sorted(contours, key=cv2.contourArea, reverse=True):
+                # Smaller quadrilaterals are boxes or table cells on the receipt, not its outline
+                if cv2.contourArea(contour) < min_area:
+                    break
+                
                 epsilon = 0.02 * cv2.arcLength(contour, True)
                 approx = cv2.approxPolyDP(contour, epsilon, True)
                 
@@ -1068,13 +1058,20 @@ class EnhancedReceiptProcessor:
         rotated = cv2.warpAffine(image, matrix, (w, h), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
         return rotated
     
-    def advanced_denoise(self, image: np.ndarray) -> np.ndarray:
+    def advanced_denoise(self, image: np.ndarray, smooth: bool = True) -> np.ndarray:
         """
         Phase 2.4: Multi-stage denoising
+        
+        Args:
+            image: Grayscale image
+            smooth: Also run the bilateral and Gaussian passes (skipped for
+                images that are already blurry)
         """
         try:
             # Stage 1: Non-local means denoising
             denoised = cv2.fastNlMeansDenoising(image, h=10, templateWindowSize=7, searchWindowSize=21)
+            if not smooth:
+                return denoised
             
             # Stage 2: Bilateral filter for edge preservation
             bilateral = cv2.bilateralFilter(denoised, 9, 75, 75)
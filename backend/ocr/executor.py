@@ -0,0 +1,435 @@
+"""
+OCR execution backend
+
+OpenCV preprocessing, Tesseract and EasyOCR are CPU-bound and hold the GIL for
+long stretches, so running them inside the API's event loop stalls every other
+request in the worker. The executor runs those stages in a pool of OCR worker
+processes and lets callers await them. Pending work is bounded: when every
+slot is taken, callers wait up to a queue timeout and are then rejected
+instead of piling up unbounded work behind a slow pool.
+
+Modes (OCR_EXECUTOR_MODE):
+    process  - spawned worker processes, each with its own warm OCR engines
+    thread   - a thread pool (keeps the loop responsive only while the OCR
+               libraries release the GIL); used by Celery workers, which are
+               already separate (daemonic) processes and cannot start children
+    inline   - run on the caller's thread (OCR worker processes themselves)
+"""
+import os
+import time
+import pickle
+import asyncio
+import logging
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Any, Optional
+
+import numpy as np
+
+logger = logging.getLogger("financial-agent.ocr.executor")
+
+EXECUTOR_MODES = ("process", "thread", "inline")
+
+# Stage name -> EnhancedReceiptProcessor method run in the worker
+STAGES = {
+    "preprocess": "preprocess_image_sync",
+    "tesseract_psm": "tesseract_ocr_psm_sync",
+    "easyocr": "easyocr_ocr_advanced_sync",
+}
+
+
+class OCRExecutorBusy(Exception):
+    """Raised when the OCR queue stayed full for the whole queue timeout"""
+
+
+class OCRStageError(Exception):
+    """Stage failure re-raised from a worker whose original exception cannot be pickled"""
+
+
+class OCRExecutorConfig:
+    """OCR execution backend configuration"""
+
+    def __init__(self):
+        self.mode = os.environ.get("OCR_EXECUTOR_MODE", "process").lower()
+        if self.mode not in EXECUTOR_MODES:
+            logger.warning(f"Unknown OCR_EXECUTOR_MODE '{self.mode}', using 'process'")
+            self.mode = "process"
+        # Leave one core to the API process by default
+        default_workers = max(1, (os.cpu_count() or 2) - 1)
+        self.workers = max(1, int(os.environ.get("OCR_EXECUTOR_WORKERS", str(default_workers))))
+        # Stages allowed to wait for a worker on top of the ones running
+        self.max_queue = max(0, int(os.environ.get("OCR_EXECUTOR_MAX_QUEUE", str(self.workers * 4))))
+        self.queue_timeout = float(os.environ.get("OCR_EXECUTOR_QUEUE_TIMEOUT", "30"))
+        # spawn avoids forking a process that already runs threads and an event loop
+        self.start_method = os.environ.get("OCR_EXECUTOR_START_METHOD", "spawn")
+
+    @property
+    def max_pending(self) -> int:
+        return self.workers + self.max_queue
+
+
+class SharedImage:
+    """
+    Decoded image in shared memory, passed to OCR worker processes by name
+
+    Pickles to (name, shape, dtype) only, so handing a receipt image to several
+    stages costs no copies or decodes. Whoever holds the handle last calls
+    unlink(); worker processes only attach and close.
+    """
+
+    def __init__(self, name: str, shape, dtype):
+        self.name = name
+        self.shape = tuple(shape)
+        self.dtype = str(dtype)
+        self._shm: Optional[shared_memory.SharedMemory] = None
+
+    @classmethod
+    def create(cls, array: np.ndarray) -> "SharedImage":
+        shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+        view = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+        view[...] = array
+        del view
+        handle = cls(shm.name, array.shape, array.dtype)
+        handle._shm = shm
+        return handle
+
+    def attach(self) -> np.ndarray:
+        """Zero-copy array view of the shared image"""
+        if self._shm is None:
+            self._shm = shared_memory.SharedMemory(name=self.name)
+        return np.ndarray(self.shape, dtype=self.dtype, buffer=self._shm.buf)
+
+    def close(self):
+        if self._shm is not None:
+            try:
+                self._shm.close()
+            except BufferError:
+                # An array view is still alive; the mapping goes away with it
+                pass
+            self._shm = None
+
+    def unlink(self):
+        """Free the shared segment (mappings already attached stay valid)"""
+        try:
+            if self._shm is None:
+                self._shm = shared_memory.SharedMemory(name=self.name)
+            self._shm.unlink()
+        except FileNotFoundError:
+            pass
+        self.close()
+
+    def __getstate__(self):
+        return {"name": self.name, "shape": self.shape, "dtype": self.dtype}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._shm = None
+
+
+# ==================== WORKER PROCESS SIDE ====================
+
+_worker_processor = None
+
+
+def _get_worker_processor():
+    """Receipt processor owned by this OCR worker process"""
+    global _worker_processor
+    if _worker_processor is None:
+        from .enhanced_processor import EnhancedReceiptProcessor
+        # Gemini calls are network-bound and stay in the parent's event loop
+        _worker_processor = EnhancedReceiptProcessor(enable_gemini=False, executor=OCRExecutor.inline())
+    return _worker_processor
+
+
+def _init_worker(warmup: bool):
+    """Process pool initializer: load OCR models before the first stage arrives"""
+    processor = _get_worker_processor()
+    if warmup:
+        try:
+            processor.engine_pool.warm()
+        except Exception as e:
+            logger.error(f"OCR worker warm-up failed: {str(e)}")
+
+
+def _run_stage(stage: str, *args):
+    handles = [arg for arg in args if isinstance(arg, SharedImage)]
+    resolved = [arg.attach() if isinstance(arg, SharedImage) else arg for arg in args]
+    try:
+        result = getattr(_get_worker_processor(), STAGES[stage])(*resolved)
+    except Exception as e:
+        # An exception the parent cannot unpickle (e.g. pytesseract's
+        # TesseractNotFoundError) would mark the whole pool as broken
+        try:
+            pickle.loads(pickle.dumps(e))
+        except Exception:
+            raise OCRStageError(f"{type(e).__name__}: {e}") from None
+        raise
+    finally:
+        del resolved
+        for handle in handles:
+            handle.close()
+
+    if isinstance(result, tuple):
+        return tuple(_share_result(item) for item in result)
+    return _share_result(result)
+
+
+def _share_result(result):
+    if isinstance(result, np.ndarray):
+        # Images produced by a stage (preprocessing) go back as shared memory too
+        shared = SharedImage.create(result)
+        shared.close()
+        return shared
+    return result
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+# ==================== PARENT SIDE ====================
+
+class OCRExecutor:
+    """Runs CPU-bound OCR stages off the event loop with bounded queueing"""
+
+    def __init__(self, config: Optional[OCRExecutorConfig] = None):
+        """
+        Args:
+            config: Executor configuration (defaults to environment settings)
+        """
+        self.config = config or OCRExecutorConfig()
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        # Shared across event loops (Celery creates one per task), so not an asyncio.Semaphore
+        self._slots = threading.BoundedSemaphore(self.config.max_pending)
+        self._pending = 0
+        self.stats = {
+            "submitted": 0, "completed": 0, "failed": 0, "cancelled": 0, "rejected": 0,
+            "queued": 0, "queue_wait_seconds": 0.0, "max_queue_wait_seconds": 0.0,
+            "pool_restarts": 0,
+        }
+        self.stage_stats: Dict[str, Dict[str, float]] = {}
+
+    @classmethod
+    def inline(cls) -> "OCRExecutor":
+        """Executor that runs stages directly on the caller's thread"""
+        config = OCRExecutorConfig()
+        config.mode = "inline"
+        return cls(config)
+
+    @property
+    def mode(self) -> str:
+        return self.config.mode
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    if self.mode == "process":
+                        from .engine_pool import OCREnginePoolConfig
+                        self._pool = ProcessPoolExecutor(
+                            max_workers=self.config.workers,
+                            mp_context=multiprocessing.get_context(self.config.start_method),
+                            initializer=_init_worker,
+                            initargs=(OCREnginePoolConfig().warmup,)
+                        )
+                    else:
+                        self._pool = ThreadPoolExecutor(
+                            max_workers=self.config.workers,
+                            thread_name_prefix="ocr-stage"
+                        )
+                    logger.info(f"OCR executor started: {self.config.workers} {self.mode} worker(s)")
+        return self._pool
+
+    def _reset_pool(self, pool):
+        with self._pool_lock:
+            if self._pool is pool:
+                self._pool = None
+                self.stats["pool_restarts"] += 1
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    async def _acquire_slot(self):
+        if self._slots.acquire(blocking=False):
+            return
+        # Queue is full: wait for a slot off the loop, then give up
+        self.stats["queued"] += 1
+        started = time.time()
+        waiter = asyncio.get_running_loop().run_in_executor(
+            None, self._slots.acquire, True, self.config.queue_timeout
+        )
+        try:
+            acquired = await asyncio.shield(waiter)
+        except asyncio.CancelledError:
+            # The waiting thread may still get a slot; hand it straight back
+            waiter.add_done_callback(
+                lambda f: self._slots.release() if not f.cancelled() and f.exception() is None and f.result() else None
+            )
+            raise
+        waited = time.time() - started
+        self.stats["queue_wait_seconds"] += waited
+        self.stats["max_queue_wait_seconds"] = max(self.stats["max_queue_wait_seconds"], waited)
+        if not acquired:
+            self.stats["rejected"] += 1
+            raise OCRExecutorBusy(
+                f"OCR queue full ({self.config.max_pending} pending) for {self.config.queue_timeout:.0f}s"
+            )
+
+    def _record_stage(self, stage: str, seconds: float, outcome: str):
+        """Count a finished stage (outcome: completed, failed or cancelled)"""
+        stats = self.stage_stats.setdefault(
+            stage, {"runs": 0, "failures": 0, "cancelled": 0, "total_seconds": 0.0, "max_seconds": 0.0}
+        )
+        stats["runs"] += 1
+        stats["total_seconds"] += seconds
+        stats["max_seconds"] = max(stats["max_seconds"], seconds)
+        if outcome == "failed":
+            stats["failures"] += 1
+        elif outcome == "cancelled":
+            stats["cancelled"] += 1
+        self.stats[outcome] += 1
+
+    async def run(self, stage: str, processor, *args):
+        """
+        Run an OCR stage and await its result
+
+        Args:
+            stage: Stage name (key of STAGES)
+            processor: EnhancedReceiptProcessor whose method runs in inline/thread
+                mode (process mode uses the worker's own processor)
+            *args: Picklable stage arguments (images as handles from share())
+
+        Returns:
+            The stage method's return value
+        """
+        method = STAGES[stage]
+        self.stats["submitted"] += 1
+
+        if self.mode == "inline":
+            started = time.time()
+            try:
+                result = getattr(processor, method)(*args)
+            except Exception:
+                self._record_stage(stage, time.time() - started, "failed")
+                raise
+            self._record_stage(stage, time.time() - started, "completed")
+            return result
+
+        await self._acquire_slot()
+        self._pending += 1
+        started = time.time()
+        try:
+            pool = self._get_pool()
+            if self.mode == "process":
+                future = pool.submit(_run_stage, stage, *args)
+            else:
+                future = pool.submit(getattr(processor, method), *args)
+        except Exception:
+            self._finish(stage, started, "failed")
+            raise
+
+        try:
+            result = await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # A stage already running in a worker cannot be interrupted; it keeps
+            # its slot until it finishes so the queue bound stays honest
+            def abandoned(f):
+                self._finish(stage, started, "cancelled")
+                self._release_result(f)
+            future.add_done_callback(abandoned)
+            raise
+        except BrokenProcessPool:
+            # A worker died (OOM, native crash); start a fresh pool for the next stage
+            logger.error(f"OCR worker process died during '{stage}', restarting pool")
+            self._reset_pool(pool)
+            self._finish(stage, started, "failed")
+            raise
+        except Exception:
+            self._finish(stage, started, "failed")
+            raise
+        self._finish(stage, started, "completed")
+        return result
+
+    def _finish(self, stage: str, started: float, outcome: str):
+        self._pending -= 1
+        self._slots.release()
+        self._record_stage(stage, time.time() - started, outcome)
+
+    def share(self, image: np.ndarray):
+        """
+        Handle for passing a decoded image to several stages
+
+        Process mode copies it once into shared memory; other modes pass the
+        array itself. Release the handle with release() when the receipt is done.
+        """
+        if self.mode == "process":
+            return SharedImage.create(image)
+        return image
+
+    def release(self, handle):
+        """Free an image handle returned by share() or by a stage"""
+        if isinstance(handle, SharedImage):
+            handle.unlink()
+
+    def _release_result(self, future) -> None:
+        """Free shared images returned by a stage nobody is waiting for any more"""
+        if future.cancelled() or future.exception() is not None:
+            return
+        result = future.result()
+        for item in result if isinstance(result, tuple) else (result,):
+            self.release(item)
+
+    def warm(self):
+        """Start the workers and load their OCR models (call at API start)"""
+        if self.mode == "process":
+            pool = self._get_pool()
+            pids = {f.result() for f in [pool.submit(_ping) for _ in range(self.config.workers)]}
+            logger.info(f"OCR executor warm: {len(pids)} worker process(es)")
+        else:
+            from .engine_pool import get_engine_pool
+            get_engine_pool().warm()
+
+    def shutdown(self):
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Queue depth, rejections and per-stage timings"""
+        return {
+            "mode": self.mode,
+            "workers": self.config.workers,
+            "max_pending": self.config.max_pending,
+            "pending": self._pending,
+            "started": self._pool is not None,
+            **self.stats,
+            "stages": {
+                stage: {
+                    **stats,
+                    "average_seconds": round(stats["total_seconds"] / stats["runs"], 3) if stats["runs"] else 0.0,
+                }
+                for stage, stats in self.stage_stats.items()
+            },
+        }
+
+
+_executor: Optional[OCRExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_ocr_executor() -> OCRExecutor:
+    """The OCR executor of the current process"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                config = OCRExecutorConfig()
+                if config.mode == "process" and multiprocessing.current_process().daemon:
+                    # Celery prefork children are daemonic and may not start processes;
+                    # threads still let Tesseract (a subprocess) and EasyOCR overlap
+                    config.mode = "thread"
+                _executor = OCRExecutor(config)
+    return _executor
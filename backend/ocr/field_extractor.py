@@ -0,0 +1,271 @@
+"""
+Receipt field extraction
+
+Pulls amounts, totals, VAT, dates, phone numbers, M-Pesa references, KRA PIN,
+VAT/till numbers and the vendor name out of OCR text. All Kenyan receipt
+patterns are compiled once, at import, into a single scanner that runs over
+the lower-cased text once; every match is classified by its named groups, so
+the text is scanned once instead of once per pattern and field.
+
+Engines such as EasyOCR often put a label and its value on separate lines
+("TOTAL" / "928.00"). Separators between a label and its value may include
+line breaks, so such pairs are still read as one field.
+
+Where a field has several candidate patterns, the old extraction order is
+kept: the best pattern that matches anywhere wins (e.g. "TOTAL KSH 928.00"
+beats "KSH 950.00"), then the largest amount or the first occurrence.
+"""
+import re
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Optional, Tuple
+
+_MONTHS = r'(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?'
+_RATE = r'(?:\s*\(?\d{1,2}(?:\.\d+)?\s*%\)?)?'
+
+# Runs on the lower-cased text. Matches only start where a word (or a "+")
+# starts, so positions inside and after words are rejected by one check.
+# Alternatives are tried left to right: keyed fields first, then dates and
+# phone numbers, then amounts (which would otherwise swallow "11.10" of
+# "11.10.2025"). Only amounts with a label or a currency are matched; bare
+# item prices never reach Python.
+RECEIPT_SCANNER = re.compile(
+    r"""
+    (?<![a-z0-9_])(?=[a-z0-9+])
+    (?:
+      pin\b[:\s]*(?P<kra_pin>[a-z]\d{9}[a-z])\b
+    | vat\b\.?[:\s]*(?P<vat_no>no\b\.?[:\s]*)?(?P<vat_number>\d{10})\b
+    | (?:till[:\s]*(?:no|number)\b\.?|paybill\b)[:\s]*(?P<till_number>\d{5,7})\b
+    | (?P<ref_kind>m-?pesa|transaction)\b[:\s]*
+        (?:(?P<ref_label>ref(?:erence)?|code|id)\b\.?[:\s]*(?:no\b\.?[:\s]*)?)?
+        (?P<kind_ref>(?=[a-z]*\d)[a-z0-9]{8,12})\b
+    | ref(?:erence)?\b\.?[:\s]*(?P<ref_no>no\b\.?[:\s]*)?(?P<ref>(?=[a-z]*\d)[a-z0-9]{4,20})\b
+    | (?P<mpesa_code>[a-z]{2}\d{8}[a-z]{2})\b
+    | (?P<date>
+          \d{4}[/\-.]\d{1,2}[/\-.]\d{1,2}
+        | \d{1,2}[/\-.]\d{1,2}[/\-.]\d{2,4}
+        | \d{1,2}[ \t]+""" + _MONTHS + r"""[ \t]+\d{2,4}
+      )(?!\d)
+    | (?:(?P<phone_dir>from|to)\b[:\s]*)?(?<![\d.,])(?P<phone>\+254\d{9}|\d{4}[ ]?\d{3}[ ]?\d{3})(?![\d.,])
+    | (?:
+          (?P<label>sub\s*-?\s*total|total(?:\s+(?:amount|due|payable|paid))?|amount|vat|tax)\b
+          """ + _RATE + r"""[:\s]*
+        | (?=(?:ksh|kes)\.?[:\s]*\d)
+        | (?=[\d,.]+[:\s]*(?:ksh|kes))
+      )
+      (?:(?P<cur>ksh|kes)\.?[:\s]*(?=\d))?
+      (?P<amount>\d{1,3}(?:,\d{3})+\.\d{2}|\d+[.,]\d{2})(?!\d)
+      (?:(?=[:\s]*(?P<cur_after>ksh|kes))|)
+    )
+    """,
+    re.VERBOSE
+)
+
+# First line that is only a name, else the first line naming a business
+VENDOR_LINE = re.compile(r"^[ \t]*([a-z][a-z \t&.,'-]{2,30}?)[ \t\r]*$", re.IGNORECASE | re.MULTILINE)
+BUSINESS_LINE = re.compile(
+    r'^[ \t]*([^\n]*?\b(?:business|company|ltd|limited|shop)\b[^\n]*?)[ \t\r]*$',
+    re.IGNORECASE | re.MULTILINE
+)
+
+# total_amount candidates, best first
+TOTAL_WITH_CURRENCY, TOTAL, AMOUNT_WITH_CURRENCY, CURRENCY_BEFORE, CURRENCY_AFTER = range(5)
+
+
+def parse_amount(value: str) -> float:
+    """"1,250.00" -> 1250.0, "928,50" (decimal comma) -> 928.5"""
+    if '.' in value:
+        return float(value.replace(',', ''))
+    return float(value.replace(',', '.'))
+
+
+def _append_unique(values: List, value) -> None:
+    if value not in values:
+        values.append(value)
+
+
+@dataclass
+class ReceiptFields:
+    """Fields found in one receipt text"""
+    amounts: List[float] = field(default_factory=list)
+    total_candidates: Dict[int, List[float]] = field(default_factory=dict)
+    subtotal: Optional[float] = None
+    tax_amount: Optional[float] = None
+    dates: List[str] = field(default_factory=list)
+    numeric_dates: List[str] = field(default_factory=list)
+    named_dates: List[str] = field(default_factory=list)
+    phone_numbers: List[str] = field(default_factory=list)
+    mpesa_references: List[str] = field(default_factory=list)
+    kra_pin: Optional[str] = None
+    vat_number: Optional[str] = None
+    till_number: Optional[str] = None
+    vendor_name: Optional[str] = None
+    # (priority, value) of the best candidate so far
+    mpesa_reference_candidate: Optional[Tuple[int, str]] = None
+    phone_mpesa_candidate: Optional[Tuple[int, str]] = None
+    vat_number_priority: int = 2
+
+    @property
+    def total_amount(self) -> Optional[float]:
+        if self.total_candidates:
+            return max(self.total_candidates[min(self.total_candidates)])
+        return max(self.amounts) if self.amounts else None
+
+    @property
+    def transaction_date(self) -> Optional[str]:
+        dates = self.numeric_dates or self.named_dates
+        return dates[0] if dates else None
+
+    @property
+    def mpesa_reference(self) -> Optional[str]:
+        return self.mpesa_reference_candidate[1] if self.mpesa_reference_candidate else None
+
+    @property
+    def phone_mpesa(self) -> Optional[str]:
+        return self.phone_mpesa_candidate[1] if self.phone_mpesa_candidate else None
+
+    @property
+    def pattern_score(self) -> float:
+        """Receipt-likeness: 0.2 for a currency amount plus 0.2 for a date"""
+        return (0.2 if self.amounts else 0.0) + (0.2 if self.dates else 0.0)
+
+    def basic_data(self) -> Dict[str, Any]:
+        """Amounts, dates, phones and M-Pesa references (extract_structured_data)"""
+        data = {}
+        if self.amounts:
+            data['amounts'] = list(self.amounts)
+            data['total_amount'] = max(self.amounts)  # Assume highest is total
+        if self.dates:
+            data['dates'] = list(self.dates)
+        if self.phone_numbers:
+            data['phone_numbers'] = list(self.phone_numbers)
+        if self.mpesa_references:
+            data['mpesa_references'] = list(self.mpesa_references)
+        return data
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Every field found (extract_structured_data_phase2)"""
+        data = self.basic_data()
+        for key in ('vendor_name', 'kra_pin', 'vat_number', 'mpesa_reference', 'phone_mpesa', 'till_number'):
+            value = getattr(self, key)
+            if value:
+                data[key] = value
+        if self.total_candidates:
+            data['total_amount'] = self.total_amount
+            data['currency'] = 'KES'
+        if self.subtotal is not None:
+            data['subtotal'] = self.subtotal
+        if self.tax_amount is not None:
+            data['tax_amount'] = self.tax_amount
+        if self.transaction_date:
+            data['transaction_date'] = self.transaction_date
+        return data
+
+
+class ReceiptFieldExtractor:
+    """Single-pass receipt field extraction over precompiled patterns"""
+
+    def extract(self, text: str) -> ReceiptFields:
+        fields = ReceiptFields()
+        for match in RECEIPT_SCANNER.finditer(text.lower()):
+            self._add_match(fields, match)
+
+        vendor = VENDOR_LINE.search(text) or BUSINESS_LINE.search(text)
+        if vendor:
+            fields.vendor_name = vendor.group(1)
+        return fields
+
+    def _add_match(self, fields: ReceiptFields, match: re.Match) -> None:
+        group = match.group
+
+        if group('amount') is not None:
+            self._add_amount(fields, match)
+        elif group('date') is not None:
+            date = group('date')
+            _append_unique(fields.dates, date)
+            _append_unique(fields.named_dates if ' ' in date else fields.numeric_dates, date)
+        elif group('phone') is not None:
+            phone = group('phone').replace(' ', '')
+            _append_unique(fields.phone_numbers, phone)
+            if group('phone_dir') and len(phone) == 10:
+                self._offer(fields, 'phone_mpesa_candidate', 0, phone)
+            elif phone.startswith(('07', '01', '+254')):
+                self._offer(fields, 'phone_mpesa_candidate', 1, phone)
+        elif group('kind_ref') is not None:
+            reference = group('kind_ref').upper()
+            _append_unique(fields.mpesa_references, reference)
+            label = group('ref_label') or ''
+            if group('ref_kind').replace('-', '') == 'mpesa':
+                if label in ('ref', 'reference', 'code'):
+                    self._offer(fields, 'mpesa_reference_candidate', 0, reference)
+            elif label in ('ref', 'reference', 'id'):
+                self._offer(fields, 'mpesa_reference_candidate', 1, reference)
+        elif group('ref') is not None:
+            reference = group('ref').upper()
+            _append_unique(fields.mpesa_references, reference)
+            if group('ref_no') and 8 <= len(reference) <= 12:
+                self._offer(fields, 'mpesa_reference_candidate', 2, reference)
+        elif group('mpesa_code') is not None:
+            _append_unique(fields.mpesa_references, group('mpesa_code').upper())
+        elif group('kra_pin') is not None:
+            if fields.kra_pin is None:
+                fields.kra_pin = group('kra_pin').upper()
+        elif group('vat_number') is not None:
+            priority = 0 if group('vat_no') else 1
+            if priority < fields.vat_number_priority:
+                fields.vat_number = group('vat_number')
+                fields.vat_number_priority = priority
+        elif group('till_number') is not None:
+            if fields.till_number is None:
+                fields.till_number = group('till_number')
+
+    @staticmethod
+    def _offer(fields: ReceiptFields, attribute: str, priority: int, value: str) -> None:
+        """Keep the first value of the best priority seen"""
+        current = getattr(fields, attribute)
+        if current is None or priority < current[0]:
+            setattr(fields, attribute, (priority, value))
+
+    @staticmethod
+    def _add_amount(fields: ReceiptFields, match: re.Match) -> None:
+        label = match.group('label') or ''
+        has_currency = match.group('cur') is not None
+        currency_after = match.group('cur_after') is not None
+        try:
+            amount = parse_amount(match.group('amount'))
+        except ValueError:
+            return
+
+        if label.startswith('sub'):
+            label = 'subtotal'
+            if fields.subtotal is None:
+                fields.subtotal = amount
+        elif label in ('vat', 'tax'):
+            if fields.tax_amount is None:
+                fields.tax_amount = amount
+        elif label.startswith('total'):
+            label = 'total'
+
+        is_total = label in ('total', 'subtotal')
+        if has_currency or currency_after or is_total:
+            _append_unique(fields.amounts, amount)
+
+        # VAT lines never make the receipt total
+        if label in ('vat', 'tax'):
+            return
+        if is_total:
+            priority = TOTAL_WITH_CURRENCY if has_currency else TOTAL
+        elif has_currency:
+            priority = AMOUNT_WITH_CURRENCY if label == 'amount' else CURRENCY_BEFORE
+        elif currency_after:
+            priority = CURRENCY_AFTER
+        else:
+            return
+        fields.total_candidates.setdefault(priority, []).append(amount)
+
+
+_extractor = ReceiptFieldExtractor()
+
+
+def extract_receipt_fields(text: str) -> ReceiptFields:
+    """Extract receipt fields from OCR text"""
+    return _extractor.extract(text or "")
@@ -118,7 +118,7 @@ class GeminiOCREngine:
             logger.error(f"Gemini connection test failed: {e}")
             return False
     
-    async def extract_text_only(self, image_path: str) -> Dict[str, Any]:
+    async def extract_text_only(self, image_path: str, image: Optional[Image.Image] = None) -> Dict[str, Any]:
         """
         Extract only text using Gemini Vision - equivalent to traditional OCR
         """
@@ -132,13 +132,11 @@ class GeminiOCREngine:
         start_time = time.time()
         
         try:
-            # Load and encode image
-            image = Image.open(image_path)
-            
             # Use Gemini service for OCR
             response = await self.gemini_service.analyze_image(
                 image_path=image_path,
-                prompt=self.ocr_prompt
+                prompt=self.ocr_prompt,
+                image=image
             )
             
             processing_time = time.time() - start_time
@@ -174,7 +172,7 @@ class GeminiOCREngine:
                 "engine": "gemini_vision_ocr"
             }
     
-    async def extract_structured_data(self, image_path: str) -> Dict[str, Any]:
+    async def extract_structured_data(self, image_path: str, image: Optional[Image.Image] = None) -> Dict[str, Any]:
         """
         Extract structured data directly from image using Gemini Vision
         This is more powerful than traditional OCR + parsing
@@ -192,7 +190,8 @@ class GeminiOCREngine:
             # Use Gemini service for structured extraction
             response = await self.gemini_service.analyze_image(
                 image_path=image_path,
-                prompt=self.structured_prompt
+                prompt=self.structured_prompt,
+                image=image
             )
             
             processing_time = time.time() - start_time
@@ -308,16 +307,23 @@ class GeminiOCREngine:
         
         return fallback_data
 
-    async def comprehensive_analysis(self, image_path: str) -> Dict[str, Any]:
+    async def comprehensive_analysis(self, image_path: str, image: Optional[Image.Image] = None) -> Dict[str, Any]:
         """
         Perform both text extraction and structured data extraction
         Returns comprehensive results
+        
+        Args:
+            image_path: Path to the receipt image
+            image: Already decoded image shared by both requests (read from image_path if omitted)
         """
         start_time = time.time()
         
+        if image is None:
+            image = Image.open(image_path)
+        
         # Run both extractions in parallel
-        text_task = asyncio.create_task(self.extract_text_only(image_path))
-        structured_task = asyncio.create_task(self.extract_structured_data(image_path))
+        text_task = asyncio.create_task(self.extract_text_only(image_path, image))
+        structured_task = asyncio.create_task(self.extract_structured_data(image_path, image))
         
         text_result, structured_result = await asyncio.gather(text_task, structured_task)
         
@@ -121,6 +121,10 @@ class Receipt(ReceiptBase):
     processing_status: ProcessingStatus = ProcessingStatus.PENDING
     verification_status: VerificationStatus = VerificationStatus.UNVERIFIED
     
+    # Same or a similar image as an earlier receipt
+    possible_duplicate: bool = False
+    duplicate_of: Optional[str] = None
+    
     # Timestamps
     created_at: datetime = Field(default_factory=datetime.now)
     updated_at: datetime = Field(default_factory=datetime.now)
@@ -193,4 +197,18 @@ class FileUploadResponse(BaseModel):
     file_size: int
     upload_status: str
     message: str
-    processing_status: ProcessingStatus
\ No newline at end of file
+    processing_status: ProcessingStatus
+    possible_duplicate: bool = False
+    duplicate_of: Optional[str] = None
+
+class BatchProcessRequest(BaseModel):
+    """Batch OCR request"""
+    receipt_ids: List[str] = Field(min_length=1)
+    force: bool = False  # Run full OCR even for images with a cached result
+
+class BatchProcessResponse(BaseModel):
+    """Batch OCR accepted; progress follows on the realtime WebSocket"""
+    batch_id: str
+    total: int
+    mode: str
+    message: str
@@ -0,0 +1,275 @@
+"""
+OCR batch progress
+
+Batch OCR fans receipts out over the ocr_processing Celery workers, which run
+in other processes (often on other hosts) than the API that holds the
+dashboard WebSocket connections. Workers therefore publish progress events to
+a Redis channel and the API relays each event to the batch owner's
+connections through the realtime ConnectionManager. Batches run locally in
+the API (OCR_BATCH_MODE=local) send the same events to the ConnectionManager
+directly.
+
+Receipts of one batch finish on different workers in any order, so the
+running counts live in a Redis hash that every worker increments.
+
+Events (sent to WebSocket client_id == user id):
+    ocr_batch_started   - batch accepted, with its receipt count
+    ocr_batch_progress  - one receipt finished (completed or failed)
+    ocr_batch_complete  - every receipt finished, with the batch summary
+"""
+import os
+import json
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Callable, Awaitable
+
+try:
+    import redis
+    import redis.asyncio as redis_asyncio
+except ImportError:
+    redis = None
+    redis_asyncio = None
+
+logger = logging.getLogger("financial-agent.ocr.progress")
+
+BATCH_MODES = ("celery", "local")
+
+
+class OCRBatchConfig:
+    """Batch OCR configuration"""
+
+    def __init__(self):
+        # celery: fan out over ocr_processing workers; local: the API's own OCR executor
+        self.mode = os.environ.get("OCR_BATCH_MODE", "celery").lower()
+        if self.mode not in BATCH_MODES:
+            logger.warning(f"Unknown OCR_BATCH_MODE '{self.mode}', using 'celery'")
+            self.mode = "celery"
+        # Receipts processed at once by a local batch (OCR stages still queue on the executor)
+        self.local_concurrency = max(1, int(os.environ.get("OCR_BATCH_LOCAL_CONCURRENCY", "4")))
+        self.max_receipts = int(os.environ.get("OCR_BATCH_MAX_RECEIPTS", "500"))
+        self.redis_url = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+        self.channel = os.environ.get("OCR_BATCH_PROGRESS_CHANNEL", "ocr:batch_progress")
+        # Counters of batches whose completion callback never ran expire on their own
+        self.state_ttl = int(os.environ.get("OCR_BATCH_STATE_TTL", "86400"))
+
+
+def batch_event(event_type: str, batch_id: str, user_id: str, **fields) -> Dict[str, Any]:
+    """WebSocket message for a batch event"""
+    return {
+        "type": event_type,
+        "batch_id": batch_id,
+        "user_id": user_id,
+        **fields,
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
+
+def receipt_result(receipt_id: str, receipt=None, error: Optional[str] = None) -> Dict[str, Any]:
+    """Per-receipt batch result (JSON-serialisable, returned by Celery tasks)"""
+    if receipt is None:
+        return {
+            'receipt_id': receipt_id,
+            'status': 'failed',
+            'error': error or 'Receipt processing failed'
+        }
+    return {
+        'receipt_id': receipt_id,
+        'status': 'completed',
+        'data': {
+            'vendor': receipt.vendor.name if receipt.vendor and receipt.vendor.name else 'Unknown',
+            'total_amount': receipt.total_amount or 0.0,
+            'date': receipt.transaction_date.isoformat() if receipt.transaction_date else None,
+            'category': receipt.category.value if receipt.category else 'other',
+            'confidence': receipt.classification_confidence or 0.0,
+            'processing_status': receipt.processing_status.value,
+            'possible_duplicate': receipt.possible_duplicate
+        }
+    }
+
+
+def summarize_batch(results: List[Dict[str, Any]]) -> Dict[str, int]:
+    """Counts of a finished batch"""
+    successful = len([r for r in results if r.get('status') == 'completed'])
+    return {
+        'total': len(results),
+        'successful': successful,
+        'failed': len(results) - successful
+    }
+
+
+class BatchProgressPublisher:
+    """
+    Records batch progress in Redis and publishes it (blocking client, Celery workers)
+
+    Progress is best effort: Redis errors are logged and never fail a receipt.
+    """
+
+    def __init__(self, config: Optional[OCRBatchConfig] = None):
+        self.config = config or OCRBatchConfig()
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None and redis is not None:
+            self._client = redis.Redis.from_url(self.config.redis_url, decode_responses=True)
+        return self._client
+
+    @staticmethod
+    def _key(batch_id: str) -> str:
+        return f"ocr:batch:{batch_id}"
+
+    def publish(self, event: Dict[str, Any]) -> None:
+        if self.client is None:
+            return
+        try:
+            self.client.publish(self.config.channel, json.dumps(event, default=str))
+        except Exception as e:
+            logger.warning(f"Failed to publish OCR batch progress: {str(e)}")
+
+    def start(self, batch_id: str, user_id: str, total: int) -> None:
+        """Reset the batch counters and announce the batch"""
+        if self.client is not None:
+            try:
+                key = self._key(batch_id)
+                pipe = self.client.pipeline()
+                pipe.hset(key, mapping={'total': total, 'processed': 0, 'failed': 0})
+                pipe.expire(key, self.config.state_ttl)
+                pipe.execute()
+            except Exception as e:
+                logger.warning(f"Failed to record OCR batch {batch_id}: {str(e)}")
+        self.publish(batch_event("ocr_batch_started", batch_id, user_id, total=total))
+
+    def receipt_done(self, batch_id: str, user_id: str, result: Dict[str, Any]) -> None:
+        """Count a finished receipt and publish the batch's progress"""
+        failed = result.get('status') != 'completed'
+        processed = failed_count = total = None
+        if self.client is not None:
+            try:
+                pipe = self.client.pipeline()
+                key = self._key(batch_id)
+                pipe.hincrby(key, 'processed', 1)
+                pipe.hincrby(key, 'failed', 1 if failed else 0)
+                pipe.hget(key, 'total')
+                processed, failed_count, total = pipe.execute()
+            except Exception as e:
+                logger.warning(f"Failed to count OCR batch {batch_id} progress: {str(e)}")
+        self.publish(batch_event(
+            "ocr_batch_progress", batch_id, user_id,
+            receipt=result,
+            processed=processed,
+            failed=failed_count,
+            total=int(total) if total is not None else None
+        ))
+
+    def finish(self, batch_id: str, user_id: str, summary: Dict[str, int]) -> None:
+        """Publish the batch summary and drop its counters"""
+        self.publish(batch_event("ocr_batch_complete", batch_id, user_id, summary=summary))
+        if self.client is not None:
+            try:
+                self.client.delete(self._key(batch_id))
+            except Exception as e:
+                logger.warning(f"Failed to clear OCR batch {batch_id}: {str(e)}")
+
+
+class LocalBatchProgress:
+    """Batch progress for batches run inside the API: sends events straight to the owner's WebSockets"""
+
+    def __init__(self, batch_id: str, user_id: str, total: int,
+                 send: Callable[[str, Dict[str, Any]], Awaitable[None]]):
+        self.batch_id = batch_id
+        self.user_id = user_id
+        self.total = total
+        self.processed = 0
+        self.failed = 0
+        self._send = send
+
+    async def _publish(self, event: Dict[str, Any]) -> None:
+        try:
+            await self._send(self.user_id, event)
+        except Exception as e:
+            logger.warning(f"Failed to send OCR batch progress: {str(e)}")
+
+    async def start(self) -> None:
+        await self._publish(batch_event("ocr_batch_started", self.batch_id, self.user_id, total=self.total))
+
+    async def receipt_done(self, result: Dict[str, Any]) -> None:
+        self.processed += 1
+        if result.get('status') != 'completed':
+            self.failed += 1
+        await self._publish(batch_event(
+            "ocr_batch_progress", self.batch_id, self.user_id,
+            receipt=result, processed=self.processed, failed=self.failed, total=self.total
+        ))
+
+    async def finish(self, summary: Dict[str, int]) -> None:
+        await self._publish(batch_event("ocr_batch_complete", self.batch_id, self.user_id, summary=summary))
+
+
+class BatchProgressRelay:
+    """Forwards progress events published by Celery workers to the batch owner's WebSocket connections"""
+
+    def __init__(self, manager, config: Optional[OCRBatchConfig] = None, retry_delay: float = 5.0):
+        self.manager = manager
+        self.config = config or OCRBatchConfig()
+        self.retry_delay = retry_delay
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if redis_asyncio is None:
+            logger.warning("redis is not installed; OCR batch progress will not reach WebSocket clients")
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            client = redis_asyncio.Redis.from_url(self.config.redis_url, decode_responses=True)
+            pubsub = client.pubsub()
+            try:
+                await pubsub.subscribe(self.config.channel)
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    await self._forward(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"OCR batch progress subscription lost, retrying: {str(e)}")
+                await asyncio.sleep(self.retry_delay)
+            finally:
+                try:
+                    await pubsub.aclose()
+                    await client.aclose()
+                except Exception:
+                    pass
+
+    async def _forward(self, data: str) -> None:
+        try:
+            event = json.loads(data)
+        except ValueError:
+            logger.warning("Ignoring malformed OCR batch progress event")
+            return
+        user_id = event.get("user_id")
+        if user_id:
+            await self.manager.broadcast_to_client(user_id, event)
+
+
+_publisher: Optional[BatchProgressPublisher] = None
+
+
+def get_progress_publisher() -> BatchProgressPublisher:
+    """Progress publisher shared by the tasks of a worker process"""
+    global _publisher
+    if _publisher is None:
+        _publisher = BatchProgressPublisher()
+    return _publisher
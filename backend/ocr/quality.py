@@ -0,0 +1,229 @@
+"""
+Receipt image quality assessment and adaptive preprocessing plans
+
+The Phase 2 preprocessing pipeline (perspective correction, shadow removal,
+Hough/OSD rotation, non-local means denoising, multi-stage contrast) is built
+for phone photos. Crisp PDF renders and screenshots gain nothing from most of
+it and pay for all of it. assess_image_quality() estimates blur, noise, skew,
+contrast, lighting and background on a small downsampled copy (~20 ms), and
+plan_preprocessing() keeps only the stages the image needs. Thresholding and
+morphological cleanup always run.
+"""
+import os
+import math
+import time
+import logging
+from dataclasses import dataclass, asdict, field
+from typing import Dict, Any, List, Optional
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger("financial-agent.ocr.quality")
+
+# Preprocessing stages in pipeline order
+PREPROCESSING_STAGES = (
+    "perspective",
+    "shadows",
+    "rotate",
+    "denoise",
+    "contrast",
+    "threshold",
+    "morphology",
+)
+
+# Stages every plan keeps (cheap, and Tesseract wants a clean binary image)
+ALWAYS_STAGES = ("threshold", "morphology")
+
+# Long side of the copy the estimates are computed on
+ASSESSMENT_SIZE = 640
+
+# Immerkaer noise estimation kernel
+_NOISE_KERNEL = np.array([[1, -2, 1], [-2, 4, -2], [1, -2, 1]], dtype=np.float32)
+
+
+class PreprocessingConfig:
+    """Adaptive preprocessing configuration"""
+
+    def __init__(self):
+        # false: run every stage on every image (the pre-adaptive behaviour)
+        self.adaptive = os.environ.get("OCR_ADAPTIVE_PREPROCESSING", "true").lower() == "true"
+        # Estimated noise sigma (grey levels) above which denoising runs
+        self.noise_threshold = float(os.environ.get("OCR_PREPROCESS_NOISE_THRESHOLD", "2.5"))
+        # Laplacian variance below which an image counts as blurry
+        self.blur_threshold = float(os.environ.get("OCR_PREPROCESS_BLUR_THRESHOLD", "100"))
+        # Skew (degrees) above which rotation runs
+        self.skew_threshold = float(os.environ.get("OCR_PREPROCESS_SKEW_THRESHOLD", "1.0"))
+
+
+@dataclass
+class ImageQuality:
+    """Quality estimates for a receipt image (computed on a downsampled copy)"""
+    width: int
+    height: int
+    sharpness: float          # variance of the Laplacian; low = blurry
+    noise_sigma: float        # Immerkaer noise estimate in grey levels
+    skew_angle: float         # dominant text line angle in degrees
+    contrast: float           # ink (1st percentile) to paper (90th percentile) spread
+    lighting_spread: float    # spread of the large-scale background brightness
+    background_delta: float   # border vs centre brightness difference
+    assessment_ms: float = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {k: round(v, 3) if isinstance(v, float) else v for k, v in asdict(self).items()}
+
+
+@dataclass
+class PreprocessingPlan:
+    """Stages chosen for one image and why"""
+    stages: List[str]
+    reasons: Dict[str, str] = field(default_factory=dict)
+    adaptive: bool = True
+    # Blurry images keep non-local means but skip the extra smoothing passes
+    light_denoise: bool = False
+
+    @property
+    def skipped(self) -> List[str]:
+        return [stage for stage in PREPROCESSING_STAGES if stage not in self.stages]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "adaptive": self.adaptive,
+            "stages": list(self.stages),
+            "skipped": self.skipped,
+            "reasons": dict(self.reasons),
+            "light_denoise": self.light_denoise,
+        }
+
+
+def _downsample(gray: np.ndarray) -> np.ndarray:
+    height, width = gray.shape[:2]
+    scale = ASSESSMENT_SIZE / max(height, width)
+    if scale >= 1:
+        return gray
+    return cv2.resize(gray, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+
+
+def estimate_noise(gray: np.ndarray) -> float:
+    """
+    Noise sigma from Immerkaer's kernel response
+
+    Uses the median absolute response rather than the mean, so text edges
+    (a minority of pixels on a receipt) do not read as noise.
+    """
+    height, width = gray.shape[:2]
+    if height < 3 or width < 3:
+        return 0.0
+    response = cv2.filter2D(gray.astype(np.float32), -1, _NOISE_KERNEL)[1:-1, 1:-1]
+    # The kernel response of white noise has standard deviation 6 * sigma
+    return float(1.4826 * np.median(np.abs(response)) / 6)
+
+
+def estimate_skew(gray: np.ndarray) -> float:
+    """Median angle of near-horizontal line segments (degrees, 0 if none)"""
+    edges = cv2.Canny(gray, 50, 150, apertureSize=3)
+    min_length = max(20, gray.shape[1] // 8)
+    lines = cv2.HoughLinesP(edges, 1, np.pi / 360, threshold=60, minLineLength=min_length, maxLineGap=10)
+    if lines is None:
+        return 0.0
+    angles = []
+    for x1, y1, x2, y2 in lines.reshape(-1, 4):
+        angle = math.degrees(math.atan2(y2 - y1, x2 - x1))
+        if angle > 90:
+            angle -= 180
+        elif angle < -90:
+            angle += 180
+        if abs(angle) <= 45:
+            angles.append(angle)
+    return float(np.median(angles)) if angles else 0.0
+
+
+def assess_image_quality(image: np.ndarray) -> ImageQuality:
+    """
+    Estimate how much cleaning a receipt image needs
+
+    Args:
+        image: Decoded BGR or grayscale image
+
+    Returns:
+        ImageQuality estimates
+    """
+    started = time.perf_counter()
+
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = _downsample(gray)
+
+    sharpness = float(cv2.Laplacian(small, cv2.CV_64F).var())
+    noise_sigma = estimate_noise(small)
+    skew_angle = estimate_skew(small)
+    ink, paper = np.percentile(small, (1, 90))
+
+    # Large-scale brightness: text averages out, shadows and gradients remain
+    background = cv2.resize(small, (16, 16), interpolation=cv2.INTER_AREA)
+    background = cv2.dilate(background, np.ones((3, 3), np.uint8))
+    lighting_spread = float(np.percentile(background, 90) - np.percentile(background, 10))
+
+    # Photos of a receipt on a table have a border unlike the paper itself
+    h, w = small.shape[:2]
+    band_h, band_w = max(1, h // 20), max(1, w // 20)
+    border = np.concatenate([
+        small[:band_h].ravel(), small[-band_h:].ravel(),
+        small[:, :band_w].ravel(), small[:, -band_w:].ravel(),
+    ])
+    centre = small[h // 4: 3 * h // 4, w // 4: 3 * w // 4]
+    background_delta = float(abs(np.median(centre) - np.median(border))) if centre.size else 0.0
+
+    return ImageQuality(
+        width=int(gray.shape[1]),
+        height=int(gray.shape[0]),
+        sharpness=sharpness,
+        noise_sigma=noise_sigma,
+        skew_angle=skew_angle,
+        contrast=float(paper - ink),
+        lighting_spread=lighting_spread,
+        background_delta=background_delta,
+        assessment_ms=(time.perf_counter() - started) * 1000,
+    )
+
+
+def plan_preprocessing(quality: Optional[ImageQuality], config: Optional[PreprocessingConfig] = None) -> PreprocessingPlan:
+    """
+    Choose the preprocessing stages for an image
+
+    Args:
+        quality: Estimates from assess_image_quality (None runs every stage)
+        config: Thresholds (defaults to environment settings)
+
+    Returns:
+        PreprocessingPlan
+    """
+    config = config or PreprocessingConfig()
+    if quality is None or not config.adaptive:
+        return PreprocessingPlan(
+            stages=list(PREPROCESSING_STAGES),
+            reasons={"all": "adaptive preprocessing disabled" if not config.adaptive else "quality unknown"},
+            adaptive=False,
+        )
+
+    reasons: Dict[str, str] = {}
+
+    if quality.background_delta > 40:
+        reasons["perspective"] = f"background differs from paper by {quality.background_delta:.0f} grey levels"
+    if quality.lighting_spread > 40:
+        reasons["shadows"] = f"uneven lighting (spread {quality.lighting_spread:.0f})"
+    if abs(quality.skew_angle) > config.skew_threshold:
+        reasons["rotate"] = f"skewed {quality.skew_angle:.1f} degrees"
+    elif quality.width > quality.height * 1.5:
+        reasons["rotate"] = "landscape image, receipt may be on its side"
+    if quality.noise_sigma > config.noise_threshold:
+        reasons["denoise"] = f"noise sigma {quality.noise_sigma:.1f}"
+    if quality.contrast < 120 or "shadows" in reasons:
+        reasons["contrast"] = f"contrast spread {quality.contrast:.0f}"
+    for stage in ALWAYS_STAGES:
+        reasons[stage] = "always"
+
+    return PreprocessingPlan(
+        stages=[stage for stage in PREPROCESSING_STAGES if stage in reasons],
+        reasons=reasons,
+        light_denoise=quality.sharpness < config.blur_threshold,
+    )
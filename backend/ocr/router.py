@@ -2,6 +2,7 @@
 OCR Router - API endpoints for receipt processing and expense management
 """
 import asyncio
+import uuid
 from typing import List, Optional, Dict, Any
 from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, status, Query, BackgroundTasks
 from fastapi.responses import FileResponse
@@ -15,22 +16,29 @@ backend_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 if backend_path not in sys.path:
     sys.path.append(backend_path)
 
-from auth.middleware import get_current_user, get_auth_service
+from auth.middleware import get_current_user, get_auth_service, require_owner
 from auth.models import User
 from database.mongodb import Database
+from automation.realtime_service import connection_manager
 from .models import (
     Receipt, ReceiptUpdate, ExpenseFilter, ExpenseSummary,
     ProcessingStatus, ExpenseCategory, PaymentMethod, VerificationStatus,
-    FileUploadResponse
+    FileUploadResponse, BatchProcessRequest, BatchProcessResponse
 )
 from .service import OCRService
-from .uploader import FileUploader
+from .uploader import FileUploader, UploadLimitRoute
+from .engine_pool import get_engine_pool
+from .executor import get_ocr_executor
+from .dedup import current_engine_version
+from .progress import OCRBatchConfig, BatchProgressRelay, LocalBatchProgress
 
 logger = logging.getLogger("financial-agent.ocr.router")
 
 router = APIRouter(
     prefix="/api/receipts",
     tags=["OCR & Expenses"],
+    # Oversized uploads are refused while the body arrives, not after it is spooled
+    route_class=UploadLimitRoute,
     responses={
         401: {"description": "Unauthorized"},
         403: {"description": "Forbidden"}, 
@@ -40,6 +48,30 @@ router = APIRouter(
     }
 )
 
+@router.on_event("startup")
+async def warm_ocr_engines():
+    """Start OCR workers and load their models in the background so the first upload does not pay for it"""
+    if get_engine_pool().config.warmup:
+        asyncio.get_running_loop().run_in_executor(None, get_ocr_executor().warm)
+
+@router.on_event("shutdown")
+async def stop_ocr_executor():
+    """Stop OCR worker processes with the API"""
+    get_ocr_executor().shutdown()
+
+batch_config = OCRBatchConfig()
+batch_progress_relay = BatchProgressRelay(connection_manager, batch_config)
+
+@router.on_event("startup")
+async def start_batch_progress_relay():
+    """Relay batch OCR progress from Celery workers to WebSocket clients"""
+    if batch_config.mode == "celery":
+        batch_progress_relay.start()
+
+@router.on_event("shutdown")
+async def stop_batch_progress_relay():
+    await batch_progress_relay.stop()
+
 def get_ocr_service(request) -> OCRService:
     """Get OCR service instance"""
     db = request.app.state.db if hasattr(request.app.state, 'db') else None
@@ -82,10 +114,31 @@ async def upload_receipt(
             mime_type=file.content_type or "unknown"
         )
         
-        # Process receipt in background
+        # Same image uploaded before: answer from its OCR result right away
+        cached_receipt = await ocr_service.process_cached_receipt(receipt)
+        if cached_receipt:
+            logger.info(f"Receipt upload served from OCR cache: {receipt.id}")
+            if not cached_receipt.ai_extracted_data:
+                background_tasks.add_task(ocr_service.enhance_receipt_with_ai, receipt.id)
+            return FileUploadResponse(
+                receipt_id=receipt.id,
+                filename=upload_response.filename,
+                file_size=upload_response.file_size,
+                upload_status="success",
+                message=(
+                    "Receipt uploaded; this image was already processed"
+                    + (" (possible duplicate expense)" if cached_receipt.possible_duplicate else "")
+                ),
+                processing_status=cached_receipt.processing_status,
+                possible_duplicate=cached_receipt.possible_duplicate,
+                duplicate_of=cached_receipt.duplicate_of
+            )
+        
+        # Process receipt in background (the cache was just checked)
         background_tasks.add_task(
             ocr_service.process_receipt_async,
-            receipt.id
+            receipt.id,
+            False
         )
         
         logger.info(f"Receipt upload successful: {receipt.id}")
@@ -108,6 +161,88 @@ async def upload_receipt(
             detail=f"Failed to upload receipt: {str(e)}"
         )
 
+@router.post(
+    "/batch",
+    response_model=BatchProcessResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+    summary="Process receipts in batch",
+    description=(
+        "Run OCR on many uploaded receipts in parallel. Progress is sent per receipt "
+        "to the user's realtime WebSocket (/automation/ws/{user_id})"
+    )
+)
+async def process_receipt_batch(
+    batch: BatchProcessRequest,
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(get_current_user),
+    ocr_service: OCRService = Depends(get_ocr_service)
+) -> BatchProcessResponse:
+    """Fan a batch of receipts out over the OCR workers"""
+    try:
+        receipt_ids = list(dict.fromkeys(batch.receipt_ids))
+        if len(receipt_ids) > batch_config.max_receipts:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"A batch can contain at most {batch_config.max_receipts} receipts"
+            )
+        
+        owners = await ocr_service.get_receipt_owners(receipt_ids)
+        missing = [receipt_id for receipt_id in receipt_ids if receipt_id not in owners]
+        if missing:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Receipts not found: {', '.join(missing[:10])}"
+            )
+        if current_user.role != "owner" and any(owner != current_user.id for owner in owners.values()):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Access denied to one or more receipts"
+            )
+        
+        batch_id = str(uuid.uuid4())
+        use_cache = not batch.force
+        
+        if batch_config.mode == "celery":
+            from celery_app import celery_app
+            # Publishing to the broker is a blocking network call
+            await asyncio.get_running_loop().run_in_executor(
+                None,
+                lambda: celery_app.send_task(
+                    "backend.ocr.tasks.batch_process_receipts",
+                    args=[receipt_ids, current_user.id, batch_id, use_cache],
+                    task_id=batch_id
+                )
+            )
+        else:
+            progress = LocalBatchProgress(
+                batch_id, current_user.id, len(receipt_ids), connection_manager.broadcast_to_client
+            )
+            background_tasks.add_task(
+                ocr_service.process_receipt_batch,
+                receipt_ids,
+                progress,
+                batch_config.local_concurrency,
+                use_cache
+            )
+        
+        logger.info(f"OCR batch {batch_id} queued by user {current_user.id}: {len(receipt_ids)} receipts")
+        
+        return BatchProcessResponse(
+            batch_id=batch_id,
+            total=len(receipt_ids),
+            mode=batch_config.mode,
+            message="Batch processing started"
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Batch processing error: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Failed to start batch processing: {str(e)}"
+        )
+
 @router.get(
     "/",
     response_model=List[Receipt],
@@ -347,6 +482,7 @@ async def get_receipt_image(
 async def reprocess_receipt(
     receipt_id: str,
     background_tasks: BackgroundTasks,
+    force: bool = Query(False, description="Run full OCR even if a cached result for this image exists"),
     current_user: User = Depends(get_current_user),
     ocr_service: OCRService = Depends(get_ocr_service)
 ) -> Receipt:
@@ -372,7 +508,8 @@ async def reprocess_receipt(
         # Process in background
         background_tasks.add_task(
             ocr_service.process_receipt_async,
-            receipt_id
+            receipt_id,
+            not force
         )
         
         return await ocr_service.get_receipt(receipt_id)
@@ -523,6 +660,51 @@ async def get_expense_categories() -> Dict[str, List[Dict[str, str]]]:
     
     return {"categories": categories}
 
+@router.get(
+    "/admin/ocr-cache",
+    summary="OCR dedup cache statistics",
+    description="Hit rate of the OCR result dedup cache and cached results by engine version (owner only)"
+)
+async def get_ocr_cache_stats(
+    current_user: User = Depends(require_owner),
+    ocr_service: OCRService = Depends(get_ocr_service)
+) -> Dict[str, Any]:
+    """OCR dedup cache statistics"""
+    try:
+        return await ocr_service.dedup_cache.get_stats()
+    except Exception as e:
+        logger.error(f"OCR cache stats error: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to get OCR cache statistics"
+        )
+
+@router.post(
+    "/admin/ocr-cache/invalidate",
+    summary="Invalidate cached OCR results",
+    description="Stop reusing OCR results from other engine versions, or all of them with include_current=true (owner only)"
+)
+async def invalidate_ocr_cache(
+    include_current: bool = Query(False, description="Invalidate results from the current engine version too"),
+    current_user: User = Depends(require_owner),
+    ocr_service: OCRService = Depends(get_ocr_service)
+) -> Dict[str, Any]:
+    """Invalidate cached OCR results"""
+    try:
+        invalidated = await ocr_service.dedup_cache.invalidate(stale_only=not include_current)
+        logger.info(f"OCR cache invalidated by {current_user.id}: {invalidated} results")
+        return {
+            "invalidated": invalidated,
+            "stale_only": not include_current,
+            "engine_version": current_engine_version()
+        }
+    except Exception as e:
+        logger.error(f"OCR cache invalidation error: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to invalidate OCR cache"
+        )
+
 @router.get(
     "/health",
     summary="OCR service health check",
@@ -564,6 +746,8 @@ async def health_check() -> Dict[str, Any]:
                 }
             },
             "storage": storage_stats,
+            "engine_pool": get_engine_pool().get_metrics(),
+            "executor": get_ocr_executor().get_metrics(),
             "timestamp": "2024-01-01T00:00:00Z"  # Would use actual timestamp
         }
         
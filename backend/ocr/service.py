@@ -25,8 +25,10 @@ from .models import (
     ExpenseFilter, ExpenseSummary, VerificationStatus
 )
 from .processor import ReceiptProcessor
-from .enhanced_processor import EnhancedReceiptProcessor
+from .enhanced_processor import EnhancedReceiptProcessor, Phase2OCRResult
 from .uploader import FileUploader
+from .dedup import ImageFingerprint, fingerprint_image, get_ocr_dedup_cache
+from .progress import LocalBatchProgress, receipt_result, summarize_batch
 
 logger = logging.getLogger("financial-agent.ocr.service")
 
@@ -38,6 +40,7 @@ class OCRService:
         self.ai_service = ai_service or GeminiService()
         self.processor = ReceiptProcessor()
         # Phase 2: Use enhanced processor with multi-engine OCR
+        # (cheap to create: OCR models live in the process-wide engine pool)
         self.enhanced_processor = EnhancedReceiptProcessor()
         self.uploader = FileUploader()
         
@@ -45,6 +48,9 @@ class OCRService:
         self.receipts_collection = "receipts"
         self.ocr_results_collection = "ocr_results"  # Phase 3: Store OCR results separately
         
+        # Re-uploads of the same receipt reuse its saved OCR result
+        self.dedup_cache = get_ocr_dedup_cache(db)
+        
     async def create_receipt_record(
         self, 
         user_id: str, 
@@ -76,13 +82,23 @@ class OCRService:
             logger.error(f"Failed to create receipt record: {str(e)}")
             raise Exception(f"Failed to create receipt record: {str(e)}")
     
-    async def save_ocr_result(self, image_path: str, ocr_result) -> str:
+    async def save_ocr_result(
+        self,
+        image_path: str,
+        ocr_result,
+        fingerprint: Optional[ImageFingerprint] = None,
+        user_id: Optional[str] = None,
+        receipt_id: Optional[str] = None
+    ) -> str:
         """
         Phase 3: Save OCR processing result to database
         
         Args:
             image_path: Path to the processed image
             ocr_result: Phase2OCRResult from enhanced processor
+            fingerprint: Image hashes; makes the result reusable for duplicate uploads
+            user_id: Owner of the receipt
+            receipt_id: Receipt the result belongs to
             
         Returns:
             str: ID of the saved OCR result document
@@ -97,7 +113,11 @@ class OCRService:
                 "text": ocr_result.text,
                 "structured_data": ocr_result.structured_data or {},
                 "error": ocr_result.error,
-                "created_at": datetime.utcnow()
+                "early_exit": getattr(ocr_result, "early_exit", False),
+                "engine_runs": getattr(ocr_result, "engine_runs", None) or {},
+                "preprocessing": getattr(ocr_result, "preprocessing", None) or {},
+                "created_at": datetime.utcnow(),
+                **self.dedup_cache.index_fields(fingerprint, user_id, receipt_id)
             }
             
             result = await self.db.create_document(self.ocr_results_collection, ocr_doc)
@@ -125,8 +145,128 @@ class OCRService:
             logger.error(f"Failed to retrieve OCR result {result_id}: {str(e)}")
             return None
     
-    async def process_receipt_async(self, receipt_id: str) -> Receipt:
-        """Process receipt asynchronously with OCR and AI"""
+    async def fingerprint_receipt(self, receipt: Receipt) -> Optional[ImageFingerprint]:
+        """Content and perceptual hash of a receipt's file (None if unreadable)"""
+        try:
+            return await asyncio.to_thread(fingerprint_image, receipt.file_path)
+        except Exception as e:
+            logger.warning(f"Failed to fingerprint receipt {receipt.id}: {str(e)}")
+            return None
+    
+    async def process_cached_receipt(
+        self,
+        receipt: Receipt,
+        fingerprint: Optional[ImageFingerprint] = None
+    ) -> Optional[Receipt]:
+        """
+        Complete a receipt from the saved OCR result of an identical upload
+        
+        Only a byte-identical file (same content hash) reuses the saved text
+        and structured data. A perceptually similar image is often another
+        receipt from the same shop with a different amount, so it only flags
+        the receipt as a possible duplicate and leaves OCR to run.
+        
+        No AI call is made here: the original receipt's AI data is reused when
+        there is one, otherwise call enhance_receipt_with_ai later.
+        
+        Args:
+            receipt: Receipt to complete
+            fingerprint: Hashes of the receipt's file (computed if omitted)
+            
+        Returns:
+            Updated receipt, or None when no reusable OCR result exists
+        """
+        if not self.dedup_cache.config.enabled:
+            return None
+        
+        fingerprint = fingerprint or await self.fingerprint_receipt(receipt)
+        if not fingerprint:
+            return None
+        
+        cached = await self.dedup_cache.lookup(fingerprint, receipt.user_id)
+        if not cached:
+            return None
+        
+        # A different receipt with the same image is probably the same expense twice
+        original_id = cached.get("receipt_id")
+        duplicate_of = original_id if original_id and original_id != receipt.id else None
+        duplicate_fields = {
+            "possible_duplicate": duplicate_of is not None,
+            "duplicate_of": duplicate_of,
+            "ocr_cache": {"result_id": cached["id"], "match": cached["match"], "distance": cached["distance"]},
+        }
+        
+        if cached["match"] != "exact":
+            await self.db.update_document(self.receipts_collection, receipt.id, duplicate_fields)
+            logger.info(
+                f"Receipt {receipt.id} looks like OCR result {cached['id']} "
+                f"(distance {cached['distance']}); running OCR"
+            )
+            return None
+        
+        ocr_result = Phase2OCRResult(
+            text=cached.get("text", ""),
+            confidence=cached.get("confidence", 0.0),
+            processing_time=0.0,
+            status=ProcessingStatus.COMPLETED,
+            engine=cached.get("engine", "cached"),
+            structured_data=cached.get("structured_data") or {}
+        )
+        parsed_data = ocr_result.structured_data
+        
+        # Reuse the original receipt's AI classification when there is one
+        original = await self.get_receipt(duplicate_of) if duplicate_of else None
+        ai_enhanced_data = original.ai_extracted_data if original and original.ai_extracted_data else {}
+        
+        updated_receipt = await self._update_receipt_with_processed_data(
+            receipt.id, ocr_result, parsed_data, ai_enhanced_data
+        )
+        await self.db.update_document(self.receipts_collection, receipt.id, duplicate_fields)
+        
+        final_status = ProcessingStatus.COMPLETED
+        if ocr_result.confidence < 0.7:
+            final_status = ProcessingStatus.NEEDS_REVIEW
+        await self.update_receipt_status(receipt.id, final_status)
+        
+        logger.info(
+            f"Receipt {receipt.id} completed from cached OCR result {cached['id']}"
+            + (f" (possible duplicate of {duplicate_of})" if duplicate_of else "")
+        )
+        return await self.get_receipt(receipt.id) or updated_receipt
+    
+    async def enhance_receipt_with_ai(self, receipt_id: str) -> Optional[Receipt]:
+        """
+        Add AI classification to a receipt completed from cached OCR data
+        
+        Args:
+            receipt_id: Receipt to enhance
+            
+        Returns:
+            Updated receipt, or None if it no longer exists
+        """
+        doc = await self.db.find_one(self.receipts_collection, {"_id": receipt_id})
+        if not doc:
+            return None
+        ocr_result = doc.get("ocr_result") or {}
+        ai_data = await self._enhance_with_ai(ocr_result.get("text", ""), ocr_result.get("structured_data") or {})
+        if ai_data:
+            update_data = {
+                "ai_extracted_data": ai_data,
+                "ocr_data.extracted_data.category": ai_data.get("category", "other"),
+                "updated_at": datetime.now(),
+                **self._ai_fields(ai_data)
+            }
+            await self.db.update_document(self.receipts_collection, receipt_id, update_data)
+        return await self.get_receipt(receipt_id)
+    
+    async def process_receipt_async(self, receipt_id: str, use_cache: bool = True) -> Receipt:
+        """
+        Process receipt asynchronously with OCR and AI
+        
+        Args:
+            receipt_id: Receipt to process
+            use_cache: Reuse the OCR result of an identical earlier upload if one exists
+        """
         try:
             # Get receipt record
             receipt = await self.get_receipt(receipt_id)
@@ -136,6 +276,15 @@ class OCRService:
             # Update status to processing
             await self.update_receipt_status(receipt_id, ProcessingStatus.PROCESSING)
             
+            # Step 0: Skip OCR entirely for an image we have already read
+            fingerprint = await self.fingerprint_receipt(receipt)
+            if use_cache:
+                cached_receipt = await self.process_cached_receipt(receipt, fingerprint)
+                if cached_receipt:
+                    if not cached_receipt.ai_extracted_data:
+                        cached_receipt = await self.enhance_receipt_with_ai(receipt_id) or cached_receipt
+                    return cached_receipt
+            
             # Step 1: Phase 2 Enhanced OCR Processing with multi-engine support
             image_path = Path(receipt.file_path)
             logger.info(f"Starting Phase 2 OCR processing for receipt: {receipt_id}")
@@ -144,7 +293,10 @@ class OCRService:
             ocr_result = await self.enhanced_processor.process_receipt(str(image_path))
             
             # Phase 3: Save OCR result to database
-            ocr_result_id = await self.save_ocr_result(str(image_path), ocr_result)
+            ocr_result_id = await self.save_ocr_result(
+                str(image_path), ocr_result,
+                fingerprint=fingerprint, user_id=receipt.user_id, receipt_id=receipt_id
+            )
             logger.info(f"OCR result saved with ID: {ocr_result_id}")
             
             # Step 2: Use structured data from Phase 2 OCR (already extracted)
@@ -174,6 +326,48 @@ class OCRService:
             await self.update_receipt_status(receipt_id, ProcessingStatus.FAILED)
             raise Exception(f"Receipt processing failed: {str(e)}")
     
+    async def process_receipt_batch(
+        self,
+        receipt_ids: List[str],
+        progress: LocalBatchProgress,
+        concurrency: int = 4,
+        use_cache: bool = True
+    ) -> Dict[str, Any]:
+        """
+        Process a batch of receipts in this process, reporting each one as it finishes
+        
+        Used when no Celery workers are available; OCR stages still run in the
+        OCR executor, so concurrency only bounds receipts in flight.
+        
+        Args:
+            receipt_ids: Receipts to process
+            progress: Receives the batch events
+            concurrency: Receipts processed at once
+            use_cache: Reuse OCR results of identical earlier uploads
+        """
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        
+        async def process_one(receipt_id: str) -> Dict[str, Any]:
+            async with semaphore:
+                try:
+                    receipt = await self.process_receipt_async(receipt_id, use_cache)
+                    result = receipt_result(receipt_id, receipt)
+                except Exception as e:
+                    result = receipt_result(receipt_id, error=str(e))
+            await progress.receipt_done(result)
+            return result
+        
+        await progress.start()
+        results = await asyncio.gather(*(process_one(receipt_id) for receipt_id in receipt_ids))
+        summary = summarize_batch(results)
+        await progress.finish(summary)
+        
+        logger.info(
+            f"OCR batch {progress.batch_id} finished: "
+            f"{summary['successful']} of {summary['total']} receipts processed"
+        )
+        return {'batch_id': progress.batch_id, 'summary': summary, 'results': results}
+    
     async def _enhance_with_ai(self, raw_text: str, parsed_data: Dict[str, Any]) -> Dict[str, Any]:
         """Use AI to enhance and validate extracted data"""
         try:
@@ -248,6 +442,25 @@ class OCRService:
             logger.warning(f"Failed to parse AI response: {str(e)}")
             return {}
     
+    def _ai_fields(self, ai_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Receipt fields set from an AI classification"""
+        fields = {}
+        if ai_data.get('category'):
+            try:
+                fields['category'] = ExpenseCategory(ai_data['category'])
+            except ValueError:
+                pass
+        
+        if ai_data.get('payment_method'):
+            try:
+                fields['payment_method'] = PaymentMethod(ai_data['payment_method'])
+            except ValueError:
+                pass
+        
+        if ai_data.get('confidence_score'):
+            fields['classification_confidence'] = float(ai_data['confidence_score'])
+        return fields
+    
     async def _update_receipt_with_processed_data(
         self, 
         receipt_id: str, 
@@ -288,6 +501,9 @@ class OCRService:
             if parsed_data.get('transaction_date'):
                 update_data['transaction_date'] = parsed_data['transaction_date']
             
+            if parsed_data.get('tax_amount'):
+                update_data['tax_amount'] = parsed_data['tax_amount']
+            
             if parsed_data.get('vendor_info'):
                 update_data['vendor'] = parsed_data['vendor_info']
             
@@ -298,20 +514,7 @@ class OCRService:
                 update_data['items'] = [item.dict() for item in parsed_data['items']]
             
             # Apply AI enhancements
-            if ai_data.get('category'):
-                try:
-                    update_data['category'] = ExpenseCategory(ai_data['category'])
-                except ValueError:
-                    pass
-            
-            if ai_data.get('payment_method'):
-                try:
-                    update_data['payment_method'] = PaymentMethod(ai_data['payment_method'])
-                except ValueError:
-                    pass
-            
-            if ai_data.get('confidence_score'):
-                update_data['classification_confidence'] = float(ai_data['confidence_score'])
+            update_data.update(self._ai_fields(ai_data))
             
             # Update in database
             await self.db.update_document(
@@ -342,6 +545,17 @@ class OCRService:
             logger.error(f"Failed to get receipt: {str(e)}")
             return None
     
+    async def get_receipt_owners(self, receipt_ids: List[str]) -> Dict[str, str]:
+        """Owner user id of each existing receipt, in one query"""
+        cursor = self.db.db[self.receipts_collection].find(
+            {"$or": [{"_id": {"$in": receipt_ids}}, {"id": {"$in": receipt_ids}}]},
+            {"_id": 1, "id": 1, "user_id": 1}
+        )
+        owners = {}
+        async for doc in cursor:
+            owners[doc.get("id") or doc["_id"]] = doc.get("user_id")
+        return owners
+    
     async def get_user_receipts(
         self, 
         user_id: str, 
@@ -1,12 +1,13 @@
 """
 Celery Tasks for OCR Processing
 """
-import asyncio
 import logging
+import uuid
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
-from celery import current_task
+from celery import current_task, chord, group
+from celery.signals import worker_process_init, worker_process_shutdown
 import sys
 import os
 
@@ -16,133 +17,139 @@ sys.path.append(project_root)
 
 from backend.celery_app import celery_app
 from backend.ocr.enhanced_processor import EnhancedReceiptProcessor  
-from backend.ocr.service import OCRService
-from backend.database.mongodb import Database
+from backend.ocr.engine_pool import get_engine_pool
+from backend.ocr.progress import get_progress_publisher, receipt_result, summarize_batch
+from backend.ocr.worker_runtime import get_worker_runtime
 
 logger = logging.getLogger("financial-agent.ocr.tasks")
 
+_processor = None
+
+def get_processor() -> EnhancedReceiptProcessor:
+    """Receipt processor shared by every task in this worker process"""
+    global _processor
+    if _processor is None:
+        _processor = EnhancedReceiptProcessor()
+    return _processor
+
+@worker_process_init.connect
+def warm_ocr_engines(**kwargs):
+    """Load OCR models when a worker process starts instead of on its first receipt"""
+    pool = get_engine_pool()
+    if not pool.config.warmup:
+        return
+    try:
+        pool.warm()
+        get_processor()
+    except Exception as e:
+        logger.error(f"OCR engine warm-up failed: {str(e)}")
+
+@worker_process_init.connect
+def start_worker_runtime(**kwargs):
+    """Open the worker's event loop and database connection once, before its first task"""
+    try:
+        get_worker_runtime().start()
+    except Exception as e:
+        # Tasks retry the start on first use
+        logger.error(f"OCR worker runtime start failed: {str(e)}")
+
+@worker_process_shutdown.connect
+def stop_worker_runtime(**kwargs):
+    """Close the worker's database connection and event loop"""
+    get_worker_runtime().shutdown()
+
 @celery_app.task(bind=True)
-def process_receipt_task(self, receipt_id: str, user_id: str) -> Dict[str, Any]:
+def process_receipt_task(
+    self, receipt_id: str, user_id: str, batch_id: Optional[str] = None, use_cache: bool = True
+) -> Dict[str, Any]:
     """
     Background task to process a single receipt
+
+    Receipts of a batch also report their progress to the batch owner.
     """
     try:
         # Update task status
         self.update_state(
             state='PROCESSING',
-            meta={'receipt_id': receipt_id, 'status': 'Starting OCR processing...'}
+            meta={'receipt_id': receipt_id, 'batch_id': batch_id, 'status': 'Starting OCR processing...'}
         )
         
-        # Initialize services
-        db = Database.get_instance()
-        ocr_service = OCRService(db)
-        processor = EnhancedReceiptProcessor()
-        
-        # Get receipt record
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
-        receipt = loop.run_until_complete(ocr_service.get_receipt(receipt_id))
-        if not receipt:
-            raise Exception(f"Receipt {receipt_id} not found")
+        runtime = get_worker_runtime()
+        runtime.start()
         
-        # Update status
         self.update_state(
             state='PROCESSING',
-            meta={'receipt_id': receipt_id, 'status': 'Processing image...'}
+            meta={'receipt_id': receipt_id, 'batch_id': batch_id, 'status': 'Processing image...'}
         )
         
-        # Process the receipt
-        ocr_result = loop.run_until_complete(
-            processor.process_receipt(receipt.file_path)
-        )
-        
-        # Update status  
-        self.update_state(
-            state='PROCESSING',
-            meta={'receipt_id': receipt_id, 'status': 'Extracting data with AI...'}
-        )
-        
-        # Extract structured data with AI
-        receipt_data = loop.run_until_complete(
-            ocr_service.extract_receipt_data(ocr_result, receipt.file_path)
-        )
-        
-        # Update receipt in database
-        updated_receipt = loop.run_until_complete(
-            ocr_service.update_receipt_from_ocr(receipt_id, receipt_data)
+        # OCR, AI extraction and the receipt update (fails the receipt on error)
+        updated_receipt = runtime.run(
+            runtime.ocr_service.process_receipt_async(receipt_id, use_cache)
         )
         
         logger.info(f"Successfully processed receipt {receipt_id}")
-        
-        return {
-            'receipt_id': receipt_id,
-            'status': 'completed',
-            'data': {
-                'vendor': updated_receipt.vendor.name if updated_receipt.vendor else 'Unknown',
-                'total_amount': updated_receipt.total_amount or 0.0,
-                'date': updated_receipt.date.isoformat() if updated_receipt.date else None,
-                'category': updated_receipt.category.value if updated_receipt.category else 'other',
-                'confidence': updated_receipt.confidence or 0.0
-            }
-        }
+        result = receipt_result(receipt_id, updated_receipt)
         
     except Exception as e:
         logger.error(f"Failed to process receipt {receipt_id}: {str(e)}")
-        
-        # Update receipt status to failed
-        try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            loop.run_until_complete(
-                ocr_service.update_receipt_status(receipt_id, "failed")
-            )
-        except:
-            pass
-            
-        return {
-            'receipt_id': receipt_id,
-            'status': 'failed',
-            'error': str(e)
-        }
-    finally:
-        if 'loop' in locals():
-            loop.close()
+        result = receipt_result(receipt_id, error=str(e))
+    
+    if batch_id:
+        get_progress_publisher().receipt_done(batch_id, user_id, result)
+    return result
 
 @celery_app.task(bind=True)
-def batch_process_receipts(self, receipt_ids: list, user_id: str) -> Dict[str, Any]:
+def batch_process_receipts(
+    self, receipt_ids: list, user_id: str, batch_id: Optional[str] = None, use_cache: bool = True
+) -> Dict[str, Any]:
     """
     Background task to process multiple receipts
+
+    Fans the receipts out as a chord over the ocr_processing workers and returns
+    right away; aggregate_batch_results collects the results once all are done.
+    Progress is published per receipt (see backend.ocr.progress).
     """
-    results = []
+    batch_id = batch_id or self.request.id or str(uuid.uuid4())
     total_receipts = len(receipt_ids)
+    publisher = get_progress_publisher()
+    publisher.start(batch_id, user_id, total_receipts)
     
-    for i, receipt_id in enumerate(receipt_ids):
-        # Update progress
-        self.update_state(
-            state='PROCESSING',
-            meta={
-                'current': i + 1,
-                'total': total_receipts,
-                'status': f'Processing receipt {i + 1} of {total_receipts}'
-            }
-        )
-        
-        # Process individual receipt
-        result = process_receipt_task.apply(args=[receipt_id, user_id])
-        results.append(result.get())
+    if not receipt_ids:
+        summary = summarize_batch([])
+        publisher.finish(batch_id, user_id, summary)
+        return {'status': 'completed', 'batch_id': batch_id, 'summary': summary, 'results': []}
+    
+    header = group(
+        process_receipt_task.s(receipt_id, user_id, batch_id, use_cache) for receipt_id in receipt_ids
+    )
+    callback = aggregate_batch_results.s(batch_id, user_id)
+    chord_result = chord(header)(callback)
     
-    # Summary
-    successful = len([r for r in results if r['status'] == 'completed'])
-    failed = len([r for r in results if r['status'] == 'failed'])
+    logger.info(f"Dispatched OCR batch {batch_id} with {total_receipts} receipts")
+    
+    return {
+        'status': 'dispatched',
+        'batch_id': batch_id,
+        'result_id': chord_result.id,
+        'total': total_receipts
+    }
+
+@celery_app.task
+def aggregate_batch_results(results: list, batch_id: str, user_id: str) -> Dict[str, Any]:
+    """
+    Chord callback of batch_process_receipts: summarise the batch and notify its owner
+    """
+    summary = summarize_batch(results)
+    get_progress_publisher().finish(batch_id, user_id, summary)
+    
+    logger.info(
+        f"OCR batch {batch_id} finished: {summary['successful']} of {summary['total']} receipts processed"
+    )
     
     return {
         'status': 'completed',
-        'summary': {
-            'total': total_receipts,
-            'successful': successful,
-            'failed': failed
-        },
+        'batch_id': batch_id,
+        'summary': summary,
         'results': results
     }
 
@@ -152,7 +159,7 @@ def test_ocr_processing() -> Dict[str, Any]:
     Test task to verify OCR processing pipeline
     """
     try:
-        processor = EnhancedReceiptProcessor()
+        processor = get_processor()
         
         # Create a simple test image with text
         from PIL import Image, ImageDraw, ImageFont
@@ -190,14 +197,10 @@ def test_ocr_processing() -> Dict[str, Any]:
             temp_path = tmp_file.name
         
         # Process with OCR
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
-        result = loop.run_until_complete(processor.process_receipt(temp_path))
+        result = get_worker_runtime().run(processor.process_receipt(temp_path))
         
         # Clean up
         Path(temp_path).unlink(missing_ok=True)
-        loop.close()
         
         return {
             'status': 'success',
@@ -3,9 +3,10 @@ File Upload Handler for Receipt Processing
 """
 import os
 import uuid
-import shutil
-from typing import Optional, List, Tuple
-from fastapi import UploadFile, HTTPException, status
+import asyncio
+from typing import Optional, List, Tuple, Callable
+from fastapi import UploadFile, HTTPException, Request, status
+from fastapi.routing import APIRoute
 from pathlib import Path
 import magic
 from PIL import Image, ImageOps
@@ -15,6 +16,66 @@ from .models import ProcessingStatus, FileUploadResponse
 
 logger = logging.getLogger("financial-agent.ocr.uploader")
 
+# Leading bytes of each accepted file type
+FILE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'%PDF-', 'application/pdf'),
+)
+
+MAX_UPLOAD_SIZE = 10 * 1024 * 1024  # 10MB
+# Multipart boundaries and form fields sent around the file
+MULTIPART_OVERHEAD = 64 * 1024
+
+def sniff_mime_type(head: bytes) -> Optional[str]:
+    """MIME type from a file's leading bytes, None if not a supported type"""
+    for signature, mime_type in FILE_SIGNATURES:
+        if head.startswith(signature):
+            return mime_type
+    return None
+
+class UploadLimitRoute(APIRoute):
+    """
+    Route that refuses request bodies larger than an upload may be
+    
+    Starlette receives and spools the whole multipart body before an
+    UploadFile exists, so the limit is applied while the body arrives: a
+    declared Content-Length over the limit is rejected before anything is
+    read, and a chunked body is cut off as soon as it passes the limit.
+    """
+    max_body_size = MAX_UPLOAD_SIZE + MULTIPART_OVERHEAD
+    
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+        limit = self.max_body_size
+        
+        async def limited_handler(request: Request):
+            too_large = HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"File too large. Maximum size is {MAX_UPLOAD_SIZE / 1024 / 1024:.1f}MB"
+            )
+            length = request.headers.get("content-length", "")
+            if length.isdigit() and int(length) > limit:
+                raise too_large
+            
+            receive = request.receive
+            received = 0
+            
+            async def limited_receive():
+                nonlocal received
+                message = await receive()
+                if message["type"] == "http.request":
+                    received += len(message.get("body", b""))
+                    if received > limit:
+                        raise too_large
+                return message
+            
+            return await handler(Request(request.scope, limited_receive))
+        
+        return limited_handler
+
 class FileUploader:
     """Handle file uploads for receipt processing"""
     
@@ -23,7 +84,11 @@ class FileUploader:
         self.upload_dir.mkdir(parents=True, exist_ok=True)
         
         # Configuration
-        self.max_file_size = 10 * 1024 * 1024  # 10MB
+        self.max_file_size = MAX_UPLOAD_SIZE
+        self.chunk_size = 1024 * 1024  # Bytes held in memory per upload while streaming
+        self.max_dimension = 2048  # Longer side of stored images
+        # Largest image decoded (after JPEG draft scaling); PNG and GIF decode at full size
+        self.max_pixels = 25_000_000
         self.allowed_mime_types = {
             'image/jpeg', 'image/jpg', 'image/png', 'image/gif',
             'application/pdf'
@@ -31,10 +96,10 @@ class FileUploader:
         self.allowed_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.pdf'}
         
     def validate_file(self, file: UploadFile) -> Tuple[bool, str]:
-        """Validate uploaded file"""
+        """Validate upload metadata before any content is read"""
         try:
-            # Check file size
-            if hasattr(file, 'size') and file.size > self.max_file_size:
+            # Check declared file size (enforced again while streaming)
+            if getattr(file, 'size', None) and file.size > self.max_file_size:
                 return False, f"File too large. Maximum size is {self.max_file_size / 1024 / 1024:.1f}MB"
             
             # Check file extension
@@ -43,27 +108,38 @@ class FileUploader:
                 if file_ext not in self.allowed_extensions:
                     return False, f"File type not supported. Allowed types: {', '.join(self.allowed_extensions)}"
             
-            # Read a small portion to check MIME type
-            file_content = file.file.read(2048)
-            file.file.seek(0)  # Reset file pointer
-            
-            # Use python-magic to detect MIME type
-            try:
-                mime_type = magic.from_buffer(file_content, mime=True)
-                if mime_type not in self.allowed_mime_types:
-                    return False, f"Invalid file type detected: {mime_type}"
-            except Exception:
-                # Fallback to extension-based validation if magic fails
-                logger.warning("MIME type detection failed, using extension validation")
-            
             return True, "File validation passed"
             
         except Exception as e:
             logger.error(f"File validation error: {str(e)}")
             return False, f"File validation failed: {str(e)}"
     
+    def validate_content(self, head: bytes) -> Tuple[bool, str]:
+        """Validate the first chunk of an upload by its magic bytes"""
+        mime_type = sniff_mime_type(head)
+        if mime_type is None:
+            # Fall back to libmagic for variants the signature table does not know
+            try:
+                mime_type = magic.from_buffer(head[:2048], mime=True)
+            except Exception:
+                logger.warning("MIME type detection failed")
+                return False, "Could not determine file type"
+        if mime_type not in self.allowed_mime_types:
+            return False, f"Invalid file type detected: {mime_type}"
+        return True, mime_type
+    
     async def upload_file(self, file: UploadFile, user_id: str) -> FileUploadResponse:
-        """Upload and save receipt file"""
+        """
+        Stream an uploaded receipt file to disk
+        
+        The spooled file is copied in chunks, so memory per upload stays at
+        one chunk. The type is checked on the first chunk and the size limit
+        as bytes are copied (UploadLimitRoute already rejects oversized
+        request bodies as they arrive). Images with more pixels than
+        max_pixels are rejected before they are decoded. A rejected upload
+        leaves no file behind.
+        """
+        partial_path = None
         try:
             # Validate file
             is_valid, message = self.validate_file(file)
@@ -82,17 +158,52 @@ class FileUploader:
             user_dir = self.upload_dir / user_id
             user_dir.mkdir(exist_ok=True)
             
-            # Save file
+            # Stream to a partial file, renamed once complete
             file_path = user_dir / safe_filename
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
+            partial_path = user_dir / f"{safe_filename}.part"
+            file_size = 0
+            loop = asyncio.get_running_loop()
             
-            # Get file size
-            file_size = file_path.stat().st_size
+            with open(partial_path, "wb") as buffer:
+                while True:
+                    chunk = await file.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    
+                    if file_size == 0:
+                        is_valid, message = self.validate_content(chunk)
+                        if not is_valid:
+                            raise HTTPException(
+                                status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=message
+                            )
+                    
+                    file_size += len(chunk)
+                    if file_size > self.max_file_size:
+                        raise HTTPException(
+                            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"File too large. Maximum size is {self.max_file_size / 1024 / 1024:.1f}MB"
+                        )
+                    
+                    await loop.run_in_executor(None, buffer.write, chunk)
+            
+            if file_size == 0:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Uploaded file is empty"
+                )
+            
+            os.replace(partial_path, file_path)
+            partial_path = None
             
             # Optimize image if it's an image file
             if file_extension in ['.jpg', '.jpeg', '.png', '.gif']:
-                await self._optimize_image(file_path)
+                if not await self._optimize_image(file_path):
+                    file_path.unlink(missing_ok=True)
+                    raise HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail=f"Image too large. Maximum is {self.max_pixels / 1e6:.0f} megapixels"
+                    )
             
             logger.info(f"File uploaded successfully: {file_path}")
             
@@ -113,31 +224,62 @@ class FileUploader:
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"File upload failed: {str(e)}"
             )
+        finally:
+            if partial_path is not None:
+                partial_path.unlink(missing_ok=True)
+    
+    async def _optimize_image(self, file_path: Path) -> bool:
+        """Optimize uploaded image for better OCR processing (decoding runs off the event loop)"""
+        return await asyncio.get_running_loop().run_in_executor(None, self._optimize_image_sync, file_path)
     
-    async def _optimize_image(self, file_path: Path) -> None:
-        """Optimize uploaded image for better OCR processing"""
+    def _optimize_image_sync(self, file_path: Path) -> bool:
+        """
+        Downscale, orient and re-encode an uploaded image
+        
+        JPEGs are decoded at reduced size (DCT scaling via draft), so a large
+        phone photo never exists in memory at full resolution. Other formats
+        decode at full size, so their pixel count is checked from the header
+        first.
+        
+        Returns:
+            False if the image has more than max_pixels to decode (nothing is
+            decoded then), True otherwise
+        """
         try:
+            max_dimension = self.max_dimension
             with Image.open(file_path) as img:
-                # Convert to RGB if needed
-                if img.mode in ('RGBA', 'LA', 'P'):
-                    img = img.convert('RGB')
+                # Must run before anything loads the pixels; picks the smallest
+                # 1/2, 1/4 or 1/8 scale still at least twice the target size
+                img.draft('RGB', (max_dimension * 2, max_dimension * 2))
                 
-                # Auto-orient image based on EXIF data
-                img = ImageOps.exif_transpose(img)
+                # Size after any draft scaling, read from the header
+                if img.width * img.height > self.max_pixels:
+                    logger.warning(f"Image has {img.width}x{img.height} pixels to decode: {file_path}")
+                    return False
                 
                 # Resize if too large (max 2048px on longer side)
-                max_dimension = 2048
                 if max(img.size) > max_dimension:
                     img.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
                 
+                # Auto-orient image based on EXIF data
+                img = ImageOps.exif_transpose(img)
+                
+                # Convert to RGB if needed
+                if img.mode in ('RGBA', 'LA', 'P'):
+                    img = img.convert('RGB')
+                
                 # Save optimized image
                 img.save(file_path, optimize=True, quality=85)
                 
             logger.info(f"Image optimized: {file_path}")
             
+        except Image.DecompressionBombError as e:
+            logger.warning(f"Image rejected: {str(e)}")
+            return False
         except Exception as e:
             logger.warning(f"Image optimization failed: {str(e)}")
             # Continue without optimization if it fails
+        return True
     
     def get_file_path(self, user_id: str, filename: str) -> Path:
         """Get full file path for a user's receipt"""
@@ -0,0 +1,132 @@
+"""
+Event loop and database client for Celery OCR workers
+
+Celery tasks are synchronous, but the OCR pipeline and Motor are asyncio. A
+task that creates (and closes) its own event loop leaves the Motor client
+bound to a dead loop, so every job pays for new connections, and a client
+reused across loops breaks outright. Each worker process therefore owns one
+long-lived loop, running in a background thread, plus one Motor client and
+OCRService created on that loop. Tasks submit coroutines to it and block on
+the result, which also works for the threads and solo pools.
+
+The runtime is started from worker_process_init and stopped from
+worker_process_shutdown (see backend/ocr/tasks.py); run() starts it on first
+use where those signals do not fire.
+"""
+import asyncio
+import logging
+import threading
+import sys
+import os
+from typing import Any, Awaitable, Optional
+
+# Add backend directory to path for backend modules
+backend_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if backend_path not in sys.path:
+    sys.path.append(backend_path)
+
+from database.mongodb import Database
+from .service import OCRService
+
+logger = logging.getLogger("financial-agent.ocr.worker_runtime")
+
+
+class OCRWorkerRuntime:
+    """Event loop, Motor client and OCRService owned by one worker process"""
+
+    def __init__(self, shutdown_timeout: float = 10.0):
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.db: Optional[Database] = None
+        self.ocr_service: Optional[OCRService] = None
+        self.shutdown_timeout = shutdown_timeout
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """Start the loop thread and connect (no-op when already running)"""
+        if self.running:
+            return
+        with self._lock:
+            if self.running:
+                return
+            self.loop = asyncio.new_event_loop()
+            ready = threading.Event()
+            self._thread = threading.Thread(
+                target=self._run_loop, args=(ready,), name="ocr-worker-loop", daemon=True
+            )
+            self._thread.start()
+            ready.wait()
+            self.db, self.ocr_service = asyncio.run_coroutine_threadsafe(self._connect(), self.loop).result()
+        logger.info(f"OCR worker runtime started (pid {os.getpid()})")
+
+    def _run_loop(self, ready: threading.Event) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_soon(ready.set)
+        self.loop.run_forever()
+
+    async def _connect(self):
+        # Created on the runtime loop; replaces any client inherited from the parent process
+        db = Database()
+        Database._instance = db
+        return db, OCRService(db)
+
+    def run(self, coro: Awaitable[Any], timeout: Optional[float] = None) -> Any:
+        """Run a coroutine on the worker loop and return its result"""
+        self.start()
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        try:
+            return future.result(timeout)
+        except BaseException:
+            # Timeouts and task revocation must not leave the coroutine running
+            future.cancel()
+            raise
+
+    def shutdown(self) -> None:
+        """Close the database client and stop the loop"""
+        if not self.running:
+            return
+        with self._lock:
+            try:
+                asyncio.run_coroutine_threadsafe(self._close(), self.loop).result(self.shutdown_timeout)
+            except Exception as e:
+                logger.warning(f"OCR worker runtime did not close cleanly: {str(e)}")
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join(self.shutdown_timeout)
+            if not self._thread.is_alive():
+                self.loop.close()
+            self._thread = None
+            self.loop = None
+            self.db = None
+            self.ocr_service = None
+        logger.info(f"OCR worker runtime stopped (pid {os.getpid()})")
+
+    async def _close(self) -> None:
+        current = asyncio.current_task()
+        pending = [task for task in asyncio.all_tasks() if task is not current]
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        if self.db is not None:
+            await self.db.close()
+            if Database._instance is self.db:
+                Database._instance = None
+        await self.loop.shutdown_asyncgens()
+
+
+_runtime: Optional[OCRWorkerRuntime] = None
+_runtime_lock = threading.Lock()
+
+
+def get_worker_runtime() -> OCRWorkerRuntime:
+    """Runtime of the current worker process"""
+    global _runtime
+    if _runtime is None:
+        with _runtime_lock:
+            if _runtime is None:
+                _runtime = OCRWorkerRuntime()
+    return _runtime
@@ -10,6 +10,7 @@ from datetime import datetime, timedelta
 import os
 import shutil
 from bson import ObjectId
+from pymongo import ReturnDocument
 import google.generativeai as genai
 import json
 
@@ -346,10 +347,12 @@ async def create_receipt_from_ocr(
         receipt = await service.generate_receipt(receipt_request)
         
         # Store image reference in receipt metadata
-        await db.db.receipts.update_one(
+        receipt_doc = await db.db.receipts.find_one_and_update(
             {"_id": ObjectId(receipt.id)},
-            {"$set": {"metadata.ocr_image_path": image_filename}}
+            {"$set": {"metadata.ocr_image_path": image_filename}},
+            return_document=ReturnDocument.AFTER
         )
+        await db.on_financial_write("receipts", receipt_doc)
         
         # Sync with budgets for expense tracking
         try:
@@ -124,6 +124,7 @@ class ReceiptService:
         receipt_dict = receipt.dict(by_alias=True, exclude={"id"})
         result = await self.receipts_collection.insert_one(receipt_dict)
         receipt.id = str(result.inserted_id)
+        await self.db.on_financial_write("receipts", receipt_dict)
         
         # Log audit event
         await self._log_audit(
@@ -279,6 +280,7 @@ class ReceiptService:
             {"_id": ObjectId(receipt_id)},
             {"$set": update_data}
         )
+        await self.db.on_financial_write("receipts", {"created_at": receipt.created_at})
         
         # Log audit event
         await self._log_audit(
@@ -0,0 +1,421 @@
+"""
+Optimal payment-to-invoice assignment for batch reconciliation
+
+Scoring each payment greedily lets two payments claim the same invoice and
+makes the outcome depend on processing order. This module scores every
+payment/invoice pair at once with NumPy (the same amount/phone/reference
+features as score_candidate), keeps the pairs that reach the match threshold
+and solves a maximum-weight one-to-one assignment over them. Further rounds
+over the residual amounts split payments: installments can settle one invoice
+and one payment can settle several invoices of the same customer.
+"""
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from database.match_keys import (
+    normalize_phone,
+    reference_tokens,
+    invoice_amount,
+    invoice_phone,
+)
+
+try:
+    from scipy.optimize import linear_sum_assignment
+    SCIPY_AVAILABLE = True
+except ImportError:
+    SCIPY_AVAILABLE = False
+
+logger = logging.getLogger("financial-agent.reconciliation.assignment")
+
+# Feature weights, matching score_candidate
+AMOUNT_EXACT_SCORE = 60
+AMOUNT_CLOSE_SCORE = 40
+AMOUNT_PARTIAL_SCORE = 30
+PHONE_SCORE = 25
+REFERENCE_SCORE = 15
+
+# Amounts below this are treated as settled
+MIN_ALLOCATION = 1.0
+
+# Rows scored per block when the dense matrix is needed
+DENSE_BLOCK_ROWS = 512
+
+
+@dataclass
+class Allocation:
+    """Part (or all) of a payment applied to one invoice"""
+    payment_index: int
+    invoice_index: int
+    amount: float
+    score: int
+    round: int
+
+
+@dataclass
+class AssignmentResult:
+    """Allocations for a batch plus solver statistics"""
+    allocations: List[Allocation] = field(default_factory=list)
+    stats: Dict[str, Any] = field(default_factory=dict)
+
+
+def _invoice_due(invoice: Dict[str, Any]) -> float:
+    """Outstanding amount on an invoice"""
+    try:
+        already_paid = float(invoice.get("amount_paid") or 0)
+    except (TypeError, ValueError):
+        already_paid = 0.0
+    return max(0.0, invoice_amount(invoice) - already_paid)
+
+
+def _factorize(values: Sequence[Optional[str]], codes: Dict[str, int]) -> np.ndarray:
+    """Integer codes for hashable values (-1 for missing), sharing one code table"""
+    return np.fromiter(
+        (codes.setdefault(value, len(codes)) if value else -1 for value in values),
+        dtype=np.int64,
+        count=len(values)
+    )
+
+
+class _Features:
+    """Per-side feature arrays for a payment batch and a pending-invoice set"""
+
+    def __init__(self, payments: List[Dict[str, Any]], invoices: List[Dict[str, Any]]):
+        self.n_payments = len(payments)
+        self.n_invoices = len(invoices)
+
+        self.payment_amounts = np.fromiter(
+            (float(p.get("amount", 0) or 0) for p in payments), dtype=np.float64, count=len(payments)
+        )
+        self.invoice_amounts = np.fromiter(
+            (_invoice_due(inv) for inv in invoices), dtype=np.float64, count=len(invoices)
+        )
+
+        phone_codes: Dict[str, int] = {}
+        self.payment_phones = _factorize([normalize_phone(p.get("phone_number")) for p in payments], phone_codes)
+        self.invoice_phones = _factorize(
+            [(inv.get("reconciliation_keys") or {}).get("phone") or invoice_phone(inv) for inv in invoices],
+            phone_codes
+        )
+
+        # Reference matches are sparse: index invoices by token, look payments up
+        by_token: Dict[str, List[int]] = {}
+        for position, invoice in enumerate(invoices):
+            keys = invoice.get("reconciliation_keys") or {}
+            tokens = keys.get("ref_tokens")
+            if tokens is None:
+                tokens = reference_tokens(invoice.get("invoice_number") or invoice.get("invoice_id"))
+            for token in tokens:
+                by_token.setdefault(token, []).append(position)
+
+        ref_rows, ref_cols = [], []
+        for row, payment in enumerate(payments):
+            matched = set()
+            for token in reference_tokens(payment.get("reference") or payment.get("account_reference")):
+                matched.update(by_token.get(token, ()))
+            ref_rows.extend([row] * len(matched))
+            ref_cols.extend(matched)
+        self.ref_keys = np.unique(
+            np.asarray(ref_rows, dtype=np.int64) * max(self.n_invoices, 1) + np.asarray(ref_cols, dtype=np.int64)
+        )
+
+    def phone_pairs(self) -> Tuple[np.ndarray, np.ndarray]:
+        """All (payment, invoice) pairs sharing a normalized phone number"""
+        order = np.argsort(self.invoice_phones, kind="stable")
+        sorted_phones = self.invoice_phones[order]
+        rows = np.flatnonzero(self.payment_phones >= 0)
+        lo = np.searchsorted(sorted_phones, self.payment_phones[rows], side="left")
+        hi = np.searchsorted(sorted_phones, self.payment_phones[rows], side="right")
+        counts = hi - lo
+        if counts.sum() == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        pair_rows = np.repeat(rows, counts)
+        # Position within each payment's run of matching invoices
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        pair_cols = order[np.repeat(lo, counts) + offsets]
+        return pair_rows, pair_cols
+
+    def score_pairs(
+        self,
+        rows: np.ndarray,
+        cols: np.ndarray,
+        payment_amounts: np.ndarray,
+        invoice_amounts: np.ndarray,
+        allow_overpayment: bool
+    ) -> np.ndarray:
+        """Vectorized score for arbitrary (payment, invoice) index arrays"""
+        paid = payment_amounts[rows]
+        due = invoice_amounts[cols]
+        diff = np.abs(paid - due)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            relative = np.where(due != 0, diff / np.abs(due), np.inf)
+        amount_score = np.select(
+            [
+                diff < 1,
+                relative < 0.05,
+                (paid > 0) & (paid < due),
+                # One payment covering several invoices of the same customer
+                allow_overpayment & (due > 0) & (paid > due),
+            ],
+            [AMOUNT_EXACT_SCORE, AMOUNT_CLOSE_SCORE, AMOUNT_PARTIAL_SCORE, AMOUNT_PARTIAL_SCORE],
+            default=0
+        )
+
+        payment_phones = self.payment_phones[rows]
+        phone_match = (payment_phones >= 0) & (payment_phones == self.invoice_phones[cols])
+        ref_match = np.isin(rows * max(self.n_invoices, 1) + cols, self.ref_keys, assume_unique=False)
+
+        return (amount_score + PHONE_SCORE * phone_match + REFERENCE_SCORE * ref_match).astype(np.int16)
+
+
+def build_score_edges(
+    features: _Features,
+    payment_amounts: np.ndarray,
+    invoice_amounts: np.ndarray,
+    threshold: int,
+    allow_overpayment: bool = False
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Sparse payment x invoice score matrix restricted to pairs at or above the threshold
+
+    Above the best amount-only score, a pair needs a phone or reference match,
+    so only those pairs are scored. Lower thresholds score the dense matrix in
+    row blocks.
+
+    Args:
+        features: Feature arrays for the batch
+        payment_amounts: Payment amounts still to allocate
+        invoice_amounts: Invoice amounts still due
+        threshold: Minimum score for an edge
+        allow_overpayment: Score payments larger than the amount due
+
+    Returns:
+        (payment indices, invoice indices, scores) of the edges
+    """
+    active_rows = payment_amounts >= MIN_ALLOCATION
+    active_cols = invoice_amounts >= MIN_ALLOCATION
+
+    if threshold > AMOUNT_EXACT_SCORE:
+        phone_rows, phone_cols = features.phone_pairs()
+        n_cols = max(features.n_invoices, 1)
+        keys = np.union1d(phone_rows * n_cols + phone_cols, features.ref_keys)
+        rows, cols = keys // n_cols, keys % n_cols
+        keep = active_rows[rows] & active_cols[cols]
+        rows, cols = rows[keep], cols[keep]
+        scores = features.score_pairs(rows, cols, payment_amounts, invoice_amounts, allow_overpayment)
+        mask = scores >= threshold
+        return rows[mask], cols[mask], scores[mask]
+
+    edge_rows, edge_cols, edge_scores = [], [], []
+    cols = np.flatnonzero(active_cols)
+    for start in range(0, features.n_payments, DENSE_BLOCK_ROWS):
+        block = np.arange(start, min(start + DENSE_BLOCK_ROWS, features.n_payments))
+        block = block[active_rows[block]]
+        if not len(block) or not len(cols):
+            continue
+        rows = np.repeat(block, len(cols))
+        block_cols = np.tile(cols, len(block))
+        scores = features.score_pairs(rows, block_cols, payment_amounts, invoice_amounts, allow_overpayment)
+        mask = scores >= threshold
+        edge_rows.append(rows[mask])
+        edge_cols.append(block_cols[mask])
+        edge_scores.append(scores[mask])
+    if not edge_rows:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int16)
+    return np.concatenate(edge_rows), np.concatenate(edge_cols), np.concatenate(edge_scores)
+
+
+def _hungarian_max(weights: np.ndarray) -> List[Tuple[int, int]]:
+    """
+    Maximum-weight assignment on a dense matrix (Hungarian algorithm, O(n^3))
+
+    Used when SciPy is not installed; components are small in practice.
+
+    Returns:
+        (row, column) pairs of the assignment, including zero-weight pairs
+    """
+    n_rows, n_cols = weights.shape
+    n = max(n_rows, n_cols)
+    cost = np.zeros((n, n))
+    cost[:n_rows, :n_cols] = -weights
+
+    u = np.zeros(n + 1)
+    v = np.zeros(n + 1)
+    match = np.zeros(n + 1, dtype=np.int64)  # match[j]: 1-based row assigned to column j
+    way = np.zeros(n + 1, dtype=np.int64)
+    for row in range(1, n + 1):
+        match[0] = row
+        j0 = 0
+        minv = np.full(n + 1, np.inf)
+        used = np.zeros(n + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = match[j0]
+            free = np.flatnonzero(~used[1:]) + 1
+            reduced = cost[i0 - 1, free - 1] - u[i0] - v[free]
+            improve = reduced < minv[free]
+            minv[free[improve]] = reduced[improve]
+            way[free[improve]] = j0
+            j1 = free[np.argmin(minv[free])]
+            delta = minv[j1]
+            used_cols = np.flatnonzero(used)
+            u[match[used_cols]] += delta
+            v[used_cols] -= delta
+            minv[free] -= delta
+            j0 = j1
+            if match[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            match[j0] = match[j1]
+            j0 = j1
+
+    return [
+        (int(match[col]) - 1, col - 1)
+        for col in range(1, n_cols + 1)
+        if 0 < match[col] <= n_rows
+    ]
+
+
+def _components(rows: np.ndarray, cols: np.ndarray, n_rows: int) -> np.ndarray:
+    """Connected-component label per edge of the bipartite edge graph (union-find)"""
+    parent = list(range(n_rows + int(cols.max()) + 1 if len(cols) else n_rows))
+
+    def find(node):
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    for row, col in zip(rows.tolist(), (cols + n_rows).tolist()):
+        root_row, root_col = find(row), find(col)
+        if root_row != root_col:
+            parent[root_col] = root_row
+    return np.fromiter((find(row) for row in rows.tolist()), dtype=np.int64, count=len(rows))
+
+
+def solve_assignment(
+    rows: np.ndarray,
+    cols: np.ndarray,
+    scores: np.ndarray,
+    n_rows: int,
+    max_component_size: int = 2000
+) -> Tuple[List[Tuple[int, int, int]], Dict[str, Any]]:
+    """
+    Maximum-weight one-to-one assignment over a sparse edge list
+
+    The edge graph splits into small connected components (usually one
+    customer each), which are solved independently. Components larger than
+    max_component_size fall back to greedy by descending score when SciPy is
+    not installed.
+
+    Returns:
+        ([(row, col, score)], solver stats)
+    """
+    stats = {"edges": int(len(rows)), "components": 0, "largest_component": 0, "greedy_components": 0,
+             "solver": "scipy" if SCIPY_AVAILABLE else "hungarian"}
+    if not len(rows):
+        return [], stats
+
+    labels = _components(rows, cols, n_rows)
+    order = np.argsort(labels, kind="stable")
+    boundaries = np.flatnonzero(np.diff(labels[order])) + 1
+    assigned: List[Tuple[int, int, int]] = []
+
+    for group in np.split(order, boundaries):
+        stats["components"] += 1
+        if len(group) == 1:
+            edge = group[0]
+            assigned.append((int(rows[edge]), int(cols[edge]), int(scores[edge])))
+            continue
+
+        local_rows, row_index = np.unique(rows[group], return_inverse=True)
+        local_cols, col_index = np.unique(cols[group], return_inverse=True)
+        size = max(len(local_rows), len(local_cols))
+        stats["largest_component"] = max(stats["largest_component"], size)
+
+        if not SCIPY_AVAILABLE and size > max_component_size:
+            stats["greedy_components"] += 1
+            taken_rows, taken_cols = set(), set()
+            for edge in group[np.argsort(-scores[group], kind="stable")]:
+                if rows[edge] not in taken_rows and cols[edge] not in taken_cols:
+                    taken_rows.add(rows[edge])
+                    taken_cols.add(cols[edge])
+                    assigned.append((int(rows[edge]), int(cols[edge]), int(scores[edge])))
+            continue
+
+        weights = np.zeros((len(local_rows), len(local_cols)))
+        weights[row_index, col_index] = scores[group]
+        if SCIPY_AVAILABLE:
+            pairs = zip(*linear_sum_assignment(weights, maximize=True))
+        else:
+            pairs = _hungarian_max(weights)
+        for r, c in pairs:
+            # Zero weight means the pair is not an edge (left unassigned)
+            if weights[r, c] > 0:
+                assigned.append((int(local_rows[r]), int(local_cols[c]), int(weights[r, c])))
+
+    return assigned, stats
+
+
+def allocate_payments(
+    payments: List[Dict[str, Any]],
+    invoices: List[Dict[str, Any]],
+    threshold: int,
+    split_payments: bool = True,
+    max_rounds: int = 3,
+    max_component_size: int = 2000
+) -> AssignmentResult:
+    """
+    Allocate a batch of payments to pending invoices
+
+    Round 1 is a one-to-one maximum-weight assignment. With split_payments,
+    later rounds re-run the assignment over what is left: the unpaid balance
+    of partially paid invoices and the unallocated part of payments that
+    exceeded their invoice, so installments and multi-invoice payments are
+    allocated too.
+
+    Args:
+        payments: Payments to allocate (amount, phone_number, reference)
+        invoices: Pending invoices
+        threshold: Minimum score for an allocation
+        split_payments: Allow multiple allocations per payment/invoice
+        max_rounds: Maximum assignment rounds when splitting
+        max_component_size: Largest component solved exactly without SciPy
+
+    Returns:
+        AssignmentResult with allocations and per-round statistics
+    """
+    features = _Features(payments, invoices)
+    remaining_payments = features.payment_amounts.copy()
+    remaining_due = features.invoice_amounts.copy()
+    result = AssignmentResult(stats={"rounds": []})
+
+    for round_number in range(1, (max_rounds if split_payments else 1) + 1):
+        rows, cols, scores = build_score_edges(
+            features, remaining_payments, remaining_due, threshold,
+            allow_overpayment=split_payments
+        )
+        assigned, round_stats = solve_assignment(rows, cols, scores, features.n_payments, max_component_size)
+        round_stats["allocations"] = len(assigned)
+        result.stats["rounds"].append(round_stats)
+        if not assigned:
+            break
+
+        for row, col, score in assigned:
+            amount = round(float(min(remaining_payments[row], remaining_due[col])), 2)
+            remaining_payments[row] -= amount
+            remaining_due[col] -= amount
+            result.allocations.append(Allocation(row, col, amount, score, round_number))
+
+    result.stats["allocations"] = len(result.allocations)
+    result.stats["allocated_amount"] = round(sum(a.amount for a in result.allocations), 2)
+    result.stats["remaining_payments"] = remaining_payments
+    result.stats["remaining_due"] = remaining_due
+    logger.info(
+        f"Assigned {len(result.allocations)} allocations for {features.n_payments} payments "
+        f"over {features.n_invoices} invoices in {len(result.stats['rounds'])} rounds"
+    )
+    return result
@@ -0,0 +1,311 @@
+"""
+Batch reconciliation engine
+
+Reconciles a batch of unreconciled payments against one snapshot of the
+pending invoices. In "score" mode candidates come from an in-memory index and
+payments are scored concurrently (bounded by a semaphore so Gemini is not
+flooded); in "optimal" mode the whole batch is allocated at once with a
+maximum-weight assignment (see assignment.py). Either way all logs and
+invoice/transaction updates are written with bulk writes at the end instead
+of several round trips per payment.
+"""
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+from database.match_keys import invoice_amount
+from .candidates import PendingInvoiceIndex, MATCH_THRESHOLD, AUTO_MATCH_THRESHOLD
+from .assignment import allocate_payments, MIN_ALLOCATION
+
+BATCH_MODES = ("auto", "score", "optimal")
+
+logger = logging.getLogger("financial-agent.reconciliation.batch")
+
+
+class BatchReconciliationConfig:
+    """Batch reconciliation configuration"""
+
+    def __init__(self):
+        # Payments scored at the same time (bounds concurrent Gemini calls)
+        self.concurrency = int(os.environ.get("RECONCILIATION_BATCH_CONCURRENCY", "8"))
+        # Operations per bulk_write call
+        self.write_batch_size = int(os.environ.get("RECONCILIATION_BATCH_WRITE_SIZE", "1000"))
+        # "score": per-payment scoring (Gemini when available), "optimal": batch
+        # assignment, "auto": optimal unless Gemini is available
+        self.mode = os.environ.get("RECONCILIATION_BATCH_MODE", "auto")
+        # Let optimal mode split payments across invoices and invoices across payments
+        self.split_payments = os.environ.get("RECONCILIATION_BATCH_SPLIT_PAYMENTS", "true").lower() == "true"
+
+
+def _payment_label(payment: Dict[str, Any]) -> str:
+    return payment.get("receipt_number", payment.get("id", "unknown"))
+
+
+class BatchReconciliationEngine:
+    """Concurrent batch reconciliation over a single pending-invoice snapshot"""
+
+    def __init__(self, service, config: Optional[BatchReconciliationConfig] = None):
+        """
+        Args:
+            service: ReconciliationService providing the database, Gemini
+                service and the per-payment decision logic
+            config: Batch configuration (defaults to environment settings)
+        """
+        self.service = service
+        self.db = service.db
+        self.config = config or BatchReconciliationConfig()
+
+    async def _load_pending_invoices(self) -> List[Dict[str, Any]]:
+        """Load the pending invoices once for the whole batch"""
+        if self.db is not None:
+            return await self.db.get_pending_invoices()
+        return self.service._get_mock_invoices()
+
+    async def _score_payment(
+        self,
+        payment: Dict[str, Any],
+        index: PendingInvoiceIndex,
+        semaphore: asyncio.Semaphore
+    ) -> Dict[str, Any]:
+        """Reconcile one payment against the snapshot (no writes)"""
+        async with semaphore:
+            candidates = index.shortlist(payment)
+            if not candidates:
+                return {"payment": payment, "result": None}
+
+            result = await self.service._match_payment(payment, candidates)
+            return {"payment": payment, "result": result}
+
+    @staticmethod
+    def _release_conflicts(scored: List[Dict[str, Any]]):
+        """
+        Keep one payment per invoice within the batch
+
+        Processed one by one, an invoice stops being pending once a payment
+        matches it; with a shared snapshot later payments in the batch would
+        match it again, so they are sent to review instead.
+        """
+        claimed = set()
+        for item in scored:
+            result = item.get("result")
+            if not result or result.get("action_required", True):
+                continue
+            invoice_id = result.get("matched_invoice_id")
+            if not invoice_id:
+                continue
+            if invoice_id in claimed:
+                item["result"] = {
+                    **result,
+                    "matched_invoice_id": None,
+                    "action_required": True,
+                    "review_reason": "Invoice already matched by another payment in this batch",
+                    "best_potential_match": invoice_id
+                }
+            else:
+                claimed.add(invoice_id)
+
+    def _resolve_mode(self) -> str:
+        mode = self.config.mode if self.config.mode in BATCH_MODES else "auto"
+        if mode == "auto":
+            return "score" if self.service.gemini_service is not None else "optimal"
+        return mode
+
+    def _assign(self, payments: List[Dict[str, Any]], invoices: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """Allocate the whole batch with the optimal assignment (no writes)"""
+        assignment = allocate_payments(payments, invoices, MATCH_THRESHOLD, split_payments=self.config.split_payments)
+        remaining_payments = assignment.stats.pop("remaining_payments")
+        assignment.stats.pop("remaining_due")
+
+        by_payment: Dict[int, list] = {}
+        for allocation in assignment.allocations:
+            by_payment.setdefault(allocation.payment_index, []).append(allocation)
+
+        # Only confident payments are written (medium ones go to review), so
+        # balances count just their allocations, as run() does when writing
+        applied: Dict[int, float] = {}
+        for allocations in by_payment.values():
+            if min(a.score for a in allocations) >= AUTO_MATCH_THRESHOLD:
+                for a in allocations:
+                    applied[a.invoice_index] = applied.get(a.invoice_index, 0.0) + a.amount
+
+        def balance(invoice_index: int) -> float:
+            invoice = invoices[invoice_index]
+            paid = float(invoice.get("amount_paid") or 0) + applied.get(invoice_index, 0.0)
+            return round(max(0.0, invoice_amount(invoice) - paid), 2)
+
+        scored = []
+        for position, payment in enumerate(payments):
+            allocations = by_payment.get(position)
+            if not invoices:
+                result = None
+            elif not allocations:
+                result = {
+                    "matched_invoice_id": None,
+                    "confidence_score": 0,
+                    "action_required": True,
+                    "review_reason": "No match found",
+                    "partial_payment": False,
+                    "best_potential_match": None,
+                    "assignment": "optimal"
+                }
+            else:
+                primary = max(allocations, key=lambda a: a.amount)
+                invoice = invoices[primary.invoice_index]
+                confidence = min(a.score for a in allocations)
+                result = {
+                    "matched_invoice_id": invoice.get("id"),
+                    "confidence_score": confidence,
+                    "action_required": confidence < AUTO_MATCH_THRESHOLD,
+                    "review_reason": "Medium confidence match" if confidence < AUTO_MATCH_THRESHOLD else None,
+                    "partial_payment": balance(primary.invoice_index) >= MIN_ALLOCATION,
+                    "amount_paid": float(payment.get("amount", 0) or 0),
+                    "balance": balance(primary.invoice_index),
+                    "invoice_details": {
+                        "invoice_number": invoice.get("invoice_number"),
+                        "customer": (invoice.get("customer") or {}).get("name"),
+                        "amount": invoice_amount(invoice)
+                    },
+                    "allocations": [
+                        {
+                            "invoice_id": invoices[a.invoice_index].get("id"),
+                            "invoice_number": invoices[a.invoice_index].get("invoice_number"),
+                            "amount": a.amount,
+                            "confidence_score": a.score
+                        }
+                        for a in allocations
+                    ],
+                    "unallocated_amount": round(float(remaining_payments[position]), 2),
+                    "assignment": "optimal"
+                }
+            scored.append({"payment": payment, "result": result})
+        return scored, assignment.stats
+
+    async def run(self, payments: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Reconcile a batch of payments
+
+        Args:
+            payments: Unreconciled payments
+
+        Returns:
+            Dict with batch processing results and throughput
+        """
+        started = time.perf_counter()
+        mode = self._resolve_mode()
+        invoices = await self._load_pending_invoices()
+        invoices_by_id = {invoice.get("id"): invoice for invoice in invoices}
+        logger.info(f"Reconciling {len(payments)} payments against {len(invoices)} pending invoices ({mode} mode)")
+
+        results = {
+            "total_processed": len(payments),
+            "reconciled": 0,
+            "needs_review": 0,
+            "failed": 0,
+            "details": []
+        }
+
+        if mode == "optimal":
+            # CPU-bound; keep the event loop responsive while the batch is solved
+            succeeded, results["assignment"] = await asyncio.to_thread(self._assign, payments, invoices)
+        else:
+            # Score concurrently; return_exceptions keeps one failure from sinking the batch
+            index = PendingInvoiceIndex(invoices)
+            semaphore = asyncio.Semaphore(max(1, self.config.concurrency))
+            scored = await asyncio.gather(
+                *(self._score_payment(payment, index, semaphore) for payment in payments),
+                return_exceptions=True
+            )
+
+            succeeded = []
+            for payment, item in zip(payments, scored):
+                if isinstance(item, Exception):
+                    logger.error(f"Error processing payment in batch: {str(item)}")
+                    results["failed"] += 1
+                    results["details"].append({"payment_id": _payment_label(payment), "error": str(item)})
+                else:
+                    succeeded.append(item)
+            self._release_conflicts(succeeded)
+        scoring_seconds = time.perf_counter() - started
+
+        logs, invoice_updates, transaction_updates, paid_invoices = [], [], [], []
+        # Optimal-mode allocations, summed per invoice across payments
+        allocated: Dict[str, Dict[str, Any]] = {}
+        for item in succeeded:
+            payment, result = item["payment"], item["result"]
+            if result is None:
+                response = {
+                    "success": False,
+                    "message": "No pending invoices found",
+                    "matched_invoice_id": None,
+                    "confidence_score": 0
+                }
+            else:
+                outcome = self.service._plan_outcome(payment, result)
+                response = outcome["response"]
+                logs.append({"payment_data": payment, "result": result, "timestamp": datetime.now()})
+                transaction_update = outcome["transaction_update"]
+                if outcome["invoice_update"] and result.get("allocations"):
+                    for allocation in result["allocations"]:
+                        entry = allocated.setdefault(allocation["invoice_id"], {"amount": 0.0, "transactions": []})
+                        entry["amount"] += allocation["amount"]
+                        entry["transactions"].append(payment.get("transaction_id", "unknown"))
+                    if transaction_update:
+                        transaction_update = {**transaction_update, "allocations": result["allocations"]}
+                elif outcome["invoice_update"]:
+                    invoice_updates.append((outcome["matched_invoice_id"], outcome["invoice_update"]))
+                    if outcome["matched_invoice_id"] in invoices_by_id:
+                        paid_invoices.append(invoices_by_id[outcome["matched_invoice_id"]])
+                if transaction_update:
+                    transaction_updates.append((payment["transaction_id"], transaction_update))
+
+            if response.get("success") and not response.get("needs_review"):
+                results["reconciled"] += 1
+            elif response.get("needs_review"):
+                results["needs_review"] += 1
+            else:
+                results["failed"] += 1
+            results["details"].append({"payment_id": _payment_label(payment), "result": response})
+
+        for invoice_id, entry in allocated.items():
+            invoice = invoices_by_id[invoice_id]
+            amount_paid = round(float(invoice.get("amount_paid") or 0) + entry["amount"], 2)
+            balance = round(max(0.0, invoice_amount(invoice) - amount_paid), 2)
+            invoice_updates.append((invoice_id, {
+                "status": "paid" if balance < MIN_ALLOCATION else "partially_paid",
+                "amount_paid": amount_paid,
+                "balance": balance,
+                "payment_transactions": entry["transactions"]
+            }))
+            paid_invoices.append(invoice)
+
+        write_started = time.perf_counter()
+        if self.db is not None:
+            results["writes"] = await self.db.apply_reconciliation_batch(
+                logs, invoice_updates, transaction_updates,
+                batch_size=self.config.write_batch_size
+            )
+            # Status changes move invoices between revenue rollups; reconciliation
+            # fields on transactions do not feed any rollup
+            if paid_invoices:
+                await self.db.on_financial_write("invoices", *paid_invoices)
+        write_seconds = time.perf_counter() - write_started
+
+        elapsed = time.perf_counter() - started
+        results["throughput"] = {
+            "mode": mode,
+            "pending_invoices": len(invoices),
+            "concurrency": self.config.concurrency,
+            "scoring_seconds": round(scoring_seconds, 4),
+            "write_seconds": round(write_seconds, 4),
+            "elapsed_seconds": round(elapsed, 4),
+            "payments_per_second": round(len(payments) / elapsed, 2) if elapsed > 0 else 0.0
+        }
+        logger.info(
+            f"Batch reconciliation finished: {results['reconciled']} reconciled, "
+            f"{results['needs_review']} for review, {results['failed']} failed, "
+            f"{results['throughput']['payments_per_second']} payments/sec"
+        )
+        return results
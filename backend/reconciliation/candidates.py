@@ -0,0 +1,278 @@
+"""
+Candidate retrieval for payment reconciliation
+
+Shortlists the top-k pending invoices for a payment through indexes on the
+invoices' normalized reconciliation_keys (phone, amount band, invoice-number
+tokens) so scoring and Gemini prompts only see a handful of plausible
+invoices instead of every pending invoice.
+"""
+import os
+import random
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Dict, Any, List, Optional, Tuple
+
+from database.match_keys import (
+    normalize_phone,
+    amount_band,
+    reference_tokens,
+    invoice_amount,
+    invoice_phone,
+    build_invoice_match_keys,
+)
+
+logger = logging.getLogger("financial-agent.reconciliation.candidates")
+
+PENDING_INVOICE_STATUSES = ["sent", "overdue"]
+
+# Minimum score for _basic_reconciliation to accept a match
+MATCH_THRESHOLD = 70
+
+# Matches below this score are accepted but flagged for human review
+AUTO_MATCH_THRESHOLD = 80
+
+
+class CandidateRetrievalConfig:
+    """Candidate retrieval configuration"""
+
+    def __init__(self):
+        # Invoices handed to scoring / the Gemini prompt per payment
+        self.top_k = int(os.environ.get("RECONCILIATION_CANDIDATE_K", "20"))
+        # Upper bound on invoices pulled from the amount band before pre-scoring
+        # (phone and reference matches are always included)
+        self.scan_limit = int(os.environ.get("RECONCILIATION_CANDIDATE_SCAN_LIMIT", "500"))
+        # Fraction of lookups re-checked against a full pending-invoice scan to
+        # measure the shortlist hit rate (0 disables shadow checks and the
+        # shortlist_hit_rate metric; each check loads every pending invoice)
+        self.shadow_sample_rate = float(os.environ.get("RECONCILIATION_SHADOW_SAMPLE_RATE", "0.01"))
+
+
+def score_candidate(payment_data: Dict[str, Any], invoice: Dict[str, Any]) -> int:
+    """
+    Score how well an invoice matches a payment (0-100)
+
+    Amount: 60 exact (within 1 KES), 40 within 5%, 30 plausible partial payment.
+    Phone: 25 when the normalized phone numbers agree.
+    Reference: 15 when the payment reference and invoice number contain each other.
+    """
+    score = 0
+    payment_amount = float(payment_data.get("amount", 0) or 0)
+    amount = invoice_amount(invoice)
+
+    if abs(payment_amount - amount) < 1:
+        score += 60
+    elif amount != 0 and abs(payment_amount - amount) / amount < 0.05:
+        score += 40
+    elif payment_amount > 0 and payment_amount < amount:
+        score += 30
+
+    payment_phone = normalize_phone(payment_data.get("phone_number"))
+    keys = invoice.get("reconciliation_keys") or {}
+    phone = keys.get("phone") or invoice_phone(invoice)
+    if phone and phone == payment_phone:
+        score += 25
+
+    payment_reference = str(payment_data.get("reference", "") or "").lower()
+    invoice_number = str(invoice.get("invoice_number", "") or "").lower()
+    if payment_reference and invoice_number and (
+        payment_reference in invoice_number or
+        invoice_number in payment_reference
+    ):
+        score += 15
+
+    return score
+
+
+class CandidateRetriever:
+    """Index-backed shortlist of pending invoices for a payment"""
+
+    def __init__(self, db, config: Optional[CandidateRetrievalConfig] = None):
+        """
+        Args:
+            db: Database instance
+            config: Retrieval configuration (defaults to environment settings)
+        """
+        self.db = db
+        self.config = config or CandidateRetrievalConfig()
+        self.metrics = {
+            "lookups": 0,
+            "candidates_returned": 0,
+            "empty_shortlists": 0,
+            "matched": 0,
+            "shadow_checks": 0,
+            "shadow_hits": 0,
+        }
+
+    def _build_queries(self, payment_data: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """
+        Index-friendly queries over the payment's match keys
+
+        Returns:
+            (keyed queries on phone and reference tokens, amount-band query or None)
+        """
+        pending = {"status": {"$in": PENDING_INVOICE_STATUSES}}
+        keyed = []
+
+        phone = normalize_phone(payment_data.get("phone_number"))
+        if phone:
+            keyed.append({**pending, "reconciliation_keys.phone": phone})
+
+        tokens = reference_tokens(payment_data.get("reference") or payment_data.get("account_reference"))
+        if tokens:
+            keyed.append({**pending, "reconciliation_keys.ref_tokens": {"$in": tokens}})
+
+        band = amount_band(payment_data.get("amount"))
+        band_query = None
+        if band is not None:
+            band_query = {**pending, "reconciliation_keys.amount_band": {"$in": [band - 1, band, band + 1]}}
+        return keyed, band_query
+
+    async def shortlist(self, payment_data: Dict[str, Any], top_k: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Retrieve the top-k candidate invoices for a payment
+
+        Args:
+            payment_data: Payment data (amount, phone_number, reference)
+            top_k: Override for the configured shortlist size
+
+        Returns:
+            Candidate invoices, best pre-score first, each with a
+            `candidate_score` field
+        """
+        top_k = top_k or self.config.top_k
+        self.metrics["lookups"] += 1
+
+        # Phone and reference matches are selective and always kept; only the
+        # amount band (which can hold many invoices) is capped
+        keyed, band_query = self._build_queries(payment_data)
+        lookups = [self.db.invoices.find(query).to_list(None) for query in keyed]
+        if band_query is not None:
+            lookups.append(self.db.invoices.find(band_query).limit(self.config.scan_limit).to_list(None))
+
+        candidates = {}
+        for docs in await asyncio.gather(*lookups):
+            for doc in docs:
+                if "_id" in doc:
+                    doc["id"] = str(doc.pop("_id"))
+                if doc.get("id") in candidates:
+                    continue
+                doc["candidate_score"] = score_candidate(payment_data, doc)
+                candidates[doc.get("id")] = doc
+        candidates = list(candidates.values())
+
+        candidates.sort(key=lambda inv: inv["candidate_score"], reverse=True)
+        candidates = candidates[:top_k]
+
+        self.metrics["candidates_returned"] += len(candidates)
+        if not candidates:
+            self.metrics["empty_shortlists"] += 1
+
+        if self.config.shadow_sample_rate > 0 and random.random() < self.config.shadow_sample_rate:
+            await self._shadow_check(payment_data, candidates)
+
+        logger.info(f"Shortlisted {len(candidates)} candidate invoices for payment")
+        return candidates
+
+    async def _shadow_check(self, payment_data: Dict[str, Any], candidates: List[Dict[str, Any]]):
+        """Compare the shortlist with the best match from a full pending-invoice scan"""
+        try:
+            best_id, best_score = None, 0
+            for invoice in await self.db.get_pending_invoices():
+                score = score_candidate(payment_data, invoice)
+                if score > best_score:
+                    best_id, best_score = invoice.get("id"), score
+
+            self.metrics["shadow_checks"] += 1
+            shortlist_ids = {inv.get("id") for inv in candidates}
+            if best_score < MATCH_THRESHOLD or best_id in shortlist_ids:
+                self.metrics["shadow_hits"] += 1
+            else:
+                logger.warning(f"Shortlist missed best full-scan match {best_id} (score {best_score})")
+        except Exception as e:
+            logger.error(f"Shadow candidate check failed: {str(e)}")
+
+    def record_outcome(self, matched_invoice_id: Optional[str]):
+        """Record whether a reconciliation matched one of the shortlisted invoices"""
+        if matched_invoice_id:
+            self.metrics["matched"] += 1
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Shortlist size, match rate and shadow-measured hit rate"""
+        lookups = self.metrics["lookups"]
+        shadow_checks = self.metrics["shadow_checks"]
+        return {
+            **self.metrics,
+            "top_k": self.config.top_k,
+            "avg_shortlist_size": round(self.metrics["candidates_returned"] / lookups, 2) if lookups else 0.0,
+            "match_rate": round(self.metrics["matched"] / lookups, 4) if lookups else 0.0,
+            "shortlist_hit_rate": round(self.metrics["shadow_hits"] / shadow_checks, 4) if shadow_checks else None,
+        }
+
+
+class PendingInvoiceIndex:
+    """
+    In-memory candidate index over a pending-invoice snapshot
+
+    Batch reconciliation loads the pending invoices once and shortlists every
+    payment against this index with the same keys CandidateRetriever queries
+    in MongoDB, instead of issuing one query per payment.
+    """
+
+    def __init__(self, invoices: List[Dict[str, Any]], config: Optional[CandidateRetrievalConfig] = None):
+        """
+        Args:
+            invoices: Pending invoices (with `id` set)
+            config: Retrieval configuration (defaults to environment settings)
+        """
+        self.config = config or CandidateRetrievalConfig()
+        self.invoices = invoices
+        self.by_phone: Dict[str, List[int]] = defaultdict(list)
+        self.by_band: Dict[int, List[int]] = defaultdict(list)
+        self.by_token: Dict[str, List[int]] = defaultdict(list)
+
+        for position, invoice in enumerate(invoices):
+            # Invoices written before the keys existed fall back to embedded fields
+            keys = invoice.get("reconciliation_keys") or build_invoice_match_keys(invoice)
+            if keys.get("phone"):
+                self.by_phone[keys["phone"]].append(position)
+            if keys.get("amount_band") is not None:
+                self.by_band[keys["amount_band"]].append(position)
+            for token in keys.get("ref_tokens") or []:
+                self.by_token[token].append(position)
+
+    def __len__(self) -> int:
+        return len(self.invoices)
+
+    def shortlist(self, payment_data: Dict[str, Any], top_k: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Shortlist the top-k candidate invoices for a payment
+
+        Args:
+            payment_data: Payment data (amount, phone_number, reference)
+            top_k: Override for the configured shortlist size
+
+        Returns:
+            Candidate invoices, best pre-score first (the snapshot documents
+            are shared, so callers must not mutate them)
+        """
+        top_k = top_k or self.config.top_k
+        positions = set()
+
+        phone = normalize_phone(payment_data.get("phone_number"))
+        if phone:
+            positions.update(self.by_phone.get(phone, ()))
+
+        band = amount_band(payment_data.get("amount"))
+        if band is not None:
+            for neighbour in (band - 1, band, band + 1):
+                positions.update(self.by_band.get(neighbour, ()))
+
+        for token in reference_tokens(payment_data.get("reference") or payment_data.get("account_reference")):
+            positions.update(self.by_token.get(token, ()))
+
+        scored = sorted(
+            ((score_candidate(payment_data, self.invoices[position]), position) for position in positions),
+            key=lambda item: (-item[0], item[1])
+        )
+        return [self.invoices[position] for _, position in scored[:top_k]]
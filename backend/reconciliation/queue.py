@@ -0,0 +1,387 @@
+"""
+Durable reconciliation work queue
+
+Payments waiting for reconciliation are stored as jobs in a MongoDB
+collection and processed by a fixed-size pool of asyncio workers that lease
+jobs, so callbacks survive restarts, bursts queue up instead of spawning
+unbounded tasks, failures are retried with exponential backoff and jobs that
+keep failing are dead-lettered for inspection.
+
+Job lifecycle: pending -> processing (leased) -> done
+                                  \\-> pending (retry with backoff) -> ... -> dead
+A worker that dies mid-job leaves an expired lease, and the job is claimed
+again by the next worker.
+"""
+import os
+import uuid
+import socket
+import random
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional, Callable, Awaitable, List
+
+from pymongo import ReturnDocument
+
+logger = logging.getLogger("financial-agent.reconciliation.queue")
+
+JOB_PENDING = "pending"
+JOB_PROCESSING = "processing"
+JOB_DONE = "done"
+JOB_DEAD = "dead"
+
+
+def payment_job_id(payment_data: Dict[str, Any]) -> str:
+    """Job ID that is the same for every delivery of one payment"""
+    reference = payment_data.get("receipt_number") or payment_data.get("gateway_reference")
+    if reference:
+        return f"ref-{reference}"
+    transaction_id = payment_data.get("transaction_id")
+    return f"txn-{transaction_id}" if transaction_id else str(uuid.uuid4())
+
+
+class ReconciliationQueueFull(Exception):
+    """Raised when the queue is at its configured maximum depth"""
+
+
+class ReconciliationQueueConfig:
+    """Reconciliation queue configuration"""
+
+    def __init__(self):
+        self.collection = os.environ.get("RECONCILIATION_QUEUE_COLLECTION", "reconciliation_queue")
+        # In-process workers (0 disables them, e.g. when a separate worker process runs)
+        self.workers = int(os.environ.get("RECONCILIATION_WORKERS", "4"))
+        # How long a claimed job stays reserved without a heartbeat
+        self.lease_seconds = int(os.environ.get("RECONCILIATION_LEASE_SECONDS", "60"))
+        self.max_attempts = int(os.environ.get("RECONCILIATION_MAX_ATTEMPTS", "5"))
+        self.retry_base_seconds = float(os.environ.get("RECONCILIATION_RETRY_BASE_SECONDS", "2"))
+        self.retry_max_seconds = float(os.environ.get("RECONCILIATION_RETRY_MAX_SECONDS", "300"))
+        # Idle workers poll for new jobs this often
+        self.poll_interval = float(os.environ.get("RECONCILIATION_POLL_INTERVAL", "1.0"))
+        # Reject new jobs beyond this many waiting jobs (0 = unlimited)
+        self.max_depth = int(os.environ.get("RECONCILIATION_QUEUE_MAX_DEPTH", "0"))
+        # Completed jobs are removed by a TTL index after this many days
+        self.retention_days = int(os.environ.get("RECONCILIATION_QUEUE_RETENTION_DAYS", "7"))
+
+
+class ReconciliationQueue:
+    """MongoDB-backed job queue with leases, retries and dead-lettering"""
+
+    def __init__(self, db, config: Optional[ReconciliationQueueConfig] = None):
+        """
+        Args:
+            db: Database instance
+            config: Queue configuration (defaults to environment settings)
+        """
+        self.config = config or ReconciliationQueueConfig()
+        self.jobs = db.db[self.config.collection]
+        self._indexes_ready = False
+
+    async def ensure_indexes(self):
+        """Create the claim, lease-recovery and retention indexes"""
+        if self._indexes_ready:
+            return
+        await self.jobs.create_index([("status", 1), ("available_at", 1)])
+        await self.jobs.create_index([("status", 1), ("lease_expires_at", 1)])
+        await self.jobs.create_index(
+            "completed_at",
+            expireAfterSeconds=self.config.retention_days * 86400
+        )
+        self._indexes_ready = True
+
+    def _backoff(self, attempts: int) -> float:
+        """Exponential backoff (jittered between half and full delay) for the given attempt number"""
+        ceiling = min(self.config.retry_max_seconds, self.config.retry_base_seconds * (2 ** max(0, attempts - 1)))
+        return random.uniform(ceiling / 2, ceiling)
+
+    async def depth(self) -> int:
+        """Jobs waiting or in progress"""
+        return await self.jobs.count_documents({"status": {"$in": [JOB_PENDING, JOB_PROCESSING]}})
+
+    async def enqueue(self, payment_data: Dict[str, Any]) -> str:
+        """
+        Add a payment to the queue
+
+        A payment is enqueued at most once per gateway receipt number (or
+        transaction_id when it has none), so a redelivered M-Pesa callback
+        does not reconcile the same payment twice.
+
+        Args:
+            payment_data: Payment data to reconcile
+
+        Returns:
+            Job ID
+
+        Raises:
+            ReconciliationQueueFull: If the queue is at its maximum depth
+        """
+        if self.config.max_depth and await self.depth() >= self.config.max_depth:
+            raise ReconciliationQueueFull(f"Reconciliation queue is full ({self.config.max_depth} jobs)")
+
+        job_id = payment_job_id(payment_data)
+        now = datetime.now()
+        await self.jobs.update_one(
+            {"_id": job_id},
+            {"$setOnInsert": {
+                "payment_data": payment_data,
+                "status": JOB_PENDING,
+                "attempts": 0,
+                "available_at": now,
+                "created_at": now,
+                "updated_at": now
+            }},
+            upsert=True
+        )
+        return job_id
+
+    async def claim(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Lease the next due job (or a job whose lease expired)
+
+        Args:
+            worker_id: ID of the claiming worker
+
+        Returns:
+            The claimed job, or None if nothing is due
+        """
+        now = datetime.now()
+        return await self.jobs.find_one_and_update(
+            {"$or": [
+                {"status": JOB_PENDING, "available_at": {"$lte": now}},
+                {"status": JOB_PROCESSING, "lease_expires_at": {"$lt": now}}
+            ]},
+            {
+                "$set": {
+                    "status": JOB_PROCESSING,
+                    "lease_owner": worker_id,
+                    "lease_expires_at": now + timedelta(seconds=self.config.lease_seconds),
+                    "updated_at": now
+                },
+                "$inc": {"attempts": 1}
+            },
+            sort=[("available_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def extend_lease(self, job: Dict[str, Any], worker_id: str) -> bool:
+        """Push a running job's lease forward; False if the lease was lost"""
+        result = await self.jobs.update_one(
+            {"_id": job["_id"], "status": JOB_PROCESSING, "lease_owner": worker_id},
+            {"$set": {"lease_expires_at": datetime.now() + timedelta(seconds=self.config.lease_seconds)}}
+        )
+        return result.modified_count == 1
+
+    async def complete(self, job: Dict[str, Any], worker_id: str, result: Dict[str, Any]):
+        """Mark a job done with a summary of its reconciliation result"""
+        now = datetime.now()
+        await self.jobs.update_one(
+            {"_id": job["_id"], "lease_owner": worker_id},
+            {
+                "$set": {
+                    "status": JOB_DONE,
+                    "result": {
+                        "success": result.get("success"),
+                        "message": result.get("message"),
+                        "matched_invoice_id": result.get("matched_invoice_id"),
+                        "needs_review": result.get("needs_review"),
+                        "confidence_score": result.get("confidence_score")
+                    },
+                    "completed_at": now,
+                    "updated_at": now
+                },
+                "$unset": {"lease_owner": "", "lease_expires_at": ""}
+            }
+        )
+
+    async def fail(self, job: Dict[str, Any], worker_id: str, error: str) -> str:
+        """
+        Record a failed attempt: schedule a retry or dead-letter the job
+
+        Returns:
+            The job's new status
+        """
+        now = datetime.now()
+        if job.get("attempts", 1) >= self.config.max_attempts:
+            update = {"status": JOB_DEAD, "dead_lettered_at": now}
+            logger.error(f"Dead-lettered reconciliation job {job['_id']} after {job.get('attempts')} attempts: {error}")
+        else:
+            delay = self._backoff(job.get("attempts", 1))
+            update = {"status": JOB_PENDING, "available_at": now + timedelta(seconds=delay)}
+            logger.warning(f"Reconciliation job {job['_id']} failed (attempt {job.get('attempts')}), retrying in {delay:.1f}s: {error}")
+
+        await self.jobs.update_one(
+            {"_id": job["_id"], "lease_owner": worker_id},
+            {
+                "$set": {**update, "last_error": error, "updated_at": now},
+                "$unset": {"lease_owner": "", "lease_expires_at": ""}
+            }
+        )
+        return update["status"]
+
+    async def requeue_dead_letters(self, job_ids: Optional[List[str]] = None) -> int:
+        """
+        Move dead-lettered jobs back to the queue with a fresh attempt budget
+
+        Args:
+            job_ids: Jobs to requeue (all dead letters when omitted)
+
+        Returns:
+            Number of jobs requeued
+        """
+        query: Dict[str, Any] = {"status": JOB_DEAD}
+        if job_ids:
+            query["_id"] = {"$in": job_ids}
+        now = datetime.now()
+        result = await self.jobs.update_many(
+            query,
+            {
+                "$set": {"status": JOB_PENDING, "attempts": 0, "available_at": now, "updated_at": now},
+                "$unset": {"dead_lettered_at": ""}
+            }
+        )
+        return result.modified_count
+
+    async def get_dead_letters(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Most recently dead-lettered jobs"""
+        cursor = self.jobs.find({"status": JOB_DEAD}).sort("dead_lettered_at", -1).limit(limit)
+        jobs = []
+        async for job in cursor:
+            job["id"] = str(job.pop("_id"))
+            jobs.append(job)
+        return jobs
+
+    async def get_metrics(self) -> Dict[str, Any]:
+        """Queue depth per status, jobs due now and the age of the oldest waiting job"""
+        now = datetime.now()
+        counts = {JOB_PENDING: 0, JOB_PROCESSING: 0, JOB_DONE: 0, JOB_DEAD: 0}
+        async for row in self.jobs.aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}]):
+            counts[row["_id"]] = row["count"]
+
+        due = await self.jobs.count_documents({"status": JOB_PENDING, "available_at": {"$lte": now}})
+        oldest = await self.jobs.find_one(
+            {"status": JOB_PENDING},
+            {"created_at": 1},
+            sort=[("created_at", 1)]
+        )
+        return {
+            "depth": counts[JOB_PENDING] + counts[JOB_PROCESSING],
+            "pending": counts[JOB_PENDING],
+            "due": due,
+            "processing": counts[JOB_PROCESSING],
+            "done": counts[JOB_DONE],
+            "dead_lettered": counts[JOB_DEAD],
+            "oldest_pending_seconds": round((now - oldest["created_at"]).total_seconds(), 1) if oldest else 0.0,
+            "max_depth": self.config.max_depth or None
+        }
+
+
+class ReconciliationWorkerPool:
+    """Fixed-size pool of asyncio workers draining the reconciliation queue"""
+
+    def __init__(
+        self,
+        queue: ReconciliationQueue,
+        handler: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]],
+        concurrency: Optional[int] = None
+    ):
+        """
+        Args:
+            queue: Queue to drain
+            handler: Coroutine reconciling one payment (raises to trigger a retry)
+            concurrency: Number of workers (defaults to the queue configuration)
+        """
+        self.queue = queue
+        self.handler = handler
+        self.concurrency = concurrency if concurrency is not None else queue.config.workers
+        self.node_id = f"{socket.gethostname()}-{os.getpid()}"
+        self._stopping = asyncio.Event()
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self.stats = {"processed": 0, "retried": 0, "dead_lettered": 0, "lost_leases": 0}
+
+    @property
+    def running(self) -> bool:
+        return any(not task.done() for task in self._tasks)
+
+    async def start(self):
+        """Start the workers (no-op when already running or concurrency is 0)"""
+        if self.running or self.concurrency <= 0:
+            return
+        await self.queue.ensure_indexes()
+        self._stopping.clear()
+        self._tasks = [
+            asyncio.create_task(self._worker(f"{self.node_id}-{n}"))
+            for n in range(self.concurrency)
+        ]
+        logger.info(f"Started {self.concurrency} reconciliation workers")
+
+    async def stop(self, timeout: float = 10.0):
+        """Stop the workers, letting in-flight jobs finish within the timeout"""
+        self._stopping.set()
+        self._wakeup.set()
+        if not self._tasks:
+            return
+        done, pending = await asyncio.wait(self._tasks, timeout=timeout)
+        for task in pending:
+            # Unfinished jobs keep their lease and are picked up again once it expires
+            task.cancel()
+        self._tasks = []
+        logger.info("Stopped reconciliation workers")
+
+    def notify(self):
+        """Wake idle workers after an enqueue instead of waiting for the next poll"""
+        self._wakeup.set()
+
+    async def _idle(self):
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=self.queue.config.poll_interval)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    async def _heartbeat(self, job: Dict[str, Any], worker_id: str):
+        """Keep extending the lease while a long reconciliation (e.g. a Gemini call) runs"""
+        interval = max(1.0, self.queue.config.lease_seconds / 3)
+        while True:
+            await asyncio.sleep(interval)
+            if not await self.queue.extend_lease(job, worker_id):
+                self.stats["lost_leases"] += 1
+                logger.warning(f"Lost lease on reconciliation job {job['_id']}")
+                return
+
+    async def _worker(self, worker_id: str):
+        while not self._stopping.is_set():
+            try:
+                job = await self.queue.claim(worker_id)
+            except Exception as e:
+                logger.error(f"Failed to claim reconciliation job: {str(e)}")
+                await self._idle()
+                continue
+
+            if job is None:
+                await self._idle()
+                continue
+
+            heartbeat = asyncio.create_task(self._heartbeat(job, worker_id))
+            try:
+                try:
+                    result = await self.handler(job["payment_data"])
+                except Exception as e:
+                    status = await self.queue.fail(job, worker_id, str(e))
+                    self.stats["dead_lettered" if status == JOB_DEAD else "retried"] += 1
+                else:
+                    await self.queue.complete(job, worker_id, result or {})
+                    self.stats["processed"] += 1
+            except Exception as e:
+                # The job keeps its lease and is retried once the lease expires
+                logger.error(f"Failed to record outcome of reconciliation job {job['_id']}: {str(e)}")
+            finally:
+                heartbeat.cancel()
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Worker counters for this process"""
+        return {
+            "workers": self.concurrency,
+            "running": self.running,
+            **self.stats
+        }
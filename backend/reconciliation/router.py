@@ -1,11 +1,12 @@
 """
 Reconciliation API endpoints
 """
-from fastapi import APIRouter, HTTPException, Depends, Body
-from typing import Dict, Any, List
+from fastapi import APIRouter, HTTPException, Depends, Body, Query
+from typing import Dict, Any, List, Optional
 import logging
 
 from .service import ReconciliationService
+from .queue import ReconciliationQueueFull
 
 logger = logging.getLogger("financial-agent.reconciliation.router")
 
@@ -14,6 +15,16 @@ router = APIRouter(prefix="/api/reconciliation", tags=["reconciliation"])
 # Initialize reconciliation service
 reconciliation_service = ReconciliationService()
 
+@router.on_event("startup")
+async def start_reconciliation_workers():
+    """Start draining the reconciliation queue with the app"""
+    await reconciliation_service.start_workers()
+
+@router.on_event("shutdown")
+async def stop_reconciliation_workers():
+    """Let in-flight reconciliation jobs finish on shutdown"""
+    await reconciliation_service.stop_workers()
+
 @router.post("/reconcile")
 async def reconcile_payment(
     payment_data: Dict[str, Any] = Body(...)
@@ -42,20 +53,83 @@ async def queue_for_reconciliation(
         
         return result
         
+    except ReconciliationQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         logger.error(f"Error in queue endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/batch")
-async def process_batch():
+async def process_batch(
+    concurrency: Optional[int] = Query(None, ge=1, le=64, description="Payments scored concurrently"),
+    mode: Optional[str] = Query(None, pattern="^(auto|score|optimal)$", description="Per-payment scoring or optimal batch assignment")
+):
     """
     Process batch reconciliation for unreconciled payments
     """
     try:
-        result = await reconciliation_service.process_batch_reconciliation()
+        result = await reconciliation_service.process_batch_reconciliation(concurrency=concurrency, mode=mode)
         
         return result
         
     except Exception as e:
         logger.error(f"Error in batch endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/metrics")
+async def get_candidate_metrics():
+    """
+    Candidate retrieval metrics (shortlist size, match rate, shortlist hit rate)
+    """
+    try:
+        return reconciliation_service.get_candidate_metrics()
+        
+    except Exception as e:
+        logger.error(f"Error in metrics endpoint: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/queue/metrics")
+async def get_queue_metrics():
+    """
+    Reconciliation queue depth (pending, due, processing, dead-lettered) and worker counters
+    """
+    try:
+        return await reconciliation_service.get_queue_metrics()
+        
+    except Exception as e:
+        logger.error(f"Error in queue metrics endpoint: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/queue/dead-letters")
+async def get_dead_letters(
+    limit: int = Query(50, ge=1, le=500)
+):
+    """
+    Reconciliation jobs that exhausted their retries
+    """
+    if reconciliation_service.queue is None:
+        raise HTTPException(status_code=503, detail="Reconciliation queue not available")
+    try:
+        return {"jobs": await reconciliation_service.queue.get_dead_letters(limit)}
+        
+    except Exception as e:
+        logger.error(f"Error in dead letters endpoint: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/queue/dead-letters/requeue")
+async def requeue_dead_letters(
+    job_ids: Optional[List[str]] = Body(None, embed=True)
+):
+    """
+    Move dead-lettered jobs (all, or the given IDs) back to the queue
+    """
+    if reconciliation_service.queue is None:
+        raise HTTPException(status_code=503, detail="Reconciliation queue not available")
+    try:
+        requeued = await reconciliation_service.queue.requeue_dead_letters(job_ids)
+        reconciliation_service.worker_pool.notify()
+        return {"requeued": requeued}
+        
+    except Exception as e:
+        logger.error(f"Error in requeue endpoint: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
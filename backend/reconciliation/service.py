@@ -10,12 +10,18 @@ import asyncio
 # Import AI and database services
 try:
     from ai_agent.gemini import GeminiService
+    from ai_agent.gemini.client import AIUnavailableError
     from database.mongodb import Database
     services_available = True
 except ImportError:
     services_available = False
     print("Database or AI services not available. Using mock data only.")
 
+from database.match_keys import invoice_amount
+from .candidates import CandidateRetriever, score_candidate, MATCH_THRESHOLD, AUTO_MATCH_THRESHOLD
+from .batch import BatchReconciliationEngine, BatchReconciliationConfig
+from .queue import ReconciliationQueue, ReconciliationWorkerPool
+
 logger = logging.getLogger("financial-agent.reconciliation")
 
 class ReconciliationService:
@@ -27,9 +33,15 @@ class ReconciliationService:
         if services_available:
             self.gemini_service = GeminiService()
             self.db = Database.get_instance()
+            self.candidate_retriever = CandidateRetriever(self.db)
+            self.queue = ReconciliationQueue(self.db)
+            self.worker_pool = ReconciliationWorkerPool(self.queue, self._process_queued_payment)
         else:
             self.gemini_service = None
             self.db = None
+            self.candidate_retriever = None
+            self.queue = None
+            self.worker_pool = None
         
     async def reconcile_payment(self, payment_data: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -45,10 +57,10 @@ class ReconciliationService:
             # Log the reconciliation attempt
             logger.info(f"Reconciling payment: {json.dumps(payment_data)}")
             
-            # Get pending invoices from database or use mock data
+            # Shortlist candidate invoices through indexes or use mock data
             if self.db is not None:
-                pending_invoices = await self.db.get_pending_invoices()
-                logger.info(f"Found {len(pending_invoices)} pending invoices for reconciliation")
+                pending_invoices = await self.candidate_retriever.shortlist(payment_data)
+                logger.info(f"Found {len(pending_invoices)} candidate invoices for reconciliation")
             else:
                 # Use mock data for testing
                 pending_invoices = self._get_mock_invoices()
@@ -64,14 +76,14 @@ class ReconciliationService:
                     "confidence_score": 0
                 }
             
-            # Use Gemini to reconcile payment if available
-            if self.gemini_service is not None:
-                result = await self.gemini_service.reconcile_payment(payment_data, pending_invoices)
-            else:
-                # Simple fallback reconciliation logic
-                result = self._basic_reconciliation(payment_data, pending_invoices)
+            result = await self._match_payment(payment_data, pending_invoices)
+            
+            if self.candidate_retriever is not None:
+                self.candidate_retriever.record_outcome(result.get("matched_invoice_id"))
             
-            # Store reconciliation log if database is available
+            outcome = self._plan_outcome(payment_data, result)
+            
+            # Store reconciliation log and apply the planned updates if database is available
             if self.db is not None:
                 log_data = {
                     "payment_data": payment_data,
@@ -80,83 +92,115 @@ class ReconciliationService:
                 }
                 await self.db.store_reconciliation_log(log_data)
                 
-            # Check confidence score to determine if we need human review
-            if result.get("action_required", True):
-                # Flag for human review
-                logger.info(f"Payment requires human review. Confidence: {result.get('confidence_score', 0)}")
-                
-                # Update transaction if available
-                if self.db is not None and "transaction_id" in payment_data:
-                    await self.db.update_transaction(payment_data["transaction_id"], {
-                        "reconciliation_status": "needs_review",
-                        "confidence_score": result.get("confidence_score", 0),
-                        "needs_review": True,
-                        "review_reason": result.get("review_reason", "Low confidence match")
-                    })
+                if outcome["invoice_update"]:
+                    await self.db.update_invoice(outcome["matched_invoice_id"], outcome["invoice_update"])
+                if outcome["transaction_update"]:
+                    await self.db.update_transaction(payment_data["transaction_id"], outcome["transaction_update"])
+            
+            return outcome["response"]
                 
-                return {
+        except Exception as e:
+            logger.error(f"Error in payment reconciliation: {str(e)}")
+            raise
+    
+    async def _match_payment(self, payment_data: Dict[str, Any], invoices: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Match a payment against candidate invoices with Gemini, falling back to
+        rule-based matching when Gemini is not configured or the AI client is
+        refusing calls (circuit open, rate limited)
+        """
+        if self.gemini_service is not None:
+            try:
+                return await self.gemini_service.reconcile_payment(payment_data, invoices)
+            except AIUnavailableError as e:
+                logger.warning(f"Gemini unavailable, using basic reconciliation: {str(e)}")
+        
+        # Simple fallback reconciliation logic
+        return self._basic_reconciliation(payment_data, invoices)
+    
+    def _plan_outcome(self, payment_data: Dict[str, Any], result: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Decide the response and invoice/transaction updates for a reconciliation result
+        
+        Shared by reconcile_payment (applied one by one) and the batch engine
+        (applied with bulk writes).
+        
+        Args:
+            payment_data: Payment data
+            result: Reconciliation result from Gemini or _basic_reconciliation
+            
+        Returns:
+            Dict with the API response, matched invoice ID and the invoice and
+            transaction updates to apply (None when nothing to update)
+        """
+        has_transaction = "transaction_id" in payment_data
+        matched_invoice_id = result.get("matched_invoice_id")
+        
+        # Check confidence score to determine if we need human review
+        if result.get("action_required", True):
+            # Flag for human review
+            logger.info(f"Payment requires human review. Confidence: {result.get('confidence_score', 0)}")
+            return {
+                "response": {
                     "success": True,
                     "message": "Payment reconciliation requires human review",
                     "needs_review": True,
                     **result
-                }
-                
-            # Process successful reconciliation
-            matched_invoice_id = result.get("matched_invoice_id")
-            if matched_invoice_id:
-                # Update invoice and transaction status if database is available
-                if self.db is not None:
-                    # Check if this is a partial payment
-                    is_partial = result.get("partial_payment", False)
-                    new_status = "partially_paid" if is_partial else "paid"
-                    
-                    # Update invoice status
-                    await self.db.update_invoice(matched_invoice_id, {
-                        "status": new_status,
-                        "amount_paid": result.get("amount_paid", 0),
-                        "balance": result.get("balance", 0),
-                        "payment_transactions": [payment_data.get("transaction_id", "unknown")]
-                    })
-                    
-                    # Update transaction reconciliation status
-                    if "transaction_id" in payment_data:
-                        await self.db.update_transaction(payment_data["transaction_id"], {
-                            "reconciliation_status": "matched" if not is_partial else "partial",
-                            "matched_invoice_id": matched_invoice_id,
-                            "confidence_score": result.get("confidence_score", 0),
-                            "needs_review": False
-                        })
-                
-                logger.info(f"Payment successfully reconciled with invoice {matched_invoice_id}")
-                
-                return {
+                },
+                "matched_invoice_id": None,
+                "invoice_update": None,
+                "transaction_update": {
+                    "reconciliation_status": "needs_review",
+                    "confidence_score": result.get("confidence_score", 0),
+                    "needs_review": True,
+                    "review_reason": result.get("review_reason", "Low confidence match")
+                } if has_transaction else None
+            }
+        
+        # Process successful reconciliation
+        if matched_invoice_id:
+            # Check if this is a partial payment
+            is_partial = result.get("partial_payment", False)
+            logger.info(f"Payment successfully reconciled with invoice {matched_invoice_id}")
+            return {
+                "response": {
                     "success": True,
                     "message": "Payment successfully reconciled",
                     "needs_review": False,
                     **result
-                }
-            else:
-                # No match found
-                logger.info("No matching invoice found for payment")
-                
-                # Update transaction if available
-                if self.db is not None and "transaction_id" in payment_data:
-                    await self.db.update_transaction(payment_data["transaction_id"], {
-                        "reconciliation_status": "unmatched",
-                        "needs_review": True,
-                        "review_reason": "No matching invoice found"
-                    })
-                
-                return {
-                    "success": False,
-                    "message": "No matching invoice found",
-                    "needs_review": True,
-                    **result
-                }
-                
-        except Exception as e:
-            logger.error(f"Error in payment reconciliation: {str(e)}")
-            raise
+                },
+                "matched_invoice_id": matched_invoice_id,
+                "invoice_update": {
+                    "status": "partially_paid" if is_partial else "paid",
+                    "amount_paid": result.get("amount_paid", 0),
+                    "balance": result.get("balance", 0),
+                    "payment_transactions": [payment_data.get("transaction_id", "unknown")]
+                },
+                "transaction_update": {
+                    "reconciliation_status": "matched" if not is_partial else "partial",
+                    "matched_invoice_id": matched_invoice_id,
+                    "confidence_score": result.get("confidence_score", 0),
+                    "needs_review": False
+                } if has_transaction else None
+            }
+        
+        # No match found
+        logger.info("No matching invoice found for payment")
+        return {
+            "response": {
+                "success": False,
+                "message": "No matching invoice found",
+                "needs_review": True,
+                **result
+            },
+            "matched_invoice_id": None,
+            "invoice_update": None,
+            "transaction_update": {
+                "reconciliation_status": "unmatched",
+                "needs_review": True,
+                "review_reason": "No matching invoice found"
+            } if has_transaction else None
+        }
     
     def _basic_reconciliation(self, payment_data: Dict[str, Any], pending_invoices: List[Dict[str, Any]]) -> Dict[str, Any]:
         """
@@ -172,56 +216,30 @@ class ReconciliationService:
         best_match = None
         highest_score = 0
         payment_amount = float(payment_data.get("amount", 0))
-        payment_phone = str(payment_data.get("phone_number", ""))
-        payment_reference = payment_data.get("reference", "").lower()
         
         for invoice in pending_invoices:
-            # Initial score
-            score = 0
+            score = score_candidate(payment_data, invoice)
             
-            # Compare amount (most important factor)
-            invoice_amount = float(invoice.get("total", 0))
-            if abs(payment_amount - invoice_amount) < 1:  # Exact match within 1 KES
-                score += 60
-            elif invoice_amount != 0 and abs(payment_amount - invoice_amount) / invoice_amount < 0.05:  # Within 5%
-                score += 40
-            elif payment_amount > 0 and payment_amount < invoice_amount:  # Partial payment
-                score += 30
-                
-            # Compare phone number
-            customer = invoice.get("customer", {})
-            invoice_phone = customer.get("phone_number", "")
-            if invoice_phone and invoice_phone == payment_phone:
-                score += 25
-                
-            # Compare reference with invoice number
-            invoice_number = invoice.get("invoice_number", "").lower()
-            if payment_reference and (
-                payment_reference in invoice_number or 
-                invoice_number in payment_reference
-            ):
-                score += 15
-                
             # Keep track of best match
             if score > highest_score:
                 highest_score = score
                 best_match = invoice
         
         # Prepare result based on match score
-        if best_match and highest_score >= 70:  # Good match above 70%
-            invoice_amount = float(best_match.get("total", 0))
+        if best_match and highest_score >= MATCH_THRESHOLD:  # Good match above 70%
+            amount_due = invoice_amount(best_match)
             result = {
                 "matched_invoice_id": best_match.get("id"),
                 "confidence_score": highest_score,
-                "action_required": False if highest_score >= 80 else True,
-                "review_reason": "Medium confidence match" if highest_score < 80 else None,
-                "partial_payment": payment_amount < invoice_amount,
+                "action_required": False if highest_score >= AUTO_MATCH_THRESHOLD else True,
+                "review_reason": "Medium confidence match" if highest_score < AUTO_MATCH_THRESHOLD else None,
+                "partial_payment": payment_amount < amount_due,
                 "amount_paid": payment_amount,
-                "balance": max(0, invoice_amount - payment_amount),
+                "balance": max(0, amount_due - payment_amount),
                 "invoice_details": {
                     "invoice_number": best_match.get("invoice_number"),
                     "customer": best_match.get("customer", {}).get("name"),
-                    "amount": invoice_amount
+                    "amount": amount_due
                 }
             }
         else:
@@ -267,79 +285,144 @@ class ReconciliationService:
                     "reconciliation_status": "pending"
                 }
                 
-                stored_id = await self.db.store_transaction(transaction_data)
+                # A redelivered callback finds the transaction stored the first time
+                stored_id = await self.db.store_transaction_once(transaction_data)
                 payment_data["transaction_id"] = stored_id
             
-            # Start reconciliation in the background
-            asyncio.create_task(self.reconcile_payment(payment_data))
+            # Persist the job for the worker pool; without a database there is
+            # nowhere to persist it, so reconcile in the background instead
+            job_id = None
+            if self.queue is not None:
+                job_id = await self.queue.enqueue(payment_data)
+                self.worker_pool.notify()
+            else:
+                asyncio.create_task(self.reconcile_payment(payment_data))
             
             return {
                 "success": True,
                 "message": "Payment queued for reconciliation",
                 "payment_id": payment_data.get("receipt_number", "unknown"),
-                "transaction_id": payment_data.get("transaction_id", stored_id)
+                "transaction_id": payment_data.get("transaction_id", stored_id),
+                "job_id": job_id
             }
             
         except Exception as e:
             logger.error(f"Error queueing payment for reconciliation: {str(e)}")
             raise
     
-    async def process_batch_reconciliation(self) -> Dict[str, Any]:
+    async def _process_queued_payment(self, payment_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Reconcile a payment taken from the queue
+        
+        A job retried after a crash may already have been applied (or the
+        payment picked up by a batch run), so transactions that are no
+        longer pending are not reconciled again.
+        
+        Args:
+            payment_data: Queued payment data
+            
+        Returns:
+            Dict with reconciliation result
+        """
+        transaction_id = payment_data.get("transaction_id")
+        if transaction_id:
+            transaction = await self.db.get_transaction(transaction_id)
+            if transaction and transaction.get("reconciliation_status", "pending") != "pending":
+                logger.info(f"Transaction {transaction_id} already reconciled, skipping queued job")
+                return {
+                    "success": True,
+                    "message": "Payment already reconciled",
+                    "matched_invoice_id": transaction.get("matched_invoice_id"),
+                    "needs_review": transaction.get("needs_review", False),
+                    "confidence_score": transaction.get("confidence_score")
+                }
+        
+        return await self.reconcile_payment(payment_data)
+    
+    async def start_workers(self):
+        """Start the reconciliation queue worker pool"""
+        if self.worker_pool is not None:
+            await self.worker_pool.start()
+    
+    async def stop_workers(self):
+        """Stop the reconciliation queue worker pool"""
+        if self.worker_pool is not None:
+            await self.worker_pool.stop()
+    
+    async def get_queue_metrics(self) -> Dict[str, Any]:
+        """
+        Get reconciliation queue depth and worker metrics
+        
+        Returns:
+            Dict with queue and worker metrics
+        """
+        if self.queue is None:
+            return {"enabled": False}
+        return {
+            "enabled": True,
+            "queue": await self.queue.get_metrics(),
+            "workers": self.worker_pool.get_metrics()
+        }
+    
+    async def process_batch_reconciliation(
+        self,
+        concurrency: Optional[int] = None,
+        mode: Optional[str] = None
+    ) -> Dict[str, Any]:
         """
         Process batch reconciliation for unreconciled payments
         
+        Payments are matched against one pending-invoice snapshot, either
+        scored concurrently or allocated with an optimal one-to-one
+        assignment, and all updates are bulk-written (see
+        BatchReconciliationEngine).
+        
+        Args:
+            concurrency: Override for the number of payments scored at once
+            mode: Override for the batch mode ("auto", "score" or "optimal")
+            
         Returns:
-            Dict with batch processing results
+            Dict with batch processing results and throughput
         """
         try:
             # Get unreconciled payments from database or use mock data
             if self.db is not None:
                 unreconciled_payments = await self.db.get_unreconciled_transactions()
                 logger.info(f"Found {len(unreconciled_payments)} unreconciled payments for batch processing")
+                
+                # Stored transactions carry their ID as `id`; the updates key off transaction_id
+                for payment in unreconciled_payments:
+                    if payment.get("id"):
+                        payment.setdefault("transaction_id", payment["id"])
             else:
                 # Use mock data for testing
                 unreconciled_payments = self._get_mock_unreconciled_payments()
                 logger.info(f"Using {len(unreconciled_payments)} mock unreconciled payments")
             
-            results = {
-                "total_processed": len(unreconciled_payments),
-                "reconciled": 0,
-                "needs_review": 0,
-                "failed": 0,
-                "details": []
-            }
-            
-            # Process each payment
-            for payment in unreconciled_payments:
-                try:
-                    result = await self.reconcile_payment(payment)
-                    
-                    if result.get("success") and not result.get("needs_review"):
-                        results["reconciled"] += 1
-                    elif result.get("needs_review"):
-                        results["needs_review"] += 1
-                    else:
-                        results["failed"] += 1
-                    
-                    results["details"].append({
-                        "payment_id": payment.get("receipt_number", payment.get("id", "unknown")),
-                        "result": result
-                    })
-                    
-                except Exception as e:
-                    logger.error(f"Error processing payment in batch: {str(e)}")
-                    results["failed"] += 1
-                    results["details"].append({
-                        "payment_id": payment.get("receipt_number", payment.get("id", "unknown")),
-                        "error": str(e)
-                    })
+            config = BatchReconciliationConfig()
+            if concurrency:
+                config.concurrency = concurrency
+            if mode:
+                config.mode = mode
             
-            return results
+            engine = BatchReconciliationEngine(self, config)
+            return await engine.run(unreconciled_payments)
             
         except Exception as e:
             logger.error(f"Error in batch reconciliation: {str(e)}")
             raise
     
+    def get_candidate_metrics(self) -> Dict[str, Any]:
+        """
+        Get candidate retrieval metrics (shortlist size, match and hit rates)
+        
+        Returns:
+            Dict with retrieval metrics
+        """
+        if self.candidate_retriever is None:
+            return {"enabled": False}
+        return {"enabled": True, **self.candidate_retriever.get_metrics()}
+    
     def _get_mock_invoices(self) -> List[Dict[str, Any]]:
         """
         Get mock invoices for testing
@@ -2,10 +2,11 @@
 Custom AI Reports Service
 Generates custom financial reports using Gemini AI based on natural language queries
 """
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, AsyncIterator
 from datetime import datetime, timedelta
 from database.mongodb import Database
 import json
+from ai_agent.gemini.streaming import sse_event, sse_stream, extract_suggestions
 
 try:
     from ai_agent.gemini.service import GeminiService
@@ -127,6 +128,58 @@ class CustomAIReportsService:
                 "message": str(e)
             }
     
+    async def stream_ai_insights(
+        self,
+        report_type: str = "general",
+        period_days: int = 30
+    ) -> AsyncIterator[str]:
+        """
+        Streaming variant of get_ai_insights (Server-Sent Events)
+        
+        The insight metrics are computed first; an AI narrative explaining
+        them is streamed as "token" events, and the final "done" event
+        carries the structured insights, data summary and suggestions.
+        
+        Args:
+            report_type: Type of insights (general, revenue, expenses, cash_flow)
+            period_days: Number of days to analyze
+            
+        Yields:
+            Server-Sent Events frames
+        """
+        if not self.gemini_service:
+            yield sse_event("error", {
+                "error": "AI service not available",
+                "message": "Gemini AI service is not configured"
+            })
+            return
+        
+        end = datetime.now()
+        start = end - timedelta(days=period_days)
+        
+        try:
+            financial_data = await self._gather_financial_data(start, end)
+            insights = await self._generate_insights(financial_data, report_type)
+        except Exception as e:
+            yield sse_event("error", {"error": "Insight generation failed", "message": str(e)})
+            return
+        
+        prompt = self._create_insights_prompt(financial_data, insights, report_type)
+        
+        def finish(narrative: str) -> Dict[str, Any]:
+            return {
+                "report_type": report_type,
+                "period_days": period_days,
+                "insights": insights,
+                "narrative": narrative,
+                "data_summary": self._create_data_summary(financial_data),
+                "suggestions": extract_suggestions(narrative),
+                "generated_at": datetime.now().isoformat()
+            }
+        
+        async for frame in sse_stream(self.gemini_service.stream_content(prompt, call_type="insights"), finish):
+            yield frame
+    
     async def analyze_anomalies(
         self,
         period_days: int = 30
@@ -269,6 +322,28 @@ User Query: {query}
 """
         return context
     
+    def _create_insights_prompt(
+        self,
+        financial_data: Dict[str, Any],
+        insights: List[Dict[str, Any]],
+        report_type: str
+    ) -> str:
+        """Prompt asking the model to explain computed insights"""
+        metrics = "\n".join(
+            f"- {insight['metric']}: {insight['value']} ({insight['insight']})" for insight in insights
+        )
+        return f"""You are a financial analyst for a Kenyan small business.
+Explain the {report_type.replace('_', ' ')} picture for the period below to the business owner.
+
+{self._create_ai_context(financial_data, f"{report_type} insights")}
+COMPUTED METRICS:
+{metrics}
+
+Write a short Markdown report: a one-paragraph overview, a "## Key Points" section
+with numbered items referring to the figures above, and a "## Recommendations"
+section with 2-3 actionable recommendations. Use KES amounts.
+"""
+    
     def _create_data_summary(self, financial_data: Dict[str, Any]) -> Dict[str, Any]:
         """Create a structured data summary"""
         return {
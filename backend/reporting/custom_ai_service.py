@@ -2,10 +2,11 @@
 Custom AI Reports Service
 Generates custom financial reports using AI-powered insights and natural language queries
 """
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, AsyncIterator
 from datetime import datetime, timedelta
 from database.mongodb import Database
 from ai_agent.gemini.service import GeminiService
+from ai_agent.gemini.streaming import sse_event, sse_stream, extract_suggestions
 
 class CustomAIReportService:
     """Service for generating custom AI-powered financial reports"""
@@ -79,6 +80,66 @@ class CustomAIReportService:
                 "fallback_data": financial_data if include_data else None
             }
     
+    async def stream_custom_report(
+        self,
+        query: str,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        include_data: bool = True
+    ) -> AsyncIterator[str]:
+        """
+        Streaming variant of generate_custom_report (Server-Sent Events)
+        
+        The report text is streamed as "token" events; the final "done" event
+        carries the period, data summary, suggestions and (optionally) the
+        supporting data.
+        
+        Args:
+            query: Natural language query
+            start_date: Optional start date filter
+            end_date: Optional end date filter
+            include_data: Include raw data in the final event
+            
+        Yields:
+            Server-Sent Events frames
+        """
+        try:
+            end = datetime.strptime(end_date, "%Y-%m-%d") if end_date else datetime.now()
+            start = datetime.strptime(start_date, "%Y-%m-%d") if start_date else end - timedelta(days=30)
+            financial_data = await self._gather_financial_context(start, end)
+        except Exception as e:
+            yield sse_event("error", {"error": f"Failed to generate AI report: {str(e)}", "query": query})
+            return
+        
+        prompt = self._build_ai_context(financial_data, query, start, end) + """
+Answer the query as a Markdown report: an overview paragraph, a "## Key Findings"
+section with numbered items, and a "## Recommendations" section with 2-3 actionable
+recommendations. Use KES amounts and refer to the figures above.
+"""
+        
+        def finish(report_text: str) -> Dict[str, Any]:
+            result = {
+                "query": query,
+                "period": {
+                    "start_date": start.strftime("%Y-%m-%d"),
+                    "end_date": end.strftime("%Y-%m-%d"),
+                    "days": (end - start).days
+                },
+                "report": report_text,
+                "data_summary": {
+                    **financial_data["summary"],
+                    "top_customers": financial_data["top_customers"]
+                },
+                "suggestions": extract_suggestions(report_text),
+                "generated_at": datetime.now().isoformat()
+            }
+            if include_data:
+                result["supporting_data"] = financial_data
+            return result
+        
+        async for frame in sse_stream(self.ai_service.stream_content(prompt, call_type="insights"), finish):
+            yield frame
+    
     async def detect_anomalies(
         self,
         days: int = 30
@@ -262,6 +323,59 @@ class CustomAIReportService:
         
         return summary
     
+    async def stream_executive_summary(
+        self,
+        month: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """
+        Streaming variant of generate_executive_summary (Server-Sent Events)
+        
+        The executive summary metrics are computed first; an AI narrative for
+        them is streamed as "token" events, and the final "done" event carries
+        the structured summary plus suggestions.
+        
+        Args:
+            month: Month in YYYY-MM format (defaults to current month)
+            
+        Yields:
+            Server-Sent Events frames
+        """
+        try:
+            summary = await self.generate_executive_summary(month=month)
+        except Exception as e:
+            yield sse_event("error", {"error": f"Failed to generate executive summary: {str(e)}"})
+            return
+        
+        metrics = summary["key_metrics"]
+        notes = "\n".join(f"- {item}" for item in summary["highlights"] + summary["concerns"] + summary["recommendations"])
+        prompt = f"""You are a CFO writing the monthly executive summary for a Kenyan small business.
+
+Month: {summary['month']} ({summary['period']['start_date']} to {summary['period']['end_date']})
+- Total Revenue: KES {metrics['total_revenue']:,.2f}
+- Total Expenses: KES {metrics['total_expenses']:,.2f}
+- Net Income: KES {metrics['net_income']:,.2f}
+- Profit Margin: {metrics['profit_margin']}%
+- Invoices: {metrics['total_invoices']}
+- Collection Rate: {metrics['collection_rate']}%
+
+Observations:
+{notes or '- None'}
+
+Write a concise Markdown executive summary for the board: an overview paragraph,
+"## Highlights", "## Concerns" and "## Recommendations" sections with numbered items.
+Use KES amounts and refer to the figures above.
+"""
+        
+        def finish(narrative: str) -> Dict[str, Any]:
+            return {
+                **summary,
+                "narrative": narrative,
+                "suggestions": extract_suggestions(narrative)
+            }
+        
+        async for frame in sse_stream(self.ai_service.stream_content(prompt, call_type="insights"), finish):
+            yield frame
+    
     async def _gather_financial_context(
         self,
         start_date: datetime,
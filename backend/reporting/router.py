@@ -2,6 +2,7 @@
 API Router for financial reports
 """
 from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.responses import StreamingResponse
 from typing import Optional
 
 from database.mongodb import get_database, Database
@@ -12,7 +13,11 @@ from .tax_models import VATReport, TaxPeriod
 from .customer_service import CustomerStatementService
 from .reconciliation_report_service import ReconciliationReportService
 from .predictive_service import PredictiveAnalyticsService
+# /ai/insights uses the insights service; the custom report, anomaly and
+# executive summary endpoints (blocking and streaming) use the narrative service
 from .ai_reports_service import CustomAIReportsService as CustomAIReportService
+from .custom_ai_service import CustomAIReportService as NarrativeAIReportService
+from ai_agent.gemini.streaming import SSE_HEADERS
 
 router = APIRouter(prefix="/reports", tags=["Reports"])
 
@@ -648,6 +653,30 @@ async def get_ai_insights(
         raise HTTPException(status_code=500, detail=f"Error generating AI insights: {str(e)}")
 
 
+@router.get("/ai/insights/stream")
+async def stream_ai_insights(
+    report_type: str = Query("general", description="Type of insights to generate", enum=["general", "revenue", "expenses", "cash_flow"]),
+    days: int = Query(30, description="Number of days to analyze", ge=7, le=365),
+    db: Database = Depends(get_database)
+):
+    """
+    Streaming variant of /ai/insights (Server-Sent Events)
+    
+    Streams an AI narrative of the insights as "token" events while the model
+    generates it. The final "done" event carries the structured insights,
+    data summary and suggestions; failures send an "error" event.
+    """
+    try:
+        service = CustomAIReportService(db)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error generating AI insights: {str(e)}")
+    return StreamingResponse(
+        service.stream_ai_insights(report_type=report_type, period_days=days),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
+
+
 @router.post("/ai/custom-report")
 async def generate_custom_ai_report(
     query: str = Query(..., description="Natural language query for report"),
@@ -680,7 +709,7 @@ async def generate_custom_ai_report(
     Note: Requires AI service to be configured
     """
     try:
-        service = CustomAIReportService(db)
+        service = NarrativeAIReportService(db)
         report = await service.generate_custom_report(
             query=query,
             start_date=start_date,
@@ -692,6 +721,37 @@ async def generate_custom_ai_report(
         raise HTTPException(status_code=500, detail=f"Error generating custom AI report: {str(e)}")
 
 
+@router.post("/ai/custom-report/stream")
+async def stream_custom_ai_report(
+    query: str = Query(..., description="Natural language query for report"),
+    start_date: Optional[str] = Query(None, description="Start date (YYYY-MM-DD)"),
+    end_date: Optional[str] = Query(None, description="End date (YYYY-MM-DD)"),
+    include_data: bool = Query(True, description="Include supporting data"),
+    db: Database = Depends(get_database)
+):
+    """
+    Streaming variant of /ai/custom-report (Server-Sent Events)
+    
+    Report text is sent as "token" events as the model generates it. The
+    final "done" event carries the period, data summary, suggestions and
+    (with include_data) the supporting data.
+    """
+    try:
+        service = NarrativeAIReportService(db)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error generating custom AI report: {str(e)}")
+    return StreamingResponse(
+        service.stream_custom_report(
+            query=query,
+            start_date=start_date,
+            end_date=end_date,
+            include_data=include_data
+        ),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
+
+
 @router.get("/ai/anomaly-detection")
 async def detect_anomalies(
     days: int = Query(30, description="Number of days to analyze", ge=7, le=365),
@@ -721,7 +781,7 @@ async def detect_anomalies(
     - Summary statistics
     """
     try:
-        service = CustomAIReportService(db)
+        service = NarrativeAIReportService(db)
         anomalies = await service.detect_anomalies(days=days)
         return anomalies
     except Exception as e:
@@ -754,8 +814,31 @@ async def get_executive_summary(
     - Highlights, concerns, and recommendations
     """
     try:
-        service = CustomAIReportService(db)
+        service = NarrativeAIReportService(db)
         summary = await service.generate_executive_summary(month=month)
         return summary
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating executive summary: {str(e)}")
+
+
+@router.get("/ai/executive-summary/stream")
+async def stream_executive_summary(
+    month: Optional[str] = Query(None, description="Month in YYYY-MM format (defaults to current month)"),
+    db: Database = Depends(get_database)
+):
+    """
+    Streaming variant of /ai/executive-summary (Server-Sent Events)
+    
+    Streams an AI-written executive summary as "token" events. The final
+    "done" event carries the key metrics, highlights, concerns,
+    recommendations and suggestions.
+    """
+    try:
+        service = NarrativeAIReportService(db)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error generating executive summary: {str(e)}")
+    return StreamingResponse(
+        service.stream_executive_summary(month=month),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
@@ -5,7 +5,9 @@ from typing import Dict, Any, List, Optional
 from datetime import datetime, timedelta
 import logging
 
-from database.mongodb import Database
+from database.mongodb import Database, normalize_invoice_issue_date
+from database.rollups import month_key
+from .aging import AGING_BUCKETS, bucket_ar_aging, compute_days_outstanding
 from .models import (
     IncomeStatementReport,
     RevenueSection,
@@ -98,64 +100,39 @@ class ReportingService:
         start_dt = datetime.fromisoformat(start_date.replace('Z', '+00:00'))
         end_dt = datetime.fromisoformat(end_date.replace('Z', '+00:00'))
         
-        # Revenue from paid invoices
-        # Note: Dates in DB are strings, so we fetch all and filter in Python
-        invoice_match = {}
+        # Revenue from invoices in the period
+        # issue_date_ts is a normalized BSON date (see scripts/backfill_invoice_issue_dates.py),
+        # so the date filter and the sums run server-side on the
+        # (issue_date_ts, status) / (customer_id, issue_date_ts) indexes
+        invoice_match = {
+            "issue_date_ts": {"$gte": start_dt, "$lte": end_dt}
+        }
         if "customer_id" in filters:
             invoice_match["customer_id"] = filters["customer_id"]
         
-                # Get all invoices (we'll filter by date after)
-        all_invoices = await self.db.invoices.find(invoice_match).to_list(None)
-        
-        logger.info(f"Fetched {len(all_invoices)} invoices from database")
-        
-        # Filter by date in Python since dates are strings
-        from dateutil import parser as date_parser
-        filtered_invoices = []
-        date_parse_errors = 0
-        sample_dates = []
-        for i, invoice in enumerate(all_invoices):
-            issue_date_str = invoice.get("issue_date", invoice.get("date", ""))
-            if not issue_date_str:
-                # Fallback to created_at if issue_date is missing
-                issue_date_str = invoice.get("created_at", "")
-            
-            # Collect first 5 samples for debugging
-            if i < 5:
-                sample_dates.append({
-                    'inv_num': invoice.get('invoice_number', 'N/A'),
-                    'issue_date': str(issue_date_str)[:20],  # Truncate for logging
-                    'type': type(issue_date_str).__name__
-                })
-            
-            # Try to parse date, use start_date as fallback if missing/invalid
-            try:
-                if isinstance(issue_date_str, datetime):
-                    invoice_date = issue_date_str
-                elif issue_date_str:
-                    invoice_date = date_parser.parse(str(issue_date_str))
-                else:
-                    # No date found - use start_date so it's included in the range
-                    invoice_date = start_dt
-                
-                if start_dt <= invoice_date <= end_dt:
-                    filtered_invoices.append(invoice)
-            except Exception as e:
-                date_parse_errors += 1
-                # If date parsing fails, include the invoice anyway by using start_date
-                filtered_invoices.append(invoice)
-                logger.debug(f"Date parse error for invoice {invoice.get('invoice_number')}: {e}, including anyway")
-        
-        logger.info(f"Sample invoice dates: {sample_dates}")
-        logger.info(f"After date filtering: {len(filtered_invoices)} invoices (parse errors: {date_parse_errors})")
+        invoice_amount = {"$ifNull": ["$total_amount", {"$ifNull": ["$amount", 0]}]}
+        is_paid = {"$eq": ["$status", "paid"]}
+        revenue_pipeline = [
+            {"$match": invoice_match},
+            {"$group": {
+                "_id": None,
+                "invoice_count": {"$sum": 1},
+                "total_invoiced": {"$sum": invoice_amount},
+                "paid_invoice_count": {"$sum": {"$cond": [is_paid, 1, 0]}},
+                "total_paid": {"$sum": {"$cond": [is_paid, invoice_amount, 0]}}
+            }}
+        ]
+        
+        revenue_result = await self.db.invoices.aggregate(revenue_pipeline).to_list(1)
+        revenue_totals = revenue_result[0] if revenue_result else {}
         
         # Calculate totals
-        total_invoices = len(filtered_invoices)
-        total_invoiced = sum(inv.get("total_amount", inv.get("amount", 0)) for inv in filtered_invoices)
+        total_invoices = revenue_totals.get("invoice_count", 0)
+        total_invoiced = revenue_totals.get("total_invoiced", 0.0)
+        paid_invoices = revenue_totals.get("paid_invoice_count", 0)
+        total_paid = revenue_totals.get("total_paid", 0.0)
         
-        paid_invoices_list = [inv for inv in filtered_invoices if inv.get("status") == "paid"]
-        paid_invoices = len(paid_invoices_list)
-        total_paid = sum(inv.get("total_amount", inv.get("amount", 0)) for inv in paid_invoices_list)
+        logger.info(f"Found {total_invoices} invoices in period ({paid_invoices} paid) via aggregation")
         
         total_pending = total_invoiced - total_paid
         
@@ -272,37 +249,11 @@ class ReportingService:
         
         # ========== CASH INFLOWS (Payment Transactions) ==========
         
-        # Query for completed payment transactions
-        # Note: The actual MongoDB field values are lowercase (e.g., "completed", "pending")
-        # The API router capitalizes them in responses
-        inflow_match = {
-            "status": {"$in": ["completed", "successful", "paid"]}
-        }
-        
-        # Add date filter - MongoDB stores payment_date as datetime objects
-        if start_date and end_date:
-            inflow_match["payment_date"] = {
-                "$gte": start_dt,  # Use datetime object, not string
-                "$lte": end_dt
-            }
-        
-        logger.info(f"Inflow match query: {inflow_match}")
-        
-        # Use payments collection for inflows
-        inflow_count = await self.db.payments.count_documents(inflow_match)
-        
-        # Sum up amount field (the actual numeric field in MongoDB)
-        # Note: amountRaw is created by the API router, not stored in MongoDB
-        inflow_pipeline = [
-            {"$match": inflow_match},
-            {"$group": {
-                "_id": None,
-                "total": {"$sum": "$amount"}
-            }}
-        ]
-        
-        inflow_result = await self.db.payments.aggregate(inflow_pipeline).to_list(1)
-        total_inflows = inflow_result[0]["total"] if inflow_result else 0.0
+        # Completed payments for the period, read from the financial rollups
+        # (whole months come pre-aggregated, partial edge months are queried directly)
+        inflow_totals = await self.db.rollups.period_totals("payments_received", start_dt, end_dt)
+        inflow_count = inflow_totals["count"]
+        total_inflows = inflow_totals["amount"]
         
         logger.info(f"Found {inflow_count} payment transactions with total inflows: {total_inflows:,.2f}")
         
@@ -315,89 +266,19 @@ class ReportingService:
         
         # ========== CASH OUTFLOWS (Expenses + Refunds) ==========
         
-        # 1. Get expenses from receipts collection - use same logic as expenses API
-        expense_match = {
-            "$or": [
-                {"receipt_type": "expense"},
-                {"receipt_type": "refund"},
-                {"ocr_data.extracted_data.total_amount": {"$exists": True}}
-            ]
-        }
-        
-        if start_date and end_date:
-            expense_match["created_at"] = {
-                "$gte": start_dt,
-                "$lte": end_dt
-            }
-        
-        logger.info(f"Querying expenses with filter: {expense_match}")
-        
-        # Get all expense receipts
-        expense_receipts = await self.db.db["receipts"].find(expense_match).to_list(None)
-        
-        logger.info(f"Found {len(expense_receipts)} expense receipts")
-        
-        # Calculate total by iterating through receipts (same logic as expenses service)
-        total_expenses = 0.0
-        expenses_by_category = {}
-        
-        for receipt in expense_receipts:
-            amount = 0.0
-            
-            # Priority 1: OCR extracted data (most reliable)
-            if receipt.get("ocr_data"):
-                amount = receipt["ocr_data"]["extracted_data"].get("total_amount", 0)
-            
-            # Priority 2: Tax breakdown (for manual receipts)
-            elif receipt.get("tax_breakdown"):
-                tax_breakdown = receipt["tax_breakdown"]
-                amount = tax_breakdown.get("subtotal", 0) + tax_breakdown.get("vat_amount", 0)
-            
-            # Priority 3: Line items (for itemized receipts)
-            elif receipt.get("line_items"):
-                line_items = receipt["line_items"]
-                amount = sum(item.get("total", 0) for item in line_items)
-            
-            if amount > 0:
-                total_expenses += amount
-                
-                # Get category for breakdown
-                category = "Other Expenses"
-                if receipt.get("ocr_data"):
-                    category = receipt["ocr_data"]["extracted_data"].get("merchant_name", "Other Expenses")
-                elif receipt.get("category"):
-                    category = receipt["category"]
-                
-                expenses_by_category[category] = expenses_by_category.get(category, 0) + amount
-        
-        expense_count = len(expense_receipts)
+        # 1. Expense receipts by category (same amount priority as expenses API)
+        expense_totals = await self.db.rollups.period_totals("receipt_expenses", start_dt, end_dt)
+        expenses_by_category = {k: v for k, v in expense_totals["by_category"].items() if v > 0}
+        total_expenses = expense_totals["amount"]
+        expense_count = expense_totals["count"]
         
         logger.info(f"Total expenses: Ksh {total_expenses:,.2f} from {expense_count} receipts")
         logger.info(f"Expense categories: {list(expenses_by_category.keys())}")
         
-        # 2. Get refunds from payments collection
-        refund_match = {
-            "status": {"$in": ["refunded", "Refunded", "failed", "Failed", "returned", "Returned"]}
-        }
-        if start_date and end_date:
-            refund_match["payment_date"] = {
-                "$gte": start_dt,
-                "$lte": end_dt
-            }
-        
-        refund_count = await self.db.payments.count_documents(refund_match)
-        
-        # Calculate refunds using amount field
-        refund_pipeline = [
-            {"$match": refund_match},
-            {"$group": {
-                "_id": None,
-                "total": {"$sum": "$amount"}
-            }}
-        ]
-        
-        refund_result = await self.db.payments.aggregate(refund_pipeline).to_list(1)
-        total_refunds = round(refund_result[0]["total"], 2) if refund_result and refund_result[0].get("total") else 0.0
+        # 2. Refunds from payments collection
+        refund_totals = await self.db.rollups.period_totals("payments_refunded", start_dt, end_dt)
+        refund_count = refund_totals["count"]
+        total_refunds = round(refund_totals["amount"], 2)
         
         # Combine expenses and refunds
         total_outflows = total_expenses + total_refunds
@@ -530,11 +411,17 @@ class ReportingService:
             }
         })
         
-        # Step 5: Remove the lookup arrays to reduce memory
+        # Step 5: Keep only the fields needed for aging
         pipeline.append({
             "$project": {
-                "items": 0,
-                "customer_info": 0
+                "invoice_number": 1,
+                "customer_name": 1,
+                "calculated_total": 1,
+                "issue_date_ts": 1,
+                "issue_date": 1,
+                "date_issued": 1,
+                "date": 1,
+                "created_at": 1
             }
         })
         
@@ -550,92 +437,56 @@ class ReportingService:
         
         # ========== CREATE AGING BUCKETS ==========
         
-        bucket_definitions = [
-            {"name": "Current (0-30 days)", "min_days": 0, "max_days": 30},
-            {"name": "31-60 days", "min_days": 31, "max_days": 60},
-            {"name": "61-90 days", "min_days": 61, "max_days": 90},
-            {"name": "Over 90 days", "min_days": 91, "max_days": None},
-        ]
+        # Resolve each invoice's issue date exactly once
+        issue_dates = []
+        for invoice in outstanding_invoices:
+            invoice_date = invoice.get("issue_date_ts") or normalize_invoice_issue_date(invoice)
+            if invoice_date is None:
+                # No parseable date - treat as issued today (0 days outstanding)
+                logger.warning(f"No parseable issue date for invoice {invoice.get('invoice_number', 'unknown')}")
+                invoice_date = as_of_dt
+            issue_dates.append(invoice_date.replace(tzinfo=None))
+        
+        days_outstanding = compute_days_outstanding(issue_dates, as_of_dt)
+        amounts = [invoice.get("calculated_total", 0) for invoice in outstanding_invoices]
+        customer_names = [invoice.get("customer_name", "Unknown") for invoice in outstanding_invoices]
+        
+        # Bucket assignment, totals, top invoices and top customers in one vectorized pass
+        aging = bucket_ar_aging(days_outstanding, amounts, customer_names)
         
         buckets = []
         
-        for bucket_def in bucket_definitions:
-            bucket_invoices = []
-            bucket_total = 0.0
-            
-            for invoice in outstanding_invoices:
-                # Calculate days outstanding
-                issue_date_str = invoice.get("issue_date", invoice.get("date", ""))
-                if not issue_date_str:
-                    # If no issue_date, try created_at or use current date
-                    issue_date_str = invoice.get("created_at", as_of_date)
-                
-                try:
-                    # Parse date string - handle multiple formats
-                    from dateutil import parser as date_parser
-                    if isinstance(issue_date_str, datetime):
-                        invoice_date = issue_date_str
-                    else:
-                        # Try parsing with dateutil (handles most formats)
-                        invoice_date = date_parser.parse(str(issue_date_str))
-                except Exception as e:
-                    # If parsing fails, log and use as_of_date (0 days outstanding)
-                    logger.warning(f"Failed to parse date '{issue_date_str}' for invoice {invoice.get('invoice_number', 'unknown')}: {e}")
-                    invoice_date = as_of_dt
-                
-                days_outstanding = (as_of_dt - invoice_date).days
-                
-                # Check if invoice belongs in this bucket
-                min_days = bucket_def["min_days"]
-                max_days = bucket_def["max_days"]
-                
-                in_bucket = False
-                if max_days is None:
-                    # 90+ bucket
-                    in_bucket = days_outstanding >= min_days
-                else:
-                    # Regular bucket
-                    in_bucket = min_days <= days_outstanding <= max_days
-                
-                if in_bucket:
-                    # Use calculated_total from invoice_items
-                    amount = invoice.get("calculated_total", invoice.get("amount", 0))
-                    
-                    # Format date for display
-                    if isinstance(invoice_date, datetime):
-                        date_issued_display = invoice_date.strftime("%Y-%m-%d")
-                    elif isinstance(issue_date_str, str) and issue_date_str:
-                        date_issued_display = issue_date_str.split()[0] if ' ' in issue_date_str else issue_date_str
-                    else:
-                        date_issued_display = "N/A"
-                    
-                    bucket_invoices.append({
-                        "invoice_id": str(invoice.get("_id")),
-                        "invoice_number": invoice.get("invoice_number", "N/A"),
-                        "customer_name": invoice.get("customer_name", "Unknown"),
-                        "amount": round(amount, 2),
-                        "date_issued": date_issued_display,
-                        "days_outstanding": days_outstanding
-                    })
-                    bucket_total += amount
+        for i, bucket_def in enumerate(AGING_BUCKETS):
+            bucket_total = float(aging["totals"][i])
+            invoice_count = int(aging["counts"][i])
             
             # Calculate percentage
             percentage = (bucket_total / total_outstanding * 100) if total_outstanding > 0 else 0.0
             
-            # Sort invoices by days outstanding (descending) and limit to top 10
-            bucket_invoices.sort(key=lambda x: x["days_outstanding"], reverse=True)
+            # Top 10 invoices by days outstanding (descending)
+            bucket_invoices = []
+            for idx in aging["top_indices"][i]:
+                invoice = outstanding_invoices[idx]
+                bucket_invoices.append({
+                    "invoice_id": str(invoice.get("_id")),
+                    "invoice_number": invoice.get("invoice_number", "N/A"),
+                    "customer_name": customer_names[idx],
+                    "amount": round(amounts[idx], 2),
+                    "date_issued": issue_dates[idx].strftime("%Y-%m-%d"),
+                    "days_outstanding": int(days_outstanding[idx])
+                })
             
             bucket = AgingBucket(
                 bucket_name=bucket_def["name"],
                 min_days=bucket_def["min_days"],
                 max_days=bucket_def["max_days"],
-                invoice_count=len(bucket_invoices),
+                invoice_count=invoice_count,
                 total_amount=round(bucket_total, 2),
                 percentage=round(percentage, 1),
-                invoices=bucket_invoices[:10]  # Limit to top 10
+                invoices=bucket_invoices
             )
             
-            logger.info(f"Bucket '{bucket_def['name']}': {len(bucket_invoices)} invoices, Total: {bucket_total:,.2f} ({percentage:.1f}%)")
+            logger.info(f"Bucket '{bucket_def['name']}': {invoice_count} invoices, Total: {bucket_total:,.2f} ({percentage:.1f}%)")
             buckets.append(bucket)
         
         # ========== CALCULATE METRICS ==========
@@ -657,32 +508,7 @@ class ReportingService:
         
         # ========== TOP CUSTOMERS WITH OUTSTANDING BALANCES ==========
         
-        customer_totals = {}
-        for invoice in outstanding_invoices:
-            customer_name = invoice.get("customer_name", "Unknown")
-            # Use calculated_total from invoice_items
-            amount = invoice.get("calculated_total", invoice.get("amount", 0))
-            
-            if customer_name not in customer_totals:
-                customer_totals[customer_name] = {
-                    "customer_name": customer_name,
-                    "outstanding_amount": 0.0,
-                    "invoice_count": 0
-                }
-            
-            customer_totals[customer_name]["outstanding_amount"] += amount
-            customer_totals[customer_name]["invoice_count"] += 1
-        
-        # Sort and get top 5
-        top_customers = sorted(
-            customer_totals.values(),
-            key=lambda x: x["outstanding_amount"],
-            reverse=True
-        )[:5]
-        
-        # Round amounts
-        for customer in top_customers:
-            customer["outstanding_amount"] = round(customer["outstanding_amount"], 2)
+        top_customers = aging["top_customers"]
         
         return ARAgingReport(
             as_of_date=as_of_date,
@@ -865,47 +691,15 @@ class ReportingService:
         end_date = datetime.now()
         start_date = end_date - relativedelta(months=months)
         
-        # Aggregate revenue by period using issue_date
-        pipeline = [
-            {
-                "$match": {
-                    "issue_date": {
-                        "$gte": start_date.strftime("%Y-%m-%d"),
-                        "$lte": end_date.strftime("%Y-%m-%d")
-                    },
-                    "status": "paid"
-                }
-            },
-            {
-                "$addFields": {
-                    "year": {"$substr": ["$issue_date", 0, 4]},
-                    "month": {"$substr": ["$issue_date", 5, 2]}
-                }
-            },
-            {
-                "$group": {
-                    "_id": {
-                        "year": "$year",
-                        "month": "$month"
-                    },
-                    "revenue": {"$sum": "$total_amount"},
-                    "invoice_count": {"$sum": 1}
-                }
-            },
-            {
-                "$sort": {"_id.year": 1, "_id.month": 1}
-            }
-        ]
-        
-        results = await self.db.invoices.aggregate(pipeline).to_list(None)
+        # Monthly paid revenue from the financial_rollups collection
+        monthly = await self.db.rollups.get_monthly("revenue", month_key(start_date), month_key(end_date))
         
         # Format results
         trends = []
         prev_revenue = None
         
-        for item in results:
-            period_label = f"{item['_id']['year']}-{item['_id']['month']}"
-            revenue = item['revenue']
+        for period_label in sorted(monthly):
+            revenue = monthly[period_label]["amount"]
             
             # Calculate change from previous period
             change_pct = 0.0
@@ -915,7 +709,7 @@ class ReportingService:
             trends.append({
                 "period": period_label,
                 "revenue": round(revenue, 2),
-                "invoice_count": item['invoice_count'],
+                "invoice_count": monthly[period_label]["count"],
                 "change_pct": round(change_pct, 2) if prev_revenue else None,
                 "trend": "up" if change_pct > 5 else "down" if change_pct < -5 else "stable"
             })
@@ -946,47 +740,15 @@ class ReportingService:
         end_date = datetime.now()
         start_date = end_date - relativedelta(months=months)
         
-        # Aggregate expenses by period
-        pipeline = [
-            {
-                "$match": {
-                    "transaction_date": {
-                        "$gte": start_date.strftime("%Y-%m-%d"),
-                        "$lte": end_date.strftime("%Y-%m-%d")
-                    },
-                    "type": "expense"
-                }
-            },
-            {
-                "$addFields": {
-                    "year": {"$substr": ["$transaction_date", 0, 4]},
-                    "month": {"$substr": ["$transaction_date", 5, 2]}
-                }
-            },
-            {
-                "$group": {
-                    "_id": {
-                        "year": "$year",
-                        "month": "$month"
-                    },
-                    "expenses": {"$sum": "$amount"},
-                    "transaction_count": {"$sum": 1}
-                }
-            },
-            {
-                "$sort": {"_id.year": 1, "_id.month": 1}
-            }
-        ]
-        
-        results = await self.db.transactions.aggregate(pipeline).to_list(None)
+        # Monthly expenses from the financial_rollups collection
+        monthly = await self.db.rollups.get_monthly("expenses", month_key(start_date), month_key(end_date))
         
         # Format results
         trends = []
         prev_expenses = None
         
-        for item in results:
-            period_label = f"{item['_id']['year']}-{item['_id']['month']}"
-            expenses = item['expenses']
+        for period_label in sorted(monthly):
+            expenses = monthly[period_label]["amount"]
             
             # Calculate change from previous period
             change_pct = 0.0
@@ -996,7 +758,7 @@ class ReportingService:
             trends.append({
                 "period": period_label,
                 "expenses": round(expenses, 2),
-                "transaction_count": item['transaction_count'],
+                "transaction_count": monthly[period_label]["count"],
                 "change_pct": round(change_pct, 2) if prev_expenses else None,
                 "trend": "up" if change_pct > 5 else "down" if change_pct < -5 else "stable"
             })
@@ -1020,6 +782,21 @@ class ReportingService:
             "data": trends
         }
     
+    async def _get_period_metrics(self, start: datetime, end: datetime) -> Dict[str, Any]:
+        """Revenue/expense totals for a period, read from the financial rollups"""
+        revenue_totals = await self.db.rollups.period_totals("revenue", start, end)
+        expense_totals = await self.db.rollups.period_totals("expenses", start, end)
+        
+        revenue = revenue_totals["amount"]
+        expenses = expense_totals["amount"]
+        
+        return {
+            "revenue": round(revenue, 2),
+            "expenses": round(expenses, 2),
+            "net_income": round(revenue - expenses, 2),
+            "invoice_count": revenue_totals["count"]
+        }
+    
     async def get_month_over_month_comparison(self) -> Dict[str, Any]:
         """Compare current month metrics with previous month"""
         from dateutil.relativedelta import relativedelta
@@ -1034,36 +811,8 @@ class ReportingService:
         prev_start = (current_start - relativedelta(months=1))
         prev_end = current_start - timedelta(days=1)
         
-        async def get_period_metrics(start: datetime, end: datetime):
-            start_str = start.strftime("%Y-%m-%d")
-            end_str = end.strftime("%Y-%m-%d")
-            
-            # Revenue - using issue_date for paid invoices
-            revenue_pipeline = [
-                {"$match": {"issue_date": {"$gte": start_str, "$lte": end_str}, "status": "paid"}},
-                {"$group": {"_id": None, "total": {"$sum": "$total_amount"}, "count": {"$sum": 1}}}
-            ]
-            revenue_result = await self.db.invoices.aggregate(revenue_pipeline).to_list(None)
-            revenue = revenue_result[0]['total'] if revenue_result else 0
-            invoice_count = revenue_result[0]['count'] if revenue_result else 0
-            
-            # Expenses
-            expense_pipeline = [
-                {"$match": {"transaction_date": {"$gte": start_str, "$lte": end_str}, "type": "expense"}},
-                {"$group": {"_id": None, "total": {"$sum": "$amount"}, "count": {"$sum": 1}}}
-            ]
-            expense_result = await self.db.transactions.aggregate(expense_pipeline).to_list(None)
-            expenses = expense_result[0]['total'] if expense_result else 0
-            
-            return {
-                "revenue": round(revenue, 2),
-                "expenses": round(expenses, 2),
-                "net_income": round(revenue - expenses, 2),
-                "invoice_count": invoice_count
-            }
-        
-        current = await get_period_metrics(current_start, current_end)
-        previous = await get_period_metrics(prev_start, prev_end)
+        current = await self._get_period_metrics(current_start, current_end)
+        previous = await self._get_period_metrics(prev_start, prev_end)
         
         # Calculate changes
         revenue_change = ((current['revenue'] - previous['revenue']) / previous['revenue'] * 100) if previous['revenue'] > 0 else 0
@@ -1095,36 +844,8 @@ class ReportingService:
         prev_start = datetime(now.year - 1, 1, 1)
         prev_end = datetime(now.year - 1, now.month, now.day)
         
-        async def get_period_metrics(start: datetime, end: datetime):
-            start_str = start.strftime("%Y-%m-%d")
-            end_str = end.strftime("%Y-%m-%d")
-            
-            # Revenue - using issue_date for paid invoices
-            revenue_pipeline = [
-                {"$match": {"issue_date": {"$gte": start_str, "$lte": end_str}, "status": "paid"}},
-                {"$group": {"_id": None, "total": {"$sum": "$total_amount"}, "count": {"$sum": 1}}}
-            ]
-            revenue_result = await self.db.invoices.aggregate(revenue_pipeline).to_list(None)
-            revenue = revenue_result[0]['total'] if revenue_result else 0
-            invoice_count = revenue_result[0]['count'] if revenue_result else 0
-            
-            # Expenses
-            expense_pipeline = [
-                {"$match": {"transaction_date": {"$gte": start_str, "$lte": end_str}, "type": "expense"}},
-                {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
-            ]
-            expense_result = await self.db.transactions.aggregate(expense_pipeline).to_list(None)
-            expenses = expense_result[0]['total'] if expense_result else 0
-            
-            return {
-                "revenue": round(revenue, 2),
-                "expenses": round(expenses, 2),
-                "net_income": round(revenue - expenses, 2),
-                "invoice_count": invoice_count
-            }
-        
-        current = await get_period_metrics(current_start, current_end)
-        previous = await get_period_metrics(prev_start, prev_end)
+        current = await self._get_period_metrics(current_start, current_end)
+        previous = await self._get_period_metrics(prev_start, prev_end)
         
         # Calculate changes
         revenue_change = ((current['revenue'] - previous['revenue']) / previous['revenue'] * 100) if previous['revenue'] > 0 else 0
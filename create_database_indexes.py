@@ -94,6 +94,34 @@ async def create_indexes():
             else:
                 raise
         
+        # 7. Compound indexes on invoices.issue_date_ts (for income statement period queries)
+        #    Populate the field first with scripts/backfill_invoice_issue_dates.py
+        logger.info("Creating compound indexes on invoices.issue_date_ts...")
+        for keys in ([("issue_date_ts", 1), ("status", 1)], [("customer_id", 1), ("issue_date_ts", 1)]):
+            index_label = " + ".join(field for field, _ in keys)
+            try:
+                await db.invoices.create_index(keys)
+                logger.info(f"✅ Created index: invoices.{index_label}")
+            except Exception as e:
+                if "already exists" in str(e) or "IndexKeySpecsConflict" in str(e):
+                    logger.info(f"ℹ️  Index already exists: invoices.{index_label}")
+                else:
+                    raise
+
+        # 8. Reconciliation candidate retrieval indexes on invoices.reconciliation_keys
+        #    Populate the keys first with scripts/backfill_reconciliation_keys.py
+        logger.info("Creating reconciliation candidate indexes on invoices...")
+        for key_field in ("phone", "amount_band", "ref_tokens"):
+            index_label = f"status + reconciliation_keys.{key_field}"
+            try:
+                await db.invoices.create_index([("status", 1), (f"reconciliation_keys.{key_field}", 1)])
+                logger.info(f"✅ Created index: invoices.{index_label}")
+            except Exception as e:
+                if "already exists" in str(e) or "IndexKeySpecsConflict" in str(e):
+                    logger.info(f"ℹ️  Index already exists: invoices.{index_label}")
+                else:
+                    raise
+
         # List all indexes
         logger.info("\n" + "="*60)
         logger.info("All indexes created successfully!")
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Backfill normalized invoice issue dates
+
+Populates `issue_date_ts` (a real BSON datetime) on every invoice from the
+legacy `issue_date` / `date_issued` / `date` / `created_at` fields and creates
+the compound indexes used by the income statement aggregation.
+
+New and updated invoices get the field at write time through
+Database.store_invoice / Database.update_invoice; this script only needs to run
+once for existing data (it is safe to re-run).
+
+Usage:
+    python scripts/backfill_invoice_issue_dates.py --dry-run  # Preview changes
+    python scripts/backfill_invoice_issue_dates.py            # Execute backfill
+    python scripts/backfill_invoice_issue_dates.py --all      # Recompute every invoice
+"""
+
+import sys
+import os
+import asyncio
+import argparse
+from pymongo import UpdateOne
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+# Load environment
+load_dotenv()
+
+from backend.database.mongodb import Database, INVOICE_DATE_FIELDS, normalize_invoice_issue_date
+
+BATCH_SIZE = 1000
+
+
+async def create_index_safe(collection, keys, **kwargs):
+    """Create an index, ignoring 'already exists' conflicts"""
+    try:
+        await collection.create_index(keys, **kwargs)
+    except Exception as e:
+        if "already exists" in str(e) or "IndexKeySpecsConflict" in str(e):
+            pass
+        else:
+            raise
+
+
+async def backfill(dry_run: bool = False, recompute_all: bool = False):
+    """Populate issue_date_ts on invoices and create supporting indexes"""
+    db = Database.get_instance()
+
+    print("\n" + "="*70)
+    print("  INVOICE ISSUE DATE BACKFILL")
+    print("="*70)
+
+    if dry_run:
+        print("\n⚠️  DRY RUN MODE - No changes will be committed\n")
+
+    query = {} if recompute_all else {"issue_date_ts": {"$exists": False}}
+    projection = {field: 1 for field in INVOICE_DATE_FIELDS}
+
+    stats = {"scanned": 0, "updated": 0, "unparseable": 0}
+    operations = []
+
+    async for invoice in db.invoices.find(query, projection):
+        stats["scanned"] += 1
+        issue_date_ts = normalize_invoice_issue_date(invoice)
+        if issue_date_ts is None:
+            stats["unparseable"] += 1
+
+        operations.append(UpdateOne(
+            {"_id": invoice["_id"]},
+            {"$set": {"issue_date_ts": issue_date_ts}}
+        ))
+
+        if len(operations) >= BATCH_SIZE:
+            if not dry_run:
+                result = await db.invoices.bulk_write(operations, ordered=False)
+                stats["updated"] += result.modified_count
+            operations = []
+            print(f"   Processed {stats['scanned']:,} invoices...", end='\r')
+
+    if operations and not dry_run:
+        result = await db.invoices.bulk_write(operations, ordered=False)
+        stats["updated"] += result.modified_count
+
+    print(f"\n✅ Scanned {stats['scanned']:,} invoices")
+    print(f"   Updated: {stats['updated']:,}")
+    print(f"   Without a parseable date: {stats['unparseable']:,} (excluded from period reports)")
+
+    if not dry_run:
+        print("\n📑 Creating indexes...")
+        await create_index_safe(db.invoices, [("issue_date_ts", 1), ("status", 1)])
+        await create_index_safe(db.invoices, [("customer_id", 1), ("issue_date_ts", 1)])
+        print("✅ Indexes created: invoices.issue_date_ts + status, invoices.customer_id + issue_date_ts")
+
+    await db.close()
+    return stats
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Backfill normalized invoice issue dates")
+    parser.add_argument("--dry-run", action="store_true", help="Preview changes without writing")
+    parser.add_argument("--all", action="store_true", help="Recompute issue_date_ts for every invoice")
+    args = parser.parse_args()
+
+    await backfill(dry_run=args.dry_run, recompute_all=args.all)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Backfill invoice reconciliation keys
+
+Populates `reconciliation_keys` (normalized phone, amount band and
+invoice-number tokens) on every invoice and creates the indexes used by
+payment reconciliation candidate retrieval
+(backend/reconciliation/candidates.py).
+
+New and updated invoices get the keys at write time through
+Database.store_invoice / Database.update_invoice; this script only needs to
+run once for existing data (it is safe to re-run).
+
+Usage:
+    python scripts/backfill_reconciliation_keys.py --dry-run  # Preview changes
+    python scripts/backfill_reconciliation_keys.py            # Execute backfill
+"""
+
+import sys
+import os
+import asyncio
+import argparse
+from pymongo import UpdateOne
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+# Load environment
+load_dotenv()
+
+from backend.database.mongodb import Database
+from backend.database.match_keys import build_invoice_match_keys
+
+BATCH_SIZE = 1000
+
+
+async def create_index_safe(collection, keys, **kwargs):
+    """Create an index, ignoring 'already exists' conflicts"""
+    try:
+        await collection.create_index(keys, **kwargs)
+    except Exception as e:
+        if "already exists" in str(e) or "IndexKeySpecsConflict" in str(e):
+            pass
+        else:
+            raise
+
+
+async def backfill(dry_run: bool = False):
+    """Populate reconciliation_keys on invoices and create supporting indexes"""
+    db = Database.get_instance()
+
+    print("\n" + "="*70)
+    print("  INVOICE RECONCILIATION KEYS BACKFILL")
+    print("="*70)
+
+    if dry_run:
+        print("\n⚠️  DRY RUN MODE - No changes will be committed\n")
+
+    # Normalized invoices keep the phone on the customer document
+    customers = {}
+    async for customer in db.customers.find({}, {"customer_id": 1, "phone": 1, "phone_number": 1}):
+        if customer.get("customer_id"):
+            customers[customer["customer_id"]] = customer
+    print(f"📇 Loaded {len(customers):,} customers")
+
+    stats = {"scanned": 0, "updated": 0, "without_phone": 0}
+    operations = []
+
+    async for invoice in db.invoices.find({}):
+        stats["scanned"] += 1
+        keys = build_invoice_match_keys(invoice, customers.get(invoice.get("customer_id")))
+        if keys["phone"] is None:
+            stats["without_phone"] += 1
+
+        operations.append(UpdateOne(
+            {"_id": invoice["_id"]},
+            {"$set": {"reconciliation_keys": keys}}
+        ))
+
+        if len(operations) >= BATCH_SIZE:
+            if not dry_run:
+                result = await db.invoices.bulk_write(operations, ordered=False)
+                stats["updated"] += result.modified_count
+            operations = []
+            print(f"   Processed {stats['scanned']:,} invoices...", end='\r')
+
+    if operations and not dry_run:
+        result = await db.invoices.bulk_write(operations, ordered=False)
+        stats["updated"] += result.modified_count
+
+    print(f"\n✅ Scanned {stats['scanned']:,} invoices")
+    print(f"   Updated: {stats['updated']:,}")
+    print(f"   Without a phone number: {stats['without_phone']:,} (matched by amount/reference only)")
+
+    if not dry_run:
+        print("\n📑 Creating indexes...")
+        await create_index_safe(db.invoices, [("status", 1), ("reconciliation_keys.phone", 1)])
+        await create_index_safe(db.invoices, [("status", 1), ("reconciliation_keys.amount_band", 1)])
+        await create_index_safe(db.invoices, [("status", 1), ("reconciliation_keys.ref_tokens", 1)])
+        print("✅ Indexes created on invoices.status + reconciliation_keys.{phone, amount_band, ref_tokens}")
+
+    await db.close()
+    return stats
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Backfill invoice reconciliation keys")
+    parser.add_argument("--dry-run", action="store_true", help="Preview changes without writing")
+    args = parser.parse_args()
+
+    await backfill(dry_run=args.dry_run)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Benchmark AR aging bucketing
+
+Compares the vectorized single-pass aging (backend/reporting/aging.py) with the
+previous per-bucket loop (4 passes over all invoices, re-parsing every date)
+on synthetic outstanding invoices. No database is needed.
+
+Usage:
+    python scripts/benchmark_ar_aging.py
+    python scripts/benchmark_ar_aging.py --sizes 10000 100000 1000000 --legacy-max 100000
+"""
+
+import sys
+import os
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+from dateutil import parser as date_parser
+
+from reporting.aging import AGING_BUCKETS, bucket_ar_aging, compute_days_outstanding
+
+
+def generate_invoices(count, as_of):
+    """Synthetic outstanding invoices spread over the last 180 days"""
+    random.seed(42)
+    customers = [f"Customer {i}" for i in range(500)]
+    invoices = []
+    for i in range(count):
+        issued = as_of - timedelta(days=random.randint(0, 180), hours=random.randint(0, 23))
+        invoices.append({
+            "_id": i,
+            "invoice_number": f"INV-{i:07d}",
+            "customer_name": random.choice(customers),
+            "calculated_total": round(random.uniform(1000, 500000), 2),
+            "issue_date": issued.strftime("%Y-%m-%d %H:%M:%S"),
+            "issue_date_ts": issued,
+        })
+    return invoices
+
+
+def legacy_aging(invoices, as_of):
+    """Previous implementation: one full pass (and date parse) per bucket"""
+    buckets = []
+    for bucket_def in AGING_BUCKETS:
+        bucket_invoices = []
+        bucket_total = 0.0
+        for invoice in invoices:
+            invoice_date = date_parser.parse(str(invoice["issue_date"]))
+            days = (as_of - invoice_date).days
+            max_days = bucket_def["max_days"]
+            if (max_days is None and days >= bucket_def["min_days"]) or \
+                    (max_days is not None and bucket_def["min_days"] <= days <= max_days):
+                bucket_invoices.append({"invoice_number": invoice["invoice_number"], "days_outstanding": days})
+                bucket_total += invoice["calculated_total"]
+        bucket_invoices.sort(key=lambda x: x["days_outstanding"], reverse=True)
+        buckets.append((len(bucket_invoices), bucket_total, bucket_invoices[:10]))
+
+    customer_totals = {}
+    for invoice in invoices:
+        entry = customer_totals.setdefault(invoice["customer_name"], [0.0, 0])
+        entry[0] += invoice["calculated_total"]
+        entry[1] += 1
+    top = sorted(customer_totals.items(), key=lambda x: x[1][0], reverse=True)[:5]
+    return buckets, top
+
+
+def vectorized_aging(invoices, as_of):
+    """Current implementation: ages computed once, single vectorized pass"""
+    issue_dates = [invoice["issue_date_ts"] for invoice in invoices]
+    days = compute_days_outstanding(issue_dates, as_of)
+    amounts = [invoice["calculated_total"] for invoice in invoices]
+    names = [invoice["customer_name"] for invoice in invoices]
+    return bucket_ar_aging(days, amounts, names)
+
+
+def time_call(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return (time.perf_counter() - start) * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark AR aging bucketing")
+    parser.add_argument("--sizes", nargs="*", type=int, default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--legacy-max", type=int, default=100_000,
+                        help="Skip the legacy loop above this size (it takes minutes at 1M)")
+    args = parser.parse_args()
+
+    as_of = datetime(2025, 10, 15)
+
+    print("\n" + "="*70)
+    print("  AR AGING BENCHMARK")
+    print("="*70)
+    print(f"\n{'invoices':>10} | {'vectorized (ms)':>16} | {'legacy 4xN (ms)':>16} | {'speedup':>8}")
+    print("-" * 60)
+
+    for size in args.sizes:
+        invoices = generate_invoices(size, as_of)
+        vec_ms, result = time_call(vectorized_aging, invoices, as_of)
+
+        if size <= args.legacy_max:
+            legacy_ms, (legacy_buckets, _) = time_call(legacy_aging, invoices, as_of)
+            assert [b[0] for b in legacy_buckets] == [int(c) for c in result["counts"]]
+            print(f"{size:>10,} | {vec_ms:>16.1f} | {legacy_ms:>16.1f} | {legacy_ms / vec_ms:>7.1f}x")
+        else:
+            print(f"{size:>10,} | {vec_ms:>16.1f} | {'skipped':>16} | {'-':>8}")
+
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Benchmark Celery OCR worker task overhead
+
+Runs --tasks task bodies back to back the way a Celery OCR worker process
+does, without a broker, in two modes:
+
+    per-task  - every task creates an event loop, a Motor client and an
+                OCRService, runs, and closes the loop (the old behaviour)
+    runtime   - tasks run on the worker's long-lived loop, Motor client and
+                OCRService (backend/ocr/worker_runtime.py)
+
+Each task does the database part of a receipt job: load the receipt and set
+its processing status twice. OCR itself costs the same in both modes and is
+left out so the per-task overhead is visible. A benchmark receipt is inserted
+into the receipts collection (MONGO_URI / MONGO_DB) and removed afterwards.
+
+Usage:
+    python scripts/benchmark_celery_ocr_worker.py
+    python scripts/benchmark_celery_ocr_worker.py --tasks 500 --modes runtime
+"""
+
+import sys
+import os
+import time
+import uuid
+import asyncio
+import argparse
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+sys.path.insert(0, os.path.join(project_root, "backend"))
+
+from dotenv import load_dotenv
+
+# Load environment
+load_dotenv()
+
+from database.mongodb import Database
+from ocr.models import ProcessingStatus
+from ocr.service import OCRService
+from ocr.worker_runtime import OCRWorkerRuntime
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def receipt_job(ocr_service: OCRService, receipt_id: str):
+    receipt = await ocr_service.get_receipt(receipt_id)
+    if receipt is None:
+        raise RuntimeError(f"Benchmark receipt {receipt_id} not found")
+    await ocr_service.update_receipt_status(receipt_id, ProcessingStatus.PROCESSING)
+    await ocr_service.update_receipt_status(receipt_id, ProcessingStatus.COMPLETED)
+
+
+def per_task(receipt_id: str):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        db = Database()
+        ocr_service = OCRService(db)
+        loop.run_until_complete(receipt_job(ocr_service, receipt_id))
+        # The old task never closed its client; closing keeps the benchmark from leaking sockets
+        loop.run_until_complete(db.close())
+    finally:
+        loop.close()
+
+
+def run_mode(mode: str, receipt_id: str, tasks: int):
+    runtime = None
+    if mode == "runtime":
+        # Started by worker_process_init in a real worker, before any task
+        runtime = OCRWorkerRuntime()
+        runtime.start()
+
+    timings = []
+    started = time.perf_counter()
+    for _ in range(tasks):
+        task_started = time.perf_counter()
+        if runtime:
+            runtime.run(receipt_job(runtime.ocr_service, receipt_id))
+        else:
+            per_task(receipt_id)
+        timings.append((time.perf_counter() - task_started) * 1000)
+    elapsed = time.perf_counter() - started
+
+    if runtime:
+        runtime.shutdown()
+
+    return {
+        "mode": mode,
+        "elapsed": elapsed,
+        "tasks_per_sec": tasks / elapsed if elapsed else 0.0,
+        "p50": percentile(timings, 50),
+        "p95": percentile(timings, 95),
+        "max": max(timings) if timings else 0.0,
+    }
+
+
+def seed_receipt(receipt_id: str):
+    async def insert():
+        db = Database()
+        await db.db["receipts"].insert_one({
+            "_id": receipt_id,
+            "id": receipt_id,
+            "user_id": "benchmark",
+            "file_path": "uploads/receipts/benchmark/benchmark.png",
+            "original_filename": "benchmark.png",
+            "file_size": 0,
+            "mime_type": "image/png",
+            "total_amount": 0.0,
+            "processing_status": ProcessingStatus.PENDING.value,
+        })
+        await db.close()
+    asyncio.run(insert())
+
+
+def remove_receipt(receipt_id: str):
+    async def delete():
+        db = Database()
+        await db.db["receipts"].delete_one({"_id": receipt_id})
+        await db.close()
+    asyncio.run(delete())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Celery OCR worker tasks/sec, per-task loop vs worker runtime")
+    parser.add_argument("--tasks", type=int, default=200, help="Tasks per mode")
+    parser.add_argument("--modes", default="per-task,runtime", help="Comma-separated modes")
+    args = parser.parse_args()
+
+    receipt_id = f"benchmark-{uuid.uuid4()}"
+    seed_receipt(receipt_id)
+
+    print("=" * 80)
+    print("CELERY OCR WORKER BENCHMARK")
+    print("=" * 80)
+    print(f"Tasks per mode: {args.tasks}  MongoDB: {os.environ.get('MONGO_URI', 'mongodb://localhost:27017')}")
+
+    results = []
+    try:
+        for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+            print(f"\nRunning {mode}...")
+            results.append(run_mode(mode, receipt_id, args.tasks))
+    finally:
+        remove_receipt(receipt_id)
+
+    print(f"\n{'Mode':<10}{'tasks/s':>10}{'p50':>10}{'p95':>10}{'max':>10}{'total':>10}")
+    for r in results:
+        print(
+            f"{r['mode']:<10}{r['tasks_per_sec']:>10.1f}{r['p50']:>8.1f}ms{r['p95']:>8.1f}ms"
+            f"{r['max']:>8.1f}ms{r['elapsed']:>9.1f}s"
+        )
+
+    if len(results) == 2 and results[0]["tasks_per_sec"]:
+        print(f"\nSpeed-up: {results[1]['tasks_per_sec'] / results[0]['tasks_per_sec']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Benchmark API latency while OCR jobs run
+
+Simulates a FastAPI worker: a steady stream of light "API requests" (one
+every --interval ms, each a small JSON round trip) shares the event loop with
+--jobs concurrent receipt OCR jobs (preprocess_image + tesseract_ocr_advanced,
+plus easyocr_ocr_advanced when EasyOCR is installed). Request latency is
+measured from the moment a request was due, so time spent waiting for the
+loop counts. Each OCR executor mode is run in turn:
+
+    inline   - CPU-bound stages run on the event loop (the old behaviour)
+    thread   - stages run in a thread pool
+    process  - stages run in OCR worker processes (backend/ocr/executor.py)
+
+Receipt images default to the sample receipts in the repository root.
+
+Usage:
+    python scripts/benchmark_ocr_event_loop.py
+    python scripts/benchmark_ocr_event_loop.py --jobs 16 --modes inline,process
+    python scripts/benchmark_ocr_event_loop.py --images path/to/receipts/*.jpg
+"""
+
+import sys
+import os
+import glob
+import json
+import time
+import asyncio
+import argparse
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+sys.path.insert(0, os.path.join(project_root, "backend"))
+
+from dotenv import load_dotenv
+
+# Load environment
+load_dotenv()
+
+from ocr.enhanced_processor import EnhancedReceiptProcessor
+from ocr.executor import OCRExecutor, OCRExecutorConfig
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def default_images():
+    return sorted(
+        path for path in glob.glob(os.path.join(project_root, "*.png")) + glob.glob(os.path.join(project_root, "*.jpg"))
+        if not os.path.basename(path).startswith("processed_")
+    )
+
+
+async def api_traffic(stop: asyncio.Event, interval: float, latencies: list):
+    """Fire a light request every interval seconds and record due-to-done latency"""
+    payload = {"status": "healthy", "items": list(range(50))}
+    loop = asyncio.get_running_loop()
+    due = loop.time()
+    while not stop.is_set():
+        due += interval
+        delay = due - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await asyncio.sleep(0)
+        json.loads(json.dumps(payload))
+        latencies.append((loop.time() - due) * 1000)
+
+
+async def ocr_job(processor: EnhancedReceiptProcessor, image_path: str):
+    image = await asyncio.to_thread(processor.load_image, image_path)
+    frame = processor.executor.share(image)
+    processed, _ = await processor.preprocess_image(frame)
+    try:
+        await processor.tesseract_ocr_advanced(processed)
+        if processor.engine_pool.easyocr_available:
+            await processor.easyocr_ocr_advanced(processed)
+    finally:
+        processor.executor.release(frame)
+        processor.executor.release(processed)
+
+
+async def run_mode(mode: str, images: list, jobs: int, interval: float, workers: int):
+    config = OCRExecutorConfig()
+    config.mode = mode
+    if workers:
+        config.workers = workers
+    config.max_queue = max(config.max_queue, jobs)
+    executor = OCRExecutor(config)
+    processor = EnhancedReceiptProcessor(enable_gemini=False, executor=executor)
+
+    if mode != "inline":
+        # Worker start-up and model loading are not part of steady-state latency
+        await asyncio.get_running_loop().run_in_executor(None, executor.warm)
+
+    # Baseline: traffic alone
+    idle_latencies = []
+    stop = asyncio.Event()
+    traffic = asyncio.create_task(api_traffic(stop, interval, idle_latencies))
+    await asyncio.sleep(1.0)
+    stop.set()
+    await traffic
+
+    latencies = []
+    stop = asyncio.Event()
+    traffic = asyncio.create_task(api_traffic(stop, interval, latencies))
+    started = time.time()
+    await asyncio.gather(*(ocr_job(processor, images[i % len(images)]) for i in range(jobs)))
+    elapsed = time.time() - started
+    stop.set()
+    await traffic
+    executor.shutdown()
+
+    return {
+        "mode": mode,
+        "idle_p99": percentile(idle_latencies, 99),
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "max": max(latencies) if latencies else 0.0,
+        "requests": len(latencies),
+        "elapsed": elapsed,
+        "receipts_per_sec": jobs / elapsed if elapsed else 0.0,
+        "stages": executor.get_metrics()["stages"],
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="API latency while OCR jobs run, per OCR executor mode")
+    parser.add_argument("--images", nargs="*", help="Receipt images (default: sample receipts in the repo root)")
+    parser.add_argument("--jobs", type=int, default=8, help="Concurrent OCR jobs")
+    parser.add_argument("--interval", type=float, default=10.0, help="Milliseconds between API requests")
+    parser.add_argument("--workers", type=int, default=0, help="OCR workers (default: OCR_EXECUTOR_WORKERS)")
+    parser.add_argument("--modes", default="inline,thread,process", help="Comma-separated executor modes")
+    args = parser.parse_args()
+
+    images = args.images or default_images()
+    if not images:
+        print("No receipt images found")
+        return
+
+    print("=" * 80)
+    print("OCR EVENT LOOP BENCHMARK")
+    print("=" * 80)
+    print(f"Images: {len(images)}  Jobs: {args.jobs}  Request interval: {args.interval:.0f}ms")
+
+    results = []
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        print(f"\nRunning {mode}...")
+        results.append(await run_mode(mode, images, args.jobs, args.interval / 1000, args.workers))
+
+    print(f"\n{'Mode':<10}{'idle p99':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}{'reqs':>8}{'rcpt/s':>9}")
+    for r in results:
+        print(
+            f"{r['mode']:<10}{r['idle_p99']:>8.1f}ms{r['p50']:>8.1f}ms{r['p95']:>8.1f}ms"
+            f"{r['p99']:>8.1f}ms{r['max']:>8.1f}ms{r['requests']:>8}{r['receipts_per_sec']:>9.2f}"
+        )
+
+    print("\nStage timings (average seconds):")
+    for r in results:
+        stages = ", ".join(f"{name} {stats['average_seconds']:.3f}s" for name, stats in r["stages"].items())
+        print(f"  {r['mode']:<10}{stages}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
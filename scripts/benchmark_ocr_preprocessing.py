@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Benchmark adaptive OCR preprocessing against the full pipeline
+
+For every receipt image, preprocessing runs --repeats times with every stage
+(OCR_ADAPTIVE_PREPROCESSING=false behaviour) and with the plan picked by the
+image quality check (backend/ocr/quality.py). Reports the chosen plan, mean
+time per run and per stage, and the speedup. With --ocr (needs the tesseract
+binary) it also compares the Tesseract text produced from both outputs.
+
+Receipt images default to the sample receipts in the repository root. The
+samples are clean renders, so degraded copies of the largest one (noisy,
+skewed, photographed on a table, unevenly lit, blurry) are added to show the
+plan changing with image quality; --no-variants skips them.
+
+Usage:
+    python scripts/benchmark_ocr_preprocessing.py
+    python scripts/benchmark_ocr_preprocessing.py --repeats 10 --ocr
+    python scripts/benchmark_ocr_preprocessing.py --images path/to/receipts/*.jpg --no-variants
+"""
+
+import sys
+import os
+import glob
+import time
+import difflib
+import argparse
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+sys.path.insert(0, os.path.join(project_root, "backend"))
+
+from dotenv import load_dotenv
+
+# Load environment
+load_dotenv()
+
+import cv2
+import numpy as np
+
+from ocr.enhanced_processor import EnhancedReceiptProcessor
+from ocr.executor import OCRExecutor
+from ocr.quality import PreprocessingConfig
+
+
+def default_images():
+    return sorted(
+        path for path in glob.glob(os.path.join(project_root, "*.png")) + glob.glob(os.path.join(project_root, "*.jpg"))
+        if not os.path.basename(path).startswith("processed_")
+    )
+
+
+def degraded_variants(image: np.ndarray):
+    """Synthetic phone-photo style copies of a clean receipt"""
+    rng = np.random.default_rng(0)
+    h, w = image.shape[:2]
+
+    noisy = np.clip(image.astype(np.int16) + rng.normal(0, 12, image.shape), 0, 255).astype(np.uint8)
+
+    matrix = cv2.getRotationMatrix2D((w / 2, h / 2), 6, 1.0)
+    skewed = cv2.warpAffine(image, matrix, (w, h), borderValue=(255, 255, 255))
+
+    on_table = np.full((h + 200, w + 200, 3), 60, np.uint8)
+    on_table[100:100 + h, 100:100 + w] = image
+
+    shadowed = (image * np.linspace(0.45, 1.0, w)[None, :, None]).astype(np.uint8)
+
+    blurry = cv2.GaussianBlur(noisy, (7, 7), 0)
+
+    return {
+        "variant:noisy": noisy,
+        "variant:skewed": skewed,
+        "variant:on_table": on_table,
+        "variant:shadowed": shadowed,
+        "variant:blurry_noisy": blurry,
+    }
+
+
+def run_preprocessing(processor: EnhancedReceiptProcessor, image: np.ndarray, repeats: int):
+    durations = []
+    stage_totals = {}
+    for _ in range(repeats):
+        started = time.perf_counter()
+        processed, report = processor.preprocess_image_sync(image)
+        durations.append((time.perf_counter() - started) * 1000)
+        for stage, ms in report["timings_ms"].items():
+            stage_totals[stage] = stage_totals.get(stage, 0.0) + ms
+    stage_means = {stage: total / repeats for stage, total in stage_totals.items()}
+    return processed, report, sum(durations) / len(durations), stage_means
+
+
+def tesseract_text(processor: EnhancedReceiptProcessor, image: np.ndarray) -> str:
+    text, _ = processor.read_tesseract(image, processor.tesseract_psm_configs["tesseract_psm6"])
+    return text
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark adaptive OCR preprocessing")
+    parser.add_argument("--images", nargs="*", help="Receipt images (default: sample receipts in the repo root)")
+    parser.add_argument("--repeats", type=int, default=5, help="Preprocessing runs per image and mode")
+    parser.add_argument("--no-variants", action="store_true", help="Skip the synthetic degraded copies")
+    parser.add_argument("--ocr", action="store_true", help="Compare Tesseract output of both modes")
+    args = parser.parse_args()
+
+    paths = args.images or default_images()
+    if not paths:
+        print("No receipt images found")
+        return 1
+
+    executor = OCRExecutor.inline()
+    full = EnhancedReceiptProcessor(enable_gemini=False, executor=executor)
+    full.preprocessing_config = PreprocessingConfig()
+    full.preprocessing_config.adaptive = False
+    adaptive = EnhancedReceiptProcessor(enable_gemini=False, executor=executor)
+    adaptive.preprocessing_config = PreprocessingConfig()
+    adaptive.preprocessing_config.adaptive = True
+
+    images = {}
+    for path in paths:
+        image = adaptive.load_image(path)
+        images[os.path.basename(path)] = image
+    if not args.no_variants:
+        images.update(degraded_variants(max(images.values(), key=lambda image: image.size)))
+
+    if args.ocr and not adaptive.engine_pool.tesseract_available:
+        print("Tesseract not available; skipping OCR comparison")
+        args.ocr = False
+
+    print(f"Preprocessing benchmark: {len(images)} image(s), {args.repeats} run(s) each\n")
+    print(f"{'image':<28} {'full ms':>9} {'adaptive ms':>12} {'speedup':>8}  plan")
+
+    total_full = total_adaptive = 0.0
+    stage_rows = []
+    for name, image in images.items():
+        full_image, _, full_ms, full_stages = run_preprocessing(full, image, args.repeats)
+        adaptive_image, report, adaptive_ms, adaptive_stages = run_preprocessing(adaptive, image, args.repeats)
+        total_full += full_ms
+        total_adaptive += adaptive_ms
+
+        plan = report["plan"]
+        print(f"{name:<28} {full_ms:>9.1f} {adaptive_ms:>12.1f} {full_ms / adaptive_ms:>7.1f}x  {','.join(plan['stages'])}")
+        stage_rows.append((name, full_stages, adaptive_stages, report))
+
+        if args.ocr:
+            full_text = tesseract_text(full, full_image)
+            adaptive_text = tesseract_text(adaptive, adaptive_image)
+            similarity = difflib.SequenceMatcher(None, full_text, adaptive_text).ratio()
+            print(f"{'':<28} OCR text similarity {similarity:.1%} ({len(full_text)} vs {len(adaptive_text)} chars)")
+
+    print(f"\n{'total':<28} {total_full:>9.1f} {total_adaptive:>12.1f} {total_full / total_adaptive:>7.1f}x")
+
+    print("\nMean stage timings (ms): full -> adaptive")
+    for name, full_stages, adaptive_stages, report in stage_rows:
+        cells = []
+        for stage, ms in full_stages.items():
+            adaptive_value = adaptive_stages.get(stage)
+            cells.append(f"{stage} {ms:.1f}->{'skip' if adaptive_value is None else f'{adaptive_value:.1f}'}")
+        print(f"  {name}: " + ", ".join(cells))
+        quality = report["quality"]
+        print(
+            f"    quality: sharpness={quality['sharpness']:.0f} noise={quality['noise_sigma']:.1f} "
+            f"skew={quality['skew_angle']:.1f} contrast={quality['contrast']:.0f} "
+            f"lighting={quality['lighting_spread']:.0f} background={quality['background_delta']:.0f}"
+        )
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Benchmark receipt field extraction
+
+Compares the single-pass field extractor (backend/ocr/field_extractor.py) with
+the previous per-field extraction (every pattern list re-run over the whole
+text, plus lower/upper copies, once per field) on a corpus of OCR texts, and
+reports how often the two agree on the main fields.
+
+The corpus is synthetic Kenyan receipts in the layouts Tesseract and EasyOCR
+produce (label and value on one line, or split over two), plus any .txt files
+passed with --texts. No OCR engines or database are needed.
+
+Usage:
+    python scripts/benchmark_receipt_field_extraction.py
+    python scripts/benchmark_receipt_field_extraction.py --receipts 5000 --repeat 3
+    python scripts/benchmark_receipt_field_extraction.py --texts ocr_dumps/*.txt
+"""
+
+import sys
+import os
+import re
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+from ocr.field_extractor import extract_receipt_fields
+
+
+class LegacyExtractor:
+    """EnhancedReceiptProcessor field extraction before the single-pass scanner"""
+
+    patterns = {
+        'currency': [
+            r'ksh[:\s]*(\d+[\.,]\d{2})',
+            r'kes[:\s]*(\d+[\.,]\d{2})',
+            r'(\d+[\.,]\d{2})\s*kes',
+            r'total[:\s]*(\d+[\.,]\d{2})'
+        ],
+        'date': [
+            r'\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4}',
+            r'\d{1,2}\s+(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)\s+\d{2,4}',
+            r'\d{4}[\/\-\.]\d{1,2}[\/\-\.]\d{1,2}'
+        ],
+        'phone': [
+            r'(?:\+254|0)[7]\d{8}',
+            r'\d{4}\s*\d{3}\s*\d{3}',
+            r'\d{10}'
+        ],
+        'mpesa_reference': [
+            r'[A-Z]{2}\d{8}[A-Z]{2}',
+            r'mpesa[:\s]*([A-Z0-9]{10})',
+            r'ref[:\s]*([A-Z0-9]+)'
+        ]
+    }
+
+    def extract_structured_data_phase2(self, text):
+        structured_data = self.extract_structured_data(text)
+        enhanced_patterns = {
+            'vendor_name': [
+                r'(?:^|\n)([A-Z][A-Z\s&.,-]{2,30}?)(?:\n|$)',
+                r'(?:business|company|ltd|limited|shop)[:\s]*([^\n\r]+)',
+            ],
+            'kra_pin': [
+                r'pin[:\s]*([a-z]\d{9}[a-z])',
+                r'kra[:\s]*pin[:\s]*([a-z]\d{9}[a-z])',
+                r'tax[:\s]*pin[:\s]*([a-z]\d{9}[a-z])',
+            ],
+            'vat_number': [
+                r'vat[:\s]*no[:\s]*(\d{10})',
+                r'vat[:\s]*(\d{10})',
+            ],
+            'mpesa_reference': [
+                r'mpesa[:\s]*(?:ref|reference|code)[:\s]*([a-z0-9]{8,12})',
+                r'transaction[:\s]*(?:ref|reference|id)[:\s]*([a-z0-9]{8,12})',
+                r'ref[:\s]*no[:\s]*([a-z0-9]{8,12})',
+            ],
+            'phone_mpesa': [
+                r'(?:from|to)[:\s]*(\d{10})',
+                r'(?:07\d{8}|01\d{8}|\+254\d{9})',
+            ],
+            'till_number': [
+                r'till[:\s]*(?:no|number)[:\s]*(\d{5,7})',
+                r'paybill[:\s]*(\d{5,7})',
+            ]
+        }
+        for key, patterns in enhanced_patterns.items():
+            if key not in structured_data or not structured_data[key]:
+                for pattern in patterns:
+                    matches = re.findall(pattern, text, re.IGNORECASE | re.MULTILINE)
+                    if matches:
+                        structured_data[key] = matches[0] if isinstance(matches[0], str) else matches[0][0]
+                        break
+        amount_patterns = [
+            r'total[:\s]*(?:ksh|kes)[:\s]*(\d+[\.,]\d{2})',
+            r'total[:\s]*(\d+[\.,]\d{2})',
+            r'amount[:\s]*(?:ksh|kes)[:\s]*(\d+[\.,]\d{2})',
+            r'(?:ksh|kes)[:\s]*(\d+[\.,]\d{2})',
+            r'(\d+[\.,]\d{2})[:\s]*(?:ksh|kes)',
+        ]
+        for pattern in amount_patterns:
+            matches = re.findall(pattern, text.lower())
+            if matches:
+                amounts = []
+                for match in matches:
+                    try:
+                        amounts.append(float(match.replace(',', '')))
+                    except ValueError:
+                        continue
+                if amounts:
+                    structured_data['total_amount'] = max(amounts)
+                    structured_data['currency'] = 'KES'
+                    break
+        date_patterns = [
+            r'(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})',
+            r'(\d{1,2}\s+(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)\s+\d{2,4})',
+            r'date[:\s]*(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})',
+        ]
+        for pattern in date_patterns:
+            matches = re.findall(pattern, text.lower())
+            if matches:
+                structured_data['transaction_date'] = matches[0]
+                break
+        return structured_data
+
+    def extract_structured_data(self, text):
+        data = {}
+        amounts = self.extract_amounts(text)
+        if amounts:
+            data['amounts'] = amounts
+            data['total_amount'] = max(amounts)
+        dates = self.extract_dates(text)
+        if dates:
+            data['dates'] = dates
+        phones = self.extract_phones(text)
+        if phones:
+            data['phone_numbers'] = phones
+        mpesa_refs = self.extract_mpesa_references(text)
+        if mpesa_refs:
+            data['mpesa_references'] = mpesa_refs
+        return data
+
+    def extract_amounts(self, text):
+        amounts = []
+        for pattern in self.patterns['currency']:
+            for match in re.findall(pattern, text.lower()):
+                try:
+                    amounts.append(float(match.replace(',', '.')))
+                except ValueError:
+                    continue
+        return list(set(amounts))
+
+    def extract_dates(self, text):
+        dates = []
+        for pattern in self.patterns['date']:
+            dates.extend(re.findall(pattern, text))
+        return list(set(dates))
+
+    def extract_phones(self, text):
+        phones = []
+        for pattern in self.patterns['phone']:
+            phones.extend(re.findall(pattern, text))
+        return list(set(phones))
+
+    def extract_mpesa_references(self, text):
+        refs = []
+        for pattern in self.patterns['mpesa_reference']:
+            refs.extend(re.findall(pattern, text.upper()))
+        return list(set(refs))
+
+
+VENDORS = ["NAIVAS SUPERMARKET", "JAVA HOUSE COFFEE", "CARREFOUR", "QUICKMART", "TOTAL ENERGIES",
+           "ARTCAFFE", "CHANDARANA FOODPLUS", "TUSKYS", "GOODLIFE PHARMACY", "KENCHIC"]
+ITEMS = ["Bread", "Milk 500ml", "Sugar 1kg", "Rice 2kg", "Cooking Oil", "Eggs Tray", "Coffee",
+         "Tea Leaves", "Soap", "Tissue", "Diesel", "Printer Paper", "Toner", "Water 1L"]
+MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+# Fixed layouts that must keep parsing (currency glued to the amount, as in M-Pesa SMS)
+PARITY_TEXTS = [
+    "Ksh500.00 sent to JOHN DOE 0712345678 on 12/3/25 at 2:15 PM",
+    "SUPERMARKET\nTOTAL KSH500.00\nThank you",
+    "CAFE\nTotal:KES250.00",
+]
+
+
+def mpesa_code(rng):
+    letters = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    return "".join(rng.choice(letters) for _ in range(2)) + str(rng.randint(10_000_000, 99_999_999)) + \
+        "".join(rng.choice(letters) for _ in range(2))
+
+
+def synthetic_receipt(rng):
+    """One OCR text, in Tesseract (same-line) or EasyOCR (split-line) layout"""
+    split = rng.random() < 0.4
+    lines = [rng.choice(VENDORS), f"PIN: P{rng.randint(100_000_000, 999_999_999)}{rng.choice('ABCXYZ')}"]
+    day, month, year = rng.randint(1, 28), rng.randint(1, 12), rng.randint(2023, 2025)
+    if rng.random() < 0.7:
+        lines.append(f"Date: {day:02d}/{month:02d}/{year}  Time: {rng.randint(8, 21)}:{rng.randint(0, 59):02d}")
+    else:
+        lines.append(f"{day} {MONTHS[month - 1]} {year}")
+    subtotal = 0.0
+    for _ in range(rng.randint(2, 25)):
+        price = round(rng.uniform(20, 3000), 2)
+        subtotal += price
+        item = f"{rng.randint(1, 5)}x {rng.choice(ITEMS)}"
+        lines.extend([item, f"{price:.2f}"] if split else [f"{item:<24}{price:>10.2f}"])
+    vat = round(subtotal * 0.16, 2)
+    total = round(subtotal + vat, 2)
+    pairs = [("Subtotal", f"{subtotal:.2f}"), ("VAT 16%", f"{vat:.2f}"), ("TOTAL KSH", f"{total:.2f}")]
+    if rng.random() < 0.5:
+        pairs.append(("Cash KES", f"{total + rng.randint(0, 500):.2f}"))
+    for label, value in pairs:
+        lines.extend([label, value] if split else [f"{label}: {value}"])
+    if rng.random() < 0.6:
+        lines.append(f"M-PESA Ref: {mpesa_code(rng)}")
+        lines.append(f"Till No: {rng.randint(100_000, 999_999)}")
+    if rng.random() < 0.3:
+        lines.append(f"Tel: 07{rng.randint(10_000_000, 99_999_999)}")
+    lines.append("Thank you for shopping with us")
+    return "\n".join(lines)
+
+
+def time_extractor(extract, texts, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for text in texts:
+            extract(text)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def check_parity(legacy_extract, single_pass):
+    """Totals of the fixed layouts must match the per-field extraction"""
+    failures = 0
+    for text in PARITY_TEXTS:
+        old, new = legacy_extract(text).get("total_amount"), single_pass(text).get("total_amount")
+        if old != new:
+            failures += 1
+            print(f"  PARITY MISMATCH {text!r}: per-field {old}, single-pass {new}")
+    print(f"\nParity layouts: {len(PARITY_TEXTS) - failures}/{len(PARITY_TEXTS)} totals match")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Receipt field extraction: single-pass scanner vs per-field patterns")
+    parser.add_argument("--receipts", type=int, default=2000, help="Synthetic receipts in the corpus")
+    parser.add_argument("--texts", nargs="*", default=[], help="Extra OCR text files")
+    parser.add_argument("--repeat", type=int, default=5, help="Timing runs (best is reported)")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    texts = [synthetic_receipt(rng) for _ in range(args.receipts)] + PARITY_TEXTS
+    for path in args.texts:
+        with open(path, encoding="utf-8", errors="ignore") as f:
+            texts.append(f.read())
+
+    legacy = LegacyExtractor()
+    legacy_extract = legacy.extract_structured_data_phase2
+
+    def single_pass(text):
+        return extract_receipt_fields(text).to_dict()
+
+    print("=" * 80)
+    print("RECEIPT FIELD EXTRACTION BENCHMARK")
+    print("=" * 80)
+    print(f"Texts: {len(texts)}  Average lines: {sum(t.count(chr(10)) + 1 for t in texts) / len(texts):.1f}")
+
+    legacy_time = time_extractor(legacy_extract, texts, args.repeat)
+    single_time = time_extractor(single_pass, texts, args.repeat)
+
+    print(f"\n{'Extractor':<14}{'total':>10}{'per text':>12}{'texts/s':>12}")
+    for name, elapsed in (("per-field", legacy_time), ("single-pass", single_time)):
+        print(f"{name:<14}{elapsed:>9.3f}s{elapsed / len(texts) * 1e6:>10.1f}us{len(texts) / elapsed:>12.0f}")
+    print(f"\nSpeed-up: {legacy_time / single_time:.1f}x")
+
+    check_parity(legacy_extract, single_pass)
+
+    print("\nAgreement with the per-field extraction:")
+    for key in ('total_amount', 'transaction_date', 'kra_pin', 'mpesa_reference', 'till_number', 'vendor_name'):
+        same = found_old = found_new = 0
+        for text in texts:
+            old, new = legacy_extract(text).get(key), single_pass(text).get(key)
+            same += (str(old).upper() == str(new).upper())
+            found_old += old is not None
+            found_new += new is not None
+        print(f"  {key:<18} same {same / len(texts):>6.1%}   found: per-field {found_old:>6}  single-pass {found_new:>6}")
+
+
+if __name__ == "__main__":
+    main()
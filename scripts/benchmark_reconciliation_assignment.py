@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Benchmark batch reconciliation assignment
+
+Compares greedy per-payment matching (the best-scoring shortlisted invoice per
+payment, as _basic_reconciliation does) with the optimal one-to-one assignment
+(backend/reconciliation/assignment.py) on payments x pending invoices.
+
+Data comes from scripts/generate_5_years_data.py: either read back from MongoDB
+(--from-db, after running the generator; replicated up to --size) or generated
+in-process with the same customer/invoice/payment schema and distributions.
+The scenario then adds the cases greedy matching gets wrong: installments,
+payments covering two invoices and customers billed the same amount twice.
+
+Usage:
+    python scripts/benchmark_reconciliation_assignment.py                 # 10k x 10k synthetic
+    python scripts/benchmark_reconciliation_assignment.py --size 2000
+    python scripts/benchmark_reconciliation_assignment.py --from-db      # generate_5_years_data.py output
+"""
+
+import sys
+import os
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+from dotenv import load_dotenv
+
+# Load environment
+load_dotenv()
+
+from database.match_keys import build_invoice_match_keys
+from reconciliation.assignment import allocate_payments, SCIPY_AVAILABLE
+from reconciliation.candidates import PendingInvoiceIndex, score_candidate, MATCH_THRESHOLD
+
+PAYMENT_METHODS = ["mpesa", "bank_transfer", "card", "cash", "cheque"]
+PAYMENT_WEIGHTS = [40, 30, 15, 10, 5]
+
+
+def generate_dataset(size, customer_count, seed):
+    """Customers, invoices and payments shaped like generate_5_years_data.py output"""
+    random.seed(seed)
+    start = datetime(2021, 1, 1)
+    customers = [
+        {"customer_id": str(uuid.UUID(int=random.getrandbits(128))),
+         "name": f"Business {i + 1}",
+         "phone": f"+254{random.randint(700000000, 799999999)}"}
+        for i in range(customer_count)
+    ]
+
+    invoices, payments, gateway = [], [], {}
+    for counter in range(1, size + 1):
+        issued = start + timedelta(days=random.randint(0, 5 * 365))
+        num_items = random.choices([1, 2, 3, 4, 5, 6, 7, 8], weights=[5, 15, 25, 25, 15, 8, 5, 2])[0]
+        subtotal = sum(
+            random.choices([1, 2, 3, 4, 5, 10, 12, 20], weights=[30, 20, 15, 10, 8, 7, 5, 5])[0]
+            * round(random.uniform(5000, 300000), 2)
+            for _ in range(num_items)
+        )
+        invoice = {
+            "invoice_id": str(uuid.UUID(int=random.getrandbits(128))),
+            "invoice_number": f"INV-{issued.year}{counter:05d}",
+            "customer_id": random.choice(customers)["customer_id"],
+            "date_issued": issued,
+            "status": "paid",
+            "total_amount": round(subtotal * 1.16, 2),
+        }
+        invoices.append(invoice)
+
+        payment = {
+            "payment_id": str(uuid.UUID(int=random.getrandbits(128))),
+            "invoice_id": invoice["invoice_id"],
+            "customer_id": invoice["customer_id"],
+            "amount": invoice["total_amount"],
+            "payment_method": random.choices(PAYMENT_METHODS, weights=PAYMENT_WEIGHTS)[0],
+        }
+        payments.append(payment)
+        if payment["payment_method"] in ("mpesa", "bank_transfer"):
+            gateway[payment["payment_id"]] = invoice["invoice_number"]
+
+    return customers, invoices, payments, gateway
+
+
+async def load_generated_data(size):
+    """Read customers, paid invoices and their payments written by generate_5_years_data.py"""
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(os.getenv("MONGO_URI"))
+    db = client.financial_agent
+    customers = await db.customers.find({}, {"customer_id": 1, "name": 1, "phone": 1}).to_list(None)
+    invoices = await db.invoices.find(
+        {"status": "paid"},
+        {"invoice_id": 1, "invoice_number": 1, "customer_id": 1, "total_amount": 1, "date_issued": 1, "status": 1}
+    ).to_list(size)
+    invoice_ids = [inv["invoice_id"] for inv in invoices]
+    payments = await db.payments.find(
+        {"invoice_id": {"$in": invoice_ids}},
+        {"payment_id": 1, "invoice_id": 1, "customer_id": 1, "amount": 1, "payment_method": 1}
+    ).to_list(None)
+    gateway = {}
+    async for record in db.payment_gateway_data.find({"payment_id": {"$in": [p["payment_id"] for p in payments]}}):
+        data = record.get("gateway_data") or {}
+        gateway[record["payment_id"]] = data.get("account_reference") or data.get("reference")
+    client.close()
+
+    if not invoices:
+        raise SystemExit("No paid invoices found - run scripts/generate_5_years_data.py first")
+
+    # The generator writes a few thousand invoices; replicate them up to the requested size
+    base_invoices, base_payments = list(invoices), {p["invoice_id"]: p for p in payments}
+    copy = 1
+    while len(invoices) < size:
+        for invoice in base_invoices:
+            if len(invoices) >= size:
+                break
+            clone = {**invoice, "invoice_id": f"{invoice['invoice_id']}-{copy}",
+                     "invoice_number": f"{invoice['invoice_number']}{copy:02d}",
+                     "total_amount": round(invoice["total_amount"] * random.uniform(0.5, 1.5), 2)}
+            invoices.append(clone)
+            source = base_payments.get(invoice["invoice_id"])
+            if source:
+                payment = {**source, "payment_id": f"{source['payment_id']}-{copy}",
+                           "invoice_id": clone["invoice_id"], "amount": clone["total_amount"]}
+                payments.append(payment)
+                if source["payment_id"] in gateway:
+                    gateway[payment["payment_id"]] = clone["invoice_number"]
+        copy += 1
+
+    return customers, invoices, payments, gateway
+
+
+def build_scenario(customers, invoices, payments, gateway, seed):
+    """
+    Pending invoices and incoming payments with ground truth
+
+    Customers pay from their registered phone most of the time; M-Pesa and
+    bank payments quote the invoice number. On top of that 15% of invoices
+    repeat an earlier amount for the same customer, 10% of payments arrive
+    in two installments and 5% of payments settle two invoices at once.
+    """
+    random.seed(seed)
+    customers_by_id = {c["customer_id"]: c for c in customers}
+    last_amount = {}
+    pending = []
+    for invoice in invoices:
+        if invoice["customer_id"] in last_amount and random.random() < 0.15:
+            invoice["total_amount"] = last_amount[invoice["customer_id"]]
+        last_amount[invoice["customer_id"]] = invoice["total_amount"]
+        customer = customers_by_id.get(invoice["customer_id"])
+        pending.append({
+            "id": invoice["invoice_id"],
+            "invoice_number": invoice["invoice_number"],
+            "customer_id": invoice["customer_id"],
+            "total_amount": invoice["total_amount"],
+            "status": "sent",
+            "reconciliation_keys": build_invoice_match_keys(invoice, customer),
+        })
+    amounts = {inv["id"]: inv["total_amount"] for inv in pending}
+
+    def phone_for(customer_id):
+        customer = customers_by_id.get(customer_id) or {}
+        if customer.get("phone") and random.random() < 0.8:
+            return customer["phone"]
+        return f"+254{random.randint(700000000, 799999999)}"
+
+    incoming = []
+    by_customer = {}
+    for payment in payments:
+        by_customer.setdefault(payment["customer_id"], []).append(payment)
+    merged = set()
+
+    for payment in payments:
+        if payment["payment_id"] in merged:
+            continue
+        invoice_id = payment["invoice_id"]
+        amount = amounts[invoice_id]
+        reference = gateway.get(payment["payment_id"])
+        roll = random.random()
+
+        if roll < 0.10 and reference:
+            first = round(amount * 0.6, 2)
+            for part in (first, round(amount - first, 2)):
+                incoming.append({"amount": part, "phone_number": phone_for(payment["customer_id"]),
+                                 "reference": reference, "truth": {invoice_id}})
+            continue
+
+        if roll < 0.15 and reference:
+            sibling = next((p for p in by_customer[payment["customer_id"]]
+                            if p["payment_id"] != payment["payment_id"] and p["payment_id"] not in merged), None)
+            if sibling:
+                merged.update({payment["payment_id"], sibling["payment_id"]})
+                incoming.append({"amount": round(amount + amounts[sibling["invoice_id"]], 2),
+                                 "phone_number": customers_by_id.get(payment["customer_id"], {}).get("phone"),
+                                 "reference": reference, "truth": {invoice_id, sibling["invoice_id"]}})
+                continue
+
+        incoming.append({"amount": amount, "phone_number": phone_for(payment["customer_id"]),
+                         "reference": reference, "truth": {invoice_id}})
+
+    random.shuffle(incoming)
+    return pending, incoming
+
+
+def greedy_match(payments, invoices, sequential):
+    """
+    Best shortlisted invoice per payment in arrival order
+
+    sequential=True removes matched invoices like the per-payment flow does
+    (first come, first served); False scores every payment against the same
+    snapshot, so invoices can be claimed more than once.
+    """
+    index = PendingInvoiceIndex(invoices)
+    claimed = set()
+    matches = []
+    for position, payment in enumerate(payments):
+        best, best_score = None, 0
+        for invoice in index.shortlist(payment):
+            if sequential and invoice["id"] in claimed:
+                continue
+            score = score_candidate(payment, invoice)
+            if score > best_score:
+                best, best_score = invoice, score
+        if best is not None and best_score >= MATCH_THRESHOLD:
+            claimed.add(best["id"])
+            matches.append((position, best["id"]))
+    return matches
+
+
+def evaluate(payments, matches):
+    """
+    Precision/recall of (payment, invoice) pairs against ground truth, plus
+    conflicts: invoices claimed by several payments where at least one claim
+    is wrong (installments legitimately claim an invoice more than once)
+    """
+    truth_pairs = sum(len(p["truth"]) for p in payments)
+    correct = sum(1 for position, invoice_id in matches if invoice_id in payments[position]["truth"])
+    claims = {}
+    for position, invoice_id in matches:
+        claims.setdefault(invoice_id, []).append(invoice_id in payments[position]["truth"])
+    return {
+        "pairs": len(matches),
+        "precision": correct / len(matches) if matches else 0.0,
+        "recall": correct / truth_pairs if truth_pairs else 0.0,
+        "conflicts": sum(1 for outcomes in claims.values() if len(outcomes) > 1 and not all(outcomes)),
+    }
+
+
+def time_call(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark batch reconciliation assignment")
+    parser.add_argument("--size", type=int, default=10_000, help="Invoices (payments are derived 1:1 before splits)")
+    parser.add_argument("--customers", type=int, default=1_000, help="Customers for in-process generation")
+    parser.add_argument("--from-db", action="store_true", help="Use data written by generate_5_years_data.py")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    print("\n" + "="*70)
+    print("  RECONCILIATION ASSIGNMENT BENCHMARK")
+    print("="*70)
+
+    if args.from_db:
+        customers, invoices, payments, gateway = asyncio.run(load_generated_data(args.size))
+        print(f"\n📡 Loaded generate_5_years_data.py output ({len(invoices):,} invoices after replication)")
+    else:
+        customers, invoices, payments, gateway = generate_dataset(args.size, args.customers, args.seed)
+        print(f"\n🧪 Generated {len(invoices):,} invoices for {len(customers):,} customers")
+
+    pending, incoming = build_scenario(customers, invoices, payments, gateway, args.seed)
+    print(f"   {len(incoming):,} payments x {len(pending):,} pending invoices")
+    print(f"   Solver: {'scipy linear_sum_assignment' if SCIPY_AVAILABLE else 'built-in Hungarian'} per component\n")
+
+    rows = []
+    for label, sequential in (("greedy (snapshot)", False), ("greedy (sequential)", True)):
+        seconds, matches = time_call(greedy_match, incoming, pending, sequential)
+        rows.append((label, seconds, evaluate(incoming, matches), ""))
+
+    for label, split in (("optimal 1:1", False), ("optimal + splits", True)):
+        seconds, result = time_call(allocate_payments, incoming, pending, MATCH_THRESHOLD, split_payments=split)
+        matches = [(a.payment_index, pending[a.invoice_index]["id"]) for a in result.allocations]
+        first_round = result.stats["rounds"][0]
+        detail = (f"{first_round['edges']:,} edges, {first_round['components']:,} components "
+                  f"(largest {first_round['largest_component']}), {len(result.stats['rounds'])} rounds")
+        rows.append((label, seconds, evaluate(incoming, matches), detail))
+
+    print(f"{'method':<20} | {'time (s)':>8} | {'pairs':>7} | {'precision':>9} | {'recall':>7} | {'conflicts':>9}")
+    print("-" * 73)
+    for label, seconds, metrics, _ in rows:
+        print(f"{label:<20} | {seconds:>8.2f} | {metrics['pairs']:>7,} | {metrics['precision']:>9.3f} | "
+              f"{metrics['recall']:>7.3f} | {metrics['conflicts']:>9,}")
+    print()
+    for label, _, _, detail in rows:
+        if detail:
+            print(f"   {label}: {detail}")
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Benchmark the AI retrieval index
+
+Builds the on-disk retrieval index (backend/database/retrieval_index.py) from
+a synthetic corpus of transactions, invoices and receipts, then reports:
+
+- build and incremental-sync throughput (an incremental pass re-embeds only
+  the documents that changed),
+- search latency over the memory-mapped vectors,
+- how often the top-k hits of a question naming a merchant or customer are
+  records of that merchant or customer,
+- prompt size: the top-k records section versus the 100 transactions and 50
+  invoices the previous retrieval loaded for every question.
+
+No database or network is needed; the index is written to a temporary
+directory unless --directory is given.
+
+Usage:
+    python scripts/benchmark_retrieval_index.py
+    python scripts/benchmark_retrieval_index.py --records 50000 --top-k 8
+"""
+
+import sys
+import os
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+from bson import ObjectId
+from database.retrieval_index import (
+    RetrievalIndex, HashingEmbedder, render_record, render_relevant_records
+)
+
+MERCHANTS = ["Naivas Supermarket", "Java House", "Carrefour", "Quickmart", "Total Energies", "Artcaffe",
+             "Chandarana Foodplus", "Goodlife Pharmacy", "Kenchic", "Safaricom Shop", "Bata Shoes", "Text Book Centre"]
+CUSTOMERS = ["Acme Traders", "Kilimani Hardware", "Mombasa Logistics", "Nakuru Dairy Co-op", "Rift Valley Motors",
+             "Westlands Dental", "Kisumu Fisheries", "Eldoret Seeds", "Thika Textiles", "Nyeri Coffee Growers"]
+PRODUCTS = ["Web design", "Consulting hours", "Printer toner", "Office chairs", "Delivery charges",
+            "Maintenance contract", "Cement bags", "Laptop repair", "Accounting services", "Stationery"]
+ITEMS = ["Bread", "Milk 500ml", "Sugar 1kg", "Rice 2kg", "Cooking Oil", "Diesel", "Printer Paper", "Coffee"]
+CATEGORIES = ["groceries", "fuel", "office", "meals", "utilities", "transport"]
+
+QUESTIONS = [
+    ("How much did we spend at {merchant} last month?", "merchant"),
+    ("Show receipts from {merchant}", "merchant"),
+    ("What has {customer} been invoiced for?", "customer"),
+    ("Which invoices for {customer} are still pending?", "customer"),
+    ("List M-Pesa payments to {merchant}", "merchant"),
+]
+
+
+def synthetic_documents(rng, count):
+    """(source, document) pairs, roughly 40% transactions, 30% invoices, 30% receipts"""
+    documents = []
+    for _ in range(count):
+        kind = rng.random()
+        day = f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+        if kind < 0.4:
+            merchant = rng.choice(MERCHANTS)
+            documents.append(("transactions", {
+                "_id": ObjectId(), "timestamp": day, "amount": round(rng.uniform(50, 50000), 2),
+                "gateway": rng.choice(["mpesa", "bank", "card"]), "type": rng.choice(["debit", "credit"]),
+                "status": "completed", "description": f"Payment to {merchant}", "merchant_name": merchant,
+                "reference": f"Q{rng.randint(10**8, 10**9)}",
+            }))
+        elif kind < 0.7:
+            items = [{"description": rng.choice(PRODUCTS), "quantity": rng.randint(1, 10),
+                      "unit_price": round(rng.uniform(500, 20000), 2)} for _ in range(rng.randint(1, 5))]
+            documents.append(("invoices", {
+                "_id": ObjectId(), "invoice_number": f"INV-{rng.randint(1000, 99999)}", "date_issued": day,
+                "customer": {"name": rng.choice(CUSTOMERS)}, "items": items,
+                "total": sum(i["quantity"] * i["unit_price"] for i in items),
+                "status": rng.choice(["paid", "sent", "overdue", "draft"]),
+            }))
+        else:
+            merchant = rng.choice(MERCHANTS)
+            lines = [merchant.upper(), f"PIN: P{rng.randint(10**8, 10**9 - 1)}X", f"Date: {day}"]
+            lines += [f"{rng.choice(ITEMS):<20}{rng.uniform(20, 3000):>10.2f}" for _ in range(rng.randint(2, 15))]
+            total = round(rng.uniform(100, 15000), 2)
+            lines += [f"TOTAL KSH {total:.2f}", "Thank you for shopping with us"]
+            documents.append(("receipts", {
+                "_id": ObjectId(), "transaction_date": day, "vendor": {"name": merchant},
+                "total_amount": total, "category": rng.choice(CATEGORIES),
+                "ocr_result": {"text": "\n".join(lines)},
+            }))
+    return documents
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrieval index build, search latency and prompt size")
+    parser.add_argument("--records", type=int, default=20000, help="Synthetic documents in the corpus")
+    parser.add_argument("--top-k", type=int, default=8, help="Records per question")
+    parser.add_argument("--min-score", type=float, default=0.15, help="Minimum similarity")
+    parser.add_argument("--queries", type=int, default=500, help="Search queries to time")
+    parser.add_argument("--batch-size", type=int, default=500, help="Documents per index write")
+    parser.add_argument("--directory", default=None, help="Index directory (default: temporary)")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    documents = synthetic_documents(rng, args.records)
+    records = [render_record(source, document) for source, document in documents]
+
+    with tempfile.TemporaryDirectory() as temporary:
+        index = RetrievalIndex(args.directory or temporary, HashingEmbedder())
+        index.clear()
+
+        print("=" * 80)
+        print("RETRIEVAL INDEX BENCHMARK")
+        print("=" * 80)
+        print(f"Documents: {len(records)}  Embedder: {index.embedder_name}")
+
+        started = time.perf_counter()
+        for start in range(0, len(records), args.batch_size):
+            index.upsert(records[start:start + args.batch_size])
+        build = time.perf_counter() - started
+
+        # Incremental sync: 1% of documents changed, all re-offered
+        for source, document in rng.sample(documents, max(1, len(documents) // 100)):
+            document["status"] = "paid" if source == "invoices" else "reconciled"
+        records = [render_record(source, document) for source, document in documents]
+        started = time.perf_counter()
+        rewritten = sum(index.upsert(records[start:start + args.batch_size])
+                        for start in range(0, len(records), args.batch_size))
+        incremental = time.perf_counter() - started
+
+        print(f"\nFull build:        {build:>8.2f}s  {len(records) / build:>8.0f} docs/s")
+        print(f"Incremental sync:  {incremental:>8.2f}s  {rewritten} of {len(records)} documents re-embedded")
+        size = sum(os.path.getsize(os.path.join(index.directory, name)) for name in os.listdir(index.directory))
+        print(f"Index on disk:     {size / 1e6:>8.1f}MB  ({index.size} live records)")
+
+        # A fresh reader maps the files like another worker would
+        reader = RetrievalIndex(index.directory, HashingEmbedder())
+        started = time.perf_counter()
+        reader.refresh()
+        print(f"Open (map) index:  {(time.perf_counter() - started) * 1000:>8.1f}ms")
+
+        latencies, relevant, returned, section_chars = [], 0, 0, []
+        for _ in range(args.queries):
+            template, kind = rng.choice(QUESTIONS)
+            name = rng.choice(MERCHANTS if kind == "merchant" else CUSTOMERS)
+            started = time.perf_counter()
+            hits = reader.search(template.format(merchant=name, customer=name), k=args.top_k,
+                                 min_score=args.min_score)
+            latencies.append((time.perf_counter() - started) * 1000)
+            returned += len(hits)
+            relevant += sum(name.lower() in hit.summary.lower() for hit in hits)
+            section_chars.append(len(render_relevant_records(hits)))
+
+    legacy = [r.summary for r in records if r.id and r.key.startswith("transactions:")][:100]
+    legacy += [r.summary for r in records if r.key.startswith("invoices:")][:50]
+    legacy_chars = len("\n".join(legacy))
+    average_section = sum(section_chars) / len(section_chars)
+
+    print(f"\nSearch latency ({args.queries} queries, top-{args.top_k}):")
+    print(f"  p50 {percentile(latencies, 50):.2f}ms  p95 {percentile(latencies, 95):.2f}ms  "
+          f"max {max(latencies):.2f}ms")
+    print(f"  Hits naming the merchant/customer asked about: {relevant / max(returned, 1):.1%} "
+          f"({returned / args.queries:.1f} hits per question)")
+    print(f"\nPrompt records section: {average_section:>8.0f} chars (~{average_section / 4:.0f} tokens)")
+    print(f"100 transactions + 50 invoices: {legacy_chars:>8} chars (~{legacy_chars / 4:.0f} tokens)")
+
+
+if __name__ == "__main__":
+    main()
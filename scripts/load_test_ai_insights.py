@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Load test: API responsiveness while AI insight queries are in flight
+
+Against a running backend, probes a light endpoint (default GET /ai/examples)
+every --interval ms, first alone and then while --concurrency clients keep
+asking questions on /ai/ask (or /ai/ask-advanced). Each question is a MongoDB
+retrieval plus a full Gemini round trip. With the blocking RAG pipeline every
+question froze the event loop for that round trip, so probe latency climbed
+to the model latency; with the async pipeline it stays near the idle level.
+
+Probe latency is measured from the moment a probe was due, so time spent
+queued behind a stalled server counts.
+
+Usage:
+    python scripts/load_test_ai_insights.py
+    python scripts/load_test_ai_insights.py --concurrency 16 --duration 60
+    python scripts/load_test_ai_insights.py --base-url http://localhost:8000 --advanced
+"""
+
+import time
+import asyncio
+import argparse
+
+import httpx
+
+QUESTIONS = [
+    "What are my spending patterns this month?",
+    "How much revenue came from M-Pesa payments?",
+    "Which customers have outstanding invoices?",
+    "Give me a summary of my financial health",
+    "What are my main expense categories?",
+]
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def probe(client: httpx.AsyncClient, path: str, stop: asyncio.Event, interval: float, latencies: list, errors: list):
+    """Request path every interval seconds and record due-to-done latency"""
+    loop = asyncio.get_running_loop()
+    due = loop.time()
+    while not stop.is_set():
+        due += interval
+        delay = due - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        try:
+            response = await client.get(path)
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            errors.append(str(e))
+            continue
+        latencies.append((loop.time() - due) * 1000)
+
+
+async def asker(client: httpx.AsyncClient, worker: int, advanced: bool, stop: asyncio.Event,
+                latencies: list, errors: list):
+    """Ask questions back to back until stopped"""
+    asked = 0
+    while not stop.is_set():
+        question = QUESTIONS[(worker + asked) % len(QUESTIONS)]
+        asked += 1
+        started = time.perf_counter()
+        try:
+            if advanced:
+                response = await client.post("/ai/ask-advanced", json={"question": question})
+            else:
+                response = await client.post("/ai/ask", json={"query": question})
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            errors.append(str(e))
+            continue
+        latencies.append((time.perf_counter() - started) * 1000)
+
+
+async def probe_phase(client, path, interval, duration, concurrency=0, advanced=False):
+    probe_latencies, probe_errors, ask_latencies, ask_errors = [], [], [], []
+    stop = asyncio.Event()
+    tasks = [asyncio.create_task(probe(client, path, stop, interval, probe_latencies, probe_errors))]
+    tasks += [
+        asyncio.create_task(asker(client, worker, advanced, stop, ask_latencies, ask_errors))
+        for worker in range(concurrency)
+    ]
+    await asyncio.sleep(duration)
+    stop.set()
+    await asyncio.gather(*tasks)
+    return probe_latencies, probe_errors, ask_latencies, ask_errors
+
+
+def print_latencies(label, latencies, errors):
+    print(
+        f"  {label:<22}{len(latencies):>7}{percentile(latencies, 50):>9.1f}ms{percentile(latencies, 95):>9.1f}ms"
+        f"{percentile(latencies, 99):>9.1f}ms{(max(latencies) if latencies else 0.0):>9.1f}ms{len(errors):>8}"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Probe latency with and without AI insight queries in flight")
+    parser.add_argument("--base-url", default="http://localhost:8000", help="Backend URL")
+    parser.add_argument("--probe", default="/ai/examples", help="Light endpoint to probe")
+    parser.add_argument("--interval", type=float, default=50.0, help="Milliseconds between probes")
+    parser.add_argument("--concurrency", type=int, default=8, help="Insight queries kept in flight")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds per phase")
+    parser.add_argument("--advanced", action="store_true", help="Ask on /ai/ask-advanced instead of /ai/ask")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Request timeout in seconds")
+    args = parser.parse_args()
+
+    limits = httpx.Limits(max_connections=args.concurrency + 4)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        print("=" * 80)
+        print("AI INSIGHTS LOAD TEST")
+        print("=" * 80)
+        print(f"Backend: {args.base_url}  Probe: {args.probe} every {args.interval:.0f}ms  "
+              f"Insight queries in flight: {args.concurrency}")
+
+        print(f"\nIdle phase ({args.duration:.0f}s)...")
+        idle_probe, idle_errors, _, _ = await probe_phase(client, args.probe, args.interval / 1000, args.duration)
+
+        print(f"Load phase ({args.duration:.0f}s)...")
+        load_probe, load_errors, ask_latencies, ask_errors = await probe_phase(
+            client, args.probe, args.interval / 1000, args.duration, args.concurrency, args.advanced
+        )
+
+    print(f"\n  {'':<22}{'reqs':>7}{'p50':>11}{'p95':>11}{'p99':>11}{'max':>11}{'errors':>8}")
+    print_latencies("probe, idle", idle_probe, idle_errors)
+    print_latencies("probe, under load", load_probe, load_errors)
+    print_latencies("insight queries", ask_latencies, ask_errors)
+
+    if idle_probe and load_probe:
+        slowdown = percentile(load_probe, 95) / max(percentile(idle_probe, 95), 0.001)
+        print(f"\nProbe p95 under load: {slowdown:.1f}x idle")
+    if ask_errors:
+        print(f"First insight error: {ask_errors[0]}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
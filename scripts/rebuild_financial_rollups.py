@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Rebuild the financial_rollups collection
+
+Re-aggregates every monthly rollup (revenue, invoiced, expenses, payments,
+refunds, receipt expenses) from the source collections. Rollups are kept up to
+date incrementally on every write, so this is only needed for the initial
+backfill, after bulk imports that bypass the Database layer (e.g. the data
+generation scripts), or to repair drift.
+
+Run scripts/backfill_invoice_issue_dates.py first - invoice rollups are keyed
+on the normalized issue_date_ts field.
+
+Usage:
+    python scripts/rebuild_financial_rollups.py
+    python scripts/rebuild_financial_rollups.py --months 2025-01 2025-02  # Refresh specific months only
+"""
+
+import sys
+import os
+import asyncio
+import argparse
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+# Load environment
+load_dotenv()
+
+from backend.database.mongodb import Database
+from backend.database.rollups import ROLLUP_SOURCES
+
+
+async def rebuild(months=None):
+    """Rebuild all rollups, or refresh the given months for every source"""
+    db = Database.get_instance()
+
+    print("\n" + "="*70)
+    print("  FINANCIAL ROLLUPS REBUILD")
+    print("="*70 + "\n")
+
+    await db.rollups.ensure_indexes()
+    # Partial-month lookups for expense trends filter on these fields
+    await db.transactions.create_index([("type", 1), ("transaction_date", 1)])
+
+    if months:
+        for source in sorted(ROLLUP_SOURCES):
+            written = await db.rollups.refresh_months(source, months)
+            print(f"✅ {source}: {written} rollup documents refreshed")
+    else:
+        stats = await db.rollups.rebuild()
+        for metric, count in stats.items():
+            print(f"✅ {metric}: {count} rollup documents")
+
+    await db.close()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Rebuild the financial_rollups collection")
+    parser.add_argument("--months", nargs="*", help="Only refresh these months (YYYY-MM)")
+    args = parser.parse_args()
+
+    await rebuild(months=args.months)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Run reconciliation queue workers outside the API process
+
+The API drains the reconciliation queue with RECONCILIATION_WORKERS in-process
+workers. To scale reconciliation separately, set RECONCILIATION_WORKERS=0 for
+the API and run one or more of these processes; jobs are leased, so any
+number of processes can share the queue.
+
+Usage:
+    python scripts/run_reconciliation_workers.py              # 4 workers
+    python scripts/run_reconciliation_workers.py --workers 8
+"""
+
+import sys
+import os
+import signal
+import asyncio
+import argparse
+import logging
+
+# Add backend directory to path (modules import each other as top-level packages)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+from dotenv import load_dotenv
+
+# Load environment
+load_dotenv()
+
+from reconciliation.service import ReconciliationService
+from reconciliation.queue import ReconciliationWorkerPool
+
+logging.basicConfig(level=logging.INFO)
+
+
+async def run(workers, metrics_interval=60):
+    service = ReconciliationService()
+    if service.queue is None:
+        raise SystemExit("Database services not available - cannot run reconciliation workers")
+
+    pool = ReconciliationWorkerPool(service.queue, service._process_queued_payment, concurrency=workers)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await pool.start()
+    print(f"✅ Running {pool.concurrency} reconciliation workers (Ctrl+C to stop)")
+
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=metrics_interval)
+        except asyncio.TimeoutError:
+            queue_metrics = await service.queue.get_metrics()
+            print(f"📊 depth={queue_metrics['depth']} due={queue_metrics['due']} "
+                  f"dead={queue_metrics['dead_lettered']} workers={pool.get_metrics()}")
+
+    print("\n⏹️  Stopping workers...")
+    await pool.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run reconciliation queue workers")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent reconciliation workers")
+    parser.add_argument("--metrics-interval", type=int, default=60, help="Seconds between queue metric reports")
+    args = parser.parse_args()
+
+    asyncio.run(run(args.workers, args.metrics_interval))
+
+
+if __name__ == "__main__":
+    main()